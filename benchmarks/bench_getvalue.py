@@ -0,0 +1,75 @@
+"""
+getvalue() and stats() microbenchmark
+
+Times Semaphore.getvalue() and Semaphore.stats() against the acquire(0) and
+release() pair getvalue() used to make, for each backend that runs here::
+
+    python benchmarks/bench_getvalue.py --calls 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semaphore_win_ctypes import Semaphore, StandInKernel32  # noqa: E402
+from semaphore_win_ctypes.win32 import Win32Backend  # noqa: E402
+
+
+def backends() -> dict:
+    """
+    Every backend that can run here, by name
+    """
+    found = {'standin': Win32Backend(kernel32=StandInKernel32())}
+    if sys.platform == 'win32':
+        found['win32'] = 'win32'
+    else:
+        found['posix'] = 'posix'
+    if sys.platform.startswith('linux'):
+        found['eventfd'] = 'eventfd'
+    return found
+
+
+def acquire_release(sem: Semaphore) -> int:
+    # What getvalue() did before it could query the count
+    sem.acquire(0)
+    return sem.release() + 1
+
+
+def ns_per_call(function, sem: Semaphore, calls: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(calls):
+        function(sem)
+    return (time.perf_counter_ns() - start) / calls
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--calls', type=int, default=100000)
+    parser.add_argument('--backend', action='append', default=None,
+                        help='only this backend, may be repeated')
+    args = parser.parse_args()
+
+    for name, backend in backends().items():
+        if args.backend and name not in args.backend:
+            continue
+        sem = Semaphore(backend=backend).create(maximum_count=4)
+        try:
+            results = [
+                (label, ns_per_call(function, sem, args.calls))
+                for label, function in (
+                    ('getvalue()', Semaphore.getvalue),
+                    ('stats()', Semaphore.stats),
+                    ('acquire(0)+release()', acquire_release),
+                )
+            ]
+        finally:
+            sem.close()
+        print(f'{name}: ' + ', '.join(f'{label} {ns:.0f} ns'
+                                      for label, ns in results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
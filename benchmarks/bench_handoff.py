@@ -0,0 +1,146 @@
+"""
+Semaphore hand-off latency benchmark
+
+Starts child processes that each take a permit of a semaphore, either
+opening it by name or receiving its handle, pickled by multiprocessing or
+inherited through subprocess with Semaphore.handoff(), and reports the
+median time from starting the child to its first acquire, and for
+subprocess the part of it spent opening or adopting the semaphore::
+
+    python benchmarks/bench_handoff.py --runs 20
+
+Names are only shared across processes by the posix and win32 backends,
+the eventfd backend is only measured receiving its descriptors.
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semaphore_win_ctypes import Semaphore, get_backend  # noqa: E402
+
+BACKENDS = ['win32'] if sys.platform == 'win32' else ['posix']
+if sys.platform.startswith('linux'):
+    BACKENDS.append('eventfd')
+
+# The backends whose names other processes can open
+NAMED_BACKENDS = ('win32', 'posix')
+
+
+def take_by_name(name: str, backend: str, results) -> None:
+    sem = Semaphore(name, backend).open()
+    sem.acquire()
+    results.put(time.perf_counter())
+    sem.release()
+    sem.close()
+
+
+def take_handle(sem: Semaphore, results) -> None:
+    sem.acquire()
+    results.put(time.perf_counter())
+    sem.release()
+    sem.close()
+
+
+def child(mode: str, value: str, backend: str) -> None:
+    # Run by subprocess, prints when it acquired and how long opening took,
+    # leaving out the imports
+    get_backend(backend)
+    import semaphore_win_ctypes.handoff  # noqa: F401
+    start = time.perf_counter()
+    if mode == 'name':
+        sem = Semaphore(value, backend).open()
+    else:
+        sem = Semaphore.from_handoff(value)
+    opened = time.perf_counter()
+    sem.acquire()
+    print(time.perf_counter(), opened - start)
+    sem.release()
+    sem.close()
+
+
+def with_multiprocessing(sem: Semaphore, by_name: bool, runs: int) -> float:
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    latencies = []
+    for _ in range(runs):
+        if by_name:
+            process = context.Process(
+                target=take_by_name,
+                args=(sem.name, sem.backend.name, results))
+        else:
+            process = context.Process(target=take_handle,
+                                      args=(sem, results))
+        start = time.perf_counter()
+        process.start()
+        latencies.append(results.get() - start)
+        process.join()
+    return statistics.median(latencies)
+
+
+def with_subprocess(sem: Semaphore, by_name: bool, runs: int):
+    latencies = []
+    opening = []
+    for _ in range(runs):
+        command = [sys.executable, os.path.abspath(__file__), '--child']
+        if by_name:
+            command += ['name', sem.name, sem.backend.name]
+            kwargs = {}
+            handoff = None
+        else:
+            handoff = sem.handoff()
+            command += ['token', handoff.token, sem.backend.name]
+            kwargs = handoff.popen_kwargs()
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                   universal_newlines=True, **kwargs)
+        if handoff is not None:
+            handoff.close()
+        acquired, opened = process.communicate()[0].split()
+        latencies.append(float(acquired) - start)
+        opening.append(float(opened))
+    return statistics.median(latencies), statistics.median(opening)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--backend', action='append', default=None,
+                        help='only this backend, may be repeated')
+    parser.add_argument('--child', nargs=3, metavar=('MODE', 'VALUE',
+                                                     'BACKEND'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return 0
+
+    for backend in BACKENDS:
+        if args.backend and backend not in args.backend:
+            continue
+        sem = Semaphore(str(uuid.uuid4()), backend).create(1)
+        try:
+            for by_name in (True, False):
+                if by_name and backend not in NAMED_BACKENDS:
+                    continue
+                label = 'by name' if by_name else 'handle'
+                spawned = with_multiprocessing(sem, by_name, args.runs)
+                started, opening = with_subprocess(sem, by_name, args.runs)
+                print(f'{backend}: {label}: multiprocessing '
+                      f'{spawned * 1000:.1f} ms, subprocess '
+                      f'{started * 1000:.1f} ms '
+                      f'(opening {opening * 1e6:.0f} us)')
+        finally:
+            sem.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+win32 hot path benchmark
+
+Compares wait() and release() of the win32 backend with the code they
+replaced, which wrapped every argument in a new DWORD or LONG and built an
+LPLONG for the previous count. Reports the time per call and the memory
+tracemalloc sees allocated during a call::
+
+    python benchmarks/bench_hotpath.py --table null
+
+The null table returns success without doing anything, so only the Python
+side is measured; it is the default except on Windows, where kernel32 is.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semaphore_win_ctypes import StandInKernel32  # noqa: E402
+from semaphore_win_ctypes.constants import INFINITE, WAIT_FAILED, \
+    WAIT_OBJECT_0, WAIT_TIMEOUT  # noqa: E402
+from semaphore_win_ctypes.kernel32 import DWORD, LONG, LPLONG, Kernel32, \
+    win_error  # noqa: E402
+from semaphore_win_ctypes.win32 import Win32Backend  # noqa: E402
+
+
+class NullKernel32:
+    def WaitForSingleObject(self, handle, milliseconds):
+        return WAIT_OBJECT_0
+
+    def ReleaseSemaphore(self, handle, release_count, previous_count):
+        return 1
+
+    def CreateSemaphoreExW(self, *args):
+        return 4
+
+    def CloseHandle(self, handle):
+        return 1
+
+
+class LegacyWin32Backend(Win32Backend):
+    """
+    wait() and release() as they were before the hot path
+    """
+
+    def wait(self, handle, timeout_ms):
+        kernel32 = self.kernel32
+        ret = kernel32.WaitForSingleObject(
+            handle,
+            INFINITE if timeout_ms is None else DWORD(timeout_ms)
+        )
+        if ret == WAIT_OBJECT_0:
+            return True
+        elif ret == WAIT_TIMEOUT:
+            return False
+        elif ret == WAIT_FAILED:
+            raise win_error(kernel32)
+        assert False, f"Unexpected return code: {ret}"
+
+    def release(self, handle, release_count):
+        kernel32 = self.kernel32
+        previous_count = LONG(0)
+        ret = kernel32.ReleaseSemaphore(
+            handle,
+            LONG(release_count),
+            LPLONG(previous_count)
+        )
+        if not ret:
+            raise win_error(kernel32)
+        return previous_count.value
+
+
+def pair(backend, handle) -> None:
+    backend.wait(handle, 0)
+    backend.release(handle, 1)
+
+
+def ns_per_call(backend, handle, calls: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(calls):
+        pair(backend, handle)
+    return (time.perf_counter_ns() - start) / calls
+
+
+def bytes_per_call(backend, handle, calls: int) -> float:
+    """
+    The peak memory allocated during a call, on average
+    """
+    pair(backend, handle)
+    total = 0
+    tracemalloc.start()
+    try:
+        for _ in range(calls):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            pair(backend, handle)
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total / calls
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--calls', type=int, default=100000)
+    parser.add_argument('--table', choices=('null', 'standin', 'kernel32'),
+                        default='kernel32' if sys.platform == 'win32'
+                        else 'null')
+    args = parser.parse_args()
+
+    tables = {'null': NullKernel32, 'standin': StandInKernel32,
+              'kernel32': Kernel32}
+    for cls in (LegacyWin32Backend, Win32Backend):
+        backend = cls(kernel32=tables[args.table]())
+        handle = backend.create(None, 1, 1, 0x1F0003)
+        try:
+            ns = min(ns_per_call(backend, handle, args.calls)
+                     for _ in range(3))
+            allocated = bytes_per_call(backend, handle, 1000)
+        finally:
+            backend.close(handle)
+        print(f'{cls.__name__} ({args.table}): wait(0) + release(1) '
+              f'{ns:.0f} ns, {allocated:.0f} bytes allocated per pair')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+Import time regression benchmark
+
+Runs ``python -X importtime -c "import semaphore_win_ctypes"`` in fresh
+interpreters and reports the cumulative import time of the package::
+
+    python benchmarks/bench_import.py --runs 20 --max-us 20000
+
+Exits with status 1 when the median exceeds --max-us.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+PACKAGE = 'semaphore_win_ctypes'
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_time_us() -> int:
+    """
+    The cumulative import time of the package in one fresh interpreter
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {PACKAGE}'],
+        cwd=ROOT, stderr=subprocess.PIPE, check=True,
+        universal_newlines=True,
+    )
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == PACKAGE:
+            return int(fields[1])
+    raise RuntimeError(f'{PACKAGE} not found in -X importtime output')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-us', type=int, default=None,
+                        help='fail when the median is above this')
+    args = parser.parse_args()
+
+    samples = sorted(import_time_us() for _ in range(args.runs))
+    median = statistics.median(samples)
+    print(f'{PACKAGE} import: median {median:.0f} us, '
+          f'min {samples[0]} us, max {samples[-1]} us '
+          f'({args.runs} runs)')
+    if args.max_us is not None and median > args.max_us:
+        print(f'FAIL: median above {args.max_us} us')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
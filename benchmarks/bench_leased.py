@@ -0,0 +1,72 @@
+"""
+Leased permits benchmark
+
+Threads acquire and release a semaphore in a loop, directly and through a
+LeasedSemaphore. Reports the throughput and the kernel calls made per
+acquire and release pair, for each backend that runs here::
+
+    python benchmarks/bench_leased.py --threads 8 --iterations 5000
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semaphore_win_ctypes import AcquireSemaphore, CreateSemaphore, \
+    LeasedSemaphore  # noqa: E402
+from bench_getvalue import backends  # noqa: E402
+
+
+def run(handle, threads: int, iterations: int) -> float:
+    """
+    Acquire and release pairs per second, over every thread
+    """
+    start = threading.Barrier(threads + 1)
+
+    def worker():
+        start.wait()
+        for _ in range(iterations):
+            with AcquireSemaphore(handle):
+                pass
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    start.wait()
+    began = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return threads * iterations / (time.perf_counter() - began)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--iterations', type=int, default=5000)
+    parser.add_argument('--maximum-count', type=int, default=16)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--backend', action='append', default=None,
+                        help='only this backend, may be repeated')
+    args = parser.parse_args()
+
+    operations = args.threads * args.iterations
+    for name, backend in backends().items():
+        if args.backend and name not in args.backend:
+            continue
+        with CreateSemaphore(maximum_count=args.maximum_count,
+                             backend=backend) as created:
+            direct = run(created, args.threads, args.iterations)
+            with LeasedSemaphore(created, args.batch_size) as leased:
+                leased_rate = run(leased, args.threads, args.iterations)
+                calls = leased.kernel_waits + leased.kernel_releases
+        print(f'{name}: direct {direct:.0f}/s, 2 kernel calls per pair; '
+              f'leased {leased_rate:.0f}/s, '
+              f'{calls / operations:.4f} kernel calls per pair')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
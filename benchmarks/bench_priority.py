@@ -0,0 +1,106 @@
+"""
+Priority scheduling benchmark: wait time per priority class under mixed load
+
+Latency-sensitive threads (priority 10) and batch threads (priority 0)
+share a semaphore with fewer permits than threads, each holding a permit
+for a while and coming back after a short pause. Reports the median, 99th
+percentile and worst wait of each class, acquiring the semaphore directly
+and through a PrioritySemaphore, for each backend that runs here::
+
+    python benchmarks/bench_priority.py --high 2 --low 8 --seconds 2
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semaphore_win_ctypes import AcquireSemaphore, CreateSemaphore, \
+    PrioritySemaphore  # noqa: E402
+from bench_getvalue import backends  # noqa: E402
+
+HIGH = 10
+LOW = 0
+
+
+def run(handle, prioritized: bool, high: int, low: int, hold_s: float,
+        seconds: float) -> dict:
+    """
+    The waits of each priority class, in seconds
+    """
+    waits = {HIGH: [], LOW: []}
+    stop = threading.Event()
+    start = threading.Barrier(high + low + 1)
+
+    def worker(priority):
+        samples = waits[priority]
+        acquire = AcquireSemaphore(
+            handle, priority=priority if prioritized else None)
+        start.wait()
+        while not stop.is_set():
+            began = time.perf_counter()
+            with acquire:
+                samples.append(time.perf_counter() - began)
+                time.sleep(hold_s)
+            # Give the others a chance to queue
+            time.sleep(hold_s)
+
+    workers = [threading.Thread(target=worker, args=(HIGH,))
+               for _ in range(high)]
+    workers += [threading.Thread(target=worker, args=(LOW,))
+                for _ in range(low)]
+    for thread in workers:
+        thread.start()
+    start.wait()
+    time.sleep(seconds)
+    stop.set()
+    for thread in workers:
+        thread.join()
+    return waits
+
+
+def summary(samples: list) -> str:
+    if not samples:
+        return 'no acquires'
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return (f'p50 {statistics.median(samples) * 1000:.2f} ms, '
+            f'p99 {p99 * 1000:.2f} ms, '
+            f'max {samples[-1] * 1000:.2f} ms ({len(samples)} acquires)')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--high', type=int, default=2,
+                        help='latency-sensitive threads')
+    parser.add_argument('--low', type=int, default=8, help='batch threads')
+    parser.add_argument('--maximum-count', type=int, default=2)
+    parser.add_argument('--hold-ms', type=float, default=2)
+    parser.add_argument('--seconds', type=float, default=2)
+    parser.add_argument('--aging-s', type=float, default=0.1)
+    parser.add_argument('--backend', action='append', default=None,
+                        help='only this backend, may be repeated')
+    args = parser.parse_args()
+
+    for name, backend in backends().items():
+        if args.backend and name not in args.backend:
+            continue
+        with CreateSemaphore(maximum_count=args.maximum_count,
+                             backend=backend) as created:
+            direct = run(created, False, args.high, args.low,
+                         args.hold_ms / 1000, args.seconds)
+            with PrioritySemaphore(created, args.aging_s) as prioritized:
+                scheduled = run(prioritized, True, args.high, args.low,
+                                args.hold_ms / 1000, args.seconds)
+        for label, waits in (('direct', direct), ('priority', scheduled)):
+            for priority in (HIGH, LOW):
+                print(f'{name} {label} priority {priority}: '
+                      f'{summary(waits[priority])}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+SemaphoreSet startup and memory benchmark
+
+Opens a few hundred named semaphores one OpenSemaphore at a time and then
+as a SemaphoreSet, one by one and spread over threads, and reports the time
+to open them, to read every count and to close them, and the Python memory
+kept per semaphore, for each backend that runs here::
+
+    python benchmarks/bench_semaphoreset.py --semaphores 500 --workers 8
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semaphore_win_ctypes import OpenSemaphore, SemaphoreSet  # noqa: E402
+from bench_getvalue import backends  # noqa: E402
+
+
+def one_by_one(names, backend) -> dict:
+    start = time.perf_counter()
+    opened = [OpenSemaphore(name, backend=backend) for name in names]
+    open_s = time.perf_counter() - start
+    start = time.perf_counter()
+    [handle.getvalue() for handle in opened]
+    read_s = time.perf_counter() - start
+    kept = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    for handle in opened:
+        handle.__exit__(None, None, None)
+    close_s = time.perf_counter() - start
+    return {'open_s': open_s, 'read_s': read_s, 'close_s': close_s,
+            'kept': kept}
+
+
+def as_set(names, backend, workers) -> dict:
+    start = time.perf_counter()
+    opened = SemaphoreSet(names, backend).open(workers=workers)
+    open_s = time.perf_counter() - start
+    start = time.perf_counter()
+    opened.snapshot()
+    read_s = time.perf_counter() - start
+    kept = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    opened.close()
+    close_s = time.perf_counter() - start
+    return {'open_s': open_s, 'read_s': read_s, 'close_s': close_s,
+            'kept': kept}
+
+
+def measure(function, *args) -> dict:
+    # Memory allocated by the opening and still held, names excluded
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    values = function(*args)
+    tracemalloc.stop()
+    values['kept'] -= baseline
+    return values
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--semaphores', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--backend', action='append', default=None,
+                        help='only this backend, may be repeated')
+    args = parser.parse_args()
+
+    count = args.semaphores
+    for name, backend in backends().items():
+        if args.backend and name not in args.backend:
+            continue
+        prefix = str(uuid.uuid4())
+        names = [f'{prefix}-{index}' for index in range(count)]
+        with SemaphoreSet(names, backend).create() as created:
+            results = [
+                ('OpenSemaphore', measure(one_by_one, names,
+                                          created.backend)),
+                ('SemaphoreSet', measure(as_set, names, created.backend,
+                                         None)),
+                (f'SemaphoreSet({args.workers} workers)',
+                 measure(as_set, names, created.backend, args.workers)),
+            ]
+        for label, values in results:
+            print(f"{name}: {label}: open {values['open_s'] * 1000:.2f} ms, "
+                  f"read {values['read_s'] * 1000:.2f} ms, "
+                  f"close {values['close_s'] * 1000:.2f} ms, "
+                  f"{values['kept'] / count:.0f} bytes per semaphore")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
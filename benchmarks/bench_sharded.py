@@ -0,0 +1,99 @@
+"""
+Sharded semaphore throughput benchmark
+
+Processes acquire and release permits of one named semaphore in a loop, for
+a fixed time, first with every permit in one kernel object and then split
+across the shards of a ShardedSemaphore, and reports the pairs per second
+over every process::
+
+    python benchmarks/bench_sharded.py --processes 8 --total 256 --shards 8
+
+Uses the win32 backend on Windows and the posix backend elsewhere, the ones
+whose names other processes can open.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semaphore_win_ctypes import Semaphore, ShardedSemaphore  # noqa: E402
+
+BACKEND = 'win32' if sys.platform == 'win32' else 'posix'
+
+
+def worker(name: str, total: int, shards: int, duration_s: float,
+           start, results) -> None:
+    if shards:
+        sem = ShardedSemaphore(name, total, shards, BACKEND)
+    else:
+        sem = Semaphore(name, BACKEND).create(total)
+    try:
+        acquire = sem.acquire
+        release = sem.release
+        pairs = 0
+        start.wait()
+        deadline = time.perf_counter() + duration_s
+        while time.perf_counter() < deadline:
+            for _ in range(100):
+                acquire()
+                release()
+            pairs += 100
+        results.put(pairs)
+    finally:
+        sem.close()
+
+
+def run(processes: int, total: int, shards: int, duration_s: float
+        ) -> float:
+    """
+    Pairs per second over every process, shards=0 for a single semaphore
+    """
+    context = multiprocessing.get_context('spawn')
+    name = str(uuid.uuid4())
+    start = context.Event()
+    results = context.Queue()
+    # Created here first, so the counts outlive any one worker
+    if shards:
+        owner = ShardedSemaphore(name, total, shards, BACKEND)
+    else:
+        owner = Semaphore(name, BACKEND).create(total)
+    try:
+        workers = [context.Process(target=worker,
+                                   args=(name, total, shards, duration_s,
+                                         start, results))
+                   for _ in range(processes)]
+        for process in workers:
+            process.start()
+        # Let every worker open the semaphore before the clock starts
+        time.sleep(1)
+        start.set()
+        pairs = sum(results.get() for _ in workers)
+        for process in workers:
+            process.join()
+    finally:
+        owner.close()
+    return pairs / duration_s
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--total', type=int, default=256)
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--duration-s', type=float, default=2.0)
+    args = parser.parse_args()
+
+    single = run(args.processes, args.total, 0, args.duration_s)
+    sharded = run(args.processes, args.total, args.shards, args.duration_s)
+    print(f'{BACKEND}: {args.processes} processes, {args.total} permits; '
+          f'one semaphore {single:.0f}/s, {args.shards} shards '
+          f'{sharded:.0f}/s ({sharded / single:.2f}x)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Spin-then-block acquire latency benchmark
+
+Threads contend for a semaphore, each holding it for a short critical
+section, and the time every acquire takes is recorded. Reports the p50 and
+p99 latency of plain blocking acquires and of acquire(spin=True), for each
+backend that runs here::
+
+    python benchmarks/bench_spin.py --threads 4 --hold-us 20
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semaphore_win_ctypes import AcquireSemaphore, CreateSemaphore  # noqa
+from bench_getvalue import backends  # noqa: E402
+
+
+def percentile(samples: list, fraction: float) -> int:
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def run(backend, spin: bool, threads: int, iterations: int,
+        maximum_count: int, hold_ns: int, busy_hold: bool) -> list:
+    """
+    The sorted acquire latencies of every thread, in nanoseconds
+    """
+    latencies = []
+    start = threading.Barrier(threads)
+    with CreateSemaphore(maximum_count=maximum_count,
+                         backend=backend) as created:
+        def worker():
+            samples = []
+            start.wait()
+            for _ in range(iterations):
+                before = time.perf_counter_ns()
+                with AcquireSemaphore(created, spin=spin):
+                    acquired = time.perf_counter_ns()
+                    samples.append(acquired - before)
+                    # A short critical section, which like most I/O lets
+                    # other threads run unless --busy-hold
+                    while time.perf_counter_ns() - acquired < hold_ns:
+                        if not busy_hold:
+                            time.sleep(0)
+                # Let another thread in before trying again
+                time.sleep(0)
+            latencies.extend(samples)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    return sorted(latencies)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--maximum-count', type=int, default=1)
+    parser.add_argument('--hold-us', type=int, default=20)
+    parser.add_argument('--busy-hold', action='store_true',
+                        help='hold the GIL for the whole critical section')
+    parser.add_argument('--backend', action='append', default=None,
+                        help='only this backend, may be repeated')
+    args = parser.parse_args()
+
+    for name, backend in backends().items():
+        if args.backend and name not in args.backend:
+            continue
+        for spin in (False, True):
+            samples = run(backend, spin, args.threads, args.iterations,
+                          args.maximum_count, args.hold_us * 1000,
+                          args.busy_hold)
+            mode = 'spin ' if spin else 'block'
+            print(f'{name} {mode}: p50 {percentile(samples, 0.5) / 1000:.1f}'
+                  f' us, p99 {percentile(samples, 0.99) / 1000:.1f} us')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,353 @@
+"""
+Benchmark suite: acquire/release latency and throughput, open/close cost
+
+The benchmarks are written in the style of asv (airspeed velocity): classes
+with ``params``, ``setup()`` and ``teardown()``, ``time_*`` methods whose
+run time is measured, and ``track_*`` methods that return their own value.
+This script runs them without asv and writes the results as JSON, so they
+can be kept per release and compared::
+
+    python benchmarks/bench_suite.py --output results.json
+    python benchmarks/bench_suite.py --compare results.json --max-ratio 1.3
+
+--compare exits with status 1 when a time is more than --max-ratio times
+the baseline, or a throughput less than 1 / --max-ratio times it. Every
+backend that runs here is measured, the cross-process benchmarks only use
+named backends that work across processes (posix, win32).
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import semaphore_win_ctypes  # noqa: E402
+from semaphore_win_ctypes import Semaphore, StandInKernel32  # noqa: E402
+from semaphore_win_ctypes.win32 import Win32Backend  # noqa: E402
+
+# Backends measured here: the platform's own, plus the stand-in and eventfd
+LOCAL_BACKENDS = ['standin']
+if sys.platform == 'win32':
+    SHARED_BACKENDS = ['win32']
+else:
+    SHARED_BACKENDS = ['posix']
+    if sys.platform.startswith('linux'):
+        LOCAL_BACKENDS.append('eventfd')
+BACKENDS = SHARED_BACKENDS + LOCAL_BACKENDS
+
+# Acquire and release pairs each thread or process makes
+CONTENDED_ITERATIONS = 2000
+
+
+def get_backend(name: str):
+    if name == 'standin':
+        return Win32Backend(kernel32=StandInKernel32())
+    return name
+
+
+class RoundTrip:
+    """
+    Uncontended acquire(0) and release()
+    """
+    params = [BACKENDS]
+    param_names = ['backend']
+
+    def setup(self, backend):
+        self.sem = Semaphore(backend=get_backend(backend)).create()
+
+    def teardown(self, backend):
+        self.sem.close()
+
+    def time_acquire_release(self, backend):
+        self.sem.acquire(0)
+        self.sem.release()
+
+
+class GetValue:
+    """
+    Reading the count
+    """
+    params = [BACKENDS]
+    param_names = ['backend']
+
+    def setup(self, backend):
+        self.sem = Semaphore(backend=get_backend(backend)).create()
+
+    def teardown(self, backend):
+        self.sem.close()
+
+    def time_getvalue(self, backend):
+        self.sem.getvalue()
+
+
+class Lifecycle:
+    """
+    Creating, opening and closing named semaphores
+    """
+    params = [BACKENDS]
+    param_names = ['backend']
+
+    def setup(self, backend):
+        self.backend = get_backend(backend)
+        self.name = str(uuid.uuid4())
+        self.sem = Semaphore(self.name, self.backend).create()
+        self.names = (str(uuid.uuid4()) for _ in itertools.count())
+
+    def teardown(self, backend):
+        self.sem.close()
+
+    def time_create_close(self, backend):
+        Semaphore(next(self.names), self.backend).create().close()
+
+    def time_open_close(self, backend):
+        Semaphore(self.name, self.backend).open().close()
+
+
+class ContendedThreads:
+    """
+    Acquire and release pairs per second, threads sharing one semaphore
+    """
+    params = [BACKENDS, [1, 2, 4, 8]]
+    param_names = ['backend', 'threads']
+    unit = 'pairs/s'
+
+    def setup(self, backend, threads):
+        # Fewer permits than threads, so they contend
+        self.sem = Semaphore(backend=get_backend(backend)).create(
+            maximum_count=max(1, threads // 2))
+
+    def teardown(self, backend, threads):
+        self.sem.close()
+
+    def track_throughput(self, backend, threads):
+        sem = self.sem
+        start = threading.Barrier(threads + 1)
+
+        def worker():
+            start.wait()
+            for _ in range(CONTENDED_ITERATIONS):
+                sem.acquire()
+                sem.release()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        start.wait()
+        began = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        return threads * CONTENDED_ITERATIONS / (time.perf_counter() - began)
+
+
+def _process_worker(backend, name, start, results):
+    sem = Semaphore(name, backend).open()
+    try:
+        start.wait()
+        began = time.perf_counter()
+        for _ in range(CONTENDED_ITERATIONS):
+            sem.acquire()
+            sem.release()
+        results.put((began, time.perf_counter()))
+    finally:
+        sem.close()
+
+
+class ContendedProcesses:
+    """
+    Acquire and release pairs per second, processes sharing one semaphore
+    """
+    params = [SHARED_BACKENDS, [1, 2, 4]]
+    param_names = ['backend', 'processes']
+    unit = 'pairs/s'
+
+    def setup(self, backend, processes):
+        self.name = str(uuid.uuid4())
+        self.sem = Semaphore(self.name, backend).create(
+            maximum_count=max(1, processes // 2))
+        self.context = multiprocessing.get_context('spawn')
+
+    def teardown(self, backend, processes):
+        self.sem.close()
+
+    def track_throughput(self, backend, processes):
+        # Starting the processes isn't measured, they wait for each other
+        start = self.context.Barrier(processes)
+        results = self.context.Queue()
+        workers = [self.context.Process(
+            target=_process_worker,
+            args=(backend, self.name, start, results))
+            for _ in range(processes)]
+        for process in workers:
+            process.start()
+        spans = [results.get() for _ in workers]
+        for process in workers:
+            process.join()
+        elapsed = (max(end for _, end in spans)
+                   - min(began for began, _ in spans))
+        return processes * CONTENDED_ITERATIONS / elapsed
+
+
+BENCHMARKS = [RoundTrip, GetValue, Lifecycle, ContendedThreads,
+              ContendedProcesses]
+
+
+def time_call(method, params, repeat: int, min_time_s: float) -> list:
+    """
+    Nanoseconds per call, one sample per repeat
+
+    Each sample calls the method as many times as fit in min_time_s.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            method(*params)
+        elapsed = time.perf_counter_ns() - start
+        if elapsed >= min_time_s * 1e9:
+            break
+        number *= 10
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            method(*params)
+        samples.append((time.perf_counter_ns() - start) / number)
+    return samples
+
+
+def run(selected: str = None, repeat: int = 5, min_time_s: float = 0.05,
+        quick: bool = False) -> list:
+    """
+    Run every benchmark, or those whose name contains selected
+
+    :returns: One result dict per benchmark and parameter combination
+    """
+    results = []
+    for cls in BENCHMARKS:
+        for name in sorted(dir(cls)):
+            kind = name.partition('_')[0]
+            if kind not in ('time', 'track'):
+                continue
+            full_name = f'{cls.__name__}.{name}'
+            if selected and selected not in full_name:
+                continue
+            for params in itertools.product(*cls.params):
+                if quick and any(param not in BACKENDS and param > 2
+                                 for param in params):
+                    continue
+                benchmark = cls()
+                benchmark.setup(*params)
+                try:
+                    method = getattr(benchmark, name)
+                    if kind == 'time':
+                        samples = time_call(method, params, repeat,
+                                            min_time_s)
+                        unit = 'ns'
+                    else:
+                        samples = [method(*params) for _ in range(repeat)]
+                        unit = cls.unit
+                finally:
+                    benchmark.teardown(*params)
+                result = {
+                    'name': full_name,
+                    'params': dict(zip(cls.param_names, params)),
+                    'unit': unit,
+                    'median': statistics.median(samples),
+                    'min': min(samples),
+                    'max': max(samples),
+                    'samples': samples,
+                }
+                print(f"{full_name} {result['params']}: "
+                      f"{result['median']:.0f} {unit}", flush=True)
+                results.append(result)
+    return results
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT, check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'version': semaphore_win_ctypes.__version__,
+        'commit': commit,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+
+
+def _key(result: dict) -> tuple:
+    return result['name'], tuple(sorted(result['params'].items()))
+
+
+def compare(results: list, baseline: list, max_ratio: float) -> list:
+    """
+    The results that regressed by more than max_ratio
+
+    Times regress when they grow, throughputs when they shrink.
+    """
+    previous = {_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(_key(result))
+        if old is None or not old['median']:
+            continue
+        ratio = result['median'] / old['median']
+        if result['unit'] != 'ns':
+            ratio = 1 / ratio if ratio else float('inf')
+        if ratio > max_ratio:
+            regressions.append((result, old, ratio))
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--bench', help='only benchmarks whose name '
+                                        'contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05,
+                        help='seconds per sample of a time_ benchmark')
+    parser.add_argument('--quick', action='store_true',
+                        help='at most 2 threads or processes')
+    parser.add_argument('--compare', help='a results file to compare with')
+    parser.add_argument('--max-ratio', type=float, default=1.3)
+    args = parser.parse_args()
+
+    results = run(args.bench, args.repeat, args.min_time, args.quick)
+    document = {'metadata': metadata(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.max_ratio)
+        for result, old, ratio in regressions:
+            print(f"REGRESSION {result['name']} {result['params']}: "
+                  f"{old['median']:.0f} -> {result['median']:.0f} "
+                  f"{result['unit']} ({ratio:.2f}x worse)")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
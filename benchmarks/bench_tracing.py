@@ -0,0 +1,76 @@
+"""
+Tracing overhead benchmark
+
+Times acquire(0) and release() pairs with and without a SemaphoreTracer,
+for each backend that runs here, reports the overhead per pair, and how
+long dumping a full ring buffer as Chrome trace JSON takes::
+
+    python benchmarks/bench_tracing.py --calls 100000 --max-overhead-ns 2000
+
+Exits with status 1 when an overhead exceeds --max-overhead-ns.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semaphore_win_ctypes import Semaphore, SemaphoreTracer  # noqa: E402
+from bench_getvalue import backends  # noqa: E402
+
+
+def ns_per_pair(backend, tracer, calls: int) -> float:
+    sem = Semaphore(backend=backend).create()
+    sem.tracer = tracer
+    try:
+        acquire = sem.acquire
+        release = sem.release
+        start = time.perf_counter_ns()
+        for _ in range(calls):
+            acquire(0)
+            release()
+        return (time.perf_counter_ns() - start) / calls
+    finally:
+        sem.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--calls', type=int, default=100000)
+    parser.add_argument('--runs', type=int, default=5,
+                        help='best of this many runs')
+    parser.add_argument('--capacity', type=int, default=65536)
+    parser.add_argument('--max-overhead-ns', type=int, default=None,
+                        help='fail when an overhead is above this')
+    parser.add_argument('--backend', action='append', default=None,
+                        help='only this backend, may be repeated')
+    args = parser.parse_args()
+
+    failed = False
+    tracer = SemaphoreTracer(args.capacity)
+    for name, backend in backends().items():
+        if args.backend and name not in args.backend:
+            continue
+        plain = traced = float('inf')
+        for _ in range(args.runs):
+            # Alternate, so drifting clock speeds affect both alike
+            plain = min(plain, ns_per_pair(backend, None, args.calls))
+            traced = min(traced, ns_per_pair(backend, tracer, args.calls))
+        overhead = traced - plain
+        print(f'{name}: {plain:.0f} ns per pair untraced, '
+              f'{traced:.0f} ns traced, overhead {overhead:.0f} ns')
+        if (args.max_overhead_ns is not None
+                and overhead > args.max_overhead_ns):
+            print(f'FAIL: overhead above {args.max_overhead_ns} ns')
+            failed = True
+    start = time.perf_counter()
+    tracer.dump(io.StringIO())
+    print(f'dump of {len(tracer.spans())} spans: '
+          f'{(time.perf_counter() - start) * 1000:.0f} ms')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
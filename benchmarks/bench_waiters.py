@@ -0,0 +1,121 @@
+"""
+Pending waiters scalability benchmark
+
+Parks waiters on a set of semaphores, either one thread per blocked
+acquire() or acquire_future() on the shared waiter threads, and reports the
+threads and resident memory of the process, then how long releasing every
+semaphore takes to complete all the waits::
+
+    python benchmarks/bench_waiters.py --waiters 100 1000 5000 --semaphores 200
+
+Each measurement runs in a fresh interpreter, so memory isn't carried over.
+Resident memory is read from /proc, and reported as n/a elsewhere.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semaphore_win_ctypes import Semaphore  # noqa: E402
+from bench_getvalue import backends  # noqa: E402
+
+MODES = ('threads', 'futures')
+
+
+def rss_kib():
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except OSError:
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def measure(backend_name: str, mode: str, waiters: int,
+            semaphores: int) -> dict:
+    backend = backends()[backend_name]
+    per_semaphore = -(-waiters // semaphores)
+    sems = [Semaphore(backend=backend).create(per_semaphore, 0)
+            for _ in range(semaphores)]
+    threads_before = threading.active_count()
+    rss_before = rss_kib()
+    done = threading.Semaphore(0)
+    if mode == 'threads':
+        parked = []
+        for index in range(waiters):
+            def wait(sem=sems[index % semaphores]):
+                sem.acquire()
+                done.release()
+            thread = threading.Thread(target=wait, daemon=True)
+            thread.start()
+            parked.append(thread)
+    else:
+        parked = [sems[index % semaphores].acquire_future()
+                  for index in range(waiters)]
+        for future in parked:
+            future.add_done_callback(lambda future: done.release())
+    # Every thread started, and blocked
+    time.sleep(0.2)
+    threads = threading.active_count() - threads_before
+    rss_after = rss_kib()
+    start = time.perf_counter()
+    for sem in sems:
+        sem.release(per_semaphore)
+    for _ in range(waiters):
+        done.acquire()
+    drain_s = time.perf_counter() - start
+    for sem in sems:
+        sem.close()
+    return {
+        'threads': threads,
+        'rss_kib': None if rss_before is None else rss_after - rss_before,
+        'drain_ms': drain_s * 1000,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--waiters', type=int, nargs='+',
+                        default=[100, 1000, 5000])
+    parser.add_argument('--semaphores', type=int, default=200)
+    parser.add_argument('--backend', action='append', default=None,
+                        help='only this backend, may be repeated')
+    parser.add_argument('--measure', nargs=3, metavar=('BACKEND', 'MODE',
+                                                       'WAITERS'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        backend_name, mode, waiters = args.measure
+        print(json.dumps(measure(backend_name, mode, int(waiters),
+                                 args.semaphores)))
+        return 0
+
+    for name in backends():
+        if args.backend and name not in args.backend:
+            continue
+        for waiters in args.waiters:
+            semaphores = min(args.semaphores, waiters)
+            for mode in MODES:
+                child = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--measure',
+                     name, mode, str(waiters),
+                     '--semaphores', str(semaphores)],
+                    stdout=subprocess.PIPE, universal_newlines=True,
+                    check=True)
+                values = json.loads(child.stdout)
+                rss = values['rss_kib']
+                print(f"{name}: {waiters} waiters on {semaphores} "
+                      f"semaphores, {mode}: {values['threads']} threads, "
+                      f"{'n/a' if rss is None else f'{rss} KiB'}, "
+                      f"drained in {values['drain_ms']:.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,266 @@
+"""A concurrency limit that follows the latency of the work it guards."""
+from __future__ import annotations
+import math
+import threading
+import time
+from typing import Optional
+
+from .cancel import CancellationToken
+from .exceptions import SemaphoreWaitTimeoutException
+from .resizable import ResizableSemaphore
+
+ALGORITHMS = ('aimd', 'gradient')
+
+# AIMD: the limit grows by increase for every limit samples under the
+# target latency, and is multiplied by backoff_ratio by a slower one
+DEFAULT_INCREASE = 1.0
+DEFAULT_BACKOFF_RATIO = 0.9
+
+# Gradient: how much of the gap to the new estimate each sample closes,
+# and how much slower than the lowest latency seen the latency may get
+# before the limit shrinks
+DEFAULT_SMOOTHING = 0.2
+DEFAULT_TOLERANCE = 1.5
+
+
+class AdaptiveLimiter:
+    """
+    Adjusts the limit of a ResizableSemaphore to the latency of the work
+    done while holding its permits
+
+    Each permit released after an acquire() through the limiter, as
+    AcquireSemaphore does, is a latency sample: the time the permit was
+    held. sample() can also be called directly. The limit only grows while
+    at least half of it is in use, since an idle limit says nothing about
+    what the downstream can take.
+
+    With algorithm='aimd', the limit grows by increase for every limit
+    samples at or under target_latency_s, and is multiplied by
+    backoff_ratio for every sample over it or passed to record_drop().
+
+    With algorithm='gradient', the latency is compared to a baseline,
+    target_latency_s or else tolerance times the lowest latency seen,
+    which stands for the latency without load: the limit is multiplied by
+    baseline / latency, kept between 0.5 and 1, plus the square root of
+    the limit as headroom to probe for more, and moves towards that
+    estimate by smoothing for each sample. The lowest latency is never
+    forgotten, so if the work gets slower for good, pass target_latency_s
+    or start a new limiter.
+
+    The limit is applied with resize(), without waiting for permits in
+    use, whenever its integer part changes. It's applied outside the
+    limiter's lock, by one thread at a time, and while another process is
+    resizing the semaphore it's left for a later sample to apply. Every
+    process sharing the semaphore sees it, so one process, or a few with
+    the same settings, should adapt it::
+
+        with ResizableSemaphore('downstream', limit=4, ceiling=256) as sem:
+            limiter = AdaptiveLimiter(sem, target_latency_s=0.05)
+            with AcquireSemaphore(limiter, timeout_ms=1000):
+                # Call the downstream here
+                pass
+    """
+
+    def __init__(self,
+                 semaphore: ResizableSemaphore,
+                 algorithm: str = 'aimd',
+                 min_limit: int = 1,
+                 max_limit: Optional[int] = None,
+                 target_latency_s: Optional[float] = None,
+                 increase: float = DEFAULT_INCREASE,
+                 backoff_ratio: float = DEFAULT_BACKOFF_RATIO,
+                 smoothing: float = DEFAULT_SMOOTHING,
+                 tolerance: float = DEFAULT_TOLERANCE,
+                 ):
+        """
+        :param semaphore: The semaphore whose limit to adapt
+        :param algorithm: 'aimd' or 'gradient' (default: 'aimd')
+        :param min_limit: The lowest limit (default: 1)
+        :param max_limit: The highest limit (default: the ceiling)
+        :param target_latency_s: AIMD backs off above this latency, None
+            to only back off on record_drop(), and it's the gradient's
+            baseline (default: None)
+        :param increase: How much AIMD grows the limit for every limit
+            samples (default: 1)
+        :param backoff_ratio: What AIMD multiplies the limit by (default:
+            0.9)
+        :param smoothing: How far the gradient limit moves towards its
+            estimate for each sample, from 0 to 1 (default: 0.2)
+        :param tolerance: How much slower than the lowest latency the
+            gradient allows before shrinking the limit, without
+            target_latency_s (default: 1.5)
+        """
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"algorithm must be one of {ALGORITHMS}, not "
+                             f"{algorithm!r}")
+        if max_limit is None:
+            max_limit = semaphore.ceiling
+        if not 1 <= min_limit <= max_limit <= semaphore.ceiling:
+            raise ValueError(f"Need 1 <= min_limit ({min_limit}) <= "
+                             f"max_limit ({max_limit}) <= the ceiling "
+                             f"({semaphore.ceiling})")
+        self.semaphore = semaphore
+        self.algorithm = algorithm
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency_s = target_latency_s
+        self.increase = increase
+        self.backoff_ratio = backoff_ratio
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        #: Permits acquired through the limiter and not yet released
+        self.inflight = 0
+        #: Samples taken, and resizes they caused
+        self.samples = 0
+        self.resizes = 0
+        self._limit = float(min(max(semaphore.limit, min_limit), max_limit))
+        # The limit last applied with resize()
+        self._applied = semaphore.limit
+        self._min_latency_s = 0.0
+        self._lock = threading.Lock()
+        # Held by the thread calling resize()
+        self._applying = threading.Lock()
+        # Acquire times of each thread's permits, newest last
+        self._local = threading.local()
+        self._apply()
+
+    @property
+    def sem(self) -> AdaptiveLimiter:
+        # AcquireSemaphore acquires and releases through handle.sem
+        return self
+
+    # Not instrumented, the wrapped Semaphore can be
+    metrics = None
+    tracer = None
+
+    @property
+    def limit(self) -> int:
+        """
+        The limit as last computed
+        """
+        return int(self._limit)
+
+    def acquire(self,
+                timeout_ms: int = None,
+                count: int = 1,
+                spin: bool = False,
+                cancel: CancellationToken = None,
+                ) -> AdaptiveLimiter:
+        """
+        Take a permit, see Semaphore.acquire(), and start timing its hold
+        """
+        if count != 1:
+            raise ValueError(f"AdaptiveLimiter times one permit at a time, "
+                             f"not {count}")
+        self.semaphore.acquire(timeout_ms, 1, spin, cancel)
+        with self._lock:
+            self.inflight += 1
+        started = getattr(self._local, 'started', None)
+        if started is None:
+            started = self._local.started = []
+        started.append(time.perf_counter())
+        return self
+
+    def release(self, release_count: int = 1) -> int:
+        """
+        Give a permit back, sampling how long it was held
+        """
+        if release_count != 1:
+            raise ValueError(f"AdaptiveLimiter times one permit at a time, "
+                             f"not {release_count}")
+        started = getattr(self._local, 'started', None)
+        if started:
+            self.sample(time.perf_counter() - started.pop())
+        with self._lock:
+            self.inflight -= 1
+        return self.semaphore.release(release_count)
+
+    def getvalue(self) -> int:
+        return self.semaphore.getvalue()
+
+    def sample(self, latency_s: float, inflight: Optional[int] = None
+               ) -> int:
+        """
+        Adjust the limit for one latency sample
+
+        :param latency_s: How long the guarded work took, in seconds
+        :param inflight: The permits in use during the work (default: the
+            permits currently acquired through the limiter)
+        :returns: The new limit
+        """
+        with self._lock:
+            if inflight is None:
+                inflight = self.inflight
+            self.samples += 1
+            limit = self._limit
+            # Below half of the limit in use, it isn't what's holding back
+            # the work, so it must not grow
+            saturated = inflight * 2 >= limit
+            if self.algorithm == 'aimd':
+                target = self.target_latency_s
+                if target is not None and latency_s > target:
+                    limit *= self.backoff_ratio
+                elif saturated:
+                    limit += self.increase / limit
+            else:
+                limit = self._gradient(limit, latency_s, saturated)
+            limit = self._limit = min(max(limit, self.min_limit),
+                                      self.max_limit)
+        self._apply()
+        return int(limit)
+
+    def _gradient(self, limit: float, latency_s: float, saturated: bool
+                  ) -> float:
+        # Called with the lock held
+        baseline = self.target_latency_s
+        if baseline is None:
+            if not self._min_latency_s or latency_s < self._min_latency_s:
+                self._min_latency_s = latency_s
+            baseline = self.tolerance * self._min_latency_s
+        if latency_s <= 0:
+            return limit
+        gradient = max(0.5, min(1.0, baseline / latency_s))
+        estimate = limit * gradient + math.sqrt(limit)
+        if estimate > limit and not saturated:
+            return limit
+        return limit + (estimate - limit) * self.smoothing
+
+    def record_drop(self) -> int:
+        """
+        Back off after work that failed from overload, like a rejection or
+        a timeout downstream, AIMD only
+
+        :returns: The new limit
+        """
+        with self._lock:
+            if self.algorithm == 'aimd':
+                self._limit = max(self._limit * self.backoff_ratio,
+                                  self.min_limit)
+            limit = self._limit
+        self._apply()
+        return int(limit)
+
+    def _apply(self) -> None:
+        # Called without the lock, resize() may wait for another process.
+        # A thread that finds another applying leaves it to that thread,
+        # which checks the limit again once it has stopped applying.
+        while self._applying.acquire(blocking=False):
+            try:
+                while True:
+                    limit = int(self._limit)
+                    if limit == self._applied:
+                        break
+                    try:
+                        self.semaphore.resize(limit)
+                    except SemaphoreWaitTimeoutException:
+                        # Another process is resizing, the next sample
+                        # retries
+                        return
+                    self._applied = limit
+                    self.resizes += 1
+            finally:
+                self._applying.release()
+            # A sample between the last check and the release found this
+            # thread applying, and left its limit to it
+            if int(self._limit) == self._applied:
+                return
@@ -0,0 +1,121 @@
+"""asyncio strategies for waiting on a semaphore without blocking the loop."""
+from __future__ import annotations
+import asyncio
+import os
+from typing import Any, Optional
+
+from .backend import POLL_INTERVAL_MAX_S, POLL_INTERVAL_MIN_S, \
+    SemaphoreBackend
+
+
+def _resolve(future: asyncio.Future, acquired: bool) -> None:
+    if not future.done():
+        future.set_result(acquired)
+
+
+async def _await_acquired(future: asyncio.Future,
+                          backend: SemaphoreBackend,
+                          handle: Any,
+                          ) -> bool:
+    try:
+        return await future
+    except asyncio.CancelledError:
+        # The permit may have been taken just before the task was cancelled
+        if future.done() and not future.cancelled() and future.result():
+            backend.release(handle, 1)
+        raise
+
+
+async def wait_polling(backend: SemaphoreBackend,
+                       handle: Any,
+                       timeout_ms: Optional[int],
+                       ) -> bool:
+    """
+    Retry a non-blocking wait() with exponential backoff
+
+    For backends with nothing an event loop can wait on, such as POSIX
+    named semaphores. Every attempt runs on the loop, so a cancelled task
+    never holds a permit.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout_ms is None else loop.time() + timeout_ms / 1000
+    interval = POLL_INTERVAL_MIN_S
+    while not backend.wait(handle, 0):
+        delay = interval
+        if deadline is not None:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            delay = min(delay, remaining)
+        await asyncio.sleep(delay)
+        interval = min(interval * 2, POLL_INTERVAL_MAX_S)
+    return True
+
+
+async def wait_readable(backend: SemaphoreBackend,
+                        handle: Any,
+                        timeout_ms: Optional[int],
+                        ) -> bool:
+    """
+    Wait for backend.fileno() to become readable with loop.add_reader()
+    """
+    if backend.wait(handle, 0):
+        return True
+    if timeout_ms == 0:
+        return False
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def on_readable() -> None:
+        # Other waiters are woken too, the permit may already be gone
+        if not future.done() and backend.wait(handle, 0):
+            future.set_result(True)
+
+    # A loop only keeps one reader per descriptor, each wait gets its own
+    fd = os.dup(backend.fileno(handle))
+    loop.add_reader(fd, on_readable)
+    timer = None
+    if timeout_ms is not None:
+        timer = loop.call_later(timeout_ms / 1000, _resolve, future, False)
+    try:
+        return await _await_acquired(future, backend, handle)
+    finally:
+        if timer is not None:
+            timer.cancel()
+        loop.remove_reader(fd)
+        os.close(fd)
+
+
+async def wait_registered(backend: SemaphoreBackend,
+                          handle: Any,
+                          timeout_ms: Optional[int],
+                          ) -> bool:
+    """
+    Wait with backend.register_wait(), e.g. RegisterWaitForSingleObject
+    """
+    if backend.wait(handle, 0):
+        return True
+    if timeout_ms == 0:
+        return False
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    # Written by the waiting thread, read after unregister() has returned
+    outcome = {}
+
+    def callback(acquired: bool) -> None:
+        outcome['acquired'] = acquired
+        loop.call_soon_threadsafe(_resolve, future, acquired)
+
+    registration = backend.register_wait(handle, timeout_ms, callback)
+    try:
+        return await future
+    except asyncio.CancelledError:
+        # Once unregistered the callback can't run, so the outcome is final
+        registration.unregister()
+        registration = None
+        if outcome.get('acquired'):
+            backend.release(handle, 1)
+        raise
+    finally:
+        if registration is not None:
+            registration.unregister()
@@ -0,0 +1,543 @@
+"""Pluggable operating system backends for Semaphore."""
+from __future__ import annotations
+import errno
+import os
+import sys
+import time
+
+from .constants import ERROR_TOO_MANY_POSTS, SEMAPHORE_ALL_ACCESS
+
+# typing is only needed by type checkers, keep it off the import path
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Any, Callable, Dict, MutableSequence, Optional, \
+        Sequence, Tuple, Union
+
+# Backends are imported on first use so that, for example, the Windows
+# bindings are never touched on Linux.
+BACKENDS: Dict[str, str] = {
+    'win32': 'semaphore_win_ctypes.win32:Win32Backend',
+    'posix': 'semaphore_win_ctypes.posix:PosixBackend',
+    'eventfd': 'semaphore_win_ctypes.eventfd:EventFdBackend',
+}
+
+# Appended to a semaphore's name to name its gate, see create_gate()
+GATE_SUFFIX = '.gate'
+
+# Backoff used when waiting on something that can't be waited on directly
+POLL_INTERVAL_MIN_S = 0.001
+POLL_INTERVAL_MAX_S = 0.05
+
+# Longest a cancellable wait blocks before checking its event, for backends
+# that can't wait on both at once, see wait_cancellable()
+CANCEL_SLICE_MS = 10
+
+_instances: Dict[str, SemaphoreBackend] = {}
+_default_backend: Optional[SemaphoreBackend] = None
+
+
+class SemaphoreBackend:
+    """
+    The operating system primitives behind a Semaphore.
+
+    A backend hands out opaque handles, a false value means "no handle".
+    Every method raises OSError when the underlying call fails, so the
+    Semaphore class behaves the same whichever backend is in use.
+    """
+
+    #: The name this backend is registered under in BACKENDS
+    name: str = None
+
+    def create(self,
+               name: Optional[str],
+               initial_count: int,
+               maximum_count: int,
+               desired_access: int,
+               ) -> Any:
+        """
+        Create a semaphore, or open it if the name already exists
+
+        :param name: The name of the semaphore, None for an unnamed one
+        :param initial_count: The initial count of the semaphore
+        :param maximum_count: The maximum count of the semaphore
+        :param desired_access: The access mask for the returned handle
+        :raises OSError: The semaphore could not be created.
+        :returns: A handle to the semaphore
+        """
+        raise NotImplementedError
+
+    def open(self,
+             name: str,
+             desired_access: int,
+             inherit: bool,
+             ) -> Any:
+        """
+        Open an existing named semaphore
+
+        :param name: The name of the semaphore
+        :param desired_access: The access mask for the returned handle
+        :param inherit: Whether child processes inherit the handle
+        :raises OSError: The semaphore does not exist or can't be opened.
+        :returns: A handle to the semaphore
+        """
+        raise NotImplementedError
+
+    def wait(self, handle: Any, timeout_ms: Optional[int]) -> bool:
+        """
+        Decrement the count, waiting for it to become non-zero
+
+        :param handle: A handle returned by create() or open()
+        :param timeout_ms: The time-out interval, in milliseconds, None
+            waits forever
+        :raises OSError: The wait has failed.
+        :returns: True if the count was decremented, False on time-out
+        """
+        raise NotImplementedError
+
+    def release(self, handle: Any, release_count: int) -> int:
+        """
+        Increase the count
+
+        :param handle: A handle returned by create() or open()
+        :param release_count: The amount to increase the count by
+        :raises OSError: The count would exceed the maximum count, or the
+            release has failed.
+        :returns: The previous count
+        """
+        raise NotImplementedError
+
+    def query(self, handle: Any) -> Tuple[int, int]:
+        """
+        Read the count without changing it
+
+        :param handle: A handle returned by create() or open(), with
+            SEMAPHORE_QUERY_STATE access
+        :raises OSError: The handle is not valid.
+        :returns: The current count and the maximum count. The current
+            count may be out of date by the time it's returned.
+        """
+        raise NotImplementedError
+
+    def query_counts(self, handles: Sequence[Any],
+                     counts: MutableSequence[int]) -> None:
+        """
+        Read the counts of many semaphores, like query() on each
+
+        The default calls query(), backends override it to reuse their
+        buffers across the handles.
+
+        :param handles: Handles returned by create() or open(), with
+            SEMAPHORE_QUERY_STATE access
+        :param counts: Where to store the counts, as long as handles
+        :raises OSError: A handle is not valid.
+        """
+        query = self.query
+        for index, handle in enumerate(handles):
+            counts[index] = query(handle)[0]
+
+    def close(self, handle: Any) -> None:
+        """
+        Close a handle
+
+        :param handle: A handle returned by create() or open()
+        :raises OSError: The handle is not valid.
+        """
+        raise NotImplementedError
+
+    def share(self, handle: Any, name: Optional[str]) -> Any:
+        """
+        What another process needs to use a handle, pickled with it
+
+        The default leaves the child to open the semaphore by name. Backends
+        whose handles can cross processes override it, the way
+        multiprocessing reduces its own synchronization objects.
+
+        :param handle: A handle returned by create() or open()
+        :param name: The name of the semaphore, None for an unnamed one
+        :raises TypeError: The semaphore can't be shared with another
+            process.
+        :returns: A picklable value for adopt() in the other process
+        """
+        if name is None:
+            raise TypeError(f"An unnamed {self.name} semaphore can't be "
+                            f"shared with another process")
+        return name
+
+    def share_inheritable(self, handle: Any, name: Optional[str]
+                          ) -> Tuple[Any, Sequence[int]]:
+        """
+        What a child started by subprocess needs to use a handle
+
+        :param handle: A handle returned by create() or open()
+        :param name: The name of the semaphore, None for an unnamed one
+        :raises TypeError: The semaphore can't be shared with another
+            process.
+        :raises OSError: The handle could not be duplicated.
+        :returns: A value JSON can encode, for adopt() in the child, and the
+            handles or descriptors the child must inherit, which the parent
+            closes with close_inherited() once the child has started
+        """
+        return self.share(handle, name), ()
+
+    def close_inherited(self, inherited: Sequence[int]) -> None:
+        """
+        Close what share_inheritable() duplicated for a child
+
+        :param inherited: The handles or descriptors it returned
+        :raises OSError: One could not be closed.
+        """
+        for fd in inherited:
+            os.close(fd)
+
+    def adopt(self, shared: Any) -> Any:
+        """
+        A handle to a semaphore shared by another process
+
+        :param shared: The value returned by share() or share_inheritable()
+            in that process
+        :raises OSError: The semaphore could not be opened.
+        :returns: A handle, as create() or open() return
+        """
+        return self.open(shared, SEMAPHORE_ALL_ACCESS, False)
+
+    def create_gate(self, name: Optional[str]) -> Any:
+        """
+        Create, or open, the gate of a semaphore
+
+        The gate is a binary semaphore that lets one wait_count() at a time
+        collect permits, so two of them can't deadlock each holding part
+        of what the other needs.
+
+        :param name: The name of the semaphore, None for an unnamed one
+        :raises OSError: The gate could not be created.
+        :returns: A handle to the gate
+        """
+        return self.create(None if name is None else name + GATE_SUFFIX,
+                           1, 1, SEMAPHORE_ALL_ACCESS)
+
+    def wait_count(self,
+                   handle: Any,
+                   gate: Any,
+                   count: int,
+                   timeout_ms: Optional[int],
+                   event: Any = None,
+                   ) -> Optional[bool]:
+        """
+        Decrement the count by count, or not at all
+
+        Passes the gate, then keeps every permit it gets until it has
+        count of them. Holding on to them means a stream of single waits
+        can delay, but not starve, a large request. On time-out or
+        cancellation the permits taken so far are released.
+
+        :param handle: A handle returned by create() or open()
+        :param gate: The handle returned by create_gate() for the semaphore
+        :param count: The number of permits to take
+        :param timeout_ms: The time-out interval, in milliseconds, None
+            waits forever
+        :param event: An event returned by create_event() that cancels the
+            wait when set, see wait_cancellable() (default: not
+            cancellable)
+        :raises ValueError: count is more than the maximum count, where the
+            handle can query it.
+        :raises OSError: The wait has failed.
+        :returns: True if the count was decremented, False on time-out,
+            None if the event was set
+        """
+        try:
+            maximum_count = self.query(handle)[1]
+        except (NotImplementedError, OSError):
+            # No SEMAPHORE_QUERY_STATE access
+            maximum_count = None
+        if maximum_count is not None and count > maximum_count:
+            # Would wait forever, holding the gate and every permit
+            raise ValueError(f"Can't take {count} permits of a semaphore "
+                             f"with a maximum count of {maximum_count}")
+        deadline = None
+        if timeout_ms is not None:
+            deadline = time.monotonic() + timeout_ms / 1000
+        acquired = self._wait_event(gate, event, timeout_ms)
+        if not acquired:
+            return acquired
+        taken = 0
+        try:
+            while taken < count:
+                remaining_ms = None
+                if deadline is not None:
+                    remaining_ms = max(
+                        0, int((deadline - time.monotonic()) * 1000))
+                acquired = self._wait_event(handle, event, remaining_ms)
+                if not acquired:
+                    return acquired
+                taken += 1
+            return True
+        finally:
+            try:
+                if 0 < taken < count:
+                    self.release(handle, taken)
+            finally:
+                self.release(gate, 1)
+
+    def create_event(self) -> Any:
+        """
+        Create an unnamed manual-reset event, initially not set
+
+        Events are what CancellationToken is built on: once set, every
+        wait_cancellable() on them returns. The default is a
+        threading.Event, which wait_cancellable() checks between slices of
+        a normal wait.
+
+        :raises OSError: The event could not be created.
+        :returns: A handle to the event
+        """
+        import threading
+        return threading.Event()
+
+    def set_event(self, event: Any) -> None:
+        """
+        Set an event, waking every wait_cancellable() on it
+
+        :param event: An event returned by create_event()
+        :raises OSError: The event could not be set.
+        """
+        event.set()
+
+    def close_event(self, event: Any) -> None:
+        """
+        Close an event
+
+        :param event: An event returned by create_event()
+        :raises OSError: The handle is not valid.
+        """
+
+    def wait_cancellable(self,
+                         handle: Any,
+                         event: Any,
+                         timeout_ms: Optional[int],
+                         ) -> Optional[bool]:
+        """
+        Like wait(), returning early when an event is set
+
+        The default waits CANCEL_SLICE_MS at a time and checks the event in
+        between, so it returns at most that long after the event was set.
+
+        :param handle: A handle returned by create() or open()
+        :param event: An event returned by create_event()
+        :param timeout_ms: The time-out interval, in milliseconds, None
+            waits forever
+        :raises OSError: The wait has failed.
+        :returns: True if the count was decremented, False on time-out,
+            None if the event was set first
+        """
+        deadline = None
+        if timeout_ms is not None:
+            deadline = time.monotonic() + timeout_ms / 1000
+        while not event.is_set():
+            slice_ms = CANCEL_SLICE_MS
+            if deadline is not None:
+                remaining_ms = int((deadline - time.monotonic()) * 1000)
+                if remaining_ms <= 0:
+                    return self.wait(handle, 0)
+                slice_ms = min(slice_ms, remaining_ms)
+            if self.wait(handle, slice_ms):
+                return True
+        return None
+
+    def _wait_event(self, handle: Any, event: Any,
+                    timeout_ms: Optional[int]) -> Optional[bool]:
+        if event is None:
+            return self.wait(handle, timeout_ms)
+        return self.wait_cancellable(handle, event, timeout_ms)
+
+    def wait_any(self,
+                 handles: Sequence[Any],
+                 timeout_ms: Optional[int],
+                 ) -> Optional[int]:
+        """
+        Decrement the count of whichever semaphore is available first
+
+        The default retries non-blocking waits with exponential backoff.
+
+        :param handles: Handles returned by create() or open()
+        :param timeout_ms: The time-out interval, in milliseconds, None
+            waits forever
+        :raises OSError: The wait has failed.
+        :returns: The index of the decremented handle, None on time-out
+        """
+        deadline = None
+        if timeout_ms is not None:
+            deadline = time.monotonic() + timeout_ms / 1000
+        interval = POLL_INTERVAL_MIN_S
+        while True:
+            for index, handle in enumerate(handles):
+                if self.wait(handle, 0):
+                    return index
+            delay = interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                delay = min(delay, remaining)
+            time.sleep(delay)
+            interval = min(interval * 2, POLL_INTERVAL_MAX_S)
+
+    def wait_all(self,
+                 handles: Sequence[Any],
+                 timeout_ms: Optional[int],
+                 ) -> bool:
+        """
+        Decrement the count of every semaphore, or of none of them
+
+        The default never blocks while holding a permit: it takes what it
+        can without waiting, gives it all back if one semaphore is
+        unavailable, then waits on that one alone before trying again.
+
+        :param handles: Handles returned by create() or open()
+        :param timeout_ms: The time-out interval, in milliseconds, None
+            waits forever
+        :raises OSError: The wait has failed.
+        :returns: True if every count was decremented, False on time-out
+        """
+        deadline = None
+        if timeout_ms is not None:
+            deadline = time.monotonic() + timeout_ms / 1000
+        held = None
+        while True:
+            # The permit waited for last time is already held
+            taken = [] if held is None else [held]
+            unavailable = None
+            try:
+                for index, handle in enumerate(handles):
+                    if index == held:
+                        continue
+                    if not self.wait(handle, 0):
+                        unavailable = index
+                        break
+                    taken.append(index)
+            except BaseException:
+                self._release_each(handles, taken)
+                raise
+            if unavailable is None:
+                return True
+            self._release_each(handles, taken)
+            remaining_ms = None
+            if deadline is not None:
+                remaining_ms = int((deadline - time.monotonic()) * 1000)
+                if remaining_ms <= 0:
+                    return False
+            held = unavailable
+            if not self.wait(handles[held], remaining_ms):
+                return False
+
+    def _release_each(self, handles: Sequence[Any], indexes: Sequence[int]
+                      ) -> None:
+        for index in indexes:
+            self.release(handles[index], 1)
+
+    def fileno(self, handle: Any) -> Optional[int]:
+        """
+        A file descriptor that polls readable when the count may be non-zero
+
+        :param handle: A handle returned by create() or open()
+        :returns: The file descriptor, or None if the backend has none
+        """
+        return None
+
+    def register_wait(self,
+                      handle: Any,
+                      timeout_ms: Optional[int],
+                      callback: Callable[[bool], None],
+                      ) -> Any:
+        """
+        Wait on another thread, like RegisterWaitForSingleObject
+
+        :param handle: A handle returned by create() or open()
+        :param timeout_ms: The time-out interval, in milliseconds, None
+            waits forever
+        :param callback: Called once from another thread, with True if the
+            count was decremented and False on time-out
+        :raises OSError: The wait could not be registered.
+        :returns: An object whose unregister() method cancels the wait, and
+            only returns once the callback is no longer running
+        """
+        raise NotImplementedError
+
+    async def wait_async(self, handle: Any, timeout_ms: Optional[int]
+                         ) -> bool:
+        """
+        Like wait(), without blocking the running event loop
+
+        Cancelling the awaiting task never leaves the count decremented.
+        The default waits for fileno() to become readable, or polls when
+        the backend has no file descriptor.
+
+        :param handle: A handle returned by create() or open()
+        :param timeout_ms: The time-out interval, in milliseconds, None
+            waits forever
+        :raises OSError: The wait has failed.
+        :returns: True if the count was decremented, False on time-out
+        """
+        from .aio import wait_polling, wait_readable
+        if self.fileno(handle) is not None:
+            return await wait_readable(self, handle, timeout_ms)
+        return await wait_polling(self, handle, timeout_ms)
+
+
+def is_too_many_posts(exc: OSError) -> bool:
+    """
+    Whether a release failed because it would exceed the maximum count
+
+    ERROR_TOO_MANY_POSTS on Windows, EOVERFLOW from the other backends and
+    the stand-in kernel32.
+    """
+    return (getattr(exc, 'winerror', None) == ERROR_TOO_MANY_POSTS
+            or exc.errno == errno.EOVERFLOW)
+
+
+def get_backend(backend: Union[SemaphoreBackend, str, None] = None
+                ) -> SemaphoreBackend:
+    """
+    Resolve a backend
+
+    :param backend: A backend instance, the name of a registered backend, or
+        None for the default backend of this platform
+    :raises KeyError: The backend name is not registered.
+    :returns: The backend instance
+    """
+    if isinstance(backend, SemaphoreBackend):
+        return backend
+    if backend is None:
+        return get_default_backend()
+    instance = _instances.get(backend)
+    if instance is None:
+        import importlib
+        module_name, _, class_name = BACKENDS[backend].partition(':')
+        module = importlib.import_module(module_name)
+        instance = _instances[backend] = getattr(module, class_name)()
+    return instance
+
+
+def get_default_backend() -> SemaphoreBackend:
+    """
+    The backend used by Semaphore when none is given
+
+    :returns: The backend set by set_default_backend(), otherwise 'win32' on
+        Windows and 'posix' everywhere else
+    """
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = get_backend(
+            'win32' if sys.platform == 'win32' else 'posix')
+    return _default_backend
+
+
+def set_default_backend(backend: Union[SemaphoreBackend, str, None]
+                        ) -> None:
+    """
+    Change the backend used by Semaphore when none is given
+
+    :param backend: A backend instance or registered name, None restores
+        the platform default
+    """
+    global _default_backend
+    _default_backend = None if backend is None else get_backend(backend)
@@ -0,0 +1,110 @@
+"""Cancelling waits from another thread."""
+from __future__ import annotations
+import _thread
+from typing import Any, Dict
+
+from .backend import SemaphoreBackend
+from .exceptions import SemaphoreWaitCancelledException
+
+
+class CancellationToken:
+    """
+    Cancels every acquire(cancel=token) waiting on it, at once
+
+    Each backend the token is used with gets an event object, created on
+    first use: a manual-reset event on Windows, an eventfd with the eventfd
+    backend. A cancellable wait waits on the semaphore and the event
+    together, so cancel() wakes every waiter without the cost of polling.
+    Backends without events, like posix, check the token between short
+    slices of a normal wait, see SemaphoreBackend.wait_cancellable().
+
+    A token can't be reset, use a new one for the next round of work::
+
+        with CancellationToken() as token:
+            # On other threads
+            with AcquireSemaphore(handle, cancel=token):
+                # Perform work here
+                pass
+
+            # On shutdown
+            token.cancel()
+    """
+
+    def __init__(self):
+        self._cancelled = False
+        self._closed = False
+        self._events: Dict[SemaphoreBackend, Any] = {}
+        self._lock = _thread.allocate_lock()
+
+    def __enter__(self) -> CancellationToken:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        Whether cancel() was called
+        """
+        return self._cancelled
+
+    def cancel(self) -> None:
+        """
+        Cancel current and future waits on the token
+
+        Calling it again does nothing.
+        :raises OSError: An event could not be set.
+        """
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            for backend, event in self._events.items():
+                backend.set_event(event)
+
+    def raise_if_cancelled(self) -> None:
+        """
+        :raises SemaphoreWaitCancelledException: cancel() was called.
+        """
+        if self._cancelled:
+            raise SemaphoreWaitCancelledException()
+
+    def event(self, backend: SemaphoreBackend) -> Any:
+        """
+        The token's event for a backend, created on first use
+
+        :param backend: The backend of the semaphore being waited on
+        :raises ValueError: The token is closed.
+        :raises OSError: The event could not be created.
+        :returns: An event returned by backend.create_event(), set once the
+            token is cancelled
+        """
+        event = self._events.get(backend)
+        if event is not None:
+            return event
+        with self._lock:
+            if self._closed:
+                raise ValueError("CancellationToken is closed")
+            event = self._events.get(backend)
+            if event is None:
+                event = backend.create_event()
+                if self._cancelled:
+                    backend.set_event(event)
+                self._events[backend] = event
+        return event
+
+    def close(self) -> None:
+        """
+        Close the token's events
+
+        No wait may still be using the token. cancelled keeps working.
+        """
+        with self._lock:
+            self._closed = True
+            events, self._events = self._events, {}
+        for backend, event in events.items():
+            backend.close_event(event)
+
+    def __repr__(self) -> str:
+        return f'<CancellationToken cancelled={self._cancelled}>'
@@ -0,0 +1,328 @@
+"""Command line tools to create, inspect and load test named semaphores."""
+from __future__ import annotations
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .exceptions import SemaphoreWaitTimeoutException
+from .semaphore import AcquireSemaphore, CreateSemaphore, OpenSemaphore
+
+# Exit statuses, argparse exits with 2 on usage errors too
+EXIT_OK = 0
+EXIT_TIMEOUT = 1
+EXIT_ERROR = 2
+
+# The latency percentiles loadgen reports
+PERCENTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+def _hold(hold_ms: Optional[int]) -> None:
+    # Until the time is up, or forever with None, Ctrl+C ends both
+    try:
+        if hold_ms is None:
+            while True:
+                time.sleep(3600)
+        time.sleep(hold_ms / 1000)
+    except KeyboardInterrupt:
+        pass
+
+
+def _print(args: argparse.Namespace, values: Dict[str, Any]) -> None:
+    if args.json:
+        print(json.dumps(values, sort_keys=True))
+    else:
+        for key, value in values.items():
+            print(f'{key}: {value}')
+    sys.stdout.flush()
+
+
+def create(args: argparse.Namespace) -> int:
+    """
+    Create a semaphore and keep it open, like SemaphoreHelper.exe create
+    """
+    maximum_count = args.maximum_count
+    if maximum_count is None:
+        maximum_count = max(1, args.initial_count or 1)
+    with CreateSemaphore(args.name, maximum_count, args.initial_count,
+                         backend=args.backend, ledger=args.ledger,
+                         shared_stats=args.shared_stats) as created:
+        # A line to wait for, once other processes can open it
+        _print(args, {'created': args.name,
+                      'count': created.getvalue(),
+                      'maximum_count': maximum_count})
+        if args.reap:
+            from .ledger import LeaseReaper
+            with LeaseReaper(created):
+                _hold(args.hold_ms)
+        else:
+            _hold(args.hold_ms)
+    return EXIT_OK
+
+
+def open_and_acquire(args: argparse.Namespace) -> int:
+    """
+    Open a semaphore, acquire it and hold it, like SemaphoreHelper.exe
+    open-and-acquire
+    """
+    with OpenSemaphore(args.name, backend=args.backend,
+                       ledger=args.ledger,
+                       shared_stats=args.shared_stats) as opened:
+        try:
+            with AcquireSemaphore(opened, args.timeout_ms, args.count):
+                _print(args, {'acquired': args.count})
+                _hold(args.hold_ms)
+        except SemaphoreWaitTimeoutException:
+            print(f'Timed out acquiring {args.name!r}', file=sys.stderr)
+            return EXIT_TIMEOUT
+    return EXIT_OK
+
+
+def inspect(args: argparse.Namespace) -> int:
+    """
+    Print the count of a semaphore, and its shared stats and lease ledger
+    if it has them
+    """
+    with OpenSemaphore(args.name, backend=args.backend) as opened:
+        stats = opened.sem.stats()
+        backend = opened.sem.backend
+    values: Dict[str, Any] = {
+        'name': args.name,
+        'backend': backend.name,
+        'count': stats.current_count,
+        'maximum_count': stats.maximum_count,
+    }
+    from .sharedstats import read_shared_stats
+    try:
+        snapshot = read_shared_stats(args.name, backend)
+    except FileNotFoundError:
+        pass
+    else:
+        shared = snapshot.as_dict()
+        del shared['name'], shared['time_ns']
+        values['shared_stats'] = shared
+    from .ledger import LeaseLedger, ledger_path
+    if os.path.exists(ledger_path(args.name, backend)):
+        with LeaseLedger(args.name, backend) as ledger:
+            values['holders'] = ledger.holders()
+    _print(args, values)
+    return EXIT_OK
+
+
+def release(args: argparse.Namespace) -> int:
+    """
+    Release a semaphore
+    """
+    with OpenSemaphore(args.name, backend=args.backend) as opened:
+        previous_count = opened.sem.release(args.count)
+    _print(args, {'previous_count': previous_count,
+                  'count': previous_count + args.count})
+    return EXIT_OK
+
+
+def loadgen_worker(name: str,
+                   backend: Optional[str],
+                   cycles_per_s: Optional[float],
+                   hold_s: float,
+                   duration_s: float,
+                   timeout_ms: Optional[int],
+                   ) -> Tuple[List[int], int, float, float]:
+    """
+    Acquire, hold and release a semaphore for duration_s seconds
+
+    :returns: The wait of each acquire in nanoseconds, the number of
+        timeouts, and the wall clock times the worker started and ended
+    """
+    waits: List[int] = []
+    timeouts = 0
+    interval_s = 1 / cycles_per_s if cycles_per_s else 0
+    with OpenSemaphore(name, backend=backend) as opened:
+        sem = opened.sem
+        began = time.time()
+        start = time.perf_counter()
+        deadline = start + duration_s
+        next_cycle = start
+        while True:
+            now = time.perf_counter()
+            if interval_s:
+                if next_cycle > now:
+                    time.sleep(next_cycle - now)
+                    now = next_cycle
+                next_cycle += interval_s
+            if now >= deadline:
+                break
+            try:
+                sem.acquire(timeout_ms)
+            except SemaphoreWaitTimeoutException:
+                timeouts += 1
+                continue
+            # From when the cycle was due, so a late cycle counts as waiting
+            waits.append(int((time.perf_counter() - now) * 1e9))
+            if hold_s:
+                time.sleep(hold_s)
+            sem.release()
+        return waits, timeouts, began, time.time()
+
+
+def _percentile(samples: Sequence[int], fraction: float) -> int:
+    # samples sorted, nearest rank
+    if not samples:
+        return 0
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def loadgen(args: argparse.Namespace) -> int:
+    """
+    Run acquire, hold and release cycles from several workers and report
+    throughput and wait percentiles
+    """
+    import concurrent.futures
+    if args.processes:
+        import multiprocessing
+        executor = concurrent.futures.ProcessPoolExecutor(
+            args.workers, multiprocessing.get_context('spawn'))
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(args.workers)
+    cycles_per_s = args.rate / args.workers if args.rate else None
+    created = None
+    if args.create is not None:
+        created = CreateSemaphore(args.name, args.create,
+                                  backend=args.backend)
+    try:
+        with executor:
+            futures = [executor.submit(
+                loadgen_worker, args.name, args.backend, cycles_per_s,
+                args.hold_ms / 1000, args.duration_s, args.timeout_ms)
+                for _ in range(args.workers)]
+            results = [future.result() for future in futures]
+    finally:
+        if created is not None:
+            created.sem.close()
+    waits = sorted(wait for result in results for wait in result[0])
+    timeouts = sum(result[1] for result in results)
+    elapsed_s = (max(result[3] for result in results)
+                 - min(result[2] for result in results))
+    values: Dict[str, Any] = {
+        'workers': args.workers,
+        'mode': 'processes' if args.processes else 'threads',
+        'cycles': len(waits),
+        'timeouts': timeouts,
+        'seconds': round(elapsed_s, 3),
+        'cycles_per_s': round(len(waits) / elapsed_s, 1) if elapsed_s else 0,
+    }
+    for fraction in PERCENTILES:
+        values[f'wait_p{fraction * 100:g}_ms'] = round(
+            _percentile(waits, fraction) / 1e6, 3)
+    values['wait_max_ms'] = round(waits[-1] / 1e6, 3) if waits else 0
+    _print(args, values)
+    return EXIT_OK
+
+
+def _timeout_ms(value: str) -> Optional[int]:
+    # 'infinite' for an infinite wait
+    if value.lower() in ('infinite', 'none'):
+        return None
+    return int(value)
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """
+    The parser of python -m semaphore_win_ctypes
+    """
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--backend', default=None,
+                        help='backend name (default: the platform default)')
+    common.add_argument('--json', action='store_true',
+                        help='print one JSON object instead of lines')
+
+    parser = argparse.ArgumentParser(
+        prog='python -m semaphore_win_ctypes',
+        description='Create, inspect and load test named semaphores.')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    command = commands.add_parser(
+        'create', parents=[common],
+        help='create a semaphore and keep it open')
+    command.add_argument('name')
+    command.add_argument('hold_ms', type=int, nargs='?', default=None,
+                         help='how long to keep it open (default: until '
+                              'interrupted)')
+    command.add_argument('initial_count', type=int, nargs='?', default=1)
+    command.add_argument('maximum_count', type=int, nargs='?', default=None,
+                         help='(default: initial_count)')
+    command.add_argument('--ledger', action='store_true',
+                         help='record held permits in a lease ledger')
+    command.add_argument('--reap', action='store_true',
+                         help='release the permits of dead processes, '
+                              'implies --ledger')
+    command.add_argument('--shared-stats', action='store_true',
+                         help='count in the shared stats')
+    command.set_defaults(run=create)
+
+    command = commands.add_parser(
+        'open-and-acquire', parents=[common],
+        help='open a semaphore and hold a permit, exit status 1 on timeout')
+    command.add_argument('name')
+    command.add_argument('hold_ms', type=int, nargs='?', default=0,
+                         help='how long to hold it (default: 0)')
+    command.add_argument('--timeout-ms', type=_timeout_ms, default=0,
+                         help="how long to wait, or 'infinite' (default: 0)")
+    command.add_argument('--count', type=int, default=1)
+    command.add_argument('--ledger', action='store_true',
+                         help='record held permits in the lease ledger')
+    command.add_argument('--shared-stats', action='store_true',
+                         help='count in the shared stats')
+    command.set_defaults(run=open_and_acquire)
+
+    command = commands.add_parser(
+        'inspect', parents=[common],
+        help='print the count, shared stats and holders of a semaphore')
+    command.add_argument('name')
+    command.set_defaults(run=inspect)
+
+    command = commands.add_parser(
+        'release', parents=[common], help='release a semaphore')
+    command.add_argument('name')
+    command.add_argument('count', type=int, nargs='?', default=1)
+    command.set_defaults(run=release)
+
+    command = commands.add_parser(
+        'loadgen', parents=[common],
+        help='run acquire, hold and release cycles from several workers')
+    command.add_argument('name')
+    command.add_argument('--workers', type=int, default=4)
+    command.add_argument('--processes', action='store_true',
+                         help='run workers in processes (default: threads)')
+    command.add_argument('--rate', type=float, default=None,
+                         help='cycles per second, of all workers together '
+                              '(default: as fast as possible)')
+    command.add_argument('--hold-ms', type=float, default=1)
+    command.add_argument('--duration-s', type=float, default=5)
+    command.add_argument('--timeout-ms', type=_timeout_ms, default=1000,
+                         help="how long each acquire waits, or 'infinite' "
+                              "(default: 1000)")
+    command.add_argument('--create', type=int, default=None,
+                         metavar='MAXIMUM_COUNT',
+                         help='create the semaphore for the run')
+    command.set_defaults(run=loadgen)
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """
+    Run python -m semaphore_win_ctypes
+
+    :param argv: The arguments (default: sys.argv[1:])
+    :returns: The exit status
+    """
+    args = make_parser().parse_args(argv)
+    if getattr(args, 'reap', False):
+        args.ledger = True
+    try:
+        return args.run(args)
+    except OSError as exc:
+        print(f'{args.command}: {exc}', file=sys.stderr)
+        return EXIT_ERROR
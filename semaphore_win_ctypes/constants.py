@@ -0,0 +1,44 @@
+"""Constants shared by every semaphore backend."""
+
+# https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-waitforsingleobject
+WAIT_OBJECT_0 = 0x00000000
+WAIT_ABANDONED = 0x00000080
+WAIT_TIMEOUT = 0x00000102
+WAIT_FAILED = 0xFFFFFFFF
+INFINITE = 0xFFFFFFFF
+INVALID_HANDLE_VALUE = -1
+
+# https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-waitformultipleobjects
+MAXIMUM_WAIT_OBJECTS = 64
+
+# https://docs.microsoft.com/en-us/windows/win32/sync/synchronization-object-security-and-access-rights
+SEMAPHORE_ALL_ACCESS = 0x1F0003
+SEMAPHORE_MODIFY_STATE = 0x0002
+SEMAPHORE_QUERY_STATE = 0x0001
+SYNCHRONIZE = 0x00100000
+EVENT_ALL_ACCESS = 0x1F0003
+EVENT_MODIFY_STATE = 0x0002
+
+# https://docs.microsoft.com/en-us/windows/win32/procthread/process-security-and-access-rights
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+# https://docs.microsoft.com/en-us/windows/win32/api/processthreadsapi/nf-processthreadsapi-getexitcodeprocess
+STILL_ACTIVE = 259
+
+# https://docs.microsoft.com/en-us/windows/win32/api/handleapi/nf-handleapi-duplicatehandle
+DUPLICATE_CLOSE_SOURCE = 0x00000001
+DUPLICATE_SAME_ACCESS = 0x00000002
+
+# https://docs.microsoft.com/en-us/windows/win32/debug/system-error-codes--0-499-
+ERROR_FILE_NOT_FOUND = 2
+ERROR_ACCESS_DENIED = 5
+ERROR_INVALID_HANDLE = 6
+ERROR_INVALID_PARAMETER = 87
+ERROR_ALREADY_EXISTS = 183
+ERROR_TOO_MANY_POSTS = 298
+
+# https://docs.microsoft.com/en-us/openspecs/windows_protocols/ms-erref/596a1078-e883-4972-9bbc-49e60bebca55
+STATUS_SUCCESS = 0x00000000
+STATUS_INFO_LENGTH_MISMATCH = 0xC0000004
+STATUS_INVALID_HANDLE = 0xC0000008
+STATUS_INVALID_PARAMETER = 0xC000000D
+STATUS_ACCESS_DENIED = 0xC0000022
@@ -0,0 +1,333 @@
+"""Linux eventfd semaphores, which an event loop can poll."""
+from __future__ import annotations
+import errno
+import os
+import select
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from .backend import SemaphoreBackend
+from .constants import SEMAPHORE_MODIFY_STATE, SEMAPHORE_QUERY_STATE, \
+    SYNCHRONIZE
+
+# https://man7.org/linux/man-pages/man2/eventfd.2.html
+EFD_SEMAPHORE = 0o1
+EFD_CLOEXEC = os.O_CLOEXEC
+EFD_NONBLOCK = os.O_NONBLOCK
+
+# Returned by _read_any() when the cancel descriptor became readable
+CANCELLED = -1
+
+
+def _eventfd(initial_value: int, flags: int) -> int:
+    if hasattr(os, 'eventfd'):
+        return os.eventfd(initial_value, flags)
+    # Python < 3.10
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    fd = libc.eventfd(ctypes.c_uint(initial_value), ctypes.c_int(flags))
+    if fd < 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+    return fd
+
+
+def _error(code: int, filename: str = None) -> OSError:
+    return OSError(code, os.strerror(code), filename)
+
+
+def eventfd_count(fd: int) -> int:
+    """
+    Read the counter of an eventfd without changing it
+
+    :param fd: An eventfd file descriptor
+    :returns: The value of the counter
+    """
+    info_fd = os.open(f'/proc/self/fdinfo/{fd}', os.O_RDONLY)
+    try:
+        info = os.read(info_fd, 4096)
+    finally:
+        os.close(info_fd)
+    for line in info.splitlines():
+        if line.startswith(b'eventfd-count:'):
+            return int(line.split()[1], 16)
+    raise _error(errno.EBADF)
+
+
+class _EventFdObject:
+    """
+    One semaphore, shared by every handle to it
+    """
+    __slots__ = ('name', 'fd', 'lock_fd', 'maximum_count', 'handles')
+
+    def __init__(self, name: Optional[str], initial_count: int,
+                 maximum_count: int):
+        self.name = name
+        self.maximum_count = maximum_count
+        self.handles = 0
+        # Each read takes one permit, and fails with EAGAIN at zero
+        self.fd = _eventfd(initial_count,
+                           EFD_SEMAPHORE | EFD_NONBLOCK | EFD_CLOEXEC)
+        # A binary semaphore that serializes release(), reads block
+        self.lock_fd = _eventfd(1, EFD_SEMAPHORE | EFD_CLOEXEC)
+
+    @classmethod
+    def adopt(cls, name: Optional[str], fd: int, lock_fd: int,
+              maximum_count: int) -> _EventFdObject:
+        """
+        The semaphore of descriptors received from another process
+        """
+        obj = cls.__new__(cls)
+        obj.name = name
+        obj.maximum_count = maximum_count
+        obj.handles = 0
+        # Inherited or received descriptors, close them on exec like ours
+        os.set_inheritable(fd, False)
+        os.set_inheritable(lock_fd, False)
+        obj.fd = fd
+        obj.lock_fd = lock_fd
+        return obj
+
+    def close(self) -> None:
+        os.close(self.fd)
+        os.close(self.lock_fd)
+
+
+class EventFdHandle:
+    """
+    A handle to an eventfd semaphore
+    """
+    __slots__ = ('obj', 'desired_access')
+
+    def __init__(self, obj: _EventFdObject, desired_access: int):
+        self.obj: Optional[_EventFdObject] = obj
+        self.desired_access = desired_access
+
+    def __bool__(self) -> bool:
+        return self.obj is not None
+
+    def __repr__(self) -> str:
+        if self.obj is None:
+            return '<EventFdHandle closed>'
+        return f'<EventFdHandle name={self.obj.name!r} fd={self.obj.fd}>'
+
+
+class EventFdBackend(SemaphoreBackend):
+    """
+    Semaphores built on eventfd(EFD_SEMAPHORE), Linux only.
+
+    Names are only visible inside this process, a semaphore reaches other
+    processes by handing its descriptors over, see share(). Unlike the posix
+    backend the semaphore has a file descriptor that becomes readable when
+    the count is non-zero, so waits can be multiplexed with poll() or an
+    asyncio event loop. Like Windows, a semaphore lives until its last
+    handle is closed.
+    """
+    name = 'eventfd'
+
+    def __init__(self):
+        self._objects: Dict[str, _EventFdObject] = {}
+        self._lock = threading.Lock()
+
+    def _new_handle(self, obj: _EventFdObject,
+                    desired_access) -> EventFdHandle:
+        obj.handles += 1
+        return EventFdHandle(obj, getattr(desired_access, 'value',
+                                          desired_access))
+
+    def create(self,
+               name: Optional[str],
+               initial_count: int,
+               maximum_count: int,
+               desired_access: int,
+               ) -> EventFdHandle:
+        if maximum_count <= 0 or not 0 <= initial_count <= maximum_count:
+            raise _error(errno.EINVAL)
+        with self._lock:
+            obj = self._objects.get(name) if name is not None else None
+            if obj is None:
+                obj = _EventFdObject(name, initial_count, maximum_count)
+                if name is not None:
+                    self._objects[name] = obj
+            return self._new_handle(obj, desired_access)
+
+    def open(self,
+             name: str,
+             desired_access: int,
+             inherit: bool,
+             ) -> EventFdHandle:
+        with self._lock:
+            obj = self._objects.get(name)
+            if obj is None:
+                raise _error(errno.ENOENT, name)
+            return self._new_handle(obj, desired_access)
+
+    def share(self, handle: EventFdHandle, name: Optional[str]) -> Any:
+        """
+        Both descriptors of the semaphore, named or not
+
+        multiprocessing passes them to a child it starts, and otherwise
+        sends them over a Unix socket with SCM_RIGHTS, see
+        multiprocessing.reduction.DupFd().
+        """
+        from multiprocessing import reduction
+        obj = _check(handle, 0)
+        return (obj.name, reduction.DupFd(obj.fd),
+                reduction.DupFd(obj.lock_fd), obj.maximum_count,
+                handle.desired_access)
+
+    def share_inheritable(self, handle: EventFdHandle, name: Optional[str]
+                          ) -> Tuple[Any, Sequence[int]]:
+        """
+        Duplicates of both descriptors, for subprocess's pass_fds, which
+        keeps their numbers in the child
+        """
+        obj = _check(handle, 0)
+        fd = os.dup(obj.fd)
+        try:
+            lock_fd = os.dup(obj.lock_fd)
+        except BaseException:
+            os.close(fd)
+            raise
+        return ((obj.name, fd, lock_fd, obj.maximum_count,
+                 handle.desired_access), (fd, lock_fd))
+
+    def adopt(self, shared: Any) -> EventFdHandle:
+        """
+        A handle to descriptors shared by another process
+
+        The semaphore takes the name it has there, unless this process has
+        one by that name already.
+        """
+        name, fd, lock_fd, maximum_count, desired_access = shared
+        if hasattr(fd, 'detach'):
+            fd = fd.detach()
+            lock_fd = lock_fd.detach()
+        obj = _EventFdObject.adopt(name, fd, lock_fd, maximum_count)
+        with self._lock:
+            if name is not None:
+                self._objects.setdefault(name, obj)
+            return self._new_handle(obj, desired_access)
+
+    def fileno(self, handle: EventFdHandle) -> int:
+        return _check(handle, 0).fd
+
+    def wait(self, handle: EventFdHandle, timeout_ms: Optional[int]) -> bool:
+        fd = _check(handle, SYNCHRONIZE).fd
+        return _read_any([fd], timeout_ms) is not None
+
+    def wait_any(self,
+                 handles: Sequence[EventFdHandle],
+                 timeout_ms: Optional[int],
+                 ) -> Optional[int]:
+        fds = [_check(handle, SYNCHRONIZE).fd for handle in handles]
+        return _read_any(fds, timeout_ms)
+
+    def create_event(self) -> int:
+        # Not in EFD_SEMAPHORE mode, and never read: once written, it stays
+        # readable, like a manual-reset event
+        return _eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC)
+
+    def set_event(self, event: int) -> None:
+        os.write(event, (1).to_bytes(8, sys.byteorder))
+
+    def close_event(self, event: int) -> None:
+        os.close(event)
+
+    def wait_cancellable(self,
+                         handle: EventFdHandle,
+                         event: int,
+                         timeout_ms: Optional[int],
+                         ) -> Optional[bool]:
+        # One poll() on both descriptors
+        fd = _check(handle, SYNCHRONIZE).fd
+        index = _read_any([fd], timeout_ms, event)
+        if index == CANCELLED:
+            return None
+        return index is not None
+
+    def release(self, handle: EventFdHandle, release_count: int) -> int:
+        obj = _check(handle, SEMAPHORE_MODIFY_STATE)
+        if release_count <= 0:
+            raise _error(errno.EINVAL)
+        os.read(obj.lock_fd, 8)
+        try:
+            # Concurrent waits can only lower the count, so checking the
+            # maximum against this value never lets the count exceed it
+            previous_count = eventfd_count(obj.fd)
+            if previous_count + release_count > obj.maximum_count:
+                raise OSError(errno.EOVERFLOW,
+                              'Too many posts were made to a semaphore')
+            os.write(obj.fd, release_count.to_bytes(8, sys.byteorder))
+        finally:
+            os.write(obj.lock_fd, (1).to_bytes(8, sys.byteorder))
+        return previous_count
+
+    def query(self, handle: EventFdHandle) -> Tuple[int, int]:
+        obj = _check(handle, SEMAPHORE_QUERY_STATE)
+        return eventfd_count(obj.fd), obj.maximum_count
+
+    def close(self, handle: EventFdHandle) -> None:
+        obj = _check(handle, 0)
+        handle.obj = None
+        with self._lock:
+            obj.handles -= 1
+            if obj.handles == 0:
+                if self._objects.get(obj.name) is obj:
+                    del self._objects[obj.name]
+                obj.close()
+
+
+def _read_any(fds: Sequence[int],
+              timeout_ms: Optional[int],
+              cancel_fd: Optional[int] = None,
+              ) -> Optional[int]:
+    """
+    Take a permit from the first eventfd that has one, polling until then
+
+    :param cancel_fd: A descriptor that ends the wait when it becomes
+        readable
+    :returns: The index of the eventfd, None on time-out, CANCELLED when
+        cancel_fd became readable first
+    """
+    deadline = None
+    poller = None
+    while True:
+        for index, fd in enumerate(fds):
+            try:
+                # Another waiter may have been woken for the same permit
+                os.read(fd, 8)
+                return index
+            except BlockingIOError:
+                pass
+        if deadline is None:
+            if timeout_ms == 0:
+                return None
+            if timeout_ms is not None:
+                deadline = time.monotonic() + timeout_ms / 1000
+        elif time.monotonic() >= deadline:
+            return None
+        if poller is None:
+            poller = select.poll()
+            for fd in set(fds):
+                poller.register(fd, select.POLLIN)
+            if cancel_fd is not None:
+                poller.register(cancel_fd, select.POLLIN)
+        if deadline is None:
+            ready = poller.poll()
+        else:
+            remaining_ms = (deadline - time.monotonic()) * 1000
+            ready = poller.poll(max(0, int(remaining_ms) + 1))
+        if cancel_fd is not None and \
+                any(fd == cancel_fd for fd, _ in ready):
+            return CANCELLED
+
+
+def _check(handle: EventFdHandle, access: int) -> _EventFdObject:
+    if not handle:
+        raise _error(errno.EBADF)
+    if handle.desired_access & access != access:
+        raise _error(errno.EACCES)
+    return handle.obj
@@ -0,0 +1,15 @@
+"""Exceptions raised by semaphore_win_ctypes."""
+
+
+class SemaphoreWaitTimeoutException(Exception):
+    """
+    WAIT_TIMEOUT
+    """
+    pass
+
+
+class SemaphoreWaitCancelledException(Exception):
+    """
+    The wait was cancelled through a CancellationToken
+    """
+    pass
@@ -0,0 +1,294 @@
+"""A concurrent.futures executor that runs tasks under a named semaphore."""
+from __future__ import annotations
+import _thread
+import collections
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Optional, Union
+
+from .backend import SemaphoreBackend
+from .cancel import CancellationToken
+from .exceptions import SemaphoreWaitCancelledException
+from .metrics import Histogram
+from .semaphore import CreateSemaphore, OpenSemaphore, Semaphore
+
+# Tasks queued per worker before submit() blocks, by default
+DEFAULT_QUEUE_PER_WORKER = 2
+
+
+class ExecutorMetrics:
+    """
+    What the tasks of a SemaphoreExecutor went through
+
+    The queue delay of a task runs from submit() to it being handed to a
+    worker, holding a permit; the permit wait is the part of it spent
+    waiting on the semaphore, once a worker was free.
+    """
+
+    def __init__(self):
+        #: Tasks accepted by submit(), and refused because the queue stayed
+        #: full
+        self.submitted = 0
+        self.rejected = 0
+        #: Tasks that returned, raised, or were cancelled before running
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        #: From submit() to a worker, and waiting for the permit
+        self.queue_delay_ns = Histogram()
+        self.permit_wait_ns = Histogram()
+        self._lock = _thread.allocate_lock()
+
+    def count(self, counter: str) -> None:
+        """
+        Add one to a counter, such as 'completed'
+        """
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record_dispatch(self, permit_wait_ns: int, queue_delay_ns: int
+                        ) -> None:
+        with self._lock:
+            self.permit_wait_ns.add(permit_wait_ns)
+            self.queue_delay_ns.add(queue_delay_ns)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Everything counted, as plain types for logging or JSON
+        """
+        with self._lock:
+            return {
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'queue_delay_ns': self.queue_delay_ns.as_dict(),
+                'permit_wait_ns': self.permit_wait_ns.as_dict(),
+            }
+
+    def __repr__(self) -> str:
+        return (f'<ExecutorMetrics submitted={self.submitted} '
+                f'completed={self.completed} failed={self.failed} '
+                f'rejected={self.rejected}>')
+
+
+class _WorkItem:
+    __slots__ = ('future', 'fn', 'args', 'kwargs', 'submitted_ns')
+
+    def __init__(self, future: concurrent.futures.Future, fn: Callable,
+                 args: tuple, kwargs: dict):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.submitted_ns = time.perf_counter_ns()
+
+
+class SemaphoreExecutor(concurrent.futures.Executor):
+    """
+    Runs each task on a worker thread while holding a permit of a named
+    semaphore, so a concurrency cap holds across every process
+
+    Tasks wait in a bounded queue, not on worker threads: one dispatcher
+    thread takes the next task once a worker is free, waits for a permit,
+    and only then hands the task to the worker, which releases the permit
+    when the task is done. So at most one thread per executor waits on the
+    semaphore, and a permit is never held by a task that has no worker.
+
+    submit() blocks while the queue is full, for at most submit_timeout_ms,
+    which pushes back on producers that outrun the fleet-wide cap::
+
+        with SemaphoreExecutor('jobs-limiter', max_workers=8) as executor:
+            futures = [executor.submit(process, job) for job in jobs]
+        print(executor.metrics.queue_delay_ns.percentile(0.99))
+    """
+
+    def __init__(self,
+                 name: Union[str, Semaphore, CreateSemaphore, OpenSemaphore],
+                 max_workers: Optional[int] = None,
+                 queue_size: Optional[int] = None,
+                 submit_timeout_ms: Optional[int] = None,
+                 backend: Union[SemaphoreBackend, str] = None,
+                 ):
+        """
+        :param name: The name of the semaphore to open, or an open one, which
+            must stay open until shutdown()
+        :param max_workers: The most tasks running at once in this process
+            (default: like ThreadPoolExecutor, min(32, CPUs + 4))
+        :param queue_size: The most tasks waiting for a worker and a permit
+            (default: 2 per worker)
+        :param submit_timeout_ms: How long submit() waits for room in the
+            queue, None to wait for as long as it takes (default: None)
+        :param backend: The backend instance or name, when opening by name
+            (default: the platform's default backend)
+        :raises OSError: The semaphore could not be opened.
+        """
+        if max_workers is None:
+            max_workers = min(32, (os.cpu_count() or 1) + 4)
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1, not "
+                             f"{max_workers}")
+        if queue_size is None:
+            queue_size = max_workers * DEFAULT_QUEUE_PER_WORKER
+        if queue_size < 1:
+            raise ValueError(f"queue_size must be at least 1, not "
+                             f"{queue_size}")
+        if isinstance(name, str):
+            self.semaphore = Semaphore(name, backend).open()
+            self._own_semaphore = True
+        else:
+            self.semaphore = getattr(name, 'sem', name)
+            self._own_semaphore = False
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.submit_timeout_ms = submit_timeout_ms
+        self.metrics = ExecutorMetrics()
+        self._queue: Deque[_WorkItem] = collections.deque()
+        self._condition = threading.Condition()
+        self._shutdown = False
+        # Workers without a task, the dispatcher takes one before a permit
+        self._idle_workers = threading.Semaphore(max_workers)
+        self._cancel = CancellationToken()
+        self._workers = concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix='SemaphoreExecutor')
+        self._dispatcher = threading.Thread(
+            target=self._dispatch,
+            name=f'SemaphoreExecutor({self.semaphore.name!r})',
+            daemon=True,
+        )
+        self._dispatcher.start()
+
+    @property
+    def queued(self) -> int:
+        """
+        The tasks waiting for a worker and a permit
+        """
+        return len(self._queue)
+
+    def submit(self, fn: Callable, *args, **kwargs
+               ) -> concurrent.futures.Future:
+        """
+        Queue a task
+
+        :raises queue.Full: The queue stayed full for submit_timeout_ms.
+        :raises RuntimeError: The executor was shut down.
+        :returns: A Future of what fn(*args, **kwargs) returns
+        """
+        item = _WorkItem(concurrent.futures.Future(), fn, args, kwargs)
+        timeout = self.submit_timeout_ms
+        with self._condition:
+            if not self._condition.wait_for(
+                    lambda: self._shutdown
+                    or len(self._queue) < self.queue_size,
+                    None if timeout is None else timeout / 1000):
+                self.metrics.count('rejected')
+                raise queue.Full(f"{self.queue_size} tasks are queued")
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after "
+                                   "shutdown")
+            self._queue.append(item)
+            self._condition.notify_all()
+        self.metrics.count('submitted')
+        return item.future
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False
+                 ) -> None:
+        """
+        Stop accepting tasks, see concurrent.futures.Executor.shutdown()
+
+        Queued tasks still run, unless cancel_futures is True, which also
+        ends the dispatcher's wait for a permit.
+        """
+        with self._condition:
+            self._shutdown = True
+            if cancel_futures:
+                while self._queue:
+                    self._cancel_item(self._queue.popleft())
+                self._cancel.cancel()
+            self._condition.notify_all()
+        if wait:
+            self._dispatcher.join()
+            self._workers.shutdown(wait=True)
+            self._close()
+        else:
+            # The last one out closes the semaphore
+            threading.Thread(target=self._finish, daemon=True).start()
+
+    def _finish(self) -> None:
+        self._dispatcher.join()
+        self._workers.shutdown(wait=True)
+        self._close()
+
+    def _close(self) -> None:
+        with self._condition:
+            if self._own_semaphore and self.semaphore.hHandle is not None:
+                self.semaphore.close()
+            self._cancel.close()
+
+    def _cancel_item(self, item: _WorkItem) -> None:
+        if item.future.cancel():
+            self.metrics.count('cancelled')
+
+    def _dispatch(self) -> None:
+        condition = self._condition
+        sem = self.semaphore
+        metrics = self.metrics
+        while True:
+            with condition:
+                condition.wait_for(lambda: self._queue or self._shutdown)
+                if not self._queue:
+                    return
+                item = self._queue.popleft()
+                # Room for submit()
+                condition.notify_all()
+            if item.future.cancelled():
+                metrics.count('cancelled')
+                continue
+            self._idle_workers.acquire()
+            waited_ns = time.perf_counter_ns()
+            try:
+                sem.acquire(cancel=self._cancel)
+            except SemaphoreWaitCancelledException:
+                self._idle_workers.release()
+                self._cancel_item(item)
+                continue
+            except BaseException as exc:
+                self._idle_workers.release()
+                if item.future.set_running_or_notify_cancel():
+                    item.future.set_exception(exc)
+                    metrics.count('failed')
+                continue
+            now = time.perf_counter_ns()
+            if not item.future.set_running_or_notify_cancel():
+                # Cancelled while waiting for the permit
+                sem.release()
+                self._idle_workers.release()
+                metrics.count('cancelled')
+                continue
+            metrics.record_dispatch(now - waited_ns, now - item.submitted_ns)
+            self._workers.submit(self._run, item)
+
+    def _run(self, item: _WorkItem) -> None:
+        error: Optional[BaseException] = None
+        try:
+            result = item.fn(*item.args, **item.kwargs)
+        except BaseException as exc:
+            error = exc
+        # Released before the future is done, so a caller waiting on it
+        # finds the permit back
+        try:
+            self.semaphore.release()
+        except OSError as exc:
+            if error is None:
+                error = exc
+        finally:
+            self._idle_workers.release()
+        self.metrics.count('completed' if error is None else 'failed')
+        if error is None:
+            item.future.set_result(result)
+        else:
+            item.future.set_exception(error)
@@ -0,0 +1,96 @@
+"""Semaphores handed to child processes without a name lookup."""
+from __future__ import annotations
+import json
+import sys
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from .backend import SemaphoreBackend
+
+# semaphore imports this module on first use, not the other way round
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from .semaphore import Semaphore
+
+
+def parse_token(token: str) -> Tuple[Optional[str], str, Any]:
+    """
+    The parts of a SemaphoreHandoff.token
+
+    :raises ValueError: The token is not one.
+    :returns: The name of the semaphore, the name of its backend, and what
+        the backend's adopt() takes
+    """
+    try:
+        backend_name, name, shared = json.loads(token)
+    except (TypeError, ValueError):
+        raise ValueError(f"Not a semaphore handoff token: {token!r}") \
+            from None
+    return name, backend_name, shared
+
+
+class SemaphoreHandoff:
+    """
+    A semaphore made ready for a child started by subprocess, see
+    Semaphore.handoff()
+
+    The child inherits a duplicate of the handle, or of the eventfd
+    backend's descriptors, so unnamed semaphores can be handed off too. The
+    posix backend's semaphores are opened by name in the child. token is a
+    string for the child's command line or environment, popen_kwargs() the
+    arguments that make subprocess pass the duplicates::
+
+        with sem.handoff() as handoff:
+            child = subprocess.Popen(
+                [sys.executable, 'child.py', handoff.token],
+                **handoff.popen_kwargs())
+        # In child.py
+        sem = Semaphore.from_handoff(sys.argv[1])
+
+    Closing the handoff, once the child has started, closes this process's
+    duplicates.
+    """
+
+    def __init__(self, sem: Semaphore):
+        """
+        :param sem: An open semaphore
+        :raises TypeError: The semaphore can't be shared with another
+            process.
+        :raises OSError: The handle could not be duplicated.
+        """
+        self.backend: SemaphoreBackend = sem.backend
+        shared, inherited = self.backend.share_inheritable(sem.hHandle,
+                                                           sem.name)
+        self.inherited: Sequence[int] = tuple(inherited)
+        self.token: str = json.dumps([self.backend.name, sem.name, shared])
+
+    def __enter__(self) -> SemaphoreHandoff:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def popen_kwargs(self) -> Dict[str, Any]:
+        """
+        The subprocess.Popen() arguments that pass the duplicates, and no
+        other handle
+
+        :returns: pass_fds on POSIX, a STARTUPINFO handle_list on Windows
+        """
+        if not self.inherited:
+            return {}
+        if sys.platform == 'win32':
+            import subprocess
+            return {
+                'close_fds': True,
+                'startupinfo': subprocess.STARTUPINFO(
+                    lpAttributeList={'handle_list': list(self.inherited)}),
+            }
+        return {'pass_fds': self.inherited}
+
+    def close(self) -> None:
+        """
+        Close this process's duplicates, the child keeps its own
+        """
+        inherited, self.inherited = self.inherited, ()
+        if inherited:
+            self.backend.close_inherited(inherited)
@@ -0,0 +1,308 @@
+"""Lazily bound kernel32 (and ntdll) function table."""
+from __future__ import annotations
+import ctypes
+import errno
+import threading
+from ctypes import POINTER, Structure, c_byte, c_long, c_ulong, \
+    c_void_p, c_wchar_p
+from typing import Any, Dict, Optional, Tuple
+
+from .constants import ERROR_ACCESS_DENIED, ERROR_ALREADY_EXISTS, \
+    ERROR_FILE_NOT_FOUND, ERROR_INVALID_HANDLE, ERROR_INVALID_PARAMETER, \
+    ERROR_TOO_MANY_POSTS
+
+# The Windows types of ctypes.wintypes, which can't be imported off Windows
+# before Python 3.8
+BOOL = c_long
+BOOLEAN = c_byte
+DWORD = c_ulong
+HANDLE = c_void_p
+LONG = c_long
+LPCWSTR = c_wchar_p
+LPVOID = c_void_p
+ULONG = c_ulong
+
+LPSECURITY_ATTRIBUTES = LPVOID
+LPLONG = POINTER(LONG)
+LPDWORD = POINTER(DWORD)
+PHANDLE = POINTER(HANDLE)
+NTSTATUS = LONG
+PULONG = POINTER(ULONG)
+
+
+class SEMAPHORE_BASIC_INFORMATION(Structure):
+    _fields_ = [('CurrentCount', LONG), ('MaximumCount', LONG)]
+
+
+# SEMAPHORE_INFORMATION_CLASS
+SemaphoreBasicInformation = 0
+
+# Callbacks use the stdcall convention on 32-bit Windows
+WINFUNCTYPE = getattr(ctypes, 'WINFUNCTYPE', ctypes.CFUNCTYPE)
+
+"""
+https://docs.microsoft.com/en-us/previous-versions/windows/desktop/legacy/ms687066(v=vs.85)
+VOID CALLBACK WaitOrTimerCallback(
+  PVOID   lpParameter,
+  BOOLEAN TimerOrWaitFired
+);
+"""
+WAITORTIMERCALLBACK = WINFUNCTYPE(None, LPVOID, BOOLEAN)
+
+# https://docs.microsoft.com/en-us/windows/win32/api/winbase/nf-winbase-registerwaitforsingleobject
+WT_EXECUTEINWAITTHREAD = 0x00000004
+WT_EXECUTEONLYONCE = 0x00000008
+
+# Used to build an OSError subclass for Windows error codes where WinError()
+# isn't available, for example with a stand-in on Linux
+WINERROR_TO_ERRNO = {
+    ERROR_FILE_NOT_FOUND: errno.ENOENT,
+    ERROR_ACCESS_DENIED: errno.EACCES,
+    ERROR_INVALID_HANDLE: errno.EBADF,
+    ERROR_INVALID_PARAMETER: errno.EINVAL,
+    ERROR_ALREADY_EXISTS: errno.EEXIST,
+    ERROR_TOO_MANY_POSTS: errno.EOVERFLOW,
+}
+
+PROTOTYPES: Dict[str, Tuple[Tuple[Any, ...], Any]] = {
+    # https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-createsemaphoreexw
+    # HANDLE CreateSemaphoreExW(
+    #   LPSECURITY_ATTRIBUTES lpSemaphoreAttributes,
+    #   LONG                  lInitialCount,
+    #   LONG                  lMaximumCount,
+    #   LPCWSTR               lpName,
+    #   DWORD                 dwFlags,
+    #   DWORD                 dwDesiredAccess
+    # );
+    'CreateSemaphoreExW': (
+        (LPSECURITY_ATTRIBUTES, LONG, LONG, LPCWSTR, DWORD, DWORD),
+        HANDLE,
+    ),
+    # https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-opensemaphorew
+    # HANDLE OpenSemaphoreW(
+    #   DWORD   dwDesiredAccess,
+    #   BOOL    bInheritHandle,
+    #   LPCWSTR lpName
+    # );
+    'OpenSemaphoreW': ((DWORD, BOOL, LPCWSTR), HANDLE),
+    # https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-waitforsingleobject
+    # DWORD WaitForSingleObject(
+    #   HANDLE hHandle,
+    #   DWORD  dwMilliseconds
+    # );
+    'WaitForSingleObject': ((HANDLE, DWORD), DWORD),
+    # https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-waitformultipleobjects
+    # DWORD WaitForMultipleObjects(
+    #   DWORD        nCount,
+    #   const HANDLE *lpHandles,
+    #   BOOL         bWaitAll,
+    #   DWORD        dwMilliseconds
+    # );
+    'WaitForMultipleObjects': ((DWORD, PHANDLE, BOOL, DWORD), DWORD),
+    # https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-releasesemaphore
+    # BOOL ReleaseSemaphore(
+    #   HANDLE hSemaphore,
+    #   LONG   lReleaseCount,
+    #   LPLONG lpPreviousCount
+    # );
+    'ReleaseSemaphore': ((HANDLE, LONG, LPLONG), BOOL),
+    # https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-createeventw
+    # HANDLE CreateEventW(
+    #   LPSECURITY_ATTRIBUTES lpEventAttributes,
+    #   BOOL                  bManualReset,
+    #   BOOL                  bInitialState,
+    #   LPCWSTR               lpName
+    # );
+    'CreateEventW': ((LPSECURITY_ATTRIBUTES, BOOL, BOOL, LPCWSTR), HANDLE),
+    # https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-setevent
+    # BOOL SetEvent(
+    #   HANDLE hEvent
+    # );
+    'SetEvent': ((HANDLE,), BOOL),
+    # https://docs.microsoft.com/en-us/windows/win32/api/processthreadsapi/nf-processthreadsapi-openprocess
+    # HANDLE OpenProcess(
+    #   DWORD dwDesiredAccess,
+    #   BOOL  bInheritHandle,
+    #   DWORD dwProcessId
+    # );
+    'OpenProcess': ((DWORD, BOOL, DWORD), HANDLE),
+    # https://docs.microsoft.com/en-us/windows/win32/api/processthreadsapi/nf-processthreadsapi-getexitcodeprocess
+    # BOOL GetExitCodeProcess(
+    #   HANDLE  hProcess,
+    #   LPDWORD lpExitCode
+    # );
+    'GetExitCodeProcess': ((HANDLE, LPDWORD), BOOL),
+    # https://docs.microsoft.com/en-us/windows/win32/api/handleapi/nf-handleapi-closehandle
+    # BOOL CloseHandle(
+    #   HANDLE hObject
+    # );
+    'CloseHandle': ((HANDLE,), BOOL),
+    # https://docs.microsoft.com/en-us/windows/win32/api/processthreadsapi/nf-processthreadsapi-getcurrentprocess
+    # HANDLE GetCurrentProcess();
+    'GetCurrentProcess': ((), HANDLE),
+    # https://docs.microsoft.com/en-us/windows/win32/api/handleapi/nf-handleapi-duplicatehandle
+    # BOOL DuplicateHandle(
+    #   HANDLE   hSourceProcessHandle,
+    #   HANDLE   hSourceHandle,
+    #   HANDLE   hTargetProcessHandle,
+    #   LPHANDLE lpTargetHandle,
+    #   DWORD    dwDesiredAccess,
+    #   BOOL     bInheritHandle,
+    #   DWORD    dwOptions
+    # );
+    'DuplicateHandle': (
+        (HANDLE, HANDLE, HANDLE, PHANDLE, DWORD, BOOL, DWORD),
+        BOOL,
+    ),
+    # https://docs.microsoft.com/en-us/windows/win32/api/winbase/nf-winbase-registerwaitforsingleobject
+    # BOOL RegisterWaitForSingleObject(
+    #   PHANDLE             phNewWaitObject,
+    #   HANDLE              hObject,
+    #   WAITORTIMERCALLBACK Callback,
+    #   PVOID               Context,
+    #   ULONG               dwMilliseconds,
+    #   ULONG               dwFlags
+    # );
+    'RegisterWaitForSingleObject': (
+        (PHANDLE, HANDLE, WAITORTIMERCALLBACK, LPVOID, ULONG, ULONG),
+        BOOL,
+    ),
+    # https://docs.microsoft.com/en-us/windows/win32/sync/unregisterwaitex
+    # BOOL UnregisterWaitEx(
+    #   HANDLE WaitHandle,
+    #   HANDLE CompletionEvent
+    # );
+    'UnregisterWaitEx': ((HANDLE, HANDLE), BOOL),
+    # https://docs.microsoft.com/en-us/windows/win32/api/errhandlingapi/nf-errhandlingapi-getlasterror
+    # DWORD GetLastError();
+    'GetLastError': ((), DWORD),
+    # Not documented by Microsoft, but part of ntdll since Windows NT
+    # NTSTATUS NtQuerySemaphore(
+    #   HANDLE                      SemaphoreHandle,
+    #   SEMAPHORE_INFORMATION_CLASS SemaphoreInformationClass,
+    #   PVOID                       SemaphoreInformation,
+    #   ULONG                       SemaphoreInformationLength,
+    #   PULONG                      ReturnLength
+    # );
+    'NtQuerySemaphore': ((HANDLE, ULONG, LPVOID, ULONG, PULONG), NTSTATUS),
+    # https://docs.microsoft.com/en-us/windows/win32/api/winternl/nf-winternl-rtlntstatustodoserror
+    # ULONG RtlNtStatusToDosError(
+    #   NTSTATUS Status
+    # );
+    'RtlNtStatusToDosError': ((NTSTATUS,), ULONG),
+}
+
+# The functions of PROTOTYPES exported by ntdll rather than kernel32
+NTDLL_FUNCTIONS = frozenset(('NtQuerySemaphore', 'RtlNtStatusToDosError'))
+
+
+class Kernel32:
+    """
+    kernel32 function table, plus the few ntdll functions the win32 backend
+    needs
+
+    Each function is looked up and given its prototype the first time it's
+    used, then cached as an attribute so later lookups are plain attribute
+    reads.
+    """
+
+    def __init__(self, dll: Any = None, ntdll: Any = None):
+        """
+        :param dll: The library to bind from (default: kernel32, loaded on
+            first use)
+        :param ntdll: The library to bind NTDLL_FUNCTIONS from (default:
+            ntdll, loaded on first use)
+        """
+        self._dll = dll
+        self._ntdll = ntdll
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            argtypes, restype = PROTOTYPES[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        with self._lock:
+            # Private instances, so these prototypes don't change the
+            # functions other modules get from windll
+            if name in NTDLL_FUNCTIONS:
+                if self._ntdll is None:
+                    self._ntdll = ctypes.WinDLL('ntdll')
+                dll = self._ntdll
+            else:
+                if self._dll is None:
+                    self._dll = ctypes.WinDLL('kernel32')
+                dll = self._dll
+            function = getattr(dll, name)
+            function.argtypes = argtypes
+            function.restype = restype
+            setattr(self, name, function)
+        return function
+
+
+_kernel32: Optional[Any] = None
+
+
+def get_kernel32() -> Any:
+    """
+    The kernel32 function table used by the win32 backend
+
+    :returns: The table set by set_kernel32(), otherwise a Kernel32
+    """
+    global _kernel32
+    if _kernel32 is None:
+        _kernel32 = Kernel32()
+    return _kernel32
+
+
+_process_kernel32: Optional[Kernel32] = None
+
+
+def get_process_kernel32() -> Kernel32:
+    """
+    The real kernel32, for the process functions
+
+    Whether a process is alive is a question for the operating system
+    even when set_kernel32() replaced the semaphore functions.
+    """
+    global _process_kernel32
+    if _process_kernel32 is None:
+        _process_kernel32 = Kernel32()
+    return _process_kernel32
+
+
+def set_kernel32(kernel32: Any) -> None:
+    """
+    Replace the kernel32 function table
+
+    :param kernel32: Any object with the attributes listed in PROTOTYPES,
+        for example a StandInKernel32. None restores the real kernel32.
+    """
+    global _kernel32
+    _kernel32 = kernel32
+
+
+def win_error(kernel32: Any, code: int = None) -> OSError:
+    """
+    Build an OSError from the table's GetLastError(), like ctypes.WinError()
+
+    :param kernel32: The function table the failed call was made through
+    :param code: The Windows error code (default: GetLastError())
+    """
+    if code is None:
+        code = kernel32.GetLastError()
+    win_error_function = getattr(ctypes, 'WinError', None)
+    if win_error_function is not None:
+        return win_error_function(code)
+    return OSError(WINERROR_TO_ERRNO.get(code, 0),
+                   f'[WinError {code}] Windows error {code}')
+
+
+def nt_error(kernel32: Any, status: int) -> OSError:
+    """
+    Build an OSError from the NTSTATUS returned by an ntdll function
+
+    :param kernel32: The function table the failed call was made through
+    :param status: The NTSTATUS returned by the function
+    """
+    return win_error(kernel32, kernel32.RtlNtStatusToDosError(status))
@@ -0,0 +1,286 @@
+"""Batching kernel permits and handing them out inside the process."""
+from __future__ import annotations
+import threading
+import time
+from typing import Optional, Union
+
+from .constants import INFINITE
+from .exceptions import SemaphoreWaitTimeoutException
+from .semaphore import CreateSemaphore, OpenSemaphore, Semaphore
+
+# Permits taken from the semaphore in one go
+DEFAULT_BATCH_SIZE = 8
+# Free permits are given back after this long without a local acquire
+DEFAULT_IDLE_S = 0.01
+
+
+class LeasedSemaphore:
+    """
+    Hands out the permits of a named semaphore to the threads of this
+    process, without a kernel call for each acquire() and release()
+
+    Permits are leased from the semaphore in batches of up to batch_size
+    and kept in a local pool guarded by a lock and condition. A released
+    permit goes back to the pool, where the next acquire() finds it. The
+    pool never holds more than batch_size free permits, and one thread at
+    a time leases more, so the process never holds more than it needs plus
+    a batch, and the semaphore's maximum count holds for every process
+    together.
+
+    Free permits go back to the semaphore when no thread of this process
+    acquired one for idle_s seconds, or when the semaphore's count is
+    zero, since a thread of another process may be waiting. A background
+    thread checks every idle_s seconds; checking the count needs
+    SEMAPHORE_QUERY_STATE access, without it only idleness counts.
+
+    Works with AcquireSemaphore, one permit at a time::
+
+        with OpenSemaphore('name') as opened, \\
+                LeasedSemaphore(opened) as leased:
+            with AcquireSemaphore(leased, timeout_ms=1000):
+                # Perform work here
+                pass
+    """
+
+    def __init__(self,
+                 semaphore: Union[Semaphore, CreateSemaphore, OpenSemaphore],
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 idle_s: float = DEFAULT_IDLE_S,
+                 ):
+        """
+        :param semaphore: The open semaphore to lease permits from, it
+            must stay open until close()
+        :param batch_size: The most permits leased at once, and kept free
+            in the pool (default: 8)
+        :param idle_s: How long free permits are kept without a local
+            acquire, in seconds (default: 0.01)
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be at least 1, "
+                             f"not {batch_size}")
+        self.semaphore: Semaphore = getattr(semaphore, 'sem', semaphore)
+        self.batch_size = batch_size
+        self.idle_s = idle_s
+        #: Kernel calls made: waits that took a permit or timed out, and
+        #: releases
+        self.kernel_waits = 0
+        self.kernel_releases = 0
+        self._condition = threading.Condition()
+        # Permits leased and free, and leased and handed out
+        self._free = 0
+        self._in_use = 0
+        # A thread is waiting in the kernel for more permits
+        self._leasing = False
+        self._acquires = 0
+        self._closed = False
+        self._stop = threading.Event()
+        self._returner: Optional[threading.Thread] = None
+
+    # Not instrumented, the wrapped Semaphore counts the kernel side
+    metrics = None
+    tracer = None
+
+    @property
+    def sem(self) -> LeasedSemaphore:
+        # Lets AcquireSemaphore wrap this, like a CreateSemaphore
+        return self
+
+    def __enter__(self) -> LeasedSemaphore:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def leased(self) -> int:
+        """
+        The permits this process holds: free in the pool, or handed out
+        """
+        return self._free + self._in_use
+
+    def acquire(self,
+                timeout_ms: int = None,
+                count: int = 1,
+                spin: bool = False,
+                ) -> LeasedSemaphore:
+        """
+        Take a permit from the pool, leasing more when it's empty
+        :param timeout_ms: The time-out interval, in milliseconds. (default:
+            None - infinite wait)
+        :param count: Must be 1, for compatibility with Semaphore.acquire()
+        :param spin: Ignored, for compatibility with Semaphore.acquire()
+        :raises SemaphoreWaitTimeoutException: The time-out interval elapsed,
+            and no permit was free.
+        :raises OSError: The wait has failed.
+        :returns: The LeasedSemaphore, for chaining calls
+        """
+        assert timeout_ms != INFINITE, \
+            "Use None to specify an infinite timeout"
+        if count != 1:
+            raise ValueError(f"LeasedSemaphore hands out one permit at a "
+                             f"time, not {count}")
+        deadline = None
+        if timeout_ms is not None:
+            deadline = time.monotonic() + timeout_ms / 1000
+        with self._condition:
+            if self._closed:
+                raise ValueError("LeasedSemaphore is closed")
+            self._acquires += 1
+            while True:
+                if self._closed:
+                    # Closed while this thread waited for the leaser
+                    raise ValueError("LeasedSemaphore is closed")
+                if self._free:
+                    self._free -= 1
+                    self._in_use += 1
+                    return self
+                if not self._leasing:
+                    self._leasing = True
+                    break
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise SemaphoreWaitTimeoutException()
+                self._condition.wait(remaining)
+        self._lease(deadline)
+        return self
+
+    def _lease(self, deadline: Optional[float]) -> None:
+        # Called by the one thread that's leasing, without the lock: wait
+        # for a permit for this thread, then take what else is available
+        sem = self.semaphore
+        backend = sem.backend
+        leased = 0
+        returned = 0
+        start = time.perf_counter_ns()
+        try:
+            remaining_ms = None
+            if deadline is not None:
+                remaining_ms = max(
+                    0, int((deadline - time.monotonic()) * 1000))
+            self.kernel_waits += 1
+            if not backend.wait(sem.hHandle, remaining_ms):
+                raise SemaphoreWaitTimeoutException()
+            leased = 1
+            while leased < self.batch_size:
+                self.kernel_waits += 1
+                if not backend.wait(sem.hHandle, 0):
+                    break
+                leased += 1
+        finally:
+            if leased:
+                # _return() gives them back through Semaphore.release()
+                sem._record_taken(leased, start)
+            with self._condition:
+                self._leasing = False
+                if leased:
+                    self._in_use += 1
+                    if self._closed:
+                        # close() has already trimmed the pool and stopped
+                        # the returner, nothing would give these back
+                        returned = leased - 1
+                    else:
+                        self._free += leased - 1
+                self._condition.notify_all()
+        if returned:
+            self._return(returned)
+        if self._returner is None:
+            self._start_returner()
+
+    def release(self, release_count: int = 1) -> int:
+        """
+        Give back permits, to the pool or to the semaphore
+        :param release_count: The number of permits to give back
+        :returns: The number of free permits in the pool before the release
+
+        Permits go to the semaphore instead of the pool while a thread is
+        waiting in the kernel for more, that thread or a thread of another
+        process gets them, or when the pool already has batch_size free.
+        """
+        if release_count <= 0:
+            raise ValueError(f"release_count must be positive, "
+                             f"not {release_count}")
+        with self._condition:
+            if release_count > self._in_use:
+                raise ValueError("Released more permits than were acquired")
+            previous_count = self._free
+            self._in_use -= release_count
+            if self._closed or self._leasing:
+                returned = release_count
+            else:
+                returned = max(0, self._free + release_count - self.batch_size)
+                self._free += release_count - returned
+                self._condition.notify(release_count - returned)
+        if returned:
+            self._return(returned)
+        return previous_count
+
+    def getvalue(self) -> int:
+        """
+        The permits available to this process: free in the pool, or in the
+        semaphore
+        """
+        return self._free + self.semaphore.getvalue()
+
+    def trim(self, exhausted_only: bool = False) -> int:
+        """
+        Give the free permits of the pool back to the semaphore
+        :param exhausted_only: Only when the semaphore's count is zero
+        :returns: The number of permits given back
+        """
+        if exhausted_only:
+            try:
+                if self.semaphore.getvalue() != 0:
+                    return 0
+            except OSError:
+                # No SEMAPHORE_QUERY_STATE access
+                return 0
+        with self._condition:
+            returned, self._free = self._free, 0
+        if returned:
+            self._return(returned)
+        return returned
+
+    def close(self) -> None:
+        """
+        Stop leasing, and give back the free permits
+
+        Permits still handed out go straight to the semaphore when they're
+        released. The semaphore itself stays open.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._stop.set()
+        if self._returner is not None:
+            self._returner.join()
+        self.trim()
+
+    def _return(self, count: int) -> None:
+        self.kernel_releases += 1
+        self.semaphore.release(count)
+
+    def _start_returner(self) -> None:
+        with self._condition:
+            if self._returner is not None or self._closed:
+                return
+            self._returner = threading.Thread(
+                target=self._return_idle_permits,
+                name=f'LeasedSemaphore({self.semaphore.name!r})',
+                daemon=True,
+            )
+            # Started before close() can see it, and join it
+            self._returner.start()
+
+    def _return_idle_permits(self) -> None:
+        acquires = self._acquires
+        while not self._stop.wait(self.idle_s):
+            if not self._free:
+                continue
+            if self._acquires == acquires:
+                self.trim()
+            else:
+                # Busy here, but another process may be waiting
+                self.trim(exhausted_only=True)
+            acquires = self._acquires
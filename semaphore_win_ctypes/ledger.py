@@ -0,0 +1,301 @@
+"""A shared record of which processes hold the permits of a semaphore."""
+from __future__ import annotations
+import _thread
+import errno
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional, Union
+
+from .backend import SemaphoreBackend
+from .segment import SharedSegment, pid_alive, segment_path
+
+# A ledger is a SharedSegment with one slot of (pid, permits) per process
+MAGIC = 0x5357434C45444752
+SLOT_WORDS = 2
+DEFAULT_SLOTS = 128
+
+# How often a LeaseReaper checks for dead holders, in seconds
+DEFAULT_REAP_INTERVAL_S = 1.0
+
+_logger = logging.getLogger(__name__)
+
+
+def ledger_path(name: str, backend: Union[SemaphoreBackend, str] = None
+                ) -> str:
+    """
+    The file of the ledger of a named semaphore
+
+    :param name: The name of the semaphore
+    :param backend: The backend instance or name (default: the platform's
+        default backend)
+    """
+    return segment_path(name, backend, '.ledger')
+
+
+class LeaseLedger:
+    """
+    Which processes hold how many permits of a named semaphore
+
+    The ledger is a small file, in /dev/shm where there is one, mapped
+    into every process that uses it. Each process claims a slot holding
+    its pid and the permits it holds, and only ever writes its own slot,
+    so recording an acquire or a release is an in-place update of one
+    mapped integer, under a lock private to the process. The file is
+    locked only to claim or free a slot and to reap, with a lock the
+    operating system drops if its holder dies.
+
+    A permit is recorded after it's acquired and forgotten before it's
+    released, so a process killed in between loses that permit rather
+    than let the reaper release one too many.
+
+    Ledger files are left behind for the next process to use, unlink()
+    removes one.
+    """
+
+    def __init__(self,
+                 name: str,
+                 backend: Union[SemaphoreBackend, str] = None,
+                 slots: int = DEFAULT_SLOTS,
+                 path: str = None,
+                 ):
+        """
+        :param name: The name of the semaphore
+        :param backend: The backend instance or name (default: the
+            platform's default backend)
+        :param slots: The most processes the ledger can track, when this
+            process creates it (default: 128)
+        :param path: The ledger file (default: ledger_path(name, backend))
+        :raises OSError: The file could not be opened or mapped.
+        """
+        if name is None:
+            raise ValueError("Only named semaphores have a ledger")
+        self.name = name
+        self.path = path or ledger_path(name, backend)
+        self._segment = SharedSegment(self.path, MAGIC, slots, SLOT_WORDS)
+        self._words = self._segment.words
+        self.slots = self._segment.slots
+        # This process's slot, as the index of its pid word
+        self._slot: Optional[int] = None
+        self._pid = 0
+        self._lock = _thread.allocate_lock()
+
+    def __enter__(self) -> LeaseLedger:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _claim(self) -> int:
+        # Called with the process lock held
+        pid = os.getpid()
+        words = self._words
+        self._segment.lock()
+        try:
+            for index in self._segment.slot_indexes():
+                holder = words[index]
+                if holder == 0 or (words[index + 1] == 0
+                                   and holder != pid
+                                   and not pid_alive(holder)):
+                    words[index + 1] = 0
+                    words[index] = pid
+                    self._slot = index
+                    self._pid = pid
+                    return index
+        finally:
+            self._segment.unlock()
+        raise OSError(errno.ENOSPC, 'The lease ledger is full', self.path)
+
+    def record_acquire(self, count: int = 1) -> None:
+        """
+        Record permits this process has just acquired
+        """
+        with self._lock:
+            slot = self._slot
+            if slot is None or self._pid != os.getpid():
+                # First use, or a forked child: the slot is the parent's
+                slot = self._claim()
+            self._words[slot + 1] += count
+
+    def record_release(self, count: int = 1) -> None:
+        """
+        Record permits this process is about to release
+        """
+        with self._lock:
+            slot = self._slot
+            if slot is None or self._pid != os.getpid():
+                return
+            words = self._words
+            words[slot + 1] = max(0, words[slot + 1] - count)
+
+    @property
+    def held(self) -> int:
+        """
+        The permits recorded for this process
+        """
+        slot = self._slot
+        if slot is None or self._pid != os.getpid():
+            return 0
+        return self._words[slot + 1]
+
+    def holders(self) -> Dict[int, int]:
+        """
+        The permits recorded for each process that holds any, by pid
+        """
+        words = self._words
+        holders: Dict[int, int] = {}
+        for index in self._segment.slot_indexes():
+            pid, permits = words[index], words[index + 1]
+            if pid and permits > 0:
+                holders[pid] = holders.get(pid, 0) + permits
+        return holders
+
+    def reap(self, semaphore: Any) -> int:
+        """
+        Release the permits of processes that died holding them
+
+        :param semaphore: An open Semaphore, CreateSemaphore or
+            OpenSemaphore of the semaphore, with SEMAPHORE_MODIFY_STATE
+            access
+        :raises OSError: The release has failed.
+        :returns: The number of permits released
+        """
+        sem = getattr(semaphore, 'sem', semaphore)
+        words = self._words
+        reclaimed = 0
+        self._segment.lock()
+        try:
+            for index in self._segment.slot_indexes():
+                pid = words[index]
+                if pid == 0 or pid == os.getpid() or pid_alive(pid):
+                    continue
+                permits = words[index + 1]
+                # Forgotten first: if this process dies now, the permits
+                # are lost again rather than released twice
+                words[index + 1] = 0
+                words[index] = 0
+                if permits > 0:
+                    # Straight to the backend, the Semaphore's own ledger
+                    # must not count them
+                    sem.backend.release(sem.hHandle, permits)
+                    reclaimed += permits
+        finally:
+            self._segment.unlock()
+        return reclaimed
+
+    def close(self) -> None:
+        """
+        Unmap the ledger, freeing this process's slot if it holds nothing
+
+        Permits still recorded stay in the ledger, for a reaper to release
+        once this process is gone.
+        """
+        with self._lock:
+            if self._segment.closed:
+                return
+            slot = self._slot
+            if slot is not None and self._pid == os.getpid() and \
+                    self._words[slot + 1] <= 0:
+                self._segment.lock()
+                try:
+                    self._words[slot] = 0
+                finally:
+                    self._segment.unlock()
+            self._slot = None
+            self._segment.close()
+
+    def unlink(self) -> None:
+        """
+        Remove the ledger file, processes that have it open keep using it
+        """
+        self._segment.unlink()
+
+
+def open_ledger(name: str, backend: Union[SemaphoreBackend, str] = None
+                ) -> LeaseLedger:
+    """
+    The ledger for Semaphore(ledger=True)
+
+    :param name: The name of the semaphore
+    :param backend: The backend instance or name
+    """
+    return LeaseLedger(name, backend)
+
+
+class LeaseReaper:
+    """
+    Reaps a ledger every interval_s seconds, on a background thread
+
+    Any process may run one, for example the one that created the
+    semaphore::
+
+        with CreateSemaphore('name', maximum_count=4, ledger=True) as sem, \\
+                LeaseReaper(sem):
+            # Permits held by crashed workers come back within a second
+            pass
+    """
+
+    def __init__(self,
+                 semaphore: Any,
+                 interval_s: float = DEFAULT_REAP_INTERVAL_S,
+                 ledger: LeaseLedger = None,
+                 ):
+        """
+        :param semaphore: An open Semaphore, CreateSemaphore or
+            OpenSemaphore of the semaphore
+        :param interval_s: How often to reap, in seconds (default: 1)
+        :param ledger: The ledger to reap (default: the semaphore's ledger,
+            or a ledger opened for its name)
+        """
+        self.semaphore = getattr(semaphore, 'sem', semaphore)
+        self.interval_s = interval_s
+        self._own_ledger = False
+        if ledger is None:
+            ledger = self.semaphore.ledger
+        if ledger is None:
+            ledger = LeaseLedger(self.semaphore.name, self.semaphore.backend)
+            self._own_ledger = True
+        self.ledger = ledger
+        #: Permits released so far
+        self.reclaimed = 0
+        #: The last exception the background thread's reap() raised
+        self.reap_error: Optional[BaseException] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f'LeaseReaper({self.semaphore.name!r})',
+            daemon=True,
+        )
+        self._thread.start()
+
+    def __enter__(self) -> LeaseReaper:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def reap(self) -> int:
+        """
+        Reap now, rather than at the next interval
+
+        :returns: The number of permits released
+        """
+        reclaimed = self.ledger.reap(self.semaphore)
+        self.reclaimed += reclaimed
+        return reclaimed
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        if self._own_ledger:
+            self.ledger.close()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.reap()
+            except Exception as exc:
+                # Keep reaping, a failure may not last
+                self.reap_error = exc
+                _logger.exception("LeaseReaper(%r) failed to reap",
+                                  self.semaphore.name)
@@ -0,0 +1,293 @@
+"""Acquire and release metrics: counts, wait times and hold times."""
+from __future__ import annotations
+import _thread
+import weakref
+from array import array
+from typing import Any, Dict, List, Optional
+
+from . import semaphore as _semaphore
+
+# Bucket i of a Histogram counts durations of 2 ** (i - 1) to 2 ** i - 1
+# nanoseconds, bucket 0 counts zero. int.bit_length() picks the bucket.
+BUCKETS = 65
+
+
+class Histogram:
+    """
+    Durations in power of two buckets, in a preallocated array
+
+    add() only updates integers in place, so recording a duration doesn't
+    allocate. Percentiles are the upper bound of their bucket, so they're
+    within a factor of two of the actual value.
+    """
+    __slots__ = ('buckets', 'count', 'total_ns', 'max_ns')
+
+    def __init__(self):
+        self.buckets = array('Q', bytes(8 * BUCKETS))
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def add(self, ns: int) -> None:
+        """
+        Count one duration
+
+        :param ns: The duration, in nanoseconds
+        """
+        self.buckets[ns.bit_length()] += 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def merge(self, other: Histogram) -> None:
+        """
+        Add the durations counted by another histogram
+        """
+        buckets = self.buckets
+        for index, count in enumerate(other.buckets):
+            buckets[index] += count
+        self.count += other.count
+        self.total_ns += other.total_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+
+    def percentile(self, fraction: float) -> int:
+        """
+        An upper bound of the given percentile
+
+        :param fraction: The percentile, from 0 to 1
+        :returns: The upper bound in nanoseconds, 0 when nothing was
+            counted
+        """
+        if not self.count:
+            return 0
+        rank = max(1, int(self.count * fraction + 0.5))
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                # Never above the largest duration actually counted
+                return min((1 << index) - 1, self.max_ns)
+        return self.max_ns
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'total_ns': self.total_ns,
+            'max_ns': self.max_ns,
+            'p50_ns': self.percentile(0.5),
+            'p99_ns': self.percentile(0.99),
+            'buckets': list(self.buckets),
+        }
+
+
+class SemaphoreMetrics:
+    """
+    What the acquires and releases of a semaphore did
+
+    Wait times are measured by Semaphore.acquire() and acquire_async(),
+    from the call to the permit being taken, and by wait_any(), wait_all()
+    and the wrappers that take permits from the backend themselves. Hold
+    times are measured by AcquireSemaphore and AsyncAcquireSemaphore, from
+    the permit being taken to its release. Updates take a lock, so counts
+    from several threads add up exactly.
+    """
+
+    def __init__(self, name: Optional[str] = None):
+        """
+        :param name: The name of the semaphore
+        """
+        self.name = name
+        #: Successful acquires, and the permits they took
+        self.acquires = 0
+        self.acquired_permits = 0
+        #: Acquires that timed out, and that were cancelled
+        self.timeouts = 0
+        self.cancellations = 0
+        #: Acquires and releases that raised OSError
+        self.failures = 0
+        #: Releases, and the permits they gave back
+        self.releases = 0
+        self.released_permits = 0
+        #: How long successful acquires waited
+        self.wait_ns = Histogram()
+        #: How long permits were held
+        self.hold_ns = Histogram()
+        self._lock = _thread.allocate_lock()
+
+    def record_wait(self, ns: int, acquired: Optional[bool], count: int = 1
+                    ) -> None:
+        """
+        Account for one acquire
+
+        :param ns: How long it waited, in nanoseconds
+        :param acquired: False if it timed out, None if it was cancelled
+        :param count: The number of permits it asked for
+        """
+        with self._lock:
+            if acquired:
+                self.acquires += 1
+                self.acquired_permits += count
+                self.wait_ns.add(ns)
+            elif acquired is None:
+                self.cancellations += 1
+            else:
+                self.timeouts += 1
+
+    def record_release(self, count: int = 1) -> None:
+        with self._lock:
+            self.releases += 1
+            self.released_permits += count
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+
+    def record_hold(self, ns: int) -> None:
+        with self._lock:
+            self.hold_ns.add(ns)
+
+    def merge(self, other: SemaphoreMetrics) -> None:
+        """
+        Add what another SemaphoreMetrics counted
+        """
+        with other._lock:
+            with self._lock:
+                self.acquires += other.acquires
+                self.acquired_permits += other.acquired_permits
+                self.timeouts += other.timeouts
+                self.cancellations += other.cancellations
+                self.failures += other.failures
+                self.releases += other.releases
+                self.released_permits += other.released_permits
+                self.wait_ns.merge(other.wait_ns)
+                self.hold_ns.merge(other.hold_ns)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Everything counted, as plain types for logging or JSON
+        """
+        with self._lock:
+            return {
+                'name': self.name,
+                'acquires': self.acquires,
+                'acquired_permits': self.acquired_permits,
+                'timeouts': self.timeouts,
+                'cancellations': self.cancellations,
+                'failures': self.failures,
+                'releases': self.releases,
+                'released_permits': self.released_permits,
+                'wait_ns': self.wait_ns.as_dict(),
+                'hold_ns': self.hold_ns.as_dict(),
+            }
+
+    def __repr__(self) -> str:
+        return (f'<SemaphoreMetrics name={self.name!r} '
+                f'acquires={self.acquires} timeouts={self.timeouts} '
+                f'failures={self.failures} releases={self.releases}>')
+
+
+class _NameMetrics:
+    __slots__ = ('live', 'closed')
+
+    def __init__(self, name: Optional[str]):
+        # Metrics of open semaphores, by id, and the sum of closed ones
+        self.live: Dict[int, SemaphoreMetrics] = {}
+        self.closed = SemaphoreMetrics(name)
+
+
+_by_name: Dict[Optional[str], _NameMetrics] = {}
+_by_name_lock = _thread.allocate_lock()
+# Metrics of semaphores collected without being closed. Their finalizers
+# may run while this thread holds the lock, so they only append here, and
+# the registry retires them the next time it takes the lock.
+_collected: List[SemaphoreMetrics] = []
+
+
+def new_metrics(name: Optional[str], owner: Any = None
+                ) -> SemaphoreMetrics:
+    """
+    Metrics for a Semaphore, counted towards get_metrics(name)
+
+    :param name: The name of the semaphore
+    :param owner: The Semaphore, whose metrics are retired when it's
+        garbage collected without being closed (default: retired by
+        retire_metrics() only)
+    """
+    metrics = SemaphoreMetrics(name)
+    with _by_name_lock:
+        _retire_collected()
+        entry = _by_name.get(name)
+        if entry is None:
+            entry = _by_name[name] = _NameMetrics(name)
+        entry.live[id(metrics)] = metrics
+    if owner is not None:
+        # Unpickled, adopted or forgotten semaphores are never closed
+        weakref.finalize(owner, _collected.append, metrics)
+    return metrics
+
+
+def retire_metrics(metrics: SemaphoreMetrics) -> None:
+    """
+    Fold the metrics of a closed, or collected, Semaphore into its name's
+    totals
+    """
+    with _by_name_lock:
+        _retire_collected()
+        _retire(metrics)
+
+
+def _retire(metrics: SemaphoreMetrics) -> None:
+    # Called with the lock held
+    entry = _by_name.get(metrics.name)
+    if entry is None or entry.live.pop(id(metrics), None) is None:
+        return
+    entry.closed.merge(metrics)
+
+
+def _retire_collected() -> None:
+    # Called with the lock held
+    while _collected:
+        _retire(_collected.pop())
+
+
+def get_metrics(name: Optional[str]) -> SemaphoreMetrics:
+    """
+    The metrics of every Semaphore of this process with the given name
+
+    :param name: The name of the semaphores, None for unnamed ones
+    :returns: A new SemaphoreMetrics adding up the open semaphores and the
+        ones closed since reset_metrics()
+    """
+    total = SemaphoreMetrics(name)
+    with _by_name_lock:
+        _retire_collected()
+        entry = _by_name.get(name)
+        if entry is not None:
+            total.merge(entry.closed)
+            for metrics in entry.live.values():
+                total.merge(metrics)
+    return total
+
+
+def reset_metrics() -> None:
+    """
+    Forget the totals of closed semaphores, open ones keep theirs
+    """
+    with _by_name_lock:
+        _retire_collected()
+        for name, entry in list(_by_name.items()):
+            if entry.live:
+                entry.closed = SemaphoreMetrics(name)
+            else:
+                del _by_name[name]
+
+
+def enable_metrics(enabled: bool = True) -> None:
+    """
+    Collect metrics for every Semaphore created from now on
+
+    :param enabled: False stops collecting for new semaphores, existing
+        ones keep their setting
+    """
+    _semaphore._metrics_enabled = enabled
@@ -0,0 +1,404 @@
+"""POSIX named semaphores, through libc."""
+from __future__ import annotations
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import os
+import threading
+import time
+import uuid
+import weakref
+from ctypes import POINTER, Structure, byref, c_char_p, c_int, c_long, \
+    c_uint, c_void_p
+from typing import MutableSequence, Optional, Sequence, Tuple
+
+from .backend import GATE_SUFFIX, SemaphoreBackend
+from .constants import SEMAPHORE_ALL_ACCESS, SEMAPHORE_MODIFY_STATE, \
+    SEMAPHORE_QUERY_STATE, SYNCHRONIZE
+from .segment import segment_path
+
+O_CREAT = os.O_CREAT
+O_EXCL = os.O_EXCL
+CLOCK_MONOTONIC = getattr(time, 'CLOCK_MONOTONIC', 1)
+SEMAPHORE_MODE = 0o600
+
+# What a POSIX semaphore lacks compared to a Windows one: the maximum count,
+# stored as the value of a companion semaphore nobody waits on, and a lock
+# that serializes release() so the maximum and the previous count are exact.
+# The lock is a file locked with flock(), which the kernel drops when its
+# holder dies.
+MAXIMUM_SUFFIX = '.max'
+LOCK_SUFFIX = '.lock'
+
+# How long create() keeps opening a semaphore whose lock file another
+# process has just created, until that process has created the rest
+CREATE_RACE_TIMEOUT_S = 1.0
+
+# Every handle with a lock file, to reopen it in a forked child
+_handles: weakref.WeakSet = weakref.WeakSet()
+
+
+class timespec(Structure):
+    _fields_ = [('tv_sec', c_long), ('tv_nsec', c_long)]
+
+
+_libc = None
+_libc_lock = threading.Lock()
+
+
+def _load_libc() -> ctypes.CDLL:
+    """
+    Bind the sem_* functions, which live in libpthread before glibc 2.34
+    """
+    global _libc
+    with _libc_lock:
+        if _libc is not None:
+            return _libc
+        for library in (None,
+                        ctypes.util.find_library('pthread'),
+                        ctypes.util.find_library('c')):
+            try:
+                lib = ctypes.CDLL(library, use_errno=True)
+                lib.sem_open
+            except (OSError, AttributeError):
+                continue
+            break
+        else:
+            raise OSError(errno.ENOSYS, 'POSIX semaphores are unavailable')
+
+        """
+        sem_t *sem_open(const char *name, int oflag,
+                        mode_t mode, unsigned int value);
+        """
+        lib.sem_open.argtypes = c_char_p, c_int, c_uint, c_uint
+        lib.sem_open.restype = c_void_p
+        for function in ('sem_close', 'sem_wait', 'sem_trywait', 'sem_post'):
+            getattr(lib, function).argtypes = (c_void_p,)
+            getattr(lib, function).restype = c_int
+        lib.sem_unlink.argtypes = (c_char_p,)
+        lib.sem_unlink.restype = c_int
+        lib.sem_timedwait.argtypes = c_void_p, POINTER(timespec)
+        lib.sem_timedwait.restype = c_int
+        lib.sem_getvalue.argtypes = c_void_p, POINTER(c_int)
+        lib.sem_getvalue.restype = c_int
+        try:
+            # glibc 2.30+, immune to wall clock changes
+            lib.sem_clockwait.argtypes = (c_void_p, c_int,
+                                          POINTER(timespec))
+            lib.sem_clockwait.restype = c_int
+        except AttributeError:
+            pass
+        _libc = lib
+        return lib
+
+
+def _error(code: int, filename: str = None) -> OSError:
+    return OSError(code, os.strerror(code), filename)
+
+
+def _sem_name(name: str, suffix: str = '') -> bytes:
+    # POSIX names are a single path component starting with a slash
+    return ('/' + name.replace('/', '_') + suffix).encode('utf-8')
+
+
+class PosixSemaphoreHandle:
+    """
+    An open POSIX semaphore, plus its maximum count and release lock
+    """
+    __slots__ = ('name', 'sem', 'maximum_sem', 'lock_path', 'lock_fd',
+                 'lock', 'maximum_count', 'desired_access', 'owner',
+                 '__weakref__')
+
+    def __init__(self, name: str, desired_access: int, owner: bool):
+        self.name = name
+        self.sem: Optional[int] = None
+        self.maximum_sem: Optional[int] = None
+        self.lock_path: Optional[str] = None
+        self.lock_fd: Optional[int] = None
+        # flock() excludes other open files, not the threads sharing this one
+        self.lock = threading.Lock()
+        self.maximum_count: int = 0
+        self.desired_access = desired_access
+        # The handle that created the semaphore removes the name on close
+        self.owner = owner
+
+    def __bool__(self) -> bool:
+        return self.sem is not None
+
+    def __repr__(self) -> str:
+        return f'<PosixSemaphoreHandle name={self.name!r} sem={self.sem!r}>'
+
+
+class PosixBackend(SemaphoreBackend):
+    """
+    POSIX named semaphores (sem_open), for Linux and other platforms with a
+    complete sem_* implementation.
+
+    Differences from Windows:
+
+    * The name is removed when the handle that created it is closed, handles
+      that are already open keep working.
+    * A process that crashes while creating or owning a name leaves it
+      behind in /dev/shm.
+    * The release lock is a file next to the segments, see
+      segment_directory(). A process that dies inside release() doesn't
+      leave it taken.
+    * The inherit flag of open() has no effect.
+
+    The gate of a semaphore, see create_gate(), is removed along with the
+    semaphore.
+    """
+    name = 'posix'
+
+    def __init__(self):
+        self.libc = _load_libc()
+        # Per thread: a c_int for sem_getvalue, and a byref() to it
+        self._buffers = threading.local()
+
+    def _sem_open(self, name: bytes, oflag: int, value: int = 0) -> int:
+        sem = self.libc.sem_open(name, oflag, SEMAPHORE_MODE, value)
+        if not sem:
+            raise _error(ctypes.get_errno(), name.decode('utf-8'))
+        return sem
+
+    def _unlink(self, name: bytes) -> None:
+        if self.libc.sem_unlink(name) != 0:
+            code = ctypes.get_errno()
+            if code != errno.ENOENT:
+                raise _error(code, name.decode('utf-8'))
+
+    def _getvalue(self, sem: int) -> int:
+        buffers = self._buffers
+        try:
+            value, value_ref = buffers.value
+        except AttributeError:
+            value = c_int(0)
+            value_ref = byref(value)
+            buffers.value = value, value_ref
+        if self.libc.sem_getvalue(sem, value_ref) != 0:
+            raise _error(ctypes.get_errno())
+        return value.value
+
+    def _close_sems(self, handle: PosixSemaphoreHandle) -> None:
+        for attribute in ('sem', 'maximum_sem'):
+            sem = getattr(handle, attribute)
+            if sem is not None:
+                self.libc.sem_close(sem)
+                setattr(handle, attribute, None)
+        if handle.lock_fd is not None:
+            _handles.discard(handle)
+            os.close(handle.lock_fd)
+            handle.lock_fd = None
+
+    def _set_lock_file(self, handle: PosixSemaphoreHandle, path: str,
+                       fd: int) -> None:
+        handle.lock_path = path
+        handle.lock_fd = fd
+        _handles.add(handle)
+
+    def create(self,
+               name: Optional[str],
+               initial_count: int,
+               maximum_count: int,
+               desired_access: int,
+               ) -> PosixSemaphoreHandle:
+        if maximum_count <= 0 or not 0 <= initial_count <= maximum_count:
+            raise _error(errno.EINVAL)
+        anonymous = name is None
+        if anonymous:
+            name = f'semaphore_win_ctypes-{os.getpid()}-{uuid.uuid4().hex}'
+        lock_path = segment_path(name, self, LOCK_SUFFIX)
+        maximum_name = _sem_name(name, MAXIMUM_SUFFIX)
+        sem_name = _sem_name(name)
+        deadline = time.monotonic() + CREATE_RACE_TIMEOUT_S
+        while True:
+            try:
+                # Whoever creates the lock file owns the name
+                lock_fd = os.open(lock_path, os.O_RDWR | O_CREAT | O_EXCL,
+                                  SEMAPHORE_MODE)
+                break
+            except FileExistsError:
+                pass
+            try:
+                # Like CreateSemaphoreExW: open the existing semaphore
+                return self.open(name, desired_access, False)
+            except FileNotFoundError:
+                # Its creator hasn't created the rest yet, or gave up
+                if time.monotonic() >= deadline:
+                    raise
+            time.sleep(0.001)
+
+        handle = PosixSemaphoreHandle(name, _access(desired_access), True)
+        self._set_lock_file(handle, lock_path, lock_fd)
+        try:
+            # Clear out anything left behind by a crashed owner. The
+            # semaphore itself is created last, it's what open() looks for.
+            self._unlink(maximum_name)
+            handle.maximum_sem = self._sem_open(
+                maximum_name, O_CREAT | O_EXCL, maximum_count)
+            handle.maximum_count = maximum_count
+            self._unlink(sem_name)
+            handle.sem = self._sem_open(
+                sem_name, O_CREAT | O_EXCL, initial_count)
+        except BaseException:
+            self._close_sems(handle)
+            self._unlink_all(name)
+            raise
+        if anonymous:
+            # Nobody else can open it, only this handle refers to it
+            self._unlink_all(name)
+            handle.owner = False
+        return handle
+
+    def open(self,
+             name: str,
+             desired_access: int,
+             inherit: bool,
+             ) -> PosixSemaphoreHandle:
+        handle = PosixSemaphoreHandle(name, _access(desired_access), False)
+        try:
+            handle.sem = self._sem_open(_sem_name(name), 0)
+            handle.maximum_sem = self._sem_open(
+                _sem_name(name, MAXIMUM_SUFFIX), 0)
+            lock_path = segment_path(name, self, LOCK_SUFFIX)
+            self._set_lock_file(handle, lock_path,
+                                os.open(lock_path, os.O_RDWR))
+            handle.maximum_count = self._getvalue(handle.maximum_sem)
+        except BaseException:
+            self._close_sems(handle)
+            raise
+        return handle
+
+    def create_gate(self, name: Optional[str]) -> PosixSemaphoreHandle:
+        handle = self.create(None if name is None else name + GATE_SUFFIX,
+                             1, 1, SEMAPHORE_ALL_ACCESS)
+        # Handles come and go, the gate must last as long as the semaphore
+        handle.owner = False
+        return handle
+
+    def wait(self,
+             handle: PosixSemaphoreHandle,
+             timeout_ms: Optional[int],
+             ) -> bool:
+        _check(handle, SYNCHRONIZE)
+        libc = self.libc
+        if timeout_ms == 0:
+            while libc.sem_trywait(handle.sem) != 0:
+                code = ctypes.get_errno()
+                if code == errno.EAGAIN:
+                    return False
+                if code != errno.EINTR:
+                    raise _error(code)
+            return True
+        if timeout_ms is None:
+            while libc.sem_wait(handle.sem) != 0:
+                code = ctypes.get_errno()
+                if code != errno.EINTR:
+                    raise _error(code)
+            return True
+        return self._timedwait(handle.sem, timeout_ms)
+
+    def _timedwait(self, sem: int, timeout_ms: int) -> bool:
+        libc = self.libc
+        clockwait = getattr(libc, 'sem_clockwait', None)
+        if clockwait is not None:
+            deadline_ns = time.monotonic_ns() + timeout_ms * 1000000
+        else:
+            deadline_ns = time.time_ns() + timeout_ms * 1000000
+        deadline = timespec(*divmod(deadline_ns, 1000000000))
+        while True:
+            if clockwait is not None:
+                ret = clockwait(sem, CLOCK_MONOTONIC, byref(deadline))
+            else:
+                ret = libc.sem_timedwait(sem, byref(deadline))
+            if ret == 0:
+                return True
+            code = ctypes.get_errno()
+            if code == errno.ETIMEDOUT:
+                return False
+            if code != errno.EINTR:
+                raise _error(code)
+
+    def release(self, handle: PosixSemaphoreHandle, release_count: int) -> int:
+        _check(handle, SEMAPHORE_MODIFY_STATE)
+        if release_count <= 0:
+            raise _error(errno.EINVAL)
+        libc = self.libc
+        with handle.lock:
+            fcntl.flock(handle.lock_fd, fcntl.LOCK_EX)
+            try:
+                # Concurrent waits can only lower the count, so checking the
+                # maximum against this value never lets the count exceed it
+                previous_count = self._getvalue(handle.sem)
+                if previous_count + release_count > handle.maximum_count:
+                    raise OSError(errno.EOVERFLOW,
+                                  'Too many posts were made to a semaphore')
+                for _ in range(release_count):
+                    if libc.sem_post(handle.sem) != 0:
+                        raise _error(ctypes.get_errno())
+            finally:
+                fcntl.flock(handle.lock_fd, fcntl.LOCK_UN)
+        return previous_count
+
+    def query(self, handle: PosixSemaphoreHandle) -> Tuple[int, int]:
+        _check(handle, SEMAPHORE_QUERY_STATE)
+        # Linux reports 0, not minus the number of waiters, when blocked
+        return max(0, self._getvalue(handle.sem)), handle.maximum_count
+
+    def query_counts(self, handles: Sequence[PosixSemaphoreHandle],
+                     counts: MutableSequence[int]) -> None:
+        getvalue = self._getvalue
+        for index, handle in enumerate(handles):
+            _check(handle, SEMAPHORE_QUERY_STATE)
+            counts[index] = max(0, getvalue(handle.sem))
+
+    def close(self, handle: PosixSemaphoreHandle) -> None:
+        if not handle:
+            raise _error(errno.EBADF)
+        self._close_sems(handle)
+        if handle.owner:
+            handle.owner = False
+            self._unlink_all(handle.name)
+
+    def _unlink_all(self, name: str) -> None:
+        # The semaphore goes first so no new open() can succeed
+        for suffix in ('', MAXIMUM_SUFFIX):
+            self._unlink(_sem_name(name, suffix))
+        try:
+            os.unlink(segment_path(name, self, LOCK_SUFFIX))
+        except FileNotFoundError:
+            pass
+        if not name.endswith(GATE_SUFFIX):
+            self._unlink_all(name + GATE_SUFFIX)
+
+
+def _access(desired_access) -> int:
+    # Accept a DWORD as well as a plain int
+    return getattr(desired_access, 'value', desired_access)
+
+
+def _check(handle: PosixSemaphoreHandle, access: int) -> None:
+    if not handle:
+        raise _error(errno.EBADF)
+    if handle.desired_access & access != access:
+        raise _error(errno.EACCES)
+
+
+def _after_fork_in_child() -> None:
+    # A forked child shares the parent's open lock files, and so its flock()
+    # locks: each handle needs a lock file of its own
+    for handle in list(_handles):
+        handle.lock = threading.Lock()
+        for path in (f'/proc/self/fd/{handle.lock_fd}', handle.lock_path):
+            try:
+                fd = os.open(path, os.O_RDWR)
+            except OSError:
+                continue
+            os.close(handle.lock_fd)
+            handle.lock_fd = fd
+            break
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,268 @@
+"""Handing out the permits of a semaphore by priority."""
+from __future__ import annotations
+import heapq
+import itertools
+import threading
+import time
+from typing import List, Optional, Tuple, Union
+
+from .cancel import CancellationToken
+from .constants import INFINITE
+from .exceptions import SemaphoreWaitCancelledException, \
+    SemaphoreWaitTimeoutException
+from .semaphore import CreateSemaphore, OpenSemaphore, Semaphore
+
+# A waiter gains one priority level for every this many seconds it waits
+DEFAULT_AGING_S = 0.1
+
+
+class _Waiter:
+    __slots__ = ('priority', 'condition', 'granted', 'abandoned', 'error')
+
+    def __init__(self, priority: int, condition: threading.Condition):
+        self.priority = priority
+        self.condition = condition
+        self.granted = False
+        # Timed out, the heap entry is skipped when it comes up
+        self.abandoned = False
+        self.error: Optional[BaseException] = None
+
+
+class PrioritySemaphore:
+    """
+    Hands out the permits of a semaphore to the threads of this process in
+    priority order, higher priorities first
+
+    The kernel wakes waiters in no particular order, so the threads of this
+    process queue in a local heap instead, and a single proxy thread waits
+    on the semaphore for them. Each permit the proxy gets, and each permit
+    released by a thread of this process while others are queued, goes to
+    the queued waiter with the highest priority. Against other processes,
+    the proxy competes like any other waiter.
+
+    Waiters age: one waiting for aging_s seconds counts as one priority
+    level higher, so low priorities are delayed but never starved. Aging
+    is linear in the time spent waiting, so the order of two waiters never
+    changes and the heap key is computed once, when a waiter is queued.
+
+    Works with AcquireSemaphore, one permit at a time::
+
+        with OpenSemaphore('name') as opened, \\
+                PrioritySemaphore(opened) as prioritized:
+            with AcquireSemaphore(prioritized, priority=10):
+                # Perform work here
+                pass
+
+    Permits released while threads of this process are queued stay in the
+    process, a busy process can hold on to the semaphore for longer than
+    its share.
+    """
+
+    def __init__(self,
+                 semaphore: Union[Semaphore, CreateSemaphore, OpenSemaphore],
+                 aging_s: Optional[float] = DEFAULT_AGING_S,
+                 ):
+        """
+        :param semaphore: The open semaphore to hand out permits of, it
+            must stay open until close()
+        :param aging_s: How long a waiter waits to gain one priority level,
+            in seconds, None to never age (default: 0.1)
+        """
+        if aging_s is not None and aging_s <= 0:
+            raise ValueError(f"aging_s must be positive, not {aging_s}")
+        self.semaphore: Semaphore = getattr(semaphore, 'sem', semaphore)
+        self.aging_s = aging_s
+        #: Permits released straight to a waiter of this process
+        self.handoffs = 0
+        #: Permits the proxy thread took from the semaphore
+        self.proxy_acquires = 0
+        self._lock = threading.Lock()
+        # The proxy thread waits on this for waiters to be queued
+        self._wakeup = threading.Condition(self._lock)
+        self._heap: List[Tuple[float, int, _Waiter]] = []
+        self._sequence = itertools.count()
+        # Waiters in the heap that haven't timed out
+        self._waiting = 0
+        self._closed = False
+        self._stop = CancellationToken()
+        self._proxy: Optional[threading.Thread] = None
+
+    # Not instrumented, the wrapped Semaphore counts the kernel side
+    metrics = None
+    tracer = None
+
+    @property
+    def sem(self) -> PrioritySemaphore:
+        # Lets AcquireSemaphore wrap this, like a CreateSemaphore
+        return self
+
+    def __enter__(self) -> PrioritySemaphore:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def waiting(self) -> int:
+        """
+        The threads of this process queued for a permit
+        """
+        return self._waiting
+
+    def acquire(self,
+                timeout_ms: int = None,
+                count: int = 1,
+                spin: bool = False,
+                priority: int = 0,
+                ) -> PrioritySemaphore:
+        """
+        Take a permit, ahead of queued waiters with a lower priority
+        :param timeout_ms: The time-out interval, in milliseconds. (default:
+            None - infinite wait)
+        :param count: Must be 1, for compatibility with Semaphore.acquire()
+        :param spin: Ignored, for compatibility with Semaphore.acquire()
+        :param priority: Higher priorities are served first (default: 0)
+        :raises SemaphoreWaitTimeoutException: The time-out interval elapsed,
+            and no permit was handed to this thread.
+        :raises OSError: The proxy thread's wait has failed.
+        :returns: The PrioritySemaphore, for chaining calls
+
+        Without queued waiters, a permit the semaphore has available is
+        taken right away.
+        """
+        assert timeout_ms != INFINITE, \
+            "Use None to specify an infinite timeout"
+        if count != 1:
+            raise ValueError(f"PrioritySemaphore hands out one permit at a "
+                             f"time, not {count}")
+        sem = self.semaphore
+        with self._lock:
+            if self._closed:
+                raise ValueError("PrioritySemaphore is closed")
+            if not self._waiting and sem.backend.wait(sem.hHandle, 0):
+                sem._record_taken()
+                return self
+            if timeout_ms == 0:
+                raise SemaphoreWaitTimeoutException()
+            now = time.monotonic()
+            waiter = _Waiter(priority, threading.Condition(self._lock))
+            if self.aging_s is None:
+                key = -priority
+            else:
+                # priority + waited / aging_s, less the part every waiter
+                # gains equally as time passes
+                key = now / self.aging_s - priority
+            heapq.heappush(self._heap, (key, next(self._sequence), waiter))
+            self._waiting += 1
+            if self._proxy is None:
+                self._proxy = threading.Thread(
+                    target=self._run_proxy,
+                    name=f'PrioritySemaphore({sem.name!r})',
+                    daemon=True,
+                )
+                self._proxy.start()
+            else:
+                self._wakeup.notify()
+            deadline = None
+            if timeout_ms is not None:
+                deadline = now + timeout_ms / 1000
+            while not waiter.granted:
+                if waiter.error is not None:
+                    raise waiter.error
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        waiter.abandoned = True
+                        self._waiting -= 1
+                        raise SemaphoreWaitTimeoutException()
+                waiter.condition.wait(remaining)
+        return self
+
+    def release(self, release_count: int = 1) -> int:
+        """
+        Give back permits, to queued waiters first, then to the semaphore
+        :param release_count: The number of permits to give back
+        :returns: The previous count of the semaphore, 0 when every permit
+            went to a waiter of this process
+        """
+        if release_count <= 0:
+            raise ValueError(f"release_count must be positive, "
+                             f"not {release_count}")
+        handed = 0
+        with self._lock:
+            while handed < release_count and self._grant():
+                handed += 1
+            self.handoffs += handed
+        if handed < release_count:
+            return self.semaphore.release(release_count - handed)
+        return 0
+
+    def getvalue(self) -> int:
+        return self.semaphore.getvalue()
+
+    def close(self) -> None:
+        """
+        Stop the proxy thread, queued waiters raise ValueError
+
+        The semaphore itself stays open.
+        """
+        with self._lock:
+            self._closed = True
+            self._fail_all(ValueError("PrioritySemaphore is closed"))
+            self._wakeup.notify()
+            proxy = self._proxy
+        self._stop.cancel()
+        if proxy is not None:
+            proxy.join()
+        self._stop.close()
+
+    def _pop(self) -> Optional[_Waiter]:
+        # Called with the lock held: the first waiter that hasn't timed out
+        while self._heap:
+            waiter = heapq.heappop(self._heap)[2]
+            if not waiter.abandoned:
+                self._waiting -= 1
+                return waiter
+        return None
+
+    def _grant(self) -> bool:
+        # Called with the lock held: hand a permit to the first waiter
+        waiter = self._pop()
+        if waiter is None:
+            return False
+        waiter.granted = True
+        waiter.condition.notify()
+        return True
+
+    def _fail_all(self, error: BaseException) -> None:
+        # Called with the lock held
+        while True:
+            waiter = self._pop()
+            if waiter is None:
+                return
+            waiter.error = error
+            waiter.condition.notify()
+
+    def _run_proxy(self) -> None:
+        sem = self.semaphore
+        while True:
+            with self._lock:
+                while not self._waiting and not self._closed:
+                    self._wakeup.wait()
+                if self._closed:
+                    return
+            try:
+                sem.acquire(cancel=self._stop)
+            except SemaphoreWaitCancelledException:
+                return
+            except OSError as exc:
+                with self._lock:
+                    self._fail_all(exc)
+                continue
+            with self._lock:
+                self.proxy_acquires += 1
+                granted = self._grant()
+            if not granted:
+                # Everyone timed out meanwhile
+                sem.release()
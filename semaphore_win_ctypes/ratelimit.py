@@ -0,0 +1,278 @@
+"""A token bucket rate limiter shared by every process on the host."""
+from __future__ import annotations
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional, Union
+
+from .backend import SemaphoreBackend, is_too_many_posts
+from .segment import SharedSegment, pid_alive, segment_path
+from .semaphore import Semaphore
+
+# Appended to the limiter's name to name the semaphore that elects the
+# process refilling the bucket, and the segment holding the pid of the
+# elected process
+REFILLER_SUFFIX = '.refiller'
+
+# The refiller segment has one slot, of the elected pid
+REFILLER_MAGIC = 0x535743524546494C
+
+_logger = logging.getLogger(__name__)
+
+# How often the elected limiter adds tokens, in seconds
+DEFAULT_INTERVAL_S = 0.01
+
+# Added to the tokens accrued before rounding down, so a clock reading
+# that's a hair short of a whole token doesn't lose it
+ROUNDING_SLACK = 1e-6
+
+
+class RateLimiter:
+    """
+    A token bucket on a named semaphore: each permit is a token, and the
+    maximum count is the size of the bucket
+
+    Consumers take tokens with Semaphore.acquire() or acquire_async(), so
+    they wait in the kernel like for any other semaphore. One limiter per
+    name is elected, through a second semaphore named name + '.refiller',
+    to add rate tokens per second with release(). The bucket is clamped to
+    burst by the maximum count: a release that would overflow it is cut
+    down to the room left.
+
+    The elected limiter refills from a background thread every interval_s
+    seconds. When it's closed, another limiter with the same name takes
+    over at its next interval. The elected pid is kept in a small file
+    next to the lease ledgers, written along with the election under the
+    file's lock, so when a refilling process crashes and leaves the
+    election taken, the next limiter to find the election taken and that
+    process gone, or no pid recorded, takes over. A refill that raises is
+    logged, and the background thread goes on.
+
+    With interval_s=None there is no background thread, the caller calls
+    refill() itself, which lets tests drive it with a simulated clock::
+
+        with RateLimiter('downstream', rate=500, burst=50) as limiter:
+            limiter.acquire(timeout_ms=1000)
+            # Make the call here
+    """
+
+    def __init__(self,
+                 name: Optional[str] = None,
+                 rate: float = 1.0,
+                 burst: int = 1,
+                 backend: Union[SemaphoreBackend, str] = None,
+                 interval_s: Optional[float] = DEFAULT_INTERVAL_S,
+                 clock: Callable[[], float] = time.monotonic,
+                 ):
+        """
+        :param name: The name shared by the limiters of every process, None
+            for a limiter private to this object (default: unnamed)
+        :param rate: The tokens added per second
+        :param burst: The most tokens the bucket holds, it starts full
+        :param backend: The backend instance or name (default: the
+            platform's default backend)
+        :param interval_s: How often the elected limiter refills, in
+            seconds, None to only refill when refill() is called (default:
+            0.01)
+        :param clock: The time source for refill(), in seconds (default:
+            time.monotonic)
+        """
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, not {rate}")
+        if burst < 1:
+            raise ValueError(f"burst must be at least 1, not {burst}")
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.interval_s = interval_s
+        self.clock = clock
+        #: Tokens added by this limiter, and tokens that didn't fit
+        self.refilled = 0
+        self.overflowed = 0
+        #: The last exception the background thread's refill() raised
+        self.refill_error: Optional[BaseException] = None
+        self.semaphore = Semaphore(name, backend).create(burst)
+        self.election: Optional[Semaphore] = None
+        # Unnamed limiters have no other process to hand over to
+        self._segment: Optional[SharedSegment] = None
+        try:
+            self.election = Semaphore(
+                None if name is None else name + REFILLER_SUFFIX,
+                self.semaphore.backend).create(1)
+            if name is not None:
+                self._segment = SharedSegment(
+                    segment_path(name, self.semaphore.backend,
+                                 REFILLER_SUFFIX),
+                    REFILLER_MAGIC, 1, 1)
+        except BaseException:
+            if self.election is not None:
+                self.election.close()
+            self.semaphore.close()
+            raise
+        self.elected = False
+        # Time of the election, and the tokens accrued since then that
+        # were added or overflowed
+        self._elected_at = 0.0
+        self._accrued = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refiller: Optional[threading.Thread] = None
+        if interval_s is not None:
+            self._refiller = threading.Thread(
+                target=self._run_refiller,
+                name=f'RateLimiter({name!r})',
+                daemon=True,
+            )
+            self._refiller.start()
+
+    def __enter__(self) -> RateLimiter:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def acquire(self, timeout_ms: int = None, tokens: int = 1
+                ) -> RateLimiter:
+        """
+        Take tokens, waiting for them to be added
+        :param timeout_ms: The time-out interval, in milliseconds. (default:
+            None - infinite wait)
+        :param tokens: The number of tokens to take, at most burst
+            (default: 1)
+        :raises SemaphoreWaitTimeoutException: The time-out interval elapsed
+            before the tokens were available.
+        :raises OSError: The wait has failed.
+        :returns: The RateLimiter, for chaining calls
+        """
+        if tokens > self.burst:
+            raise ValueError(f"Can't take {tokens} tokens from a bucket of "
+                             f"{self.burst}")
+        self.semaphore.acquire(timeout_ms, tokens)
+        return self
+
+    async def acquire_async(self, timeout_ms: int = None) -> RateLimiter:
+        """
+        Take a token without blocking the running event loop
+        :param timeout_ms: The time-out interval, in milliseconds. (default:
+            None - infinite wait)
+        :raises SemaphoreWaitTimeoutException: The time-out interval elapsed
+            before a token was available.
+        :raises OSError: The wait has failed.
+        :returns: The RateLimiter, for chaining calls
+        """
+        await self.semaphore.acquire_async(timeout_ms)
+        return self
+
+    def getvalue(self) -> int:
+        """
+        The tokens in the bucket
+        """
+        return self.semaphore.getvalue()
+
+    def refill(self) -> int:
+        """
+        Add the tokens accrued since the last refill, if this limiter is,
+        or can become, the elected refiller
+
+        :raises OSError: The release has failed.
+        :returns: The number of tokens added
+        """
+        with self._lock:
+            now = self.clock()
+            if not self.elected:
+                if not self._elect():
+                    return 0
+                # Tokens accrue from the election on, the previous
+                # refiller already added the ones before
+                self.elected = True
+                self._elected_at = now
+                self._accrued = 0
+                return 0
+            # Counted from the election rather than the last refill, so
+            # rounding doesn't add up over many refills
+            accrued = int((now - self._elected_at) * self.rate
+                          + ROUNDING_SLACK)
+            tokens = accrued - self._accrued
+            self._accrued = accrued
+            if tokens <= 0:
+                return 0
+            added = self._add(min(tokens, self.burst))
+            self.refilled += added
+            self.overflowed += tokens - added
+            return added
+
+    def _elect(self) -> bool:
+        # Win the election, or take the place of a winner that's gone
+        backend = self.election.backend
+        segment = self._segment
+        if segment is None:
+            return backend.wait(self.election.hHandle, 0)
+        index = segment.slot_indexes()[0]
+        segment.lock()
+        try:
+            # The election and the pid only change together, under the
+            # lock: a taken election with no pid, or the pid of a process
+            # that's gone, was left by a process that died
+            if not backend.wait(self.election.hHandle, 0):
+                pid = segment.words[index]
+                if pid == os.getpid() or (pid != 0 and pid_alive(pid)):
+                    return False
+            segment.words[index] = os.getpid()
+            return True
+        finally:
+            segment.unlock()
+
+    def _resign(self) -> None:
+        backend = self.election.backend
+        segment = self._segment
+        if segment is None:
+            backend.release(self.election.hHandle, 1)
+            return
+        segment.lock()
+        try:
+            segment.words[segment.slot_indexes()[0]] = 0
+            backend.release(self.election.hHandle, 1)
+        finally:
+            segment.unlock()
+
+    def _add(self, tokens: int) -> int:
+        try:
+            self.semaphore.release(tokens)
+            return tokens
+        except OSError as exc:
+            if not is_too_many_posts(exc):
+                raise
+        # Consumers only ever lower the count, so the room left can only
+        # grow until this release
+        room = self.burst - self.semaphore.getvalue()
+        if room <= 0:
+            return 0
+        self.semaphore.release(room)
+        return room
+
+    def close(self) -> None:
+        """
+        Stop refilling, handing the election over to another limiter
+        """
+        self._stop.set()
+        if self._refiller is not None:
+            self._refiller.join()
+        with self._lock:
+            if self.elected:
+                self.elected = False
+                self._resign()
+        if self._segment is not None:
+            self._segment.close()
+        self.election.close()
+        self.semaphore.close()
+
+    def _run_refiller(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.refill()
+            except Exception as exc:
+                # Keep refilling, a failure may not last
+                self.refill_error = exc
+                _logger.exception("RateLimiter(%r) failed to refill",
+                                  self.name)
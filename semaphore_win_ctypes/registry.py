@@ -0,0 +1,225 @@
+"""A process-wide cache of open named semaphore handles."""
+from __future__ import annotations
+import _thread
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from . import semaphore as _semaphore
+from .backend import SemaphoreBackend, get_backend
+from .constants import SEMAPHORE_ALL_ACCESS
+from .semaphore import Semaphore
+
+# An idle handle is closed after this many seconds without use
+DEFAULT_IDLE_TIMEOUT_S = 30.0
+# At most this many handles are kept open, see HandleRegistry
+DEFAULT_CAPACITY = 64
+
+
+class _Entry:
+    __slots__ = ('key', 'sem', 'refs', 'idle_since')
+
+    def __init__(self, key: Tuple[Any, ...], sem: Semaphore):
+        self.key = key
+        self.sem = sem
+        self.refs = 0
+        self.idle_since = 0.0
+
+
+class HandleRegistry:
+    """
+    Shared, reference counted handles to named semaphores
+
+    open() hands out one Semaphore per (backend, name, desired_access,
+    inherit, metrics), opening it only when no handle is cached, and
+    close() gives it back. A handle nobody uses is kept for idle_timeout_s
+    seconds, so a loop that opens, acquires and closes a semaphore for
+    every unit of work makes two kernel calls instead of four.
+
+    When more than capacity handles are open, the least recently used idle
+    ones are closed. Handles in use are never closed. Idle handles are
+    expired whenever the registry is used, or by prune().
+
+    A cached handle keeps its semaphore: on Windows the object outlives
+    its creator while the registry holds a handle, and with the posix
+    backend the handle keeps referring to the semaphore it opened even
+    after its creator removed the name.
+    """
+
+    def __init__(self,
+                 capacity: int = DEFAULT_CAPACITY,
+                 idle_timeout_s: float = DEFAULT_IDLE_TIMEOUT_S,
+                 ):
+        """
+        :param capacity: The number of handles above which idle handles are
+            closed, least recently used first (default: 64)
+        :param idle_timeout_s: How long an idle handle is kept, in seconds
+            (default: 30)
+        """
+        if capacity < 0:
+            raise ValueError(f"capacity must not be negative, not {capacity}")
+        self.capacity = capacity
+        self.idle_timeout_s = idle_timeout_s
+        #: open() calls served from the cache
+        self.hits = 0
+        #: open() calls that had to open a handle
+        self.misses = 0
+        #: Idle handles closed for capacity or age
+        self.evictions = 0
+        self._lock = _thread.allocate_lock()
+        self._entries: Dict[Tuple[Any, ...], _Entry] = {}
+        self._by_semaphore: Dict[int, _Entry] = {}
+        # Idle entries, least recently used first
+        self._idle: OrderedDict[Tuple[Any, ...], _Entry] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def open(self,
+             name: str,
+             desired_access: int = SEMAPHORE_ALL_ACCESS,
+             inherit: bool = True,
+             backend: Union[SemaphoreBackend, str] = None,
+             metrics: bool = None,
+             ) -> Semaphore:
+        """
+        A shared handle to a named semaphore, opened if none is cached
+
+        :param name: The name of the semaphore
+        :param desired_access: The access mask for the semaphore object
+            (default: SEMAPHORE_ALL_ACCESS)
+        :param inherit: If this value is TRUE, processes created by this
+            process will inherit the handle.
+        :param backend: The backend instance or name (default: the
+            platform's default backend)
+        :param metrics: Collect metrics, see Semaphore. Handles with and
+            without metrics are cached apart.
+        :raises OSError: The semaphore could not be opened.
+        :returns: The Semaphore, to be given back with close() rather than
+            closed directly
+        """
+        backend = get_backend(backend)
+        if metrics is None:
+            metrics = _semaphore._metrics_enabled
+        key = (backend, name, getattr(desired_access, 'value',
+                                      desired_access), bool(inherit),
+               bool(metrics))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                if entry.refs == 0:
+                    del self._idle[key]
+                entry.refs += 1
+                return entry.sem
+            self.misses += 1
+        # Opened without the lock, a slow open doesn't hold up other names
+        sem = Semaphore(name, backend, metrics).open(desired_access, inherit)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(key, sem)
+                self._by_semaphore[id(sem)] = entry
+                sem = None
+            elif entry.refs == 0:
+                del self._idle[key]
+            entry.refs += 1
+            evicted = self._evict(time.monotonic())
+        if sem is not None:
+            # Another thread opened the same handle first
+            evicted.append(sem)
+        self._close_all(evicted)
+        return entry.sem
+
+    def close(self, sem: Semaphore) -> None:
+        """
+        Give back a handle returned by open()
+
+        :param sem: The Semaphore returned by open()
+        :raises ValueError: The Semaphore did not come from this registry,
+            or was already given back.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._by_semaphore.get(id(sem))
+            if entry is None or entry.sem is not sem or entry.refs == 0:
+                raise ValueError(f"{sem!r} is not open in this registry")
+            entry.refs -= 1
+            if entry.refs == 0:
+                entry.idle_since = now
+                self._idle[entry.key] = entry
+            evicted = self._evict(now)
+        self._close_all(evicted)
+
+    def prune(self) -> int:
+        """
+        Close the handles that have been idle for longer than idle_timeout_s
+
+        :returns: The number of handles closed
+        """
+        with self._lock:
+            evicted = self._evict(time.monotonic())
+        self._close_all(evicted)
+        return len(evicted)
+
+    def clear(self) -> None:
+        """
+        Close every idle handle, handles in use stay open
+        """
+        with self._lock:
+            evicted = [self._remove(key) for key in list(self._idle)]
+        self._close_all(evicted)
+
+    def _evict(self, now: float) -> List[Semaphore]:
+        # Called with the lock held, the caller closes what's returned
+        evicted = []
+        expired = now - self.idle_timeout_s
+        while self._idle:
+            key, entry = next(iter(self._idle.items()))
+            if (len(self._entries) <= self.capacity
+                    and entry.idle_since > expired):
+                break
+            evicted.append(self._remove(key))
+        self.evictions += len(evicted)
+        return evicted
+
+    def _remove(self, key: Tuple[Any, ...]) -> Semaphore:
+        entry = self._entries.pop(key)
+        del self._idle[key]
+        del self._by_semaphore[id(entry.sem)]
+        return entry.sem
+
+    @staticmethod
+    def _close_all(sems: List[Semaphore]) -> None:
+        for sem in sems:
+            sem.close()
+
+
+_registry: Optional[HandleRegistry] = None
+_registry_lock = _thread.allocate_lock()
+
+
+def get_registry() -> HandleRegistry:
+    """
+    The process-wide registry used by OpenSemaphore(registry=True)
+
+    :returns: The registry set by set_registry(), otherwise a
+        HandleRegistry with the default capacity and idle timeout
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = HandleRegistry()
+    return _registry
+
+
+def set_registry(registry: Optional[HandleRegistry]) -> None:
+    """
+    Replace the process-wide registry
+
+    :param registry: The new registry, None for a new default one on next
+        use. Handles cached by the previous registry are left to it.
+    """
+    global _registry
+    _registry = registry
@@ -0,0 +1,230 @@
+"""A semaphore whose capacity can change while it's in use."""
+from __future__ import annotations
+import time
+from typing import Optional, Union
+
+from .backend import SemaphoreBackend
+from .cancel import CancellationToken
+from .exceptions import SemaphoreWaitTimeoutException
+from .semaphore import Semaphore
+
+# Appended to the name of a ResizableSemaphore to name the semaphores that
+# count its reserved permits and the permits still owed to the reserve, and
+# the one that lets one resize happen at a time
+RESERVED_SUFFIX = '.reserved'
+OWED_SUFFIX = '.owed'
+RESIZE_SUFFIX = '.resize'
+
+# The maximum count of the semaphore, which the limit can't exceed
+DEFAULT_CEILING = 1024
+
+
+def _suffixed(name: Optional[str], suffix: str) -> Optional[str]:
+    return None if name is None else name + suffix
+
+
+class ResizableSemaphore:
+    """
+    A semaphore created with a high maximum count, the ceiling, with some of
+    its permits held in reserve so that only limit of them are in use
+
+    resize() moves permits between the reserve and the semaphore, in any
+    process that has the semaphore open, and every process sees the new
+    limit: the permits reserved, and those still owed to the reserve, are
+    counted by two more semaphores, name + '.reserved' and name + '.owed'.
+    Growing releases reserved permits at once. Shrinking takes the free
+    permits it can, within timeout_ms, and the rest are owed: the next
+    releases, by any process, go to the reserve instead of the semaphore
+    until the debt is paid. So in-use permits can exceed a lower limit for
+    as long as it takes their holders to release them.
+
+    The wrapped semaphore's metrics, ledger and traces see the acquires and
+    releases of callers, a release that pays the debt included, not the
+    permits resize() moves.
+
+    One resize at a time is allowed by a third semaphore, name +
+    '.resize', waited on for at most timeout_ms. A process that crashes
+    while resizing leaves it taken, and later resizes time out.
+
+    Works with AcquireSemaphore like any semaphore::
+
+        with ResizableSemaphore('downstream', limit=8) as resizable:
+            with AcquireSemaphore(resizable, timeout_ms=1000):
+                # Perform work here
+                pass
+            resizable.resize(16)
+    """
+
+    def __init__(self,
+                 name: Optional[str] = None,
+                 limit: int = 1,
+                 ceiling: int = DEFAULT_CEILING,
+                 backend: Union[SemaphoreBackend, str] = None,
+                 ):
+        """
+        :param name: The name shared by every process, None for a semaphore
+            private to this object (default: unnamed)
+        :param limit: The permits in use at first, when this process creates
+            the semaphore (default: 1)
+        :param ceiling: The most the limit can grow to, when this process
+            creates the semaphore (default: 1024)
+        :param backend: The backend instance or name (default: the
+            platform's default backend)
+        """
+        if not 0 <= limit <= ceiling:
+            raise ValueError(f"limit must be from 0 to ceiling ({ceiling}), "
+                             f"not {limit}")
+        self.name = name
+        self.semaphore = Semaphore(name, backend)
+        backend = self.semaphore.backend
+        self._sems = []
+        try:
+            self.semaphore.create(ceiling, limit)
+            self._sems.append(self.semaphore)
+            # Creating a semaphore that exists opens it, so the counts are
+            # those of the process that created it
+            self.reserved = Semaphore(
+                _suffixed(name, RESERVED_SUFFIX), backend).create(
+                    ceiling, ceiling - limit)
+            self._sems.append(self.reserved)
+            self.owed = Semaphore(
+                _suffixed(name, OWED_SUFFIX), backend).create(ceiling, 0)
+            self._sems.append(self.owed)
+            self.resizing = Semaphore(
+                _suffixed(name, RESIZE_SUFFIX), backend).create(1)
+            self._sems.append(self.resizing)
+            self.ceiling = self.semaphore.stats().maximum_count
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self) -> ResizableSemaphore:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def sem(self) -> ResizableSemaphore:
+        # AcquireSemaphore acquires and releases through handle.sem
+        return self
+
+    # Not instrumented, the wrapped Semaphore can be
+    metrics = None
+    tracer = None
+
+    @property
+    def backend(self) -> SemaphoreBackend:
+        return self.semaphore.backend
+
+    @property
+    def limit(self) -> int:
+        """
+        The permits that can be in use once the debt to the reserve is
+        paid, as of the last resize by any process
+        """
+        return (self.ceiling - self.reserved.getvalue()
+                - self.owed.getvalue())
+
+    def acquire(self,
+                timeout_ms: int = None,
+                count: int = 1,
+                spin: bool = False,
+                cancel: CancellationToken = None,
+                ) -> ResizableSemaphore:
+        """
+        Take permits, see Semaphore.acquire()
+        """
+        self.semaphore.acquire(timeout_ms, count, spin, cancel)
+        return self
+
+    def release(self, release_count: int = 1) -> int:
+        """
+        Give permits back, to the reserve first while it's owed any
+
+        :returns: The previous count of the semaphore, 0 if every permit
+            went to the reserve
+        """
+        backend = self.backend
+        paid = 0
+        while paid < release_count and backend.wait(self.owed.hHandle, 0):
+            paid += 1
+        if paid:
+            # Released as far as the semaphore's holders are concerned
+            self.semaphore._record_released(paid)
+            backend.release(self.reserved.hHandle, paid)
+            if paid == release_count:
+                return 0
+        return self.semaphore.release(release_count - paid)
+
+    def getvalue(self) -> int:
+        """
+        The free permits
+        """
+        return self.semaphore.getvalue()
+
+    def resize(self, limit: int, timeout_ms: Optional[int] = 0) -> int:
+        """
+        Change the limit, for every process
+
+        :param limit: The new limit, at most the ceiling
+        :param timeout_ms: How long to wait for a resize by another thread
+            or process to finish, and then for permits in use when
+            shrinking, the rest are owed (default: 0 - don't wait)
+        :raises SemaphoreWaitTimeoutException: Another resize didn't finish
+            within timeout_ms, the limit is unchanged.
+        :raises OSError: A wait or release has failed.
+        :returns: The permits taken into or released from the reserve,
+            negative when shrinking, not counting the ones owed
+        """
+        if not 0 <= limit <= self.ceiling:
+            raise ValueError(f"limit must be from 0 to the ceiling "
+                             f"({self.ceiling}), not {limit}")
+        backend = self.backend
+        deadline = None
+        if timeout_ms is not None:
+            deadline = time.monotonic() + timeout_ms / 1000
+        if not backend.wait(self.resizing.hHandle, timeout_ms):
+            raise SemaphoreWaitTimeoutException()
+        try:
+            delta = limit - self.limit
+            if delta > 0:
+                # Forgive debt first, it was never taken from the semaphore
+                while delta and backend.wait(self.owed.hHandle, 0):
+                    delta -= 1
+                grown = 0
+                while grown < delta and backend.wait(self.reserved.hHandle,
+                                                     0):
+                    grown += 1
+                # Out of the reserve before into the semaphore, a crash in
+                # between loses permits rather than adds some
+                if grown:
+                    backend.release(self.semaphore.hHandle, grown)
+                return grown
+            shrunk = 0
+            while shrunk < -delta:
+                if not backend.wait(self.semaphore.hHandle, 0):
+                    # Wait for permits in use with what's left of the time
+                    if deadline is None:
+                        remaining_ms = None
+                    else:
+                        remaining_ms = int(
+                            (deadline - time.monotonic()) * 1000)
+                        if remaining_ms <= 0:
+                            break
+                    if not backend.wait(self.semaphore.hHandle,
+                                        remaining_ms):
+                        break
+                shrunk += 1
+            if shrunk:
+                backend.release(self.reserved.hHandle, shrunk)
+            if shrunk < -delta:
+                backend.release(self.owed.hHandle, -delta - shrunk)
+            return -shrunk
+        finally:
+            backend.release(self.resizing.hHandle, 1)
+
+    def close(self) -> None:
+        for sem in reversed(self._sems):
+            sem.close()
+        self._sems = []
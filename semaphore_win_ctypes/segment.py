@@ -0,0 +1,206 @@
+"""Small files of int64 slots mapped into every process of a semaphore."""
+from __future__ import annotations
+import errno
+import mmap
+import os
+import sys
+import tempfile
+from typing import Union
+
+from .backend import SemaphoreBackend, get_backend
+
+# A segment starts with a header of (magic, VERSION, number of slots, words
+# per slot), in int64 words, followed by its slots
+VERSION = 1
+HEADER_WORDS = 4
+
+if sys.platform == 'win32':
+    import msvcrt
+
+    def lock_file(fd: int) -> None:
+        # Locks are released by Windows when the process dies
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+
+    def unlock_file(fd: int) -> None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def lock_file(fd: int) -> None:
+        # Locks are released by the kernel when the process dies
+        fcntl.lockf(fd, fcntl.LOCK_EX, 1, 0)
+
+    def unlock_file(fd: int) -> None:
+        fcntl.lockf(fd, fcntl.LOCK_UN, 1, 0)
+
+
+def segment_directory() -> str:
+    """
+    Where segments are kept: /dev/shm where there is one, it never touches
+    a disk, or else the temporary directory
+    """
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def segment_path(name: str, backend: Union[SemaphoreBackend, str],
+                 suffix: str) -> str:
+    """
+    The file of a segment of a named semaphore
+
+    :param name: The name of the semaphore
+    :param backend: The backend instance or name, None for the platform's
+        default backend
+    :param suffix: The kind of segment, such as '.ledger'
+    """
+    backend = get_backend(backend)
+    safe_name = name.replace('/', '_').replace('\\', '_')
+    return os.path.join(segment_directory(),
+                        f'semaphore_win_ctypes-{backend.name}-{safe_name}'
+                        f'{suffix}')
+
+
+def pid_alive(pid: int) -> bool:
+    """
+    Whether a process is still running, True when unsure
+
+    A process that exited but wasn't waited for by its parent still
+    counts as running on POSIX. A pid reused by a new process keeps the
+    permits of the dead one from being reclaimed, never the other way
+    round.
+    """
+    if sys.platform == 'win32':
+        return _win32_pid_alive(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, as another user
+        return True
+    return True
+
+
+def _win32_pid_alive(pid: int) -> bool:
+    from ctypes import byref
+
+    from .constants import ERROR_INVALID_PARAMETER, \
+        PROCESS_QUERY_LIMITED_INFORMATION, STILL_ACTIVE
+    from .kernel32 import DWORD, get_process_kernel32
+
+    kernel32 = get_process_kernel32()
+    process = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION,
+                                   False, pid)
+    if not process:
+        # Anything but "no such process" means it exists
+        return kernel32.GetLastError() != ERROR_INVALID_PARAMETER
+    try:
+        exit_code = DWORD()
+        if not kernel32.GetExitCodeProcess(process, byref(exit_code)):
+            return True
+        return exit_code.value == STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(process)
+
+
+class SharedSegment:
+    """
+    A file of int64 words mapped into this process, words[] indexes the
+    whole file, header included
+
+    The file is created with its header by the first process to open it,
+    under the file lock. lock() and unlock() take the same lock, which the
+    operating system drops if its holder dies.
+    """
+
+    def __init__(self,
+                 path: str,
+                 magic: int,
+                 slots: int,
+                 slot_words: int,
+                 create: bool = True,
+                 ):
+        """
+        :param path: The file
+        :param magic: The first word, telling kinds of segments apart
+        :param slots: The number of slots, when this process creates the
+            file
+        :param slot_words: The words per slot
+        :param create: Create the file if it doesn't exist, or else map it
+            read-only (default: True)
+        :raises FileNotFoundError: create is False and there is no file.
+        :raises OSError: The file could not be opened or mapped, or is not
+            a segment of this kind.
+        """
+        self.path = path
+        if create:
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        else:
+            self.fd = os.open(path, os.O_RDONLY)
+        try:
+            if create:
+                self.lock()
+            try:
+                if create and os.fstat(self.fd).st_size == 0:
+                    words = HEADER_WORDS + slots * slot_words
+                    os.ftruncate(self.fd, words * 8)
+                    header = (magic, VERSION, slots, slot_words)
+                    os.lseek(self.fd, 0, os.SEEK_SET)
+                    os.write(self.fd, b''.join(
+                        word.to_bytes(8, sys.byteorder) for word in header))
+                self.map = mmap.mmap(
+                    self.fd, os.fstat(self.fd).st_size,
+                    access=mmap.ACCESS_WRITE if create else mmap.ACCESS_READ)
+            finally:
+                if create:
+                    self.unlock()
+        except BaseException:
+            os.close(self.fd)
+            raise
+        self.words = memoryview(self.map).cast('q')
+        if (len(self.words) < HEADER_WORDS or self.words[0] != magic
+                or self.words[1] != VERSION or self.words[3] != slot_words):
+            self.close()
+            raise OSError(errno.EINVAL, 'Not a segment of this kind', path)
+        self.slots = self.words[2]
+
+    def lock(self) -> None:
+        lock_file(self.fd)
+
+    def unlock(self) -> None:
+        unlock_file(self.fd)
+
+    def slot_indexes(self) -> range:
+        """
+        The index in words of the first word of each slot
+        """
+        slot_words = self.words[3]
+        return range(HEADER_WORDS, HEADER_WORDS + self.slots * slot_words,
+                     slot_words)
+
+    @property
+    def closed(self) -> bool:
+        return self.map is None
+
+    def close(self) -> None:
+        """
+        Unmap the file, it stays for the next process to use
+        """
+        if self.map is None:
+            return
+        self.words.release()
+        self.map.close()
+        self.map = None
+        os.close(self.fd)
+
+    def unlink(self) -> None:
+        """
+        Remove the file, processes that have it mapped keep using it
+        """
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,829 @@
+"""Semaphore and its context managers."""
+from __future__ import annotations
+import _thread
+import time
+
+from .backend import BACKENDS, SemaphoreBackend, get_backend
+from .constants import INFINITE, SEMAPHORE_ALL_ACCESS
+from .exceptions import SemaphoreWaitCancelledException, \
+    SemaphoreWaitTimeoutException
+
+# ctypes and typing are only needed by type checkers, keep them off the
+# import path
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+    from ctypes.wintypes import DWORD
+    from typing import Any, Callable, List, Optional, Sequence, Tuple, \
+        Union
+
+    from .cancel import CancellationToken
+    from .handoff import SemaphoreHandoff
+    from .ledger import LeaseLedger
+    from .metrics import SemaphoreMetrics
+    from .registry import HandleRegistry
+    from .sharedstats import SharedStats
+    from .spin import AdaptiveSpin
+    from .tracing import SemaphoreTracer
+    from .waiters import WaiterPool
+
+# Guards the lazy creation of Semaphore.gate and Semaphore.spinner. _thread,
+# unlike threading, is built in and costs nothing to import.
+_lazy_lock = _thread.allocate_lock()
+
+# Whether a Semaphore created without metrics=... collects metrics, see
+# metrics.enable_metrics()
+_metrics_enabled = False
+
+# The tracer of every Semaphore created from now on, see
+# tracing.enable_tracing()
+_tracer: Optional[SemaphoreTracer] = None
+
+
+class SemaphoreStats(tuple):
+    """
+    A snapshot of a semaphore's counts, unpacks as (current, maximum)
+    """
+    __slots__ = ()
+
+    def __new__(cls, current_count: int, maximum_count: int):
+        return tuple.__new__(cls, (current_count, maximum_count))
+
+    @property
+    def current_count(self) -> int:
+        return self[0]
+
+    @property
+    def maximum_count(self) -> int:
+        return self[1]
+
+    def __repr__(self) -> str:
+        return (f'SemaphoreStats(current_count={self[0]}, '
+                f'maximum_count={self[1]})')
+
+
+class Semaphore:
+    def __init__(self,
+                 name: str = None,
+                 backend: Union[SemaphoreBackend, str] = None,
+                 metrics: bool = None,
+                 ledger: bool = False,
+                 shared_stats: bool = False,
+                 ):
+        """
+        Initialize Semaphore class
+
+        :param name: A name for the Semaphore (default: unnamed)
+        :param backend: The backend instance or name (default: the
+            platform's default backend, see get_default_backend())
+        :param metrics: Collect metrics in Semaphore.metrics (default: as
+            set by enable_metrics(), off unless it was called)
+        :param ledger: Record the permits this process holds in the
+            semaphore's LeaseLedger, so a LeaseReaper can release them if
+            the process dies (default: False)
+        :param shared_stats: Count acquires, releases and waiters in the
+            semaphore's SharedStats, which every process can read (default:
+            False)
+        """
+        self.name: str = name
+        self.backend: SemaphoreBackend = get_backend(backend)
+        self.hHandle: Any = None
+        # Created on first use by acquire(count=...)
+        self.gate: Any = None
+        # Created on first use by acquire(spin=True)
+        self.spinner: Optional[AdaptiveSpin] = None
+        # Set on first use by acquire_future()
+        self.waiter_pool: Optional[WaiterPool] = None
+        self.metrics: Optional[SemaphoreMetrics] = None
+        if _metrics_enabled if metrics is None else metrics:
+            from .metrics import new_metrics
+            self.metrics = new_metrics(name, self)
+        self.ledger: Optional[LeaseLedger] = None
+        if ledger:
+            from .ledger import open_ledger
+            self.ledger = open_ledger(name, self.backend)
+        self.shared_stats: Optional[SharedStats] = None
+        if shared_stats:
+            from .sharedstats import open_shared_stats
+            self.shared_stats = open_shared_stats(name, self.backend)
+        self.tracer: Optional[SemaphoreTracer] = _tracer
+
+    def create(self,
+               maximum_count: int = 1,
+               initial_count: int = None,
+               desired_access: DWORD = SEMAPHORE_ALL_ACCESS,
+               ) -> Semaphore:
+        """
+        CreateSemaphoreExW
+
+        :param maximum_count: The maximum count of the Semaphore
+            (default: 1)
+        :param initial_count: The initial count of the Semaphore
+            (default: maximum_count)
+        :param desired_access: The access mask for the semaphore object
+            (default: SEMAPHORE_ALL_ACCESS)
+        :raises OSError: The function has failed.
+        :returns: The Semaphore, for chaining calls
+
+        https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-createsemaphoreexw
+        """
+        assert not self.hHandle
+        if initial_count is None:
+            initial_count = maximum_count
+        self.hHandle = self.backend.create(
+            self.name,
+            initial_count,
+            maximum_count,
+            desired_access,
+        )
+        return self
+
+    def open(self,
+             desired_access: DWORD = SEMAPHORE_ALL_ACCESS,
+             inherit: bool = True,
+             ) -> Semaphore:
+        """
+        OpenSemaphoreW
+
+        :param desired_access: The access mask for the semaphore object
+            (default: SEMAPHORE_ALL_ACCESS)
+        :param inherit: If this value is TRUE, processes created by this
+            process will inherit the handle.
+        :raises OSError: The function has failed.
+        :returns: The Semaphore, for chaining calls
+
+        https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-opensemaphorew
+        """
+        assert not self.hHandle
+        assert self.name is not None
+        self.hHandle = self.backend.open(
+            self.name,
+            desired_access,
+            inherit,
+        )
+        return self
+
+    def acquire(self,
+                timeout_ms: int = None,
+                count: int = 1,
+                spin: bool = False,
+                cancel: CancellationToken = None,
+                ) -> Semaphore:
+        """
+        WaitForSingleObject
+        :param timeout_ms: The time-out interval, in milliseconds. (default:
+            None - infinite wait)
+        :param count: The number of permits to take, all of them or none
+            (default: 1)
+        :param spin: Retry without blocking for a while before blocking,
+            for semaphores held only briefly, see AdaptiveSpin. Ignored
+            when count is not 1. (default: False)
+        :param cancel: A CancellationToken that ends the wait when it's
+            cancelled, waited on together with the semaphore (default: not
+            cancellable)
+        :raises SemaphoreWaitTimeoutException: The time-out interval elapsed,
+            and the object's state is nonsignaled.
+        :raises SemaphoreWaitCancelledException: The token was cancelled
+            before the semaphore was acquired.
+        :raises ValueError: count is more than the maximum count.
+        :raises OSError: The function has failed.
+        :returns: The Semaphore, for chaining calls
+
+        Taking more than one permit goes through the semaphore's gate, so
+        only one such acquire at a time collects permits, see
+        SemaphoreBackend.wait_count().
+
+        https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-waitforsingleobject
+        """
+        assert timeout_ms != INFINITE, \
+            "Use None to specify an infinite timeout"
+        if self.metrics is None and self.shared_stats is None \
+                and self.tracer is None:
+            acquired = self._wait(timeout_ms, count, spin, cancel)
+        else:
+            acquired = self._wait_recorded(timeout_ms, count, spin, cancel)
+        if not acquired:
+            if acquired is None:
+                raise SemaphoreWaitCancelledException()
+            raise SemaphoreWaitTimeoutException()
+        if self.ledger is not None:
+            self.ledger.record_acquire(count)
+        return self
+
+    def _wait_recorded(self,
+                       timeout_ms: Optional[int],
+                       count: int,
+                       spin: bool,
+                       cancel: Optional[CancellationToken],
+                       ) -> Optional[bool]:
+        # _wait(), counted in the metrics and shared stats, and traced
+        metrics = self.metrics
+        shared_stats = self.shared_stats
+        tracer = self.tracer
+        start = time.perf_counter_ns()
+        if shared_stats is not None:
+            started = shared_stats.begin_wait()
+        try:
+            acquired = self._wait(timeout_ms, count, spin, cancel)
+        except BaseException as exc:
+            failed = isinstance(exc, OSError)
+            if metrics is not None and failed:
+                metrics.record_failure()
+            if shared_stats is not None:
+                shared_stats.abandon_wait(started, failed)
+            if tracer is not None:
+                tracer.record_abandoned(self, start, time.perf_counter_ns(),
+                                        failed, count)
+            raise
+        end = time.perf_counter_ns()
+        if metrics is not None:
+            metrics.record_wait(end - start, acquired, count)
+        if shared_stats is not None:
+            shared_stats.end_wait(started, acquired, count)
+        if tracer is not None:
+            tracer.record_wait(self, start, end, acquired, count)
+        return acquired
+
+    def _wait(self,
+              timeout_ms: Optional[int],
+              count: int,
+              spin: bool,
+              cancel: Optional[CancellationToken] = None,
+              ) -> Optional[bool]:
+        # True when acquired, False on time-out, None when cancelled
+        event = None
+        if cancel is not None:
+            if cancel.cancelled:
+                return None
+            if timeout_ms != 0:
+                event = cancel.event(self.backend)
+        if count == 1:
+            if spin:
+                return self.get_spinner().wait(self.backend, self.hHandle,
+                                               timeout_ms, event)
+            if event is not None:
+                return self.backend.wait_cancellable(self.hHandle, event,
+                                                     timeout_ms)
+            return self.backend.wait(self.hHandle, timeout_ms)
+        else:
+            if count < 1:
+                raise ValueError(f"count must be at least 1, not {count}")
+            if self.gate is None:
+                with _lazy_lock:
+                    if self.gate is None:
+                        self.gate = self.backend.create_gate(self.name)
+            return self.backend.wait_count(self.hHandle, self.gate,
+                                           count, timeout_ms, event)
+
+    def get_spinner(self) -> AdaptiveSpin:
+        """
+        The spin budget used by acquire(spin=True), created on first use
+        """
+        if self.spinner is None:
+            from .spin import AdaptiveSpin
+            with _lazy_lock:
+                if self.spinner is None:
+                    self.spinner = AdaptiveSpin()
+        return self.spinner
+
+    async def acquire_async(self, timeout_ms: int = None) -> Semaphore:
+        """
+        Like acquire(), without blocking the running event loop
+        :param timeout_ms: The time-out interval, in milliseconds. (default:
+            None - infinite wait)
+        :raises SemaphoreWaitTimeoutException: The time-out interval elapsed,
+            and the object's state is nonsignaled.
+        :raises OSError: The function has failed.
+        :returns: The Semaphore, for chaining calls
+
+        If the awaiting task is cancelled, the semaphore is left as it was:
+        a permit taken after the cancellation is released again.
+        """
+        assert timeout_ms != INFINITE, \
+            "Use None to specify an infinite timeout"
+        metrics = self.metrics
+        shared_stats = self.shared_stats
+        tracer = self.tracer
+        if metrics is None and shared_stats is None and tracer is None:
+            acquired = await self.backend.wait_async(self.hHandle, timeout_ms)
+        else:
+            start = time.perf_counter_ns()
+            if shared_stats is not None:
+                started = shared_stats.begin_wait()
+            try:
+                acquired = await self.backend.wait_async(self.hHandle,
+                                                         timeout_ms)
+            except BaseException as exc:
+                failed = isinstance(exc, OSError)
+                if metrics is not None and failed:
+                    metrics.record_failure()
+                if shared_stats is not None:
+                    shared_stats.abandon_wait(started, failed)
+                if tracer is not None:
+                    # Including the task being cancelled
+                    tracer.record_abandoned(self, start,
+                                            time.perf_counter_ns(), failed)
+                raise
+            end = time.perf_counter_ns()
+            if metrics is not None:
+                metrics.record_wait(end - start, acquired)
+            if shared_stats is not None:
+                shared_stats.end_wait(started, acquired)
+            if tracer is not None:
+                tracer.record_wait(self, start, end, acquired)
+        if not acquired:
+            raise SemaphoreWaitTimeoutException()
+        if self.ledger is not None:
+            self.ledger.record_acquire()
+        return self
+
+    def acquire_future(self, timeout_ms: int = None) -> Future:
+        """
+        Like acquire(), on one of a few waiter threads shared by every
+        semaphore of the backend, see WaiterPool
+        :param timeout_ms: The time-out interval, in milliseconds. (default:
+            None - infinite wait)
+        :returns: A concurrent.futures.Future of the Semaphore, which raises
+            SemaphoreWaitTimeoutException when the time-out interval elapsed
+            and OSError when the wait failed
+
+        Cancelling the Future ends the wait, and a permit taken in the
+        meantime is released again. close() cancels the pending waits.
+        """
+        assert timeout_ms != INFINITE, \
+            "Use None to specify an infinite timeout"
+        if self.waiter_pool is None:
+            from .waiters import get_waiter_pool
+            self.waiter_pool = get_waiter_pool(self.backend)
+        record = None
+        if self.metrics is not None or self.shared_stats is not None \
+                or self.ledger is not None or self.tracer is not None:
+            record = self._future_recorder()
+        return self.waiter_pool.submit(self.hHandle, timeout_ms, self, record)
+
+    def _future_recorder(self) -> Callable[..., None]:
+        # What acquire() records, for a wait that completes on a waiter
+        # thread, see waiters.Recorder
+        metrics = self.metrics
+        shared_stats = self.shared_stats
+        ledger = self.ledger
+        tracer = self.tracer
+        if tracer is not None:
+            # The wait and the hold belong to the thread that asked
+            thread = tracer.current_thread()
+        start = time.perf_counter_ns()
+        if shared_stats is not None:
+            started = shared_stats.begin_wait()
+
+        def record(acquired: Optional[bool], failed: bool = False) -> None:
+            if failed:
+                if metrics is not None:
+                    metrics.record_failure()
+                if shared_stats is not None:
+                    shared_stats.abandon_wait(started, True)
+                if tracer is not None:
+                    tracer.record_abandoned(self, start,
+                                            time.perf_counter_ns(), True,
+                                            thread=thread)
+                return
+            end = time.perf_counter_ns()
+            if metrics is not None:
+                metrics.record_wait(end - start, acquired)
+            if shared_stats is not None:
+                shared_stats.end_wait(started, acquired)
+            if tracer is not None:
+                tracer.record_wait(self, start, end, acquired, thread=thread)
+            if acquired and ledger is not None:
+                ledger.record_acquire()
+        return record
+
+    def _record_taken(self, count: int = 1, start_ns: int = None) -> None:
+        # Record permits taken straight from the backend, by wait_any(),
+        # wait_all() and the wrappers, as acquire() would: release() counts
+        # and forgets them. start_ns is perf_counter_ns() before the wait,
+        # None for a wait that didn't block.
+        if self.ledger is not None:
+            self.ledger.record_acquire(count)
+        metrics = self.metrics
+        shared_stats = self.shared_stats
+        tracer = self.tracer
+        if metrics is None and shared_stats is None and tracer is None:
+            return
+        end = time.perf_counter_ns()
+        if start_ns is None:
+            start_ns = end
+        if metrics is not None:
+            metrics.record_wait(end - start_ns, True, count)
+        if shared_stats is not None:
+            shared_stats.record_acquire(count)
+        if tracer is not None:
+            tracer.record_wait(self, start_ns, end, True, count)
+
+    def _record_released(self, count: int = 1) -> None:
+        # Record permits given back other than by release(), as release()
+        # would. Called before they're given back when the semaphore has a
+        # ledger, a reaper must never release them again.
+        if self.ledger is not None:
+            self.ledger.record_release(count)
+        if self.metrics is not None:
+            self.metrics.record_release(count)
+        if self.shared_stats is not None:
+            self.shared_stats.record_release(count)
+        if self.tracer is not None:
+            self.tracer.record_release(self, time.perf_counter_ns(), count)
+
+    def release(self, release_count: int = 1) -> int:
+        """
+        ReleaseSemaphore
+        :param release_count: The amount to increase the semaphore's counter
+        :returns: The previous count
+        :raises OSError: When release() fails.
+
+        https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-releasesemaphore
+        """
+        if self.ledger is not None:
+            # Forgotten first, a reaper must never release it again
+            self.ledger.record_release(release_count)
+        metrics = self.metrics
+        shared_stats = self.shared_stats
+        tracer = self.tracer
+        if metrics is None and shared_stats is None and tracer is None:
+            return self.backend.release(self.hHandle, release_count)
+        try:
+            previous_count = self.backend.release(self.hHandle, release_count)
+        except OSError:
+            if metrics is not None:
+                metrics.record_failure()
+            if shared_stats is not None:
+                shared_stats.record_failure()
+            if tracer is not None:
+                tracer.record_release(self, time.perf_counter_ns(),
+                                      release_count, True)
+            raise
+        if metrics is not None:
+            metrics.record_release(release_count)
+        if shared_stats is not None:
+            shared_stats.record_release(release_count)
+        if tracer is not None:
+            tracer.record_release(self, time.perf_counter_ns(),
+                                  release_count)
+        return previous_count
+
+    def close(self) -> None:
+        """
+        CloseHandle
+        :raises OSError: When close() fails.
+
+        https://docs.microsoft.com/en-us/windows/win32/api/handleapi/nf-handleapi-closehandle
+        """
+        if self.waiter_pool is not None:
+            # No waiter thread may use the handle once it's closed
+            self.waiter_pool.cancel(self.hHandle)
+        self.backend.close(self.hHandle)
+        self.hHandle = None
+        if self.gate is not None:
+            gate, self.gate = self.gate, None
+            self.backend.close(gate)
+        if self.metrics is not None:
+            # Still readable, but only counted in get_metrics() totals once
+            from .metrics import retire_metrics
+            retire_metrics(self.metrics)
+        if self.ledger is not None:
+            self.ledger.close()
+        if self.shared_stats is not None:
+            self.shared_stats.close()
+
+    def getvalue(self) -> int:
+        """
+        The current count, read without acquiring the semaphore
+        :raises OSError: The handle lacks SEMAPHORE_QUERY_STATE access.
+        :returns: The count, which may change as soon as it's read
+
+        NtQuerySemaphore on Windows, sem_getvalue on POSIX.
+        """
+        assert self.hHandle is not None
+        return self.backend.query(self.hHandle)[0]
+
+    def stats(self) -> SemaphoreStats:
+        """
+        The current and maximum count, in one query
+        :raises OSError: The handle lacks SEMAPHORE_QUERY_STATE access.
+        :returns: A SemaphoreStats
+        """
+        assert self.hHandle is not None
+        return SemaphoreStats(*self.backend.query(self.hHandle))
+
+    def _check_shareable(self) -> None:
+        if self.hHandle is None:
+            raise TypeError("Only an open Semaphore can be shared with "
+                            "another process")
+        name = self.backend.name
+        if name not in BACKENDS or get_backend(name) is not self.backend:
+            raise TypeError(f"A semaphore of an unregistered backend "
+                            f"instance ({self.backend!r}) can't be shared "
+                            f"with another process")
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        """
+        Pickle the semaphore for another process, named or not
+
+        multiprocessing can pass the Semaphore to a Process or a Pool, or
+        through a Queue. The handle is duplicated into the other process on
+        Windows, the eventfd backend's descriptors are passed with it, and
+        the posix backend's semaphore is opened there by name, see
+        SemaphoreBackend.share(). Metrics, ledger and shared stats are
+        those of the other process.
+
+        :raises TypeError: The semaphore is closed, unnamed on the posix
+            backend, or of a backend instance get_backend() doesn't return.
+        """
+        self._check_shareable()
+        return _adopt, (self.name, self.backend.name,
+                        self.backend.share(self.hHandle, self.name),
+                        self.metrics is not None, self.ledger is not None,
+                        self.shared_stats is not None)
+
+    def handoff(self) -> SemaphoreHandoff:
+        """
+        The semaphore made ready for a child started by subprocess
+
+        :raises TypeError: The semaphore can't be shared with another
+            process, see __reduce__().
+        :raises OSError: The handle could not be duplicated.
+        :returns: A SemaphoreHandoff, whose token from_handoff() turns back
+            into a Semaphore in the child
+        """
+        from .handoff import SemaphoreHandoff
+        if self.hHandle is None:
+            raise TypeError("Only an open Semaphore can be shared with "
+                            "another process")
+        return SemaphoreHandoff(self)
+
+    @classmethod
+    def from_handoff(cls,
+                     token: str,
+                     backend: Union[SemaphoreBackend, str] = None,
+                     ) -> Semaphore:
+        """
+        The semaphore handed to this process, see handoff()
+
+        :param token: SemaphoreHandoff.token, from the parent
+        :param backend: The backend instance or name (default: the backend
+            named in the token)
+        :raises OSError: The semaphore could not be opened.
+        :returns: An open Semaphore
+        """
+        from .handoff import parse_token
+        name, backend_name, shared = parse_token(token)
+        sem = cls(name, backend_name if backend is None else backend)
+        sem.hHandle = sem.backend.adopt(shared)
+        return sem
+
+
+def _adopt(name: Optional[str],
+           backend_name: str,
+           shared: Any,
+           metrics: bool,
+           ledger: bool,
+           shared_stats: bool,
+           ) -> Semaphore:
+    # Unpickles a Semaphore, see Semaphore.__reduce__()
+    sem = Semaphore(name, backend_name, metrics, ledger, shared_stats)
+    sem.hHandle = sem.backend.adopt(shared)
+    return sem
+
+
+class CreateSemaphore:
+    def __init__(self,
+                 name: str = None,
+                 maximum_count: int = 1,
+                 initial_count: int = None,
+                 desired_access: DWORD = SEMAPHORE_ALL_ACCESS,
+                 backend: Union[SemaphoreBackend, str] = None,
+                 metrics: bool = None,
+                 ledger: bool = False,
+                 shared_stats: bool = False,
+                 ):
+        self.sem = Semaphore(name, backend, metrics, ledger, shared_stats)
+        self.sem.create(maximum_count, initial_count, desired_access)
+
+    def __enter__(self) -> CreateSemaphore:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.sem.close()
+
+    def getvalue(self) -> int:
+        return self.sem.getvalue()
+
+
+class OpenSemaphore:
+    def __init__(self,
+                 name: str = None,
+                 desired_access: DWORD = SEMAPHORE_ALL_ACCESS,
+                 inherit: bool = True,
+                 backend: Union[SemaphoreBackend, str] = None,
+                 registry: Union[HandleRegistry, bool] = None,
+                 metrics: bool = None,
+                 ledger: bool = False,
+                 shared_stats: bool = False,
+                 ):
+        """
+        :param registry: Share a cached handle from a HandleRegistry
+            instead of opening and closing one, True for the process-wide
+            registry (default: no registry)
+        :param metrics: Collect metrics, see Semaphore. A registry shares
+            a handle only with those opened with the same setting.
+        :param ledger: Record held permits in a LeaseLedger, see Semaphore.
+            Not available with a registry.
+        :param shared_stats: Count in the semaphore's SharedStats, see
+            Semaphore. Not available with a registry.
+        """
+        if registry is True:
+            from .registry import get_registry
+            registry = get_registry()
+        elif registry is False:
+            registry = None
+        self.registry: Optional[HandleRegistry] = registry
+        if self.registry is not None:
+            if ledger or shared_stats:
+                raise ValueError("A shared handle can't have a ledger or "
+                                 "shared stats")
+            self.sem = self.registry.open(name, desired_access, inherit,
+                                          backend, metrics)
+        else:
+            self.sem = Semaphore(name, backend, metrics, ledger,
+                                 shared_stats)
+            self.sem.open(desired_access, inherit)
+
+    def __enter__(self) -> OpenSemaphore:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.registry is not None:
+            self.registry.close(self.sem)
+        else:
+            self.sem.close()
+
+    def getvalue(self) -> int:
+        return self.sem.getvalue()
+
+
+class AcquireSemaphore:
+    def __init__(self,
+                 handle: Union[CreateSemaphore, OpenSemaphore],
+                 timeout_ms: int = None,
+                 count: int = 1,
+                 spin: bool = False,
+                 cancel: CancellationToken = None,
+                 priority: int = None,
+                 ):
+        """
+        :param spin: Spin before blocking, see Semaphore.acquire(). How long
+            the with block holds the semaphore tunes the spin budget.
+        :param cancel: A CancellationToken that ends the wait, see
+            Semaphore.acquire()
+        :param priority: The priority to wait with, for a PrioritySemaphore
+        """
+        self.handle = handle
+        self.timeout_ms = timeout_ms
+        self.count = count
+        self.spin = spin
+        self.cancel = cancel
+        self.priority = priority
+        self.acquired_ns = 0
+
+    def __enter__(self) -> AcquireSemaphore:
+        sem = self.handle.sem
+        if self.cancel is None and self.priority is None:
+            sem.acquire(self.timeout_ms, self.count, self.spin)
+        else:
+            # Only passed when given, not every acquire() takes them
+            options = {}
+            if self.cancel is not None:
+                options['cancel'] = self.cancel
+            if self.priority is not None:
+                options['priority'] = self.priority
+            sem.acquire(self.timeout_ms, self.count, self.spin, **options)
+        if self.spin or sem.metrics is not None:
+            self.acquired_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        sem = self.handle.sem
+        if self.spin or sem.metrics is not None:
+            hold_ns = time.perf_counter_ns() - self.acquired_ns
+            if self.spin:
+                sem.get_spinner().record_hold(hold_ns)
+            if sem.metrics is not None:
+                sem.metrics.record_hold(hold_ns)
+        if exc_type is not None and sem.tracer is not None:
+            # The hold ends with the exception that left the with block
+            sem.tracer.set_hold_outcome(sem, exc_type.__name__)
+        sem.release(self.count)
+
+    def getvalue(self) -> int:
+        return self.handle.getvalue()
+
+
+class AsyncAcquireSemaphore:
+    def __init__(self,
+                 handle: Union[CreateSemaphore, OpenSemaphore],
+                 timeout_ms: int = None
+                 ):
+        self.handle = handle
+        self.timeout_ms = timeout_ms
+        self.acquired_ns = 0
+
+    async def __aenter__(self) -> AsyncAcquireSemaphore:
+        sem = self.handle.sem
+        await sem.acquire_async(self.timeout_ms)
+        if sem.metrics is not None:
+            self.acquired_ns = time.perf_counter_ns()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        sem = self.handle.sem
+        if sem.metrics is not None:
+            sem.metrics.record_hold(time.perf_counter_ns() - self.acquired_ns)
+        if exc_type is not None and sem.tracer is not None:
+            sem.tracer.set_hold_outcome(sem, exc_type.__name__)
+        sem.release()
+
+    def getvalue(self) -> int:
+        return self.handle.getvalue()
+
+
+def _semaphores(semaphores: Sequence[Any]) -> List[Semaphore]:
+    # Accept CreateSemaphore and OpenSemaphore as well as Semaphore
+    sems = [getattr(semaphore, 'sem', semaphore) for semaphore in semaphores]
+    if not sems:
+        raise ValueError("No semaphores to wait on")
+    backend = sems[0].backend
+    if any(sem.backend is not backend for sem in sems):
+        raise ValueError("The semaphores must share one backend")
+    return sems
+
+
+def wait_any(semaphores: Sequence[Union[Semaphore, CreateSemaphore,
+                                        OpenSemaphore]],
+             timeout_ms: int = None,
+             ) -> Union[Semaphore, CreateSemaphore, OpenSemaphore]:
+    """
+    WaitForMultipleObjects, acquiring whichever semaphore is available first
+
+    :param semaphores: The semaphores, all from the same backend (at most
+        MAXIMUM_WAIT_OBJECTS on Windows)
+    :param timeout_ms: The time-out interval, in milliseconds. (default:
+        None - infinite wait)
+    :raises SemaphoreWaitTimeoutException: The time-out interval elapsed,
+        and no semaphore was acquired.
+    :raises OSError: The function has failed.
+    :returns: The acquired semaphore, as passed in
+
+    https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-waitformultipleobjects
+    """
+    assert timeout_ms != INFINITE, \
+        "Use None to specify an infinite timeout"
+    sems = _semaphores(semaphores)
+    start = time.perf_counter_ns()
+    index = sems[0].backend.wait_any([sem.hHandle for sem in sems],
+                                     timeout_ms)
+    if index is None:
+        raise SemaphoreWaitTimeoutException()
+    sems[index]._record_taken(1, start)
+    return semaphores[index]
+
+
+def wait_all(semaphores: Sequence[Union[Semaphore, CreateSemaphore,
+                                        OpenSemaphore]],
+             timeout_ms: int = None,
+             ) -> List[Union[Semaphore, CreateSemaphore, OpenSemaphore]]:
+    """
+    WaitForMultipleObjects, acquiring every semaphore or none of them
+
+    On Windows all permits are taken in one atomic step. Other backends
+    never wait while holding a permit, and give back what they took if they
+    can't take everything.
+
+    :param semaphores: The semaphores, all from the same backend (at most
+        MAXIMUM_WAIT_OBJECTS on Windows)
+    :param timeout_ms: The time-out interval, in milliseconds. (default:
+        None - infinite wait)
+    :raises SemaphoreWaitTimeoutException: The time-out interval elapsed,
+        and no semaphore was acquired.
+    :raises OSError: The function has failed.
+    :returns: The acquired semaphores, as passed in
+
+    https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-waitformultipleobjects
+    """
+    assert timeout_ms != INFINITE, \
+        "Use None to specify an infinite timeout"
+    sems = _semaphores(semaphores)
+    start = time.perf_counter_ns()
+    if not sems[0].backend.wait_all([sem.hHandle for sem in sems],
+                                    timeout_ms):
+        raise SemaphoreWaitTimeoutException()
+    for sem in sems:
+        sem._record_taken(1, start)
+    return list(semaphores)
@@ -0,0 +1,239 @@
+"""Many named semaphores, created, opened and closed together."""
+from __future__ import annotations
+import concurrent.futures
+from array import array
+from typing import Any, Callable, Dict, Iterable, Iterator, List, \
+    Optional, Sequence, Tuple, Union
+
+from .backend import SemaphoreBackend, get_backend
+from .constants import INFINITE, SEMAPHORE_ALL_ACCESS
+from .exceptions import SemaphoreWaitTimeoutException
+
+# ctypes is only needed by type checkers, keep it off the import path
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from ctypes.wintypes import DWORD
+
+
+class SemaphoreSet:
+    """
+    Named semaphores created or opened in one call, and closed in one pass
+
+    Rather than a Semaphore per name, the set keeps the names in a tuple,
+    their indexes in a dict, and the handles in an array('Q') when the
+    backend's handles are integers, as Windows HANDLEs are. Other backends'
+    handles are objects, kept in a list. snapshot() reads every count into
+    one array('q')::
+
+        names = [f'tenant-{index}' for index in range(500)]
+        with SemaphoreSet(names).open(workers=8) as semaphores:
+            semaphores.acquire('tenant-42', timeout_ms=100)
+            semaphores.release('tenant-42')
+            counts = semaphores.snapshot()
+
+    Creating or opening is all or nothing: when a name fails, the handles
+    already open are closed, and the error is raised.
+    """
+    __slots__ = ('names', 'backend', '_handles', '_indexes')
+
+    def __init__(self,
+                 names: Iterable[str],
+                 backend: Union[SemaphoreBackend, str] = None,
+                 ):
+        """
+        :param names: The names of the semaphores, each once
+        :param backend: The backend instance or name (default: the
+            platform's default backend)
+        """
+        self.names: Tuple[str, ...] = tuple(names)
+        self.backend: SemaphoreBackend = get_backend(backend)
+        self._indexes: Dict[str, int] = {
+            name: index for index, name in enumerate(self.names)}
+        if len(self._indexes) != len(self.names):
+            raise ValueError("The names of a SemaphoreSet must be unique")
+        self._handles: Optional[Sequence[Any]] = None
+
+    def __enter__(self) -> SemaphoreSet:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._indexes
+
+    @property
+    def closed(self) -> bool:
+        return self._handles is None
+
+    def create(self,
+               maximum_count: int = 1,
+               initial_count: int = None,
+               desired_access: DWORD = SEMAPHORE_ALL_ACCESS,
+               workers: int = None,
+               ) -> SemaphoreSet:
+        """
+        CreateSemaphoreExW for every name, see Semaphore.create()
+
+        :param workers: Threads to spread the calls over, None or 1 to make
+            them one by one (default: None)
+        :raises OSError: A semaphore could not be created.
+        :returns: The SemaphoreSet, for chaining calls
+        """
+        if initial_count is None:
+            initial_count = maximum_count
+        create = self.backend.create
+        return self._open_all(
+            lambda name: create(name, initial_count, maximum_count,
+                                desired_access),
+            workers)
+
+    def open(self,
+             desired_access: DWORD = SEMAPHORE_ALL_ACCESS,
+             inherit: bool = True,
+             workers: int = None,
+             ) -> SemaphoreSet:
+        """
+        OpenSemaphoreW for every name, see Semaphore.open()
+
+        :param workers: Threads to spread the calls over, None or 1 to make
+            them one by one (default: None)
+        :raises OSError: A semaphore could not be opened.
+        :returns: The SemaphoreSet, for chaining calls
+        """
+        open_semaphore = self.backend.open
+        return self._open_all(
+            lambda name: open_semaphore(name, desired_access, inherit),
+            workers)
+
+    def _open_all(self, function: Callable[[str], Any],
+                  workers: Optional[int]) -> SemaphoreSet:
+        assert self._handles is None
+        handles: List[Any] = []
+        error: Optional[BaseException] = None
+        if workers is None or workers <= 1:
+            try:
+                for name in self.names:
+                    handles.append(function(name))
+            except BaseException as exc:
+                error = exc
+        else:
+            with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+                futures = [executor.submit(function, name)
+                           for name in self.names]
+            # Every call has returned, keep what was opened so a failure
+            # can close it
+            for future in futures:
+                exc = future.exception()
+                if exc is None:
+                    handles.append(future.result())
+                elif error is None:
+                    error = exc
+        if error is not None:
+            try:
+                self._close_handles(handles)
+            except OSError:
+                # The error that stopped the opening is the one to report
+                pass
+            raise error
+        try:
+            self._handles = array('Q', handles)
+        except TypeError:
+            # Not integers
+            self._handles = handles
+        return self
+
+    def handle(self, name: str) -> Any:
+        """
+        The handle of a semaphore, owned by the set
+
+        :raises KeyError: The name is not in the set.
+        """
+        assert self._handles is not None
+        return self._handles[self._indexes[name]]
+
+    def acquire(self, name: str, timeout_ms: int = None) -> SemaphoreSet:
+        """
+        WaitForSingleObject on one semaphore, see Semaphore.acquire()
+
+        :raises SemaphoreWaitTimeoutException: The time-out interval elapsed,
+            and the object's state is nonsignaled.
+        :raises KeyError: The name is not in the set.
+        :raises OSError: The function has failed.
+        :returns: The SemaphoreSet, for chaining calls
+        """
+        assert timeout_ms != INFINITE, \
+            "Use None to specify an infinite timeout"
+        if not self.backend.wait(self.handle(name), timeout_ms):
+            raise SemaphoreWaitTimeoutException()
+        return self
+
+    def release(self, name: str, release_count: int = 1) -> int:
+        """
+        ReleaseSemaphore on one semaphore, see Semaphore.release()
+
+        :raises KeyError: The name is not in the set.
+        :raises OSError: When release() fails.
+        :returns: The previous count
+        """
+        return self.backend.release(self.handle(name), release_count)
+
+    def getvalue(self, name: str) -> int:
+        """
+        The current count of one semaphore, see Semaphore.getvalue()
+        """
+        return self.backend.query(self.handle(name))[0]
+
+    def snapshot(self, counts: array = None) -> array:
+        """
+        The current count of every semaphore, in the order of names
+
+        :param counts: An array('q') as long as the set to read the counts
+            into, to reuse it between snapshots (default: a new one)
+        :raises OSError: A handle lacks SEMAPHORE_QUERY_STATE access.
+        :returns: counts, each of which may change as soon as it's read
+        """
+        assert self._handles is not None
+        if counts is None:
+            counts = array('q', bytes(8 * len(self.names)))
+        self.backend.query_counts(self._handles, counts)
+        return counts
+
+    def as_dict(self) -> Dict[str, int]:
+        """
+        The current count of every semaphore, by name
+        """
+        return dict(zip(self.names, self.snapshot()))
+
+    def close(self) -> None:
+        """
+        Close every handle, in one pass
+
+        :raises OSError: A handle could not be closed, the first such error
+            once the others are closed.
+        """
+        handles, self._handles = self._handles, None
+        if handles is not None:
+            self._close_handles(handles)
+
+    def _close_handles(self, handles: Sequence[Any]) -> None:
+        close = self.backend.close
+        error = None
+        for handle in handles:
+            try:
+                close(handle)
+            except OSError as exc:
+                if error is None:
+                    error = exc
+        if error is not None:
+            raise error
+
+    def __repr__(self) -> str:
+        return (f'<SemaphoreSet {len(self.names)} semaphores '
+                f'backend={self.backend.name!r} closed={self.closed}>')
@@ -0,0 +1,254 @@
+"""A semaphore whose permits are split across several kernel objects."""
+from __future__ import annotations
+import os
+import threading
+import time
+from typing import List, Optional, Tuple, Union
+
+from .backend import CANCEL_SLICE_MS, SemaphoreBackend, get_backend, \
+    is_too_many_posts
+from .cancel import CancellationToken
+from .constants import MAXIMUM_WAIT_OBJECTS
+from .exceptions import SemaphoreWaitCancelledException, \
+    SemaphoreWaitTimeoutException
+from .semaphore import Semaphore
+
+# Separates the name of a ShardedSemaphore from the index of a shard
+SHARD_SEPARATOR = '#'
+
+DEFAULT_SHARDS = 4
+
+
+def shard_name(name: Optional[str], index: int) -> Optional[str]:
+    """
+    The name of a shard, name + '#' + index, None for an unnamed semaphore
+    """
+    return None if name is None else f'{name}{SHARD_SEPARATOR}{index}'
+
+
+class ShardedSemaphore:
+    """
+    total permits split across shards semaphores, name + '#0' to name +
+    '#K-1', so that processes acquiring and releasing at high rates don't
+    all contend on one kernel object
+
+    Each thread has a home shard, picked from its process and thread ids.
+    acquire() tries the home shard without waiting, then steals from the
+    other shards without waiting, and only then waits on every shard at once
+    with wait_any(). A permit is released to the shard it was taken from
+    when the releasing thread took it, and otherwise to its home shard, or
+    the next shard with room. A shard never holds more than its share, so
+    the free permits of every shard never add up to more than total.
+
+    Every process must use the same total and shards. Like a semaphore
+    created by CreateSemaphore, the shards of a name that exists are
+    opened, and keep their maximum counts::
+
+        with ShardedSemaphore('downstream', total=256, shards=8) as sem:
+            with AcquireSemaphore(sem, timeout_ms=1000):
+                # Perform work here
+                pass
+    """
+
+    def __init__(self,
+                 name: Optional[str] = None,
+                 total: int = 1,
+                 shards: int = DEFAULT_SHARDS,
+                 backend: Union[SemaphoreBackend, str] = None,
+                 ):
+        """
+        :param name: The name shared by every process, None for a semaphore
+            private to this object (default: unnamed)
+        :param total: The permits, all available at first (default: 1)
+        :param shards: The number of semaphores to split them across, at
+            most total and MAXIMUM_WAIT_OBJECTS (default: 4)
+        :param backend: The backend instance or name (default: the
+            platform's default backend)
+        :raises OSError: A shard could not be created.
+        """
+        if not 1 <= shards <= min(total, MAXIMUM_WAIT_OBJECTS):
+            raise ValueError(f"shards must be from 1 to total ({total}) "
+                             f"and {MAXIMUM_WAIT_OBJECTS}, not {shards}")
+        self.name = name
+        self.shards: List[Semaphore] = []
+        backend = get_backend(backend)
+        try:
+            for index in range(shards):
+                # The first total % shards shards take one more permit
+                share = total // shards + (index < total % shards)
+                self.shards.append(Semaphore(shard_name(name, index),
+                                             backend).create(share))
+            self.total = sum(shard.stats().maximum_count
+                             for shard in self.shards)
+        except BaseException:
+            self.close()
+            raise
+        self._handles = [shard.hHandle for shard in self.shards]
+        # Each thread's home shard, and the shards of its permits, newest
+        # last
+        self._local = threading.local()
+
+    def __enter__(self) -> ShardedSemaphore:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def sem(self) -> ShardedSemaphore:
+        # AcquireSemaphore acquires and releases through handle.sem
+        return self
+
+    # Not instrumented itself, each shard records the permits taken from
+    # and given back to it
+    metrics = None
+    tracer = None
+
+    @property
+    def backend(self) -> SemaphoreBackend:
+        return self.shards[0].backend
+
+    @property
+    def home(self) -> int:
+        """
+        The index of the calling thread's home shard
+        """
+        return self._thread_state()[0]
+
+    def _thread_state(self) -> Tuple[int, List[int]]:
+        # The calling thread's home shard and taken shards
+        local = self._local
+        try:
+            return local.home, local.taken
+        except AttributeError:
+            # Thread ids are addresses, aligned, hashing spreads them
+            local.home = hash(
+                (os.getpid(), threading.get_ident())) % len(self.shards)
+            local.taken = []
+            return local.home, local.taken
+
+    def acquire(self,
+                timeout_ms: int = None,
+                count: int = 1,
+                spin: bool = False,
+                cancel: CancellationToken = None,
+                ) -> ShardedSemaphore:
+        """
+        Take a permit from the home shard, another shard, or whichever shard
+        has one first, see Semaphore.acquire()
+
+        spin is ignored, the steal is what spinning would do.
+        """
+        if count != 1:
+            raise ValueError(f"ShardedSemaphore takes one permit at a time, "
+                             f"not {count}")
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        backend = self.backend
+        handles = self._handles
+        home, taken = self._thread_state()
+        if backend.wait(handles[home], 0):
+            self.shards[home]._record_taken()
+            taken.append(home)
+            return self
+        shards = len(handles)
+        for offset in range(1, shards):
+            index = (home + offset) % shards
+            if backend.wait(handles[index], 0):
+                self.shards[index]._record_taken()
+                taken.append(index)
+                return self
+        if timeout_ms == 0:
+            raise SemaphoreWaitTimeoutException()
+        start = time.perf_counter_ns()
+        if cancel is None:
+            index = backend.wait_any(handles, timeout_ms)
+        else:
+            index = self._wait_any_cancellable(timeout_ms, cancel)
+        if index is None:
+            raise SemaphoreWaitTimeoutException()
+        self.shards[index]._record_taken(1, start)
+        taken.append(index)
+        return self
+
+    def _wait_any_cancellable(self, timeout_ms: Optional[int],
+                              cancel: CancellationToken) -> Optional[int]:
+        # wait_any() can't wait on the token's event as well, so check the
+        # token between slices of it
+        deadline = None
+        if timeout_ms is not None:
+            deadline = time.monotonic() + timeout_ms / 1000
+        while True:
+            cancel.raise_if_cancelled()
+            slice_ms = CANCEL_SLICE_MS
+            if deadline is not None:
+                remaining_ms = int((deadline - time.monotonic()) * 1000)
+                if remaining_ms <= 0:
+                    return None
+                slice_ms = min(slice_ms, remaining_ms)
+            index = self.backend.wait_any(self._handles, slice_ms)
+            if index is not None:
+                if cancel.cancelled:
+                    self.backend.release(self._handles[index], 1)
+                    raise SemaphoreWaitCancelledException()
+                return index
+
+    def release(self, release_count: int = 1) -> int:
+        """
+        Give permits back to the shards they came from, or to the home
+        shard or the next one with room when another thread took them
+
+        :raises OSError: Every shard is full, or a release has failed.
+        :returns: The free permits of the shard of the last release, before
+            it
+        """
+        if release_count <= 0:
+            raise ValueError(f"release_count must be positive, "
+                             f"not {release_count}")
+        taken = self._thread_state()[1]
+        backend = self.backend
+        handles = self._handles
+        previous_count = 0
+        for _ in range(release_count):
+            if taken:
+                index = taken.pop()
+                try:
+                    previous_count = backend.release(handles[index], 1)
+                except OSError as exc:
+                    # Full, another thread gave the permit back already
+                    if not is_too_many_posts(exc):
+                        raise
+                else:
+                    self.shards[index]._record_released()
+                    continue
+            previous_count = self._release_anywhere()
+        return previous_count
+
+    def _release_anywhere(self) -> int:
+        handles = self._handles
+        home = self.home
+        error = None
+        for offset in range(len(handles)):
+            index = (home + offset) % len(handles)
+            try:
+                previous_count = self.backend.release(handles[index], 1)
+            except OSError as exc:
+                # Full: the permit was taken from another shard
+                if not is_too_many_posts(exc):
+                    raise
+                error = exc
+                continue
+            self.shards[index]._record_released()
+            return previous_count
+        raise error
+
+    def getvalue(self) -> int:
+        """
+        The free permits of every shard, read one shard at a time
+        """
+        return sum(shard.getvalue() for shard in self.shards)
+
+    def close(self) -> None:
+        for shard in reversed(self.shards):
+            shard.close()
+        self.shards = []
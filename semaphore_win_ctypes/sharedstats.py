@@ -0,0 +1,379 @@
+"""Statistics of a named semaphore shared by every process that uses it."""
+from __future__ import annotations
+import _thread
+import errno
+import os
+import time
+from typing import Any, Dict, Optional, Union
+
+from .backend import SemaphoreBackend
+from .segment import SharedSegment, pid_alive, segment_path
+
+# Shared stats are a SharedSegment with one slot per process, of these words
+MAGIC = 0x5357435354415453
+PID = 0
+WAITING = 1
+OLDEST_WAIT_NS = 2
+ACQUIRES = 3
+ACQUIRED_PERMITS = 4
+TIMEOUTS = 5
+CANCELLATIONS = 6
+FAILURES = 7
+RELEASES = 8
+RELEASED_PERMITS = 9
+SLOT_WORDS = 10
+DEFAULT_SLOTS = 128
+
+# The counters of a slot, in the order of SharedStatsSnapshot
+COUNTERS = ('acquires', 'acquired_permits', 'timeouts', 'cancellations',
+            'failures', 'releases', 'released_permits')
+
+
+def shared_stats_path(name: str,
+                      backend: Union[SemaphoreBackend, str] = None) -> str:
+    """
+    The file of the shared stats of a named semaphore
+
+    :param name: The name of the semaphore
+    :param backend: The backend instance or name (default: the platform's
+        default backend)
+    """
+    return segment_path(name, backend, '.stats')
+
+
+class SharedStatsSnapshot:
+    """
+    The shared stats of a semaphore, added up over every process
+
+    Counters count from the creation of the stats file, including
+    processes that have since exited. waiting and longest_wait_ns only
+    count processes still running.
+    """
+    __slots__ = ('name', 'time_ns', 'processes', 'waiting',
+                 'longest_wait_ns') + COUNTERS
+
+    def __init__(self, name: Optional[str], time_ns: int):
+        self.name = name
+        #: When the snapshot was taken, from time.monotonic_ns()
+        self.time_ns = time_ns
+        #: Processes using the semaphore, and their threads waiting on it
+        self.processes = 0
+        self.waiting = 0
+        #: How long the longest current wait has been waiting
+        self.longest_wait_ns = 0
+        for counter in COUNTERS:
+            setattr(self, counter, 0)
+
+    def rate(self, previous: SharedStatsSnapshot,
+             counter: str = 'acquires') -> float:
+        """
+        How fast a counter went up since an earlier snapshot
+
+        :param previous: The earlier snapshot
+        :param counter: The counter, such as 'acquires' or 'timeouts'
+            (default: 'acquires')
+        :returns: The increase per second, 0 when no time passed
+        """
+        seconds = (self.time_ns - previous.time_ns) / 1e9
+        if seconds <= 0:
+            return 0.0
+        return (getattr(self, counter) - getattr(previous, counter)) / seconds
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Everything in the snapshot, as plain types for logging or JSON
+        """
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __repr__(self) -> str:
+        return (f'<SharedStatsSnapshot name={self.name!r} '
+                f'processes={self.processes} waiting={self.waiting} '
+                f'acquires={self.acquires} timeouts={self.timeouts}>')
+
+
+def _snapshot(name: Optional[str], segment: SharedSegment
+              ) -> SharedStatsSnapshot:
+    # Taken without any lock: each word is read whole, but words of a slot
+    # may be from before and after an update by its process
+    now = time.monotonic_ns()
+    snapshot = SharedStatsSnapshot(name, now)
+    words = segment.words
+    totals = [0] * len(COUNTERS)
+    oldest = 0
+    for index in segment.slot_indexes():
+        for offset in range(len(COUNTERS)):
+            totals[offset] += words[index + ACQUIRES + offset]
+        pid = words[index + PID]
+        if not pid or not pid_alive(pid):
+            continue
+        snapshot.processes += 1
+        snapshot.waiting += max(0, words[index + WAITING])
+        started = words[index + OLDEST_WAIT_NS]
+        if started and (not oldest or started < oldest):
+            oldest = started
+    for counter, total in zip(COUNTERS, totals):
+        setattr(snapshot, counter, total)
+    if oldest:
+        snapshot.longest_wait_ns = max(0, now - oldest)
+    return snapshot
+
+
+class SharedStats:
+    """
+    Counts of the acquires, timeouts and releases of a named semaphore, and
+    its current waiters, from every process using it
+
+    The stats are a small file, in /dev/shm where there is one, mapped
+    into every process. Each process claims a slot and only ever writes
+    its own, so an update is a few in-place writes of mapped integers,
+    under a lock private to the process, and no process ever waits for
+    another. snapshot() adds up the slots without taking the semaphore or
+    any lock.
+
+    A slot is freed when its process closes the stats or dies, and the
+    next process to claim it carries on from its counters, so totals only
+    go up. Wait start times come from time.monotonic_ns(), which counts
+    from the same moment in every process of a machine.
+    """
+
+    def __init__(self,
+                 name: str,
+                 backend: Union[SemaphoreBackend, str] = None,
+                 slots: int = DEFAULT_SLOTS,
+                 path: str = None,
+                 ):
+        """
+        :param name: The name of the semaphore
+        :param backend: The backend instance or name (default: the
+            platform's default backend)
+        :param slots: The most processes the stats can track at once, when
+            this process creates them (default: 128)
+        :param path: The stats file (default: shared_stats_path(name,
+            backend))
+        :raises OSError: The file could not be opened or mapped, or every
+            slot is taken by a running process.
+        """
+        if name is None:
+            raise ValueError("Only named semaphores have shared stats")
+        self.name = name
+        self.path = path or shared_stats_path(name, backend)
+        self._segment = SharedSegment(self.path, MAGIC, slots, SLOT_WORDS)
+        self._words = self._segment.words
+        self.slots = self._segment.slots
+        # This process's slot, as the index of its first word
+        self._slot: Optional[int] = None
+        self._pid = 0
+        # Start times of the waits of this process, oldest first, and how
+        # many waits started at each
+        self._waits: Dict[int, int] = {}
+        self._lock = _thread.allocate_lock()
+        # Claimed now, so the process counts as using the semaphore
+        try:
+            with self._lock:
+                self._get_slot()
+        except BaseException:
+            self._segment.close()
+            raise
+
+    def __enter__(self) -> SharedStats:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _get_slot(self) -> int:
+        # Called with the process lock held
+        slot = self._slot
+        if slot is not None and self._pid == os.getpid():
+            return slot
+        # First use, or a forked child: the slot is the parent's
+        pid = os.getpid()
+        words = self._words
+        self._segment.lock()
+        try:
+            for index in self._segment.slot_indexes():
+                holder = words[index + PID]
+                if holder == 0 or (holder != pid and not pid_alive(holder)):
+                    words[index + PID] = pid
+                    words[index + WAITING] = 0
+                    words[index + OLDEST_WAIT_NS] = 0
+                    self._slot = index
+                    self._pid = pid
+                    self._waits.clear()
+                    return index
+        finally:
+            self._segment.unlock()
+        raise OSError(errno.ENOSPC, 'The shared stats are full', self.path)
+
+    def begin_wait(self) -> int:
+        """
+        Count a wait that's starting
+
+        :returns: Its start time, to pass to end_wait()
+        """
+        with self._lock:
+            slot = self._get_slot()
+            words = self._words
+            # Taken under the lock, so start times are in the order of
+            # self._waits
+            started = time.monotonic_ns()
+            waits = self._waits
+            if not waits:
+                words[slot + OLDEST_WAIT_NS] = started
+            waits[started] = waits.get(started, 0) + 1
+            words[slot + WAITING] += 1
+            return started
+
+    def end_wait(self, started: int, acquired: Optional[bool],
+                 count: int = 1) -> None:
+        """
+        Count the end of a wait
+
+        :param started: What begin_wait() returned
+        :param acquired: True if it acquired, False if it timed out, None
+            if it was cancelled
+        :param count: The number of permits it asked for
+        """
+        with self._lock:
+            slot = self._end_wait(started)
+            if slot is None:
+                return
+            words = self._words
+            if acquired:
+                words[slot + ACQUIRES] += 1
+                words[slot + ACQUIRED_PERMITS] += count
+            elif acquired is None:
+                words[slot + CANCELLATIONS] += 1
+            else:
+                words[slot + TIMEOUTS] += 1
+
+    def abandon_wait(self, started: int, failed: bool = True) -> None:
+        """
+        Count the end of a wait that raised
+
+        :param started: What begin_wait() returned
+        :param failed: Whether to count it as a failure, False for an
+            interrupted wait (default: True)
+        """
+        with self._lock:
+            slot = self._end_wait(started)
+            if slot is not None and failed:
+                self._words[slot + FAILURES] += 1
+
+    def _end_wait(self, started: int) -> Optional[int]:
+        # Called with the process lock held, None when the wait began
+        # before a fork or a close
+        slot = self._slot
+        waits = self._waits
+        if slot is None or self._pid != os.getpid() or started not in waits:
+            return None
+        words = self._words
+        if waits[started] > 1:
+            waits[started] -= 1
+        else:
+            del waits[started]
+            words[slot + OLDEST_WAIT_NS] = next(iter(waits), 0)
+        words[slot + WAITING] -= 1
+        return slot
+
+    def record_acquire(self, count: int = 1) -> None:
+        """
+        Count an acquire that took its permits without a counted wait
+
+        :param count: The permits it took
+        """
+        with self._lock:
+            slot = self._get_slot()
+            words = self._words
+            words[slot + ACQUIRES] += 1
+            words[slot + ACQUIRED_PERMITS] += count
+
+    def record_release(self, count: int = 1) -> None:
+        """
+        Count a release
+
+        :param count: The permits it gave back
+        """
+        with self._lock:
+            slot = self._get_slot()
+            words = self._words
+            words[slot + RELEASES] += 1
+            words[slot + RELEASED_PERMITS] += count
+
+    def record_failure(self) -> None:
+        """
+        Count a release that raised OSError
+        """
+        with self._lock:
+            self._words[self._get_slot() + FAILURES] += 1
+
+    def snapshot(self) -> SharedStatsSnapshot:
+        """
+        The stats of every process, added up
+        """
+        return _snapshot(self.name, self._segment)
+
+    def close(self) -> None:
+        """
+        Unmap the stats, freeing this process's slot
+        """
+        with self._lock:
+            if self._segment.closed:
+                return
+            slot = self._slot
+            if slot is not None and self._pid == os.getpid():
+                self._segment.lock()
+                try:
+                    # The counters stay, for the next process to carry on
+                    self._words[slot + WAITING] = 0
+                    self._words[slot + OLDEST_WAIT_NS] = 0
+                    self._words[slot + PID] = 0
+                finally:
+                    self._segment.unlock()
+            self._slot = None
+            self._waits.clear()
+            self._segment.close()
+
+    def unlink(self) -> None:
+        """
+        Remove the stats file, processes that have it open keep using it
+        """
+        self._segment.unlink()
+
+
+def open_shared_stats(name: str,
+                      backend: Union[SemaphoreBackend, str] = None
+                      ) -> SharedStats:
+    """
+    The shared stats for Semaphore(shared_stats=True)
+
+    :param name: The name of the semaphore
+    :param backend: The backend instance or name
+    """
+    return SharedStats(name, backend)
+
+
+def read_shared_stats(name: str,
+                      backend: Union[SemaphoreBackend, str] = None,
+                      path: str = None,
+                      ) -> SharedStatsSnapshot:
+    """
+    Snapshot the shared stats of a named semaphore, from any process
+
+    The stats file is mapped read-only: neither the semaphore nor the file
+    lock is taken, and this process doesn't claim a slot.
+
+    :param name: The name of the semaphore
+    :param backend: The backend instance or name (default: the platform's
+        default backend)
+    :param path: The stats file (default: shared_stats_path(name, backend))
+    :raises FileNotFoundError: No process has opened the semaphore with
+        shared_stats=True.
+    :returns: A SharedStatsSnapshot
+    """
+    segment = SharedSegment(path or shared_stats_path(name, backend), MAGIC,
+                            DEFAULT_SLOTS, SLOT_WORDS, create=False)
+    try:
+        return _snapshot(name, segment)
+    finally:
+        segment.close()
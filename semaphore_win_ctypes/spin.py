@@ -0,0 +1,117 @@
+"""Spin-then-block waits with an adaptive spin budget."""
+from __future__ import annotations
+import time
+from typing import Any, Optional
+
+from .backend import SemaphoreBackend
+
+# Spin attempts before blocking, whatever the history of the semaphore
+MIN_SPINS = 1
+MAX_SPINS = 64
+INITIAL_SPINS = 4
+# Below this share of spins that succeed, waiters block right away
+MIN_SUCCESS_RATE = 0.125
+# Holds longer than this don't end while a waiter spins, it should block
+# right away (a block and wake-up costs tens of microseconds)
+MAX_SPIN_HOLD_NS = 100000
+# Yields between two attempts double up to this many
+MAX_YIELDS = 8
+# Weight of the newest sample in the running averages, 1/8 like glibc's
+# adaptive mutexes
+SMOOTHING = 8
+
+
+class AdaptiveSpin:
+    """
+    The spin budget of one semaphore
+
+    Before blocking, a waiter makes up to budget() non-blocking attempts,
+    yielding the processor between them with exponential backoff. Like
+    an adaptive mutex, the budget follows the semaphore's history: it is
+    about twice the number of attempts recent successful spins needed,
+    and grows when a spin runs out. It drops to MIN_SPINS while fewer
+    than MIN_SUCCESS_RATE of the spins succeed, or while holders keep the
+    semaphore for longer than MAX_SPIN_HOLD_NS.
+
+    The averages are updated without a lock, a lost update only makes the
+    budget slightly less accurate.
+    """
+
+    def __init__(self, max_spins: int = MAX_SPINS):
+        """
+        :param max_spins: The largest budget (default: MAX_SPINS)
+        """
+        self.max_spins = max_spins
+        #: Running average of the attempts a spin needed, failed spins
+        #: count as their budget
+        self.spins = float(INITIAL_SPINS)
+        #: Running average of the share of spins that succeeded
+        self.success_rate = 1.0
+        #: Running average of how long the semaphore is held, in ns
+        self.hold_ns = 0.0
+        #: Acquires decided by spinning, and acquires that had to block
+        self.spin_acquires = 0
+        self.blocked_acquires = 0
+
+    def budget(self) -> int:
+        """
+        The number of non-blocking attempts the next waiter makes
+        """
+        if (self.hold_ns > MAX_SPIN_HOLD_NS
+                or self.success_rate < MIN_SUCCESS_RATE):
+            return MIN_SPINS
+        return max(MIN_SPINS, min(self.max_spins, int(self.spins * 2) + 1))
+
+    def wait(self,
+             backend: SemaphoreBackend,
+             handle: Any,
+             timeout_ms: Optional[int],
+             event: Any = None,
+             ) -> Optional[bool]:
+        """
+        Spin for up to budget() attempts, then block in backend.wait()
+
+        :param backend: The backend of the semaphore
+        :param handle: The handle to wait on
+        :param timeout_ms: The time-out interval, in milliseconds, None
+            waits forever. Time spent spinning counts towards it.
+        :param event: An event that cancels the blocking wait, see
+            SemaphoreBackend.wait_cancellable() (default: not cancellable)
+        :raises OSError: The wait has failed.
+        :returns: True if the count was decremented, False on time-out,
+            None if the event was set
+        """
+        if timeout_ms == 0:
+            return backend.wait(handle, 0)
+        start = time.monotonic()
+        budget = self.budget()
+        yields = 1
+        for attempt in range(1, budget + 1):
+            if backend.wait(handle, 0):
+                self.spins += (attempt - self.spins) / SMOOTHING
+                self.success_rate += (1 - self.success_rate) / SMOOTHING
+                self.spin_acquires += 1
+                return True
+            if attempt < budget:
+                for _ in range(yields):
+                    # Lets the holder run, and release the GIL to it
+                    time.sleep(0)
+                yields = min(yields * 2, MAX_YIELDS)
+        # A few more attempts might have been enough
+        self.spins += (budget - self.spins) / SMOOTHING
+        self.success_rate -= self.success_rate / SMOOTHING
+        self.blocked_acquires += 1
+        if timeout_ms is not None:
+            elapsed_ms = int((time.monotonic() - start) * 1000)
+            timeout_ms = max(0, timeout_ms - elapsed_ms)
+        if event is not None:
+            return backend.wait_cancellable(handle, event, timeout_ms)
+        return backend.wait(handle, timeout_ms)
+
+    def record_hold(self, hold_ns: int) -> None:
+        """
+        Account for one hold of the semaphore, from acquire to release
+
+        :param hold_ns: How long the semaphore was held, in nanoseconds
+        """
+        self.hold_ns += (hold_ns - self.hold_ns) / SMOOTHING
@@ -0,0 +1,384 @@
+"""A pure-Python stand-in for the kernel32 semaphore functions."""
+from __future__ import annotations
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .constants import DUPLICATE_CLOSE_SOURCE, DUPLICATE_SAME_ACCESS, \
+    ERROR_ACCESS_DENIED, ERROR_ALREADY_EXISTS, ERROR_FILE_NOT_FOUND, \
+    ERROR_INVALID_HANDLE, ERROR_INVALID_PARAMETER, ERROR_TOO_MANY_POSTS, \
+    EVENT_ALL_ACCESS, EVENT_MODIFY_STATE, INFINITE, \
+    INVALID_HANDLE_VALUE, SEMAPHORE_MODIFY_STATE, SEMAPHORE_QUERY_STATE, \
+    STATUS_ACCESS_DENIED, STATUS_INFO_LENGTH_MISMATCH, \
+    STATUS_INVALID_HANDLE, STATUS_INVALID_PARAMETER, STATUS_SUCCESS, \
+    SYNCHRONIZE, WAIT_FAILED, WAIT_OBJECT_0, WAIT_TIMEOUT
+
+# What RtlNtStatusToDosError() returns for the statuses used here
+_NTSTATUS_TO_WINERROR = {
+    STATUS_SUCCESS: 0,
+    STATUS_INFO_LENGTH_MISMATCH: 24,  # ERROR_BAD_LENGTH
+    STATUS_INVALID_HANDLE: ERROR_INVALID_HANDLE,
+    STATUS_INVALID_PARAMETER: ERROR_INVALID_PARAMETER,
+    STATUS_ACCESS_DENIED: ERROR_ACCESS_DENIED,
+}
+
+
+def _value(argument: Any) -> Any:
+    # Unwrap DWORD(5), LPCWSTR('name'), ...
+    return getattr(argument, 'value', argument)
+
+
+def _store(pointer: Any, value: int) -> None:
+    if pointer is None:
+        return
+    if hasattr(pointer, 'contents'):
+        # LPLONG(previous_count)
+        pointer.contents.value = value
+    elif hasattr(pointer, '_obj'):
+        # byref(previous_count)
+        pointer._obj.value = value
+    else:
+        pointer.value = value
+
+
+class _SemaphoreObject:
+    __slots__ = ('name', 'count', 'maximum_count', 'handles')
+
+    # Waits decrement the count, see _EventObject
+    manual_reset = False
+
+    def __init__(self, name: Optional[str], count: int, maximum_count: int):
+        self.name = name
+        self.count = count
+        self.maximum_count = maximum_count
+        self.handles = 0
+
+
+class _EventObject(_SemaphoreObject):
+    # A count of 1 when signaled, that waits on a manual-reset event leave
+    # alone
+    __slots__ = ('manual_reset',)
+
+    def __init__(self, name: Optional[str], manual_reset: bool,
+                 initial_state: bool):
+        super().__init__(name, int(initial_state), 1)
+        self.manual_reset = manual_reset
+
+
+class _RegisteredWait:
+    __slots__ = ('thread', 'cancelled')
+
+    def __init__(self):
+        self.thread: Optional[threading.Thread] = None
+        self.cancelled = False
+
+
+class _Waiter:
+    __slots__ = ('objects', 'wait_all', 'result')
+
+    def __init__(self, objects: List[_SemaphoreObject], wait_all: bool):
+        self.objects = objects
+        self.wait_all = wait_all
+        self.result: Optional[int] = None
+
+
+class StandInKernel32:
+    """
+    Semaphore Objects that live inside this process
+
+    Implements the functions of the kernel32 table with the same arguments,
+    return values and GetLastError() codes, so the win32 backend can run
+    anywhere::
+
+        set_kernel32(StandInKernel32())
+        set_default_backend('win32')
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._objects: Dict[str, _SemaphoreObject] = {}
+        self._handles: Dict[int, Any] = {}
+        self._waits: Dict[int, _RegisteredWait] = {}
+        self._waiters: List[_Waiter] = []
+        self._next_handle = 4
+        self._last_error = threading.local()
+
+    def _fail(self, code: int, result: Any = None) -> Any:
+        self._last_error.value = code
+        return result
+
+    def _new_handle(self, obj: _SemaphoreObject, desired_access: int) -> int:
+        handle = self._next_handle
+        self._next_handle += 4
+        obj.handles += 1
+        self._handles[handle] = (obj, desired_access)
+        return handle
+
+    def _lookup(self, handle: Any, access: int) -> Optional[_SemaphoreObject]:
+        entry = self._handles.get(_value(handle))
+        if entry is None:
+            return self._fail(ERROR_INVALID_HANDLE)
+        obj, desired_access = entry
+        if desired_access & access != access:
+            return self._fail(ERROR_ACCESS_DENIED)
+        return obj
+
+    @staticmethod
+    def _take(objects: List[_SemaphoreObject], wait_all: bool
+              ) -> Optional[int]:
+        # The wait result if the wait can be satisfied now, else None
+        if wait_all:
+            # Two handles may refer to the same object
+            if all(obj.count >= (1 if obj.manual_reset
+                                 else objects.count(obj))
+                   for obj in objects):
+                for obj in objects:
+                    if not obj.manual_reset:
+                        obj.count -= 1
+                return WAIT_OBJECT_0
+            return None
+        for index, obj in enumerate(objects):
+            if obj.count > 0:
+                if not obj.manual_reset:
+                    obj.count -= 1
+                return WAIT_OBJECT_0 + index
+        return None
+
+    def _grant(self) -> None:
+        # Like the kernel, hand released permits to waiters in the order
+        # they started waiting, so a releasing thread can't barge back in
+        for waiter in list(self._waiters):
+            waiter.result = self._take(waiter.objects, waiter.wait_all)
+            if waiter.result is not None:
+                self._waiters.remove(waiter)
+        self._condition.notify_all()
+
+    def _wait(self,
+              objects: List[_SemaphoreObject],
+              wait_all: bool,
+              milliseconds: int,
+              registration: _RegisteredWait = None,
+              ) -> Optional[int]:
+        # Called with the condition held, None when the wait was cancelled
+        result = self._take(objects, wait_all)
+        if result is not None or milliseconds == 0:
+            return WAIT_TIMEOUT if result is None else result
+        deadline = None
+        if milliseconds != INFINITE:
+            deadline = time.monotonic() + milliseconds / 1000
+        waiter = _Waiter(objects, wait_all)
+        self._waiters.append(waiter)
+        try:
+            while waiter.result is None:
+                if registration is not None and registration.cancelled:
+                    return None
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return WAIT_TIMEOUT
+                    self._condition.wait(remaining)
+            return waiter.result
+        finally:
+            if waiter.result is None:
+                self._waiters.remove(waiter)
+
+    def GetLastError(self) -> int:
+        return getattr(self._last_error, 'value', 0)
+
+    def CreateSemaphoreExW(self, attributes, initial_count, maximum_count,
+                           name, flags, desired_access) -> Optional[int]:
+        initial_count = _value(initial_count)
+        maximum_count = _value(maximum_count)
+        name = _value(name)
+        with self._condition:
+            if maximum_count <= 0 or \
+                    not 0 <= initial_count <= maximum_count:
+                return self._fail(ERROR_INVALID_PARAMETER)
+            obj = self._objects.get(name) if name is not None else None
+            if obj is not None:
+                if isinstance(obj, _EventObject):
+                    return self._fail(ERROR_INVALID_HANDLE)
+                self._last_error.value = ERROR_ALREADY_EXISTS
+            else:
+                self._last_error.value = 0
+                obj = _SemaphoreObject(name, initial_count, maximum_count)
+                if name is not None:
+                    self._objects[name] = obj
+            return self._new_handle(obj, _value(desired_access))
+
+    def OpenSemaphoreW(self, desired_access, inherit, name) -> Optional[int]:
+        with self._condition:
+            obj = self._objects.get(_value(name))
+            if obj is None:
+                return self._fail(ERROR_FILE_NOT_FOUND)
+            if isinstance(obj, _EventObject):
+                return self._fail(ERROR_INVALID_HANDLE)
+            return self._new_handle(obj, _value(desired_access))
+
+    def CreateEventW(self, attributes, manual_reset, initial_state,
+                     name) -> Optional[int]:
+        name = _value(name)
+        with self._condition:
+            obj = self._objects.get(name) if name is not None else None
+            if obj is not None:
+                if not isinstance(obj, _EventObject):
+                    # Events and semaphores share one namespace
+                    return self._fail(ERROR_INVALID_HANDLE)
+                self._last_error.value = ERROR_ALREADY_EXISTS
+            else:
+                self._last_error.value = 0
+                obj = _EventObject(name, bool(_value(manual_reset)),
+                                   bool(_value(initial_state)))
+                if name is not None:
+                    self._objects[name] = obj
+            return self._new_handle(obj, EVENT_ALL_ACCESS)
+
+    def SetEvent(self, handle) -> int:
+        with self._condition:
+            obj = self._lookup(handle, EVENT_MODIFY_STATE)
+            if obj is None:
+                return 0
+            if not isinstance(obj, _EventObject):
+                return self._fail(ERROR_INVALID_HANDLE, 0)
+            obj.count = 1
+            self._grant()
+            return 1
+
+    def WaitForSingleObject(self, handle, milliseconds) -> int:
+        with self._condition:
+            obj = self._lookup(handle, SYNCHRONIZE)
+            if obj is None:
+                return WAIT_FAILED
+            return self._wait([obj], False, _value(milliseconds))
+
+    def WaitForMultipleObjects(self, count, handles, wait_all,
+                               milliseconds) -> int:
+        handles = [_value(handle) for handle in handles[:_value(count)]]
+        with self._condition:
+            if len(set(handles)) != len(handles):
+                return self._fail(ERROR_INVALID_PARAMETER, WAIT_FAILED)
+            objects = [self._lookup(handle, SYNCHRONIZE)
+                       for handle in handles]
+            if None in objects:
+                return WAIT_FAILED
+            return self._wait(objects, bool(_value(wait_all)),
+                              _value(milliseconds))
+
+    def RegisterWaitForSingleObject(self, new_wait_object, handle, callback,
+                                    context, milliseconds, flags) -> int:
+        milliseconds = _value(milliseconds)
+        with self._condition:
+            obj = self._lookup(handle, SYNCHRONIZE)
+            if obj is None:
+                return 0
+            registration = _RegisteredWait()
+            wait_handle = self._next_handle
+            self._next_handle += 4
+            self._waits[wait_handle] = registration
+
+        def wait_thread() -> None:
+            with self._condition:
+                ret = self._wait([obj], False, milliseconds, registration)
+            if ret is not None:
+                callback(context, ret == WAIT_TIMEOUT)
+
+        registration.thread = threading.Thread(target=wait_thread,
+                                               daemon=True)
+        registration.thread.start()
+        _store(new_wait_object, wait_handle)
+        return 1
+
+    def UnregisterWaitEx(self, wait_handle, completion_event) -> int:
+        with self._condition:
+            registration = self._waits.pop(_value(wait_handle), None)
+            if registration is None:
+                return self._fail(ERROR_INVALID_HANDLE, 0)
+            registration.cancelled = True
+            self._condition.notify_all()
+        if _value(completion_event) == INVALID_HANDLE_VALUE and \
+                registration.thread is not threading.current_thread():
+            # Wait for a running callback to return
+            registration.thread.join()
+        return 1
+
+    def ReleaseSemaphore(self, handle, release_count,
+                         previous_count) -> int:
+        release_count = _value(release_count)
+        with self._condition:
+            obj = self._lookup(handle, SEMAPHORE_MODIFY_STATE)
+            if obj is None:
+                return 0
+            if isinstance(obj, _EventObject):
+                return self._fail(ERROR_INVALID_HANDLE, 0)
+            if release_count <= 0:
+                return self._fail(ERROR_INVALID_PARAMETER, 0)
+            if obj.count + release_count > obj.maximum_count:
+                return self._fail(ERROR_TOO_MANY_POSTS, 0)
+            _store(previous_count, obj.count)
+            obj.count += release_count
+            self._grant()
+            return 1
+
+    def NtQuerySemaphore(self, handle, information_class, information,
+                         length, return_length) -> int:
+        # Reports errors through its return value, not GetLastError()
+        if _value(information_class) != 0:
+            return STATUS_INVALID_PARAMETER
+        if _value(length) < 8:
+            return STATUS_INFO_LENGTH_MISMATCH
+        with self._condition:
+            entry = self._handles.get(_value(handle))
+            if entry is None:
+                return STATUS_INVALID_HANDLE
+            obj, desired_access = entry
+            if isinstance(obj, _EventObject):
+                return STATUS_INVALID_HANDLE
+            if desired_access & SEMAPHORE_QUERY_STATE == 0:
+                return STATUS_ACCESS_DENIED
+            # byref(SEMAPHORE_BASIC_INFORMATION())
+            info = getattr(information, '_obj', information)
+            info.CurrentCount = obj.count
+            info.MaximumCount = obj.maximum_count
+        _store(return_length, 8)
+        return STATUS_SUCCESS
+
+    def RtlNtStatusToDosError(self, status) -> int:
+        # ERROR_MR_MID_NOT_FOUND for anything unknown, like the real one
+        return _NTSTATUS_TO_WINERROR.get(_value(status) & 0xFFFFFFFF, 317)
+
+    def GetCurrentProcess(self) -> int:
+        # The pseudo-handle, the only process the stand-in knows
+        return INVALID_HANDLE_VALUE
+
+    def DuplicateHandle(self, source_process, source_handle, target_process,
+                        target_handle, desired_access, inherit,
+                        options) -> int:
+        options = _value(options)
+        with self._condition:
+            if _value(source_process) != INVALID_HANDLE_VALUE or \
+                    _value(target_process) != INVALID_HANDLE_VALUE:
+                return self._fail(ERROR_INVALID_HANDLE, 0)
+            entry = self._handles.get(_value(source_handle))
+            if entry is None:
+                return self._fail(ERROR_INVALID_HANDLE, 0)
+            obj, access = entry
+            if not options & DUPLICATE_SAME_ACCESS:
+                access = _value(desired_access)
+            _store(target_handle, self._new_handle(obj, access))
+        if options & DUPLICATE_CLOSE_SOURCE:
+            self.CloseHandle(source_handle)
+        return 1
+
+    def CloseHandle(self, handle) -> int:
+        with self._condition:
+            entry = self._handles.pop(_value(handle), None)
+            if entry is None:
+                return self._fail(ERROR_INVALID_HANDLE, 0)
+            obj = entry[0]
+            obj.handles -= 1
+            if obj.handles == 0 and obj.name is not None:
+                # The last handle is gone, so is the object
+                del self._objects[obj.name]
+            return 1
@@ -0,0 +1,352 @@
+"""Wait and hold spans, exported as Chrome Trace Event JSON."""
+from __future__ import annotations
+import _thread
+import itertools
+import json
+import os
+import sys
+import weakref
+from typing import Any, Dict, IO, Iterable, List, Optional, Tuple, Union
+
+from . import semaphore as _semaphore
+
+# For annotations only
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from .semaphore import Semaphore
+
+DEFAULT_CAPACITY = 65536
+
+# Acquires a thread keeps track of until it releases them, beyond which the
+# oldest are forgotten: permits handed to another thread are never
+# released by the one that took them
+MAX_HELD = 256
+
+# The kinds of span
+WAIT = 'wait'
+HOLD = 'hold'
+# A release that doesn't end a hold of the releasing thread
+RELEASE = 'release'
+
+# Outcomes of a wait
+ACQUIRED = 'acquired'
+TIMED_OUT = 'timeout'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+INTERRUPTED = 'interrupted'
+# Outcome of a hold ended by release(), AcquireSemaphore sets the name of
+# the exception that left its with block instead
+RELEASED = 'released'
+
+# Thread ids as the operating system and other tools show them
+_get_native_id = getattr(_thread, 'get_native_id', _thread.get_ident)
+
+# Every tracer, to start them afresh in a forked child
+_tracers: weakref.WeakSet = weakref.WeakSet()
+
+
+# What a wait returned -> its outcome
+_OUTCOMES = {True: ACQUIRED, False: TIMED_OUT, None: CANCELLED}
+
+
+class SemaphoreTracer:
+    """
+    Wait and hold spans of this process's semaphores, in a ring buffer
+
+    A span is a tuple written to a slot of a list allocated up front, so
+    recording takes a clock read and a tuple, and never grows the buffer:
+    once capacity spans are recorded, each new one replaces the oldest.
+    Semaphores created after enable_tracing() record into the process's
+    tracer::
+
+        tracer = enable_tracing()
+        ...
+        tracer.dump(f'trace-{os.getpid()}.json')
+
+    A wait span lasts from the call to acquire() until it returns, with its
+    outcome. A hold span lasts from the end of a successful wait until the
+    same thread releases the semaphore, the newest of its acquires first.
+    A release by another thread is recorded as a release instant.
+
+    Timestamps are time.perf_counter_ns(), the monotonic clock every
+    process reads on Linux, Windows and macOS, so the dumps of several
+    processes line up when merged with merge_traces().
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        """
+        :param capacity: The number of spans kept (default: 65536)
+        """
+        if capacity < 1:
+            raise ValueError(f"capacity must be at least 1, not {capacity}")
+        self.capacity = capacity
+        self._reset()
+        _tracers.add(self)
+
+    def _reset(self) -> None:
+        self.pid = os.getpid()
+        self._spans: List[Optional[Tuple[Any, ...]]] = [None] * self.capacity
+        # next() of an itertools.count is atomic, unlike += 1
+        self._counter = itertools.count()
+        self._local = _thread._local()
+
+    def current_thread(self) -> Tuple[int, List[List[Any]]]:
+        """
+        The calling thread's id and the acquires it hasn't released yet
+        """
+        local = self._local
+        try:
+            return local.thread
+        except AttributeError:
+            local.thread = (_get_native_id(), [])
+            return local.thread
+
+    def record_wait(self,
+                    sem: Semaphore,
+                    start_ns: int,
+                    end_ns: int,
+                    acquired: Optional[bool],
+                    count: int = 1,
+                    thread: Tuple[int, List[List[Any]]] = None,
+                    ) -> None:
+        """
+        Record a wait, and start a hold if it acquired the semaphore
+
+        :param sem: The semaphore waited on
+        :param start_ns: time.perf_counter_ns() when the wait started
+        :param end_ns: time.perf_counter_ns() when it ended
+        :param acquired: True if it acquired the semaphore, False on
+            time-out, None when cancelled
+        :param count: The number of permits waited for
+        :param thread: current_thread() of the thread that waited, when it's
+            not the calling thread (default: the calling thread)
+        """
+        if thread is None:
+            try:
+                thread = self._local.thread
+            except AttributeError:
+                thread = self.current_thread()
+        self._spans[next(self._counter) % self.capacity] = (
+            WAIT, sem.name, thread[0], start_ns, end_ns, _OUTCOMES[acquired],
+            count)
+        if acquired:
+            held = thread[1]
+            if len(held) >= MAX_HELD:
+                del held[0]
+            held.append([id(sem), end_ns, count, RELEASED])
+
+    def record_abandoned(self,
+                         sem: Semaphore,
+                         start_ns: int,
+                         end_ns: int,
+                         failed: bool,
+                         count: int = 1,
+                         thread: Tuple[int, List[List[Any]]] = None,
+                         ) -> None:
+        """
+        Record a wait that raised, FAILED for an OSError and INTERRUPTED for
+        anything else, like KeyboardInterrupt or a cancelled task
+        """
+        tid = (self.current_thread() if thread is None else thread)[0]
+        self._spans[next(self._counter) % self.capacity] = (
+            WAIT, sem.name, tid, start_ns, end_ns,
+            FAILED if failed else INTERRUPTED, count)
+
+    def record_release(self,
+                       sem: Semaphore,
+                       end_ns: int,
+                       count: int,
+                       failed: bool = False,
+                       ) -> None:
+        """
+        Record a release, ending the newest hold of the semaphore by the
+        calling thread
+
+        :param sem: The semaphore released
+        :param end_ns: time.perf_counter_ns() when it was released
+        :param count: The number of permits released
+        :param failed: The release failed, the hold goes on
+        """
+        try:
+            tid, held = self._local.thread
+        except AttributeError:
+            tid, held = self.current_thread()
+        key = id(sem)
+        if not failed and held:
+            if held[-1][0] == key:
+                # Released in the reverse order of acquiring, the usual case
+                entry = held.pop()
+            else:
+                entry = None
+                for index in range(len(held) - 2, -1, -1):
+                    if held[index][0] == key:
+                        entry = held.pop(index)
+                        break
+            if entry is not None:
+                self._spans[next(self._counter) % self.capacity] = (
+                    HOLD, sem.name, tid, entry[1], end_ns, entry[3],
+                    entry[2])
+                return
+        self._spans[next(self._counter) % self.capacity] = (
+            RELEASE, sem.name, tid, end_ns, end_ns,
+            FAILED if failed else RELEASED, count)
+
+    def set_hold_outcome(self, sem: Semaphore, outcome: str) -> None:
+        """
+        Set the outcome of the calling thread's newest hold of a semaphore,
+        recorded when it's released
+        """
+        key = id(sem)
+        held = self.current_thread()[1]
+        for index in range(len(held) - 1, -1, -1):
+            if held[index][0] == key:
+                held[index][3] = outcome
+                return
+
+    @property
+    def recorded(self) -> int:
+        """
+        The number of spans recorded since the tracer was created or
+        cleared, including those since replaced
+        """
+        # count() can't be read without advancing it, but its repr shows
+        # the next value
+        return int(repr(self._counter)[6:-1])
+
+    @property
+    def dropped(self) -> int:
+        """
+        The number of spans replaced by newer ones
+        """
+        return max(0, self.recorded - self.capacity)
+
+    def spans(self) -> List[Tuple[Any, ...]]:
+        """
+        The spans kept, oldest first
+
+        :returns: Tuples of kind, semaphore name, thread id, start and end
+            in perf_counter_ns(), outcome and count
+        """
+        spans = [span for span in list(self._spans) if span is not None]
+        spans.sort(key=lambda span: span[3])
+        return spans
+
+    def clear(self) -> None:
+        """
+        Forget every span, holds in progress are still recorded
+        """
+        self._spans = [None] * self.capacity
+        self._counter = itertools.count()
+
+    def events(self) -> List[Dict[str, Any]]:
+        """
+        The spans as Chrome Trace Event Format events, named after the
+        process and with timestamps in microseconds
+
+        https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+        """
+        pid = self.pid
+        program = os.path.basename(sys.argv[0]) if sys.argv and \
+            sys.argv[0] else 'python'
+        events: List[Dict[str, Any]] = [{
+            'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+            'args': {'name': f'{program} ({pid})'},
+        }]
+        for kind, name, tid, start_ns, end_ns, outcome, count in \
+                self.spans():
+            label = '(unnamed)' if name is None else name
+            event = {
+                'name': f'{kind} {label}',
+                'cat': f'semaphore.{kind}',
+                'pid': pid,
+                'tid': tid,
+                'ts': start_ns / 1000,
+                'args': {'semaphore': name, 'outcome': outcome,
+                         'count': count},
+            }
+            if kind == RELEASE:
+                event['ph'] = 'i'
+                event['s'] = 't'
+            else:
+                event['ph'] = 'X'
+                event['dur'] = (end_ns - start_ns) / 1000
+            events.append(event)
+        return events
+
+    def dump(self, destination: Union[str, IO[str]]) -> None:
+        """
+        Write the spans as a Chrome Trace Event JSON file, which Perfetto
+        and chrome://tracing open
+
+        :param destination: A path, or a text file
+        """
+        _write({'traceEvents': self.events(), 'displayTimeUnit': 'ms'},
+               destination)
+
+
+def _write(trace: Dict[str, Any], destination: Union[str, IO[str]]) -> None:
+    if isinstance(destination, (str, os.PathLike)):
+        with open(destination, 'w') as file:
+            json.dump(trace, file)
+    else:
+        json.dump(trace, destination)
+
+
+def merge_traces(sources: Iterable[Union[str, IO[str]]],
+                 destination: Union[str, IO[str]]) -> None:
+    """
+    Merge the dumps of several processes into one trace
+
+    :param sources: Paths, or text files, written by SemaphoreTracer.dump()
+    :param destination: A path, or a text file
+    """
+    events: List[Dict[str, Any]] = []
+    for source in sources:
+        if isinstance(source, (str, os.PathLike)):
+            with open(source) as file:
+                trace = json.load(file)
+        else:
+            trace = json.load(source)
+        # A bare list of events is valid Trace Event Format too
+        events.extend(trace['traceEvents'] if isinstance(trace, dict)
+                      else trace)
+    _write({'traceEvents': events, 'displayTimeUnit': 'ms'}, destination)
+
+
+def enable_tracing(capacity: int = DEFAULT_CAPACITY) -> SemaphoreTracer:
+    """
+    Trace every Semaphore created from now on
+
+    :param capacity: The number of spans kept, when the process has no
+        tracer yet (default: 65536)
+    :returns: The process's tracer
+    """
+    tracer = _semaphore._tracer
+    if tracer is None:
+        tracer = _semaphore._tracer = SemaphoreTracer(capacity)
+    return tracer
+
+
+def disable_tracing() -> None:
+    """
+    Stop tracing semaphores created from now on, existing ones keep their
+    tracer
+    """
+    _semaphore._tracer = None
+
+
+def get_tracer() -> Optional[SemaphoreTracer]:
+    """
+    The tracer of new semaphores, None unless enable_tracing() was called
+    """
+    return _semaphore._tracer
+
+
+def _after_fork_in_child() -> None:
+    # The parent's spans are the parent's to dump
+    for tracer in list(_tracers):
+        tracer._reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
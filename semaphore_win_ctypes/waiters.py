@@ -0,0 +1,554 @@
+"""Acquires serviced by a few shared waiter threads, see acquire_future()."""
+from __future__ import annotations
+import collections
+import concurrent.futures
+import math
+import os
+import selectors
+import threading
+import time
+import weakref
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from .backend import SemaphoreBackend
+from .constants import MAXIMUM_WAIT_OBJECTS, SEMAPHORE_ALL_ACCESS
+from .exceptions import SemaphoreWaitTimeoutException
+
+# Semaphores one waiter thread waits on with wait_any(): one slot of
+# WaitForMultipleObjects is taken by the semaphore that wakes the thread
+MULTI_WAIT_CAPACITY = MAXIMUM_WAIT_OBJECTS - 1
+
+# File descriptors one waiter thread waits on with a selector, for backends
+# whose semaphores have one
+SELECTOR_CAPACITY = 1024
+
+# How long a waiter thread with nothing to wait on lingers before exiting
+IDLE_TIMEOUT_S = 1.0
+
+# A thread using at most this share of its capacity hands its waits to
+# another thread with room for them, and exits
+MERGE_RATIO = 0.25
+
+# Called before the Future completes with True when acquired, False on
+# time-out and None when cancelled, and with (None, True) when the wait
+# failed with an OSError
+Recorder = Callable[..., None]
+
+_pools: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_pools_lock = threading.Lock()
+
+
+class _Waiter:
+    __slots__ = ('handle', 'key', 'future', 'result', 'deadline', 'record')
+
+    def __init__(self, handle: Any, key: Any,
+                 future: concurrent.futures.Future, result: Any,
+                 deadline: Optional[float], record: Optional[Recorder]):
+        self.handle = handle
+        self.key = key
+        self.future = future
+        self.result = result
+        self.deadline = deadline
+        self.record = record
+
+
+class _WaiterThread:
+    """
+    One thread waiting on the semaphores of some waiters, grouped by key so
+    that a semaphore is waited on once however many waiters it has
+    """
+
+    capacity: int = MULTI_WAIT_CAPACITY
+
+    def __init__(self, pool: WaiterPool):
+        self.pool = pool
+        self.backend = pool.backend
+        # Waiters of each key, first come first served
+        self.groups: Dict[Any, Deque[_Waiter]] = {}
+        # Bumped, under the pool lock, every time the thread is about to
+        # wait on a new set of semaphores, see WaiterPool.cancel()
+        self.generation = 0
+        # Waiters are only swept for time-outs and cancellations once the
+        # nearest deadline is due or a Future was cancelled
+        self.sweep_at: Optional[float] = None
+        self.dirty = False
+        self.exited = False
+        self.woken = False
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name='SemaphoreWaiter')
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def wake(self) -> None:
+        # Called with the pool lock held
+        if not self.woken:
+            self.woken = True
+            self._signal()
+
+    def _signal(self) -> None:
+        raise NotImplementedError
+
+    def _wait(self, keys: List[Any], handles: List[Any],
+              timeout_ms: Optional[int]) -> List[Any]:
+        # The key of each permit taken, for the first waiter of its group
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        raise NotImplementedError
+
+    def _run(self) -> None:
+        pool = self.pool
+        # Callables that complete futures, run without the pool lock since
+        # Future callbacks may take it
+        finish: List[Callable[[], None]] = []
+        granted: List[Any] = []
+        waited: Dict[Any, Any] = {}
+        idle_since = None
+        while True:
+            with pool.lock:
+                for key in granted:
+                    self._grant(key, waited[key], finish)
+                now = time.monotonic()
+                if self.dirty or (self.sweep_at is not None
+                                  and self.sweep_at <= now):
+                    self.dirty = False
+                    self.sweep_at = self._sweep(now, finish)
+                deadline = self.sweep_at
+                if self.groups:
+                    idle_since = None
+                    self._merge()
+                elif idle_since is None:
+                    idle_since = now
+                elif now - idle_since >= pool.idle_timeout_s:
+                    self.exited = True
+                    pool.threads.remove(self)
+                if not self.exited and self.groups:
+                    # Rotated, so a busy semaphore at the front can't keep
+                    # the ones after it waiting for ever
+                    keys = list(self.groups)
+                    shift = self.generation % len(keys)
+                    keys = keys[shift:] + keys[:shift]
+                else:
+                    keys = []
+                handles = [pool.handles[key] for key in keys]
+                waited = dict(zip(keys, handles))
+                self.generation += 1
+                pool.changed.notify_all()
+            for done in finish:
+                try:
+                    done()
+                except Exception:
+                    # A failed release must not strand the other waiters
+                    pass
+            finish.clear()
+            if self.exited:
+                self._close()
+                return
+            if deadline is None and not keys:
+                deadline = idle_since + pool.idle_timeout_s
+            timeout_ms = None
+            if deadline is not None:
+                timeout_ms = max(0, math.ceil(
+                    (deadline - time.monotonic()) * 1000))
+            try:
+                granted = self._wait(keys, handles, timeout_ms)
+            except OSError as exc:
+                granted = []
+                with pool.lock:
+                    self._fail(keys, exc, finish)
+
+    def _grant(self, key: Any, handle: Any,
+               finish: List[Callable[[], None]]) -> None:
+        # A permit was taken through handle, for the first live waiter of
+        # its key
+        group = self.groups.get(key)
+        while group:
+            waiter = group.popleft()
+            # Never runs Future callbacks, unlike completing the Future
+            if waiter.future.set_running_or_notify_cancel():
+                finish.append(lambda waiter=waiter: _complete(waiter, True))
+                break
+            finish.append(lambda waiter=waiter: _record(waiter, None))
+        else:
+            # Every waiter went away while the permit was being taken.
+            # Released with the lock held, so that once cancel() returns
+            # the handle is never used again.
+            try:
+                self.backend.release(handle, 1)
+            except OSError:
+                pass
+        if group is not None and not group:
+            self._forget(key)
+
+    def _sweep(self, now: float, finish: List[Callable[[], None]]
+               ) -> Optional[float]:
+        # Drop cancelled and timed out waiters, returns the next deadline
+        nearest = None
+        for key in list(self.groups):
+            group = self.groups[key]
+            kept = collections.deque()
+            for waiter in group:
+                if waiter.future.cancelled():
+                    finish.append(lambda waiter=waiter: _record(waiter, None))
+                elif waiter.deadline is not None and waiter.deadline <= now:
+                    finish.append(lambda waiter=waiter: _timed_out(waiter))
+                else:
+                    kept.append(waiter)
+                    if waiter.deadline is not None and (
+                            nearest is None or waiter.deadline < nearest):
+                        nearest = waiter.deadline
+            if kept:
+                self.groups[key] = kept
+                # The handle waited on is a live waiter's, the others may
+                # be closed once their waits are cancelled
+                self.pool.handles[key] = kept[0].handle
+            else:
+                self._forget(key)
+        return nearest
+
+    def _fail(self, keys: List[Any], exc: OSError,
+              finish: List[Callable[[], None]]) -> None:
+        # The wait itself failed, a handle may have been closed under it
+        for key in keys:
+            for waiter in self.groups.get(key, ()):
+                finish.append(lambda waiter=waiter: _failed(waiter, exc))
+            self._forget(key)
+
+    def _forget(self, key: Any) -> None:
+        self.groups.pop(key, None)
+        pool = self.pool
+        if pool.owners.get(key) is self:
+            del pool.owners[key]
+            del pool.handles[key]
+
+    def _merge(self) -> None:
+        # Rebalance: a thread that has little left to wait on moves its
+        # waits to the busiest thread that has room for them, and exits
+        pool = self.pool
+        if len(self.groups) > self.capacity * MERGE_RATIO:
+            return
+        others = [thread for thread in pool.threads
+                  if thread is not self and type(thread) is type(self)
+                  and len(thread.groups) + len(self.groups)
+                  <= thread.capacity]
+        if not others:
+            return
+        target = max(others, key=lambda thread: len(thread.groups))
+        for key, group in self.groups.items():
+            target.groups[key] = group
+            pool.owners[key] = target
+        self.groups = {}
+        target.dirty = True
+        target.wake()
+        self.exited = True
+        pool.threads.remove(self)
+        pool.merges += 1
+
+
+class _MultiWaitThread(_WaiterThread):
+    """
+    Waits with the backend's wait_any(), which is WaitForMultipleObjects on
+    Windows, on up to 63 semaphores and one more that wakes the thread
+    """
+
+    def __init__(self, pool: WaiterPool):
+        super().__init__(pool)
+        self.wake_handle = self.backend.create(None, 0, 1,
+                                               SEMAPHORE_ALL_ACCESS)
+
+    def _signal(self) -> None:
+        self.backend.release(self.wake_handle, 1)
+
+    def _wait(self, keys: List[Any], handles: List[Any],
+              timeout_ms: Optional[int]) -> List[Any]:
+        # The wake semaphore last: the lowest index wins, so a waiter's
+        # permit is never left behind for a wake-up
+        backend = self.backend
+        index = backend.wait_any(handles + [self.wake_handle], timeout_ms)
+        if index is None:
+            return []
+        if index == len(keys):
+            with self.pool.lock:
+                self.woken = False
+            return []
+        key = keys[index]
+        with self.pool.lock:
+            wanted_permits = len(self.groups.get(key, ()))
+        # More permits may be free, take them for the other waiters without
+        # blocking rather than one per wait
+        granted = [key]
+        while len(granted) < wanted_permits and \
+                backend.wait(handles[index], 0):
+            granted.append(key)
+        return granted
+
+    def _close(self) -> None:
+        self.backend.close(self.wake_handle)
+
+
+class _SelectorThread(_WaiterThread):
+    """
+    Waits for the file descriptors of up to 1024 semaphores to become
+    readable with a selector, epoll on Linux, and takes permits without
+    blocking
+    """
+
+    capacity = SELECTOR_CAPACITY
+
+    def __init__(self, pool: WaiterPool):
+        super().__init__(pool)
+        self.selector = selectors.DefaultSelector()
+        self.wake_read, self.wake_write = os.pipe()
+        os.set_blocking(self.wake_read, False)
+        self.selector.register(self.wake_read, selectors.EVENT_READ)
+        self.registered = set()
+
+    def _signal(self) -> None:
+        os.write(self.wake_write, b'\0')
+
+    def _wait(self, keys: List[Any], handles: List[Any],
+              timeout_ms: Optional[int]) -> List[Any]:
+        # Keys are file descriptors, registered here since selectors aren't
+        # thread safe
+        selector = self.selector
+        wanted = set(keys)
+        for fd in self.registered - wanted:
+            selector.unregister(fd)
+        for fd in wanted - self.registered:
+            selector.register(fd, selectors.EVENT_READ)
+        self.registered = wanted
+        ready = selector.select(None if timeout_ms is None
+                                else timeout_ms / 1000)
+        granted = []
+        backend = self.backend
+        waited = dict(zip(keys, handles))
+        for selector_key, _ in ready:
+            fd = selector_key.fd
+            if fd == self.wake_read:
+                with self.pool.lock:
+                    self.woken = False
+                    try:
+                        os.read(self.wake_read, 64)
+                    except BlockingIOError:
+                        pass
+                continue
+            with self.pool.lock:
+                group = self.groups.get(fd)
+                wanted_permits = len(group) if group else 0
+            handle = waited[fd]
+            # Readable means the count may be non-zero: take as many permits
+            # as there are waiters, without blocking
+            while wanted_permits and backend.wait(handle, 0):
+                granted.append(fd)
+                wanted_permits -= 1
+        return granted
+
+    def _close(self) -> None:
+        self.selector.close()
+        os.close(self.wake_read)
+        os.close(self.wake_write)
+
+
+class WaiterPool:
+    """
+    The waiter threads of one backend, shared by every acquire_future()
+
+    A blocked acquire() parks its own thread in the kernel. A pool parks
+    each thread on many semaphores at once instead, and completes a
+    concurrent.futures.Future per acquire: with wait_any() on up to 63
+    semaphores per thread, WaitForMultipleObjects on Windows, or with a
+    selector on up to 1024 file descriptors per thread for backends whose
+    semaphores have one, like eventfd. The posix backend has neither, so its
+    waiter threads poll their semaphores with backoff, like wait_any().
+
+    All the waiters of one semaphore handle are served by the same thread,
+    first come first served. A new semaphore goes to the least busy thread
+    that has room, or to a new thread. A thread that drops to a quarter of
+    its capacity hands its waits to the busiest thread that can take them
+    and exits, and one without waits exits after idle_timeout_s.
+    """
+
+    def __init__(self, backend: SemaphoreBackend,
+                 idle_timeout_s: float = IDLE_TIMEOUT_S):
+        """
+        :param backend: The backend of every semaphore waited on
+        :param idle_timeout_s: How long a thread without waits lingers
+            (default: 1 second)
+        """
+        self.backend = backend
+        self.idle_timeout_s = idle_timeout_s
+        self.lock = threading.Lock()
+        # Notified whenever a thread starts waiting on a new set of
+        # semaphores
+        self.changed = threading.Condition(self.lock)
+        self.threads: List[_WaiterThread] = []
+        # The thread waiting on each key, and the handle it waits on
+        self.owners: Dict[Any, _WaiterThread] = {}
+        self.handles: Dict[Any, Any] = {}
+        #: Threads started, and merged into another one
+        self.started = 0
+        self.merges = 0
+
+    @property
+    def pending(self) -> int:
+        """
+        The waits not yet granted, timed out or cancelled
+        """
+        with self.lock:
+            return sum(len(group) for thread in self.threads
+                       for group in thread.groups.values())
+
+    def _key(self, handle: Any) -> Any:
+        fd = self.backend.fileno(handle)
+        return handle if fd is None else fd
+
+    def submit(self,
+               handle: Any,
+               timeout_ms: Optional[int],
+               result: Any = None,
+               record: Recorder = None,
+               ) -> concurrent.futures.Future:
+        """
+        Acquire a semaphore on a waiter thread
+
+        :param handle: A handle returned by create() or open(), which must
+            stay open until the Future is done, see cancel()
+        :param timeout_ms: The time-out interval, in milliseconds, None
+            waits forever
+        :param result: What the Future returns once acquired
+        :param record: Called on the waiter thread before the Future
+            completes, see Recorder
+        :returns: A Future of result that raises
+            SemaphoreWaitTimeoutException on time-out and OSError when the
+            wait failed. Cancelling it gives the permit back, if it was
+            taken in the meantime.
+        """
+        future = concurrent.futures.Future()
+        deadline = None
+        if timeout_ms is not None:
+            deadline = time.monotonic() + timeout_ms / 1000
+        waiter = _Waiter(handle, self._key(handle), future, result,
+                         deadline, record)
+        # Uncontended acquires never reach a waiter thread
+        try:
+            acquired = self.backend.wait(handle, 0)
+        except OSError as exc:
+            _failed(waiter, exc)
+            return future
+        if acquired:
+            # Not shared with any thread yet, nothing can cancel it
+            future.set_running_or_notify_cancel()
+            _complete(waiter, True)
+            return future
+        if timeout_ms == 0:
+            _timed_out(waiter)
+            return future
+        with self.lock:
+            thread = self.owners.get(waiter.key)
+            if thread is None:
+                thread = self._thread_with_room(waiter.key is not handle)
+                self.owners[waiter.key] = thread
+                self.handles[waiter.key] = handle
+            thread.groups.setdefault(waiter.key,
+                                     collections.deque()).append(waiter)
+            if deadline is not None and (thread.sweep_at is None
+                                         or deadline < thread.sweep_at):
+                thread.sweep_at = deadline
+            thread.wake()
+        future.add_done_callback(
+            lambda future, key=waiter.key: self._done(future, key))
+        return future
+
+    def _thread_with_room(self, selectable: bool) -> _WaiterThread:
+        # Called with the lock held
+        cls = _SelectorThread if selectable else _MultiWaitThread
+        candidates = [thread for thread in self.threads
+                      if type(thread) is cls and not thread.exited
+                      and len(thread.groups) < thread.capacity]
+        if candidates:
+            return min(candidates, key=lambda thread: len(thread.groups))
+        thread = cls(self)
+        self.threads.append(thread)
+        self.started += 1
+        thread.start()
+        return thread
+
+    def _done(self, future: concurrent.futures.Future, key: Any) -> None:
+        # A cancelled Future's waiter is dropped by its thread once woken
+        if future.cancelled():
+            with self.lock:
+                thread = self.owners.get(key)
+                if thread is not None:
+                    thread.dirty = True
+                    thread.wake()
+
+    def cancel(self, handle: Any) -> int:
+        """
+        Cancel the waits on a handle, so that it can be closed
+
+        Returns once no waiter thread is waiting on the handle any more.
+
+        :returns: The Futures cancelled
+        """
+        key = self._key(handle)
+        with self.lock:
+            thread = self.owners.get(key)
+            if thread is None:
+                return 0
+            waiters = [waiter for waiter in thread.groups.get(key, ())
+                       if waiter.handle is handle]
+        cancelled = sum(waiter.future.cancel() for waiter in waiters)
+        if threading.current_thread() is thread.thread:
+            return cancelled
+        with self.lock:
+            generation = thread.generation
+            thread.wake()
+            # The thread is out of its wait, and has left the handle out of
+            # the next one
+            self.changed.wait_for(
+                lambda: thread.generation > generation or thread.exited)
+        return cancelled
+
+
+def get_waiter_pool(backend: SemaphoreBackend) -> WaiterPool:
+    """
+    The waiter pool of a backend, created on first use
+    """
+    pool = _pools.get(backend)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(backend)
+            if pool is None:
+                pool = _pools[backend] = WaiterPool(backend)
+    return pool
+
+
+def _complete(waiter: _Waiter, acquired: Optional[bool],
+              exc: BaseException = None) -> None:
+    # The Future is running, set_running_or_notify_cancel() returned True
+    _record(waiter, acquired, isinstance(exc, OSError))
+    if acquired:
+        waiter.future.set_result(waiter.result)
+    else:
+        waiter.future.set_exception(exc)
+
+
+def _timed_out(waiter: _Waiter) -> None:
+    if waiter.future.set_running_or_notify_cancel():
+        _complete(waiter, False, SemaphoreWaitTimeoutException())
+    else:
+        _record(waiter, None)
+
+
+def _failed(waiter: _Waiter, exc: OSError) -> None:
+    if waiter.future.set_running_or_notify_cancel():
+        _complete(waiter, None, exc)
+    else:
+        _record(waiter, None)
+
+
+def _record(waiter: _Waiter, acquired: Optional[bool],
+            failed: bool = False) -> None:
+    if waiter.record is not None:
+        waiter.record(acquired, failed)
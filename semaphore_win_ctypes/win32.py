@@ -0,0 +1,377 @@
+"""Windows Semaphore Objects, through kernel32."""
+from __future__ import annotations
+import threading
+from ctypes import byref, sizeof
+from typing import Any, Callable, MutableSequence, Optional, Sequence, \
+    Tuple
+
+from .backend import SemaphoreBackend
+from .constants import DUPLICATE_SAME_ACCESS, INFINITE, \
+    INVALID_HANDLE_VALUE, MAXIMUM_WAIT_OBJECTS, SEMAPHORE_ALL_ACCESS, \
+    STATUS_SUCCESS, WAIT_FAILED, WAIT_OBJECT_0, WAIT_TIMEOUT
+from .kernel32 import BOOL, DWORD, HANDLE, LONG, LPCWSTR, \
+    SEMAPHORE_BASIC_INFORMATION, WAITORTIMERCALLBACK, \
+    WT_EXECUTEINWAITTHREAD, WT_EXECUTEONLYONCE, \
+    SemaphoreBasicInformation, get_kernel32, nt_error, win_error
+
+
+class RegisteredWait:
+    """
+    A wait registered with RegisterWaitForSingleObject
+    """
+
+    def __init__(self, kernel32: Any, wait_handle: HANDLE, callback: Any):
+        self.kernel32 = kernel32
+        self.wait_handle = wait_handle
+        # ctypes doesn't keep the callback alive, the thread pool needs it
+        # until the wait is unregistered
+        self.callback = callback
+
+    def unregister(self) -> None:
+        """
+        UnregisterWaitEx, waiting for a running callback to return
+
+        https://docs.microsoft.com/en-us/windows/win32/sync/unregisterwaitex
+        """
+        if self.wait_handle is None:
+            return
+        ret: BOOL = self.kernel32.UnregisterWaitEx(
+            self.wait_handle,
+            INVALID_HANDLE_VALUE
+        )
+        self.wait_handle = None
+        self.callback = None
+        if not ret:
+            raise win_error(self.kernel32)
+
+
+class Win32Backend(SemaphoreBackend):
+    """
+    Semaphore Objects provided by the Windows API, interoperable with any
+    other program calling CreateSemaphoreExW or OpenSemaphoreW.
+
+    wait() and release() are the hot path: they call functions bound once
+    per function table, pass plain ints that the prototypes convert, and
+    receive the previous count in a buffer each thread reuses, so they
+    allocate no ctypes objects.
+    """
+    name = 'win32'
+
+    def __init__(self, kernel32: Any = None):
+        """
+        :param kernel32: The function table to call through (default: the
+            table returned by get_kernel32() at the time of each call)
+        """
+        self._kernel32 = kernel32
+        # (table, WaitForSingleObject, ReleaseSemaphore), see _functions()
+        self._bound: Optional[Tuple[Any, Any, Any]] = None
+        # Per thread: a LONG for ReleaseSemaphore's lpPreviousCount, and a
+        # byref() to it
+        self._buffers = threading.local()
+
+    @property
+    def kernel32(self) -> Any:
+        if self._kernel32 is not None:
+            return self._kernel32
+        return get_kernel32()
+
+    def _functions(self) -> Tuple[Any, Any, Any]:
+        # The hot path functions of the current table, bound again only
+        # when set_kernel32() replaced the table
+        kernel32 = self._kernel32
+        if kernel32 is None:
+            kernel32 = get_kernel32()
+        bound = self._bound
+        if bound is None or bound[0] is not kernel32:
+            bound = self._bound = (kernel32,
+                                   kernel32.WaitForSingleObject,
+                                   kernel32.ReleaseSemaphore)
+        return bound
+
+    def _previous_count(self) -> Tuple[LONG, Any]:
+        buffers = self._buffers
+        try:
+            return buffers.previous_count
+        except AttributeError:
+            previous_count = LONG(0)
+            buffers.previous_count = (previous_count, byref(previous_count))
+            return buffers.previous_count
+
+    def create(self,
+               name: Optional[str],
+               initial_count: int,
+               maximum_count: int,
+               desired_access: DWORD,
+               ) -> HANDLE:
+        """
+        https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-createsemaphoreexw
+        """
+        kernel32 = self.kernel32
+        handle: HANDLE = kernel32.CreateSemaphoreExW(
+            None,
+            LONG(initial_count),
+            LONG(maximum_count),
+            LPCWSTR(name),
+            DWORD(0),  # reserved
+            desired_access,
+        )
+        if not handle:
+            raise win_error(kernel32)
+        return handle
+
+    def open(self,
+             name: str,
+             desired_access: DWORD,
+             inherit: bool,
+             ) -> HANDLE:
+        """
+        https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-opensemaphorew
+        """
+        kernel32 = self.kernel32
+        handle: HANDLE = kernel32.OpenSemaphoreW(
+            desired_access,
+            BOOL(inherit),
+            LPCWSTR(name)
+        )
+        if not handle:
+            raise win_error(kernel32)
+        return handle
+
+    def wait(self, handle: HANDLE, timeout_ms: Optional[int]) -> bool:
+        """
+        https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-waitforsingleobject
+        """
+        kernel32, wait_for_single_object, _ = self._functions()
+        ret: DWORD = wait_for_single_object(
+            handle,
+            INFINITE if timeout_ms is None else timeout_ms
+        )
+        if ret == WAIT_OBJECT_0:
+            return True
+        elif ret == WAIT_TIMEOUT:
+            return False
+        elif ret == WAIT_FAILED:
+            raise win_error(kernel32)
+        else:
+            assert False, f"Unexpected return code: {ret}"
+
+    def _wait_multiple(self,
+                       handles: Sequence[HANDLE],
+                       wait_all: bool,
+                       timeout_ms: Optional[int],
+                       ) -> Optional[int]:
+        """
+        https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-waitformultipleobjects
+        """
+        count = len(handles)
+        if not 0 < count <= MAXIMUM_WAIT_OBJECTS:
+            raise ValueError(f"Can wait on 1 to {MAXIMUM_WAIT_OBJECTS} "
+                             f"objects, not {count}")
+        kernel32 = self.kernel32
+        ret: DWORD = kernel32.WaitForMultipleObjects(
+            count,
+            (HANDLE * count)(*handles),
+            wait_all,
+            INFINITE if timeout_ms is None else timeout_ms
+        )
+        if WAIT_OBJECT_0 <= ret < WAIT_OBJECT_0 + count:
+            return ret - WAIT_OBJECT_0
+        elif ret == WAIT_TIMEOUT:
+            return None
+        elif ret == WAIT_FAILED:
+            raise win_error(kernel32)
+        else:
+            assert False, f"Unexpected return code: {ret}"
+
+    def wait_any(self,
+                 handles: Sequence[HANDLE],
+                 timeout_ms: Optional[int],
+                 ) -> Optional[int]:
+        return self._wait_multiple(handles, False, timeout_ms)
+
+    def wait_all(self,
+                 handles: Sequence[HANDLE],
+                 timeout_ms: Optional[int],
+                 ) -> bool:
+        # Atomic: the kernel takes every permit at once, or none
+        return self._wait_multiple(handles, True, timeout_ms) is not None
+
+    def create_event(self) -> HANDLE:
+        """
+        https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-createeventw
+        """
+        kernel32 = self.kernel32
+        handle: HANDLE = kernel32.CreateEventW(
+            None,
+            True,  # bManualReset
+            False,  # bInitialState
+            None
+        )
+        if not handle:
+            raise win_error(kernel32)
+        return handle
+
+    def set_event(self, event: HANDLE) -> None:
+        """
+        https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-setevent
+        """
+        kernel32 = self.kernel32
+        ret: BOOL = kernel32.SetEvent(
+            event
+        )
+        if not ret:
+            raise win_error(kernel32)
+
+    def close_event(self, event: HANDLE) -> None:
+        self.close(event)
+
+    def wait_cancellable(self,
+                         handle: HANDLE,
+                         event: HANDLE,
+                         timeout_ms: Optional[int],
+                         ) -> Optional[bool]:
+        # One WaitForMultipleObjects on both. The event comes first, the
+        # lowest signaled index wins, so a set event never takes a permit.
+        index = self._wait_multiple((event, handle), False, timeout_ms)
+        if index is None:
+            return False
+        return None if index == 0 else True
+
+    def release(self, handle: HANDLE, release_count: int) -> int:
+        """
+        https://docs.microsoft.com/en-us/windows/win32/api/synchapi/nf-synchapi-releasesemaphore
+        """
+        kernel32, _, release_semaphore = self._functions()
+        previous_count, previous_count_ref = self._previous_count()
+        ret: BOOL = release_semaphore(
+            handle,
+            release_count,
+            previous_count_ref
+        )
+        if not ret:
+            raise win_error(kernel32)
+        return previous_count.value
+
+    def query(self, handle: HANDLE) -> Tuple[int, int]:
+        """
+        NtQuerySemaphore, which needs SEMAPHORE_QUERY_STATE access
+        """
+        kernel32 = self.kernel32
+        info = SEMAPHORE_BASIC_INFORMATION()
+        status = kernel32.NtQuerySemaphore(
+            handle,
+            SemaphoreBasicInformation,
+            byref(info),
+            sizeof(info),
+            None
+        )
+        if status != STATUS_SUCCESS:
+            raise nt_error(kernel32, status)
+        return info.CurrentCount, info.MaximumCount
+
+    def query_counts(self, handles: Sequence[HANDLE],
+                     counts: MutableSequence[int]) -> None:
+        # One SEMAPHORE_BASIC_INFORMATION for every handle
+        kernel32 = self.kernel32
+        nt_query_semaphore = kernel32.NtQuerySemaphore
+        info = SEMAPHORE_BASIC_INFORMATION()
+        info_ref = byref(info)
+        info_size = sizeof(info)
+        for index, handle in enumerate(handles):
+            status = nt_query_semaphore(handle, SemaphoreBasicInformation,
+                                        info_ref, info_size, None)
+            if status != STATUS_SUCCESS:
+                raise nt_error(kernel32, status)
+            counts[index] = info.CurrentCount
+
+    def close(self, handle: HANDLE) -> None:
+        """
+        https://docs.microsoft.com/en-us/windows/win32/api/handleapi/nf-handleapi-closehandle
+        """
+        kernel32 = self.kernel32
+        ret: BOOL = kernel32.CloseHandle(
+            handle
+        )
+        if not ret:
+            raise win_error(kernel32)
+
+    def share(self, handle: HANDLE, name: Optional[str]) -> Any:
+        """
+        A duplicate of the handle in the other process, named or not
+
+        While multiprocessing starts a child, the handle is duplicated into
+        it. Otherwise, as when it's sent through a Queue, the handle is
+        duplicated here and the receiving process takes the duplicate over
+        with DUPLICATE_CLOSE_SOURCE.
+        """
+        from multiprocessing import context, reduction
+        popen = context.get_spawning_popen()
+        if popen is not None:
+            return popen.duplicate_for_child(handle)
+        return reduction.DupHandle(handle, SEMAPHORE_ALL_ACCESS)
+
+    def share_inheritable(self, handle: HANDLE, name: Optional[str]
+                          ) -> Tuple[int, Sequence[int]]:
+        """
+        An inheritable duplicate of the handle, whose value the child uses
+
+        https://docs.microsoft.com/en-us/windows/win32/api/handleapi/nf-handleapi-duplicatehandle
+        """
+        kernel32 = self.kernel32
+        process = kernel32.GetCurrentProcess()
+        inherited = HANDLE()
+        ret: BOOL = kernel32.DuplicateHandle(
+            process,
+            handle,
+            process,
+            byref(inherited),
+            DWORD(0),  # ignored with DUPLICATE_SAME_ACCESS
+            BOOL(True),
+            DWORD(DUPLICATE_SAME_ACCESS),
+        )
+        if not ret:
+            raise win_error(kernel32)
+        return inherited.value, (inherited.value,)
+
+    def close_inherited(self, inherited: Sequence[int]) -> None:
+        for handle in inherited:
+            self.close(handle)
+
+    def adopt(self, shared: Any) -> HANDLE:
+        if hasattr(shared, 'detach'):
+            # A reduction.DupHandle: take the duplicate over
+            return shared.detach()
+        return shared
+
+    def register_wait(self,
+                      handle: HANDLE,
+                      timeout_ms: Optional[int],
+                      callback: Callable[[bool], None],
+                      ) -> RegisteredWait:
+        """
+        https://docs.microsoft.com/en-us/windows/win32/api/winbase/nf-winbase-registerwaitforsingleobject
+        """
+        kernel32 = self.kernel32
+
+        def wait_or_timer_callback(parameter, timer_or_wait_fired):
+            callback(not timer_or_wait_fired)
+
+        function = WAITORTIMERCALLBACK(wait_or_timer_callback)
+        wait_handle = HANDLE()
+        ret: BOOL = kernel32.RegisterWaitForSingleObject(
+            byref(wait_handle),
+            handle,
+            function,
+            None,
+            INFINITE if timeout_ms is None else timeout_ms,
+            # The callback only schedules work on the event loop
+            WT_EXECUTEINWAITTHREAD | WT_EXECUTEONLYONCE,
+        )
+        if not ret:
+            raise win_error(kernel32)
+        return RegisteredWait(kernel32, wait_handle, function)
+
+    async def wait_async(self, handle: HANDLE, timeout_ms: Optional[int]
+                         ) -> bool:
+        from .aio import wait_registered
+        return await wait_registered(self, handle, timeout_ms)
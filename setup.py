@@ -33,6 +33,11 @@ setup(
         'Programming Language :: Python :: 3.10',
     ],
     description="A ctypes wrapper for Windows Semaphore Objects",
+    entry_points={
+        'console_scripts': [
+            'semaphore_win_ctypes=semaphore_win_ctypes.cli:main',
+        ],
+    },
     install_requires=[],
     license="MIT license",
     long_description=readme + '\n\n' + history,
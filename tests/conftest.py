@@ -0,0 +1,28 @@
+"""Fixtures shared by the tests."""
+
+import pytest
+import sys
+
+# Every backend that can run here: the win32 backend over the pure-Python
+# kernel32 stand-in runs everywhere
+BACKENDS = ['standin']
+if sys.platform == 'win32':
+    BACKENDS.append('win32')
+else:
+    BACKENDS.append('posix')
+if sys.platform.startswith('linux'):
+    BACKENDS.append('eventfd')
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    """
+    A backend instance or name, for each backend that can run here
+    """
+    if request.param == 'standin':
+        # Imported here, so a win32 import error fails the standin tests
+        # alone rather than the collection of every test
+        from semaphore_win_ctypes import StandInKernel32
+        from semaphore_win_ctypes.win32 import Win32Backend
+        return Win32Backend(kernel32=StandInKernel32())
+    return request.param
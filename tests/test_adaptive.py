@@ -0,0 +1,143 @@
+"""Tests for the adaptive concurrency limiter, against a latency model."""
+
+import pytest
+import threading
+import time
+
+from semaphore_win_ctypes import AcquireSemaphore, AdaptiveLimiter, \
+    ResizableSemaphore
+
+BASE_LATENCY_S = 0.01
+
+
+def latency(inflight, capacity):
+    # A downstream that serves capacity requests at once and queues the
+    # rest: beyond capacity, latency grows with the queue
+    return BASE_LATENCY_S * max(1.0, inflight / capacity)
+
+
+def drive(limiter, capacity, samples):
+    # Saturated load: every permit of the limit is in use
+    limits = []
+    for _ in range(samples):
+        inflight = limiter.limit
+        limiter.sample(latency(inflight, capacity), inflight)
+        limits.append(limiter.limit)
+    return limits
+
+
+@pytest.mark.parametrize('algorithm, options, low, high', [
+    # Backs off once over 1.2 times the base latency, at 24
+    ('aimd', {'target_latency_s': BASE_LATENCY_S * 1.2}, 20, 26),
+    # 1.5 times the lowest latency, plus square root headroom
+    ('gradient', {}, 30, 40),
+])
+def test_follows_capacity(backend, algorithm, options, low, high):
+    with ResizableSemaphore(limit=4, ceiling=256, backend=backend) as sem:
+        limiter = AdaptiveLimiter(sem, algorithm, **options)
+        limits = drive(limiter, 20, 3000)
+        assert low <= min(limits[-500:]) <= max(limits[-500:]) <= high
+        assert sem.limit == limiter.limit
+        # The downstream loses half its capacity
+        limits = drive(limiter, 10, 3000)
+        assert low / 2 <= min(limits[-500:]) <= max(limits[-500:]) \
+            <= high / 2 + 1
+        assert sem.limit == limiter.limit
+        # And gets it back
+        limits = drive(limiter, 20, 3000)
+        assert low <= min(limits[-500:])
+
+
+def test_idle_limit_does_not_grow(backend):
+    with ResizableSemaphore(limit=4, ceiling=64, backend=backend) as sem:
+        for algorithm in ('aimd', 'gradient'):
+            limiter = AdaptiveLimiter(sem, algorithm)
+            for _ in range(1000):
+                limiter.sample(BASE_LATENCY_S, inflight=1)
+            assert limiter.limit == 4
+
+
+def test_drops_and_bounds(backend):
+    with ResizableSemaphore(limit=10, ceiling=64, backend=backend) as sem:
+        limiter = AdaptiveLimiter(sem, min_limit=8, max_limit=12)
+        assert limiter.record_drop() == 9
+        assert limiter.record_drop() == 8
+        assert limiter.record_drop() == 8
+        assert sem.limit == 8
+        drive(limiter, 1000, 1000)
+        assert limiter.limit == 12
+        assert sem.limit == 12
+        with pytest.raises(ValueError):
+            AdaptiveLimiter(sem, 'vegas')
+        with pytest.raises(ValueError):
+            AdaptiveLimiter(sem, max_limit=65)
+
+
+def test_skips_resize_while_another_runs(backend):
+    with ResizableSemaphore(limit=10, ceiling=64, backend=backend) as sem:
+        limiter = AdaptiveLimiter(sem)
+        # As if another process were resizing, or had died doing so
+        sem.resizing.acquire(0)
+        assert limiter.record_drop() == 9
+        assert sem.limit == 10 and limiter.resizes == 0
+        sem.resizing.release()
+        assert limiter.record_drop() == 8
+        assert sem.limit == 8 and limiter.resizes == 1
+
+
+def test_applies_a_limit_set_while_releasing(backend):
+    with ResizableSemaphore(limit=10, ceiling=64, backend=backend) as sem:
+        limiter = AdaptiveLimiter(sem)
+        applying = limiter._applying
+
+        class Applying:
+            def acquire(self, blocking=True):
+                return applying.acquire(blocking)
+
+            def release(self):
+                if limiter.limit == 9:
+                    # Another thread drops, and finds this one applying
+                    limiter.record_drop()
+                applying.release()
+
+        limiter._applying = Applying()
+        assert limiter.record_drop() == 9
+        assert limiter.limit == 8
+        assert sem.limit == 8 and limiter.resizes == 2
+
+
+def test_release_one_permit(backend):
+    with ResizableSemaphore(limit=4, backend=backend) as sem:
+        limiter = AdaptiveLimiter(sem)
+        limiter.acquire(0)
+        with pytest.raises(ValueError):
+            limiter.release(2)
+        assert limiter.inflight == 1
+        limiter.release()
+        assert limiter.inflight == 0 and sem.getvalue() == 4
+
+
+def test_measures_acquire_semaphore(backend):
+    # Threads doing simulated downstream calls, timed by AcquireSemaphore
+    capacity = 4
+    with ResizableSemaphore(limit=2, ceiling=64, backend=backend) as sem:
+        limiter = AdaptiveLimiter(sem, target_latency_s=0.02)
+        stop = threading.Event()
+
+        def worker():
+            while not stop.is_set():
+                with AcquireSemaphore(limiter, timeout_ms=1000):
+                    time.sleep(latency(limiter.inflight, capacity) / 5)
+
+        workers = [threading.Thread(target=worker) for _ in range(16)]
+        for thread in workers:
+            thread.start()
+        time.sleep(0.5)
+        stop.set()
+        for thread in workers:
+            thread.join()
+        assert limiter.samples > 50
+        assert limiter.inflight == 0
+        assert limiter.resizes > 0
+        assert limiter.limit > 2
+        assert sem.getvalue() == sem.limit
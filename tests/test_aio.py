@@ -0,0 +1,80 @@
+"""Tests for waiting on a semaphore from asyncio."""
+
+import asyncio
+import pytest
+import time
+
+from semaphore_win_ctypes import AsyncAcquireSemaphore, CreateSemaphore, \
+    SemaphoreWaitTimeoutException
+
+
+def test_async_with(backend):
+    async def main():
+        with CreateSemaphore(backend=backend) as created:
+            async with AsyncAcquireSemaphore(created, timeout_ms=0) as a:
+                assert a.getvalue() == 0
+                with pytest.raises(SemaphoreWaitTimeoutException):
+                    await created.sem.acquire_async(0)
+            assert created.getvalue() == 1
+
+    asyncio.run(main())
+
+
+def test_timeout(backend):
+    async def main():
+        with CreateSemaphore(initial_count=0, backend=backend) as created:
+            start = time.monotonic()
+            with pytest.raises(SemaphoreWaitTimeoutException):
+                await created.sem.acquire_async(100)
+            assert 0.1 <= time.monotonic() - start <= 1
+            assert created.getvalue() == 0
+
+    asyncio.run(main())
+
+
+def test_wait_does_not_block_loop(backend):
+    async def main():
+        with CreateSemaphore(initial_count=0, backend=backend) as created:
+            task = asyncio.ensure_future(created.sem.acquire_async())
+            # The loop keeps running while the task waits
+            for _ in range(3):
+                await asyncio.sleep(0.01)
+            assert not task.done()
+            created.sem.release()
+            assert await asyncio.wait_for(task, 5) is created.sem
+            assert created.getvalue() == 0
+            created.sem.release()
+
+    asyncio.run(main())
+
+
+def test_cancel_while_waiting(backend):
+    async def main():
+        with CreateSemaphore(initial_count=0, backend=backend) as created:
+            task = asyncio.ensure_future(created.sem.acquire_async())
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            created.sem.release()
+            assert created.getvalue() == 1
+
+    asyncio.run(main())
+
+
+def test_cancel_after_release(backend):
+    async def main():
+        with CreateSemaphore(initial_count=0, backend=backend) as created:
+            task = asyncio.ensure_future(created.sem.acquire_async())
+            await asyncio.sleep(0.05)
+            created.sem.release()
+            # Give a waiting thread time to take the permit, without
+            # letting the task see it
+            time.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            # Whoever took the permit gave it back
+            assert created.getvalue() == 1
+
+    asyncio.run(main())
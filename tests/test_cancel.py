@@ -0,0 +1,182 @@
+"""Tests for cancellable waits."""
+
+import pytest
+import threading
+import time
+
+from semaphore_win_ctypes import AcquireSemaphore, CancellationToken, \
+    CreateSemaphore, SemaphoreWaitCancelledException, \
+    SemaphoreWaitTimeoutException, StandInKernel32
+from semaphore_win_ctypes.backend import CANCEL_SLICE_MS
+from semaphore_win_ctypes.constants import ERROR_INVALID_HANDLE, \
+    SEMAPHORE_ALL_ACCESS, WAIT_OBJECT_0
+
+
+def start_waiters(created, token, waiters, **kwargs):
+    """
+    Threads blocked in acquire(cancel=token), and what each one raised
+    """
+    outcomes = []
+    started = threading.Barrier(waiters + 1)
+
+    def waiter():
+        started.wait()
+        try:
+            created.sem.acquire(cancel=token, **kwargs)
+            outcomes.append('acquired')
+        except SemaphoreWaitCancelledException:
+            outcomes.append('cancelled')
+
+    threads = [threading.Thread(target=waiter) for _ in range(waiters)]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    return threads, outcomes
+
+
+def test_cancel_wakes_every_waiter(backend):
+    with CreateSemaphore(initial_count=0, backend=backend) as created, \
+            CancellationToken() as token:
+        threads, outcomes = start_waiters(created, token, 4)
+        time.sleep(0.1)
+        assert outcomes == []
+        cancelled_at = time.monotonic()
+        token.cancel()
+        for thread in threads:
+            thread.join(5)
+        assert time.monotonic() - cancelled_at < 1
+        assert outcomes == ['cancelled'] * 4
+        assert created.getvalue() == 0
+
+
+def test_acquire_without_cancel(backend):
+    with CreateSemaphore(maximum_count=2, initial_count=1,
+                         backend=backend) as created, \
+            CancellationToken() as token:
+        created.sem.acquire(0, cancel=token)
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            created.sem.acquire(50, cancel=token)
+        threads, outcomes = start_waiters(created, token, 1)
+        created.sem.release()
+        threads[0].join(5)
+        assert outcomes == ['acquired']
+        assert not token.cancelled
+        created.sem.release()
+
+
+def test_cancelled_token_never_acquires(backend):
+    with CreateSemaphore(backend=backend) as created, \
+            CancellationToken() as token:
+        token.cancel()
+        token.cancel()
+        for timeout_ms in (None, 0, 1000):
+            with pytest.raises(SemaphoreWaitCancelledException):
+                created.sem.acquire(timeout_ms, cancel=token)
+        with pytest.raises(SemaphoreWaitCancelledException):
+            token.raise_if_cancelled()
+        assert created.getvalue() == 1
+
+
+def test_event_set_before_wait(backend):
+    # A token cancelled before it had an event for the backend
+    with CreateSemaphore(initial_count=0, backend=backend) as created:
+        backend = created.sem.backend
+        token = CancellationToken()
+        token.cancel()
+        event = token.event(backend)
+        assert backend.wait_cancellable(created.sem.hHandle, event,
+                                        None) is None
+        token.close()
+        with pytest.raises(ValueError):
+            token.event(backend)
+        assert token.cancelled
+
+
+def test_cancel_weighted_acquire(backend):
+    with CreateSemaphore(maximum_count=3, initial_count=1,
+                         backend=backend) as created, \
+            CancellationToken() as token:
+        threads, outcomes = start_waiters(created, token, 1, count=3)
+        time.sleep(0.05)
+        token.cancel()
+        threads[0].join(5)
+        assert outcomes == ['cancelled']
+        # The permit collected so far was given back
+        assert created.getvalue() == 1
+
+
+def test_cancel_spinning_acquire(backend):
+    with CreateSemaphore(initial_count=0, backend=backend) as created, \
+            CancellationToken() as token:
+        threads, outcomes = start_waiters(created, token, 1, spin=True)
+        time.sleep(0.05)
+        token.cancel()
+        threads[0].join(5)
+        assert outcomes == ['cancelled']
+
+
+def test_acquire_semaphore(backend):
+    with CreateSemaphore(backend=backend) as created, \
+            CancellationToken() as token:
+        with AcquireSemaphore(created, cancel=token):
+            assert created.getvalue() == 0
+        token.cancel()
+        with pytest.raises(SemaphoreWaitCancelledException):
+            with AcquireSemaphore(created, cancel=token):
+                pass
+        assert created.getvalue() == 1
+
+
+def test_metrics_count_cancellations(backend):
+    with CreateSemaphore(initial_count=0, backend=backend,
+                         metrics=True) as created, \
+            CancellationToken() as token:
+        token.cancel()
+        with pytest.raises(SemaphoreWaitCancelledException):
+            created.sem.acquire(cancel=token)
+        metrics = created.sem.metrics
+        assert metrics.cancellations == 1
+        assert metrics.timeouts == 0
+        assert metrics.as_dict()['cancellations'] == 1
+
+
+def test_sliced_wait_returns_after_cancel():
+    from semaphore_win_ctypes.backend import SemaphoreBackend
+
+    class SlicedBackend(SemaphoreBackend):
+        def __init__(self):
+            self.waits = []
+
+        def wait(self, handle, timeout_ms):
+            self.waits.append(timeout_ms)
+            time.sleep(timeout_ms / 1000)
+            return False
+
+    backend = SlicedBackend()
+    event = backend.create_event()
+    assert backend.wait_cancellable(None, event, 35) is False
+    assert max(backend.waits) <= CANCEL_SLICE_MS
+    threading.Timer(0.05, backend.set_event, (event,)).start()
+    began = time.monotonic()
+    assert backend.wait_cancellable(None, event, None) is None
+    assert time.monotonic() - began < 1
+
+
+def test_standin_events():
+    kernel32 = StandInKernel32()
+    event = kernel32.CreateEventW(None, True, False, None)
+    sem = kernel32.CreateSemaphoreExW(None, 1, 1, None, 0,
+                                      SEMAPHORE_ALL_ACCESS)
+    # The semaphore is signaled, the event isn't
+    assert kernel32.WaitForMultipleObjects(2, [event, sem], False, 0) \
+        == WAIT_OBJECT_0 + 1
+    assert kernel32.SetEvent(event)
+    # A manual-reset event stays set
+    for _ in range(2):
+        assert kernel32.WaitForSingleObject(event, 0) == WAIT_OBJECT_0
+    assert not kernel32.ReleaseSemaphore(event, 1, None)
+    assert kernel32.GetLastError() == ERROR_INVALID_HANDLE
+    assert not kernel32.SetEvent(sem)
+    assert kernel32.GetLastError() == ERROR_INVALID_HANDLE
+    assert kernel32.CloseHandle(event)
+    assert kernel32.CloseHandle(sem)
@@ -0,0 +1,102 @@
+"""Tests for python -m semaphore_win_ctypes."""
+
+import glob
+import json
+import os
+import pytest
+import subprocess
+import sys
+import uuid
+
+from semaphore_win_ctypes import AcquireSemaphore, CreateSemaphore
+from semaphore_win_ctypes.cli import EXIT_ERROR, EXIT_OK, EXIT_TIMEOUT, main
+from semaphore_win_ctypes.segment import segment_directory
+
+# Named semaphores other processes can open
+SHARED_BACKEND = 'win32' if sys.platform == 'win32' else 'posix'
+
+
+@pytest.fixture
+def unique_name():
+    name = str(uuid.uuid4())
+    yield name
+    for path in glob.glob(os.path.join(segment_directory(), f'*-{name}.*')):
+        os.unlink(path)
+
+
+def run_json(capsys, *argv):
+    assert main(list(argv) + ['--backend', SHARED_BACKEND,
+                              '--json']) == EXIT_OK
+    return json.loads(capsys.readouterr().out)
+
+
+def test_inspect_and_release(capsys, unique_name):
+    with CreateSemaphore(unique_name, maximum_count=3,
+                         backend=SHARED_BACKEND) as created:
+        created.sem.acquire(0, 2)
+        values = run_json(capsys, 'inspect', unique_name)
+        assert values['count'] == 1
+        assert values['maximum_count'] == 3
+        assert 'shared_stats' not in values and 'holders' not in values
+        values = run_json(capsys, 'release', unique_name, '2')
+        assert values == {'previous_count': 1, 'count': 3}
+        assert created.getvalue() == 3
+
+
+def test_inspect_shared_stats_and_holders(capsys, unique_name):
+    with CreateSemaphore(unique_name, maximum_count=2,
+                         backend=SHARED_BACKEND, ledger=True,
+                         shared_stats=True) as created:
+        with AcquireSemaphore(created):
+            values = run_json(capsys, 'inspect', unique_name)
+        assert values['holders'] == {str(os.getpid()): 1}
+        assert values['shared_stats']['processes'] == 1
+        assert values['shared_stats']['acquires'] == 1
+
+
+def test_open_and_acquire(capsys, unique_name):
+    with CreateSemaphore(unique_name, backend=SHARED_BACKEND) as created:
+        assert run_json(capsys, 'open-and-acquire', unique_name, '10') == {
+            'acquired': 1}
+        assert created.getvalue() == 1
+        with AcquireSemaphore(created):
+            assert main(['open-and-acquire', unique_name,
+                         '--backend', SHARED_BACKEND]) == EXIT_TIMEOUT
+        assert 'Timed out' in capsys.readouterr().err
+
+
+def test_missing_semaphore(capsys, unique_name):
+    assert main(['inspect', unique_name,
+                 '--backend', SHARED_BACKEND]) == EXIT_ERROR
+    assert capsys.readouterr().err.startswith('inspect: ')
+
+
+def test_loadgen(capsys, unique_name):
+    values = run_json(capsys, 'loadgen', unique_name, '--create', '2',
+                      '--workers', '3', '--duration-s', '0.2',
+                      '--hold-ms', '0.5', '--rate', '500')
+    assert values['mode'] == 'threads'
+    assert values['timeouts'] == 0
+    # 500 per second for 0.2 s, plus one due at the start of each worker
+    assert 10 <= values['cycles'] <= 103
+    assert values['wait_p50_ms'] <= values['wait_p99_ms'] \
+        <= values['wait_max_ms']
+
+
+def test_create_in_another_process(unique_name):
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'semaphore_win_ctypes', 'create',
+         unique_name, '2000', '0', '1', '--backend', SHARED_BACKEND],
+        stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        assert proc.stdout.readline() == f'created: {unique_name}\n'
+        assert proc.stdout.readline() == 'count: 0\n'
+        release = subprocess.run(
+            [sys.executable, '-m', 'semaphore_win_ctypes', 'release',
+             unique_name, '--backend', SHARED_BACKEND],
+            stdout=subprocess.PIPE, universal_newlines=True)
+        assert release.returncode == EXIT_OK
+        assert 'previous_count: 0' in release.stdout
+    finally:
+        proc.stdout.close()
+        proc.wait()
@@ -0,0 +1,62 @@
+"""Tests for the eventfd semaphore backend."""
+
+import pytest
+import select
+import sys
+import threading
+import uuid
+
+from semaphore_win_ctypes import Semaphore, SemaphoreWaitTimeoutException
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'),
+                                reason="eventfd is Linux only")
+
+
+@pytest.fixture
+def unique_name():
+    return str(uuid.uuid4())
+
+
+def test_create_open_close(unique_name):
+    with pytest.raises(FileNotFoundError):
+        Semaphore(unique_name, 'eventfd').open()
+    sem1 = Semaphore(unique_name, 'eventfd').create(maximum_count=2)
+    sem2 = Semaphore(unique_name, 'eventfd').open()
+    try:
+        sem1.acquire(0)
+        sem2.acquire(0)
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            sem2.acquire(10)
+        assert sem1.release(2) == 0
+        with pytest.raises(OSError):
+            sem1.release()
+    finally:
+        sem1.close()
+    # Like Windows, the semaphore lives until the last handle is closed
+    Semaphore(unique_name, 'eventfd').open().close()
+    sem2.close()
+    with pytest.raises(FileNotFoundError):
+        Semaphore(unique_name, 'eventfd').open()
+
+
+def test_fileno_is_readable_with_permits():
+    sem = Semaphore(backend='eventfd').create(maximum_count=1)
+    try:
+        fd = sem.backend.fileno(sem.hHandle)
+        assert select.select([fd], [], [], 0)[0] == [fd]
+        sem.acquire(0)
+        assert select.select([fd], [], [], 0)[0] == []
+    finally:
+        sem.close()
+
+
+def test_blocking_wait_is_woken():
+    sem = Semaphore(backend='eventfd').create(maximum_count=1,
+                                              initial_count=0)
+    try:
+        timer = threading.Timer(0.05, sem.release)
+        timer.start()
+        sem.acquire(5000)
+        timer.join()
+    finally:
+        sem.close()
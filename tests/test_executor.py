@@ -0,0 +1,117 @@
+"""Tests for the executor that runs tasks under a semaphore."""
+
+import pytest
+import queue
+import threading
+import time
+import uuid
+
+from semaphore_win_ctypes import CreateSemaphore, SemaphoreExecutor
+
+
+class Concurrency:
+    """
+    Tasks that count how many of them run at once
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most = 0
+
+    def task(self, value, hold_s=0.01):
+        with self.lock:
+            self.running += 1
+            self.most = max(self.most, self.running)
+        time.sleep(hold_s)
+        with self.lock:
+            self.running -= 1
+        return value * 2
+
+
+def test_cap_holds_across_executors(backend):
+    name = str(uuid.uuid4())
+    concurrency = Concurrency()
+    with CreateSemaphore(name, maximum_count=2, backend=backend) as created:
+        with SemaphoreExecutor(created, max_workers=4) as first, \
+                SemaphoreExecutor(name, max_workers=4,
+                                  backend=created.sem.backend) as second:
+            futures = [executor.submit(concurrency.task, value)
+                       for value in range(10)
+                       for executor in (first, second)]
+            assert [future.result() for future in futures] == [
+                value * 2 for value in range(10) for _ in range(2)]
+        assert concurrency.most == 2
+        assert created.getvalue() == 2
+        assert first.metrics.completed == 10
+        assert first.metrics.queue_delay_ns.count == 10
+
+
+def test_backpressure(backend):
+    with CreateSemaphore(maximum_count=1, initial_count=0,
+                         backend=backend) as created:
+        threads = threading.active_count()
+        executor = SemaphoreExecutor(created, max_workers=4, queue_size=2,
+                                     submit_timeout_ms=50)
+        try:
+            # One taken by the dispatcher, waiting for the permit, and two
+            # queued
+            futures = [executor.submit(time.sleep, 0) for _ in range(3)]
+            deadline = time.monotonic() + 5
+            while executor.queued > 2 and time.monotonic() < deadline:
+                time.sleep(0.001)
+            with pytest.raises(queue.Full):
+                executor.submit(time.sleep, 0)
+            assert executor.metrics.rejected == 1
+            # Only the dispatcher waits, no worker is parked on the
+            # semaphore
+            assert threading.active_count() == threads + 1
+            created.sem.release()
+            for future in futures:
+                future.result(5)
+            assert executor.metrics.completed == 3
+        finally:
+            executor.shutdown()
+        assert executor.metrics.as_dict()['submitted'] == 3
+
+
+def test_failures_and_map(backend):
+    with CreateSemaphore(maximum_count=2, backend=backend) as created:
+        with SemaphoreExecutor(created, max_workers=2) as executor:
+            future = executor.submit(int, 'not a number')
+            with pytest.raises(ValueError):
+                future.result(5)
+            assert list(executor.map(abs, [-1, -2, 3])) == [1, 2, 3]
+        assert executor.metrics.failed == 1
+        assert executor.metrics.completed == 3
+        # The permits all came back
+        assert created.getvalue() == 2
+    with pytest.raises(RuntimeError):
+        executor.submit(abs, 1)
+
+
+def test_shutdown_cancels_waiting_tasks(backend):
+    with CreateSemaphore(maximum_count=1, initial_count=0,
+                         backend=backend) as created:
+        executor = SemaphoreExecutor(created, max_workers=1)
+        futures = [executor.submit(abs, value) for value in range(3)]
+        began = time.monotonic()
+        executor.shutdown(cancel_futures=True)
+        assert time.monotonic() - began < 5
+        assert all(future.cancelled() for future in futures)
+        assert executor.metrics.cancelled == 3
+        assert created.getvalue() == 0
+
+
+def test_cancelled_before_dispatch(backend):
+    with CreateSemaphore(maximum_count=1, initial_count=0,
+                         backend=backend) as created:
+        with SemaphoreExecutor(created, max_workers=1) as executor:
+            first = executor.submit(abs, -1)
+            second = executor.submit(abs, -2)
+            assert second.cancel()
+            created.sem.release()
+            assert first.result(5) == 1
+        assert second.cancelled()
+        assert executor.metrics.cancelled == 1
+        assert created.getvalue() == 1
@@ -0,0 +1,143 @@
+"""Tests for handing semaphores to other processes."""
+
+import multiprocessing
+import pickle
+import pytest
+import subprocess
+import sys
+import uuid
+
+from semaphore_win_ctypes import Semaphore, SemaphoreHandoff, \
+    StandInKernel32
+from semaphore_win_ctypes.win32 import Win32Backend
+
+# Backends whose semaphores other processes can use, and which of them can
+# hand off an unnamed semaphore
+SHARED = [('win32' if sys.platform == 'win32' else 'posix', True)]
+if sys.platform == 'win32':
+    SHARED.append(('win32', False))
+if sys.platform.startswith('linux'):
+    SHARED += [('eventfd', True), ('eventfd', False)]
+
+# Reads the token from the command line, takes a permit and prints the count
+CHILD = '''
+import sys
+from semaphore_win_ctypes import Semaphore
+sem = Semaphore.from_handoff(sys.argv[1])
+sem.acquire(0)
+print(sem.getvalue())
+sem.close()
+'''
+
+
+def take_permit(sem):
+    sem.acquire(0)
+    sem.close()
+
+
+def take_permit_from(queue):
+    take_permit(queue.get(timeout=30))
+
+
+@pytest.fixture(params=SHARED, ids=lambda param: '-'.join(
+    (param[0], 'named' if param[1] else 'unnamed')))
+def shared(request):
+    backend, named = request.param
+    sem = Semaphore(str(uuid.uuid4()) if named else None, backend)
+    sem.create(3)
+    yield sem
+    sem.close()
+
+
+def test_pickle(shared):
+    copy = pickle.loads(pickle.dumps(shared))
+    try:
+        assert copy.name == shared.name
+        assert copy.backend is shared.backend
+        assert copy.hHandle is not shared.hHandle
+        copy.acquire(0)
+        assert shared.getvalue() == 2
+        shared.acquire(0)
+        assert copy.release(2) == 1
+    finally:
+        copy.close()
+    assert shared.getvalue() == 3
+
+
+def test_process_arguments(shared):
+    process = multiprocessing.get_context('spawn').Process(
+        target=take_permit, args=(shared,))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+    assert shared.getvalue() == 2
+
+
+def test_queue_to_running_process(shared):
+    # Sent once the child runs, not while it's started: the handle is
+    # duplicated for the receiver, or the descriptors sent over a socket
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=take_permit_from, args=(queue,))
+    process.start()
+    queue.put(shared)
+    process.join(30)
+    assert process.exitcode == 0
+    assert shared.getvalue() == 2
+
+
+def test_subprocess(shared):
+    with shared.handoff() as handoff:
+        output = subprocess.run([sys.executable, '-c', CHILD, handoff.token],
+                                stdout=subprocess.PIPE, check=True,
+                                universal_newlines=True,
+                                **handoff.popen_kwargs()).stdout
+    assert output == '2\n'
+    assert shared.getvalue() == 2
+    assert handoff.inherited == ()
+
+
+def test_handoff_in_process(backend):
+    named = Semaphore(str(uuid.uuid4()), backend).create(2)
+    unnamed = Semaphore(backend=named.backend).create(2)
+    try:
+        for sem in (named, unnamed):
+            if sem is unnamed and named.backend.name == 'posix':
+                with pytest.raises(TypeError):
+                    sem.handoff()
+                continue
+            # In this process the copy takes the duplicates over, the
+            # handoff isn't closed
+            handoff = sem.handoff()
+            assert isinstance(handoff, SemaphoreHandoff)
+            copy = Semaphore.from_handoff(handoff.token, sem.backend)
+            try:
+                assert copy.name == sem.name
+                copy.acquire(0)
+                assert sem.getvalue() == 1
+                assert copy.release() == 1
+            finally:
+                copy.close()
+            assert sem.getvalue() == 2
+    finally:
+        unnamed.close()
+        named.close()
+
+
+def test_cannot_share():
+    standin = Semaphore(backend=Win32Backend(kernel32=StandInKernel32()))
+    with pytest.raises(TypeError):
+        pickle.dumps(standin)
+    with pytest.raises(TypeError):
+        standin.handoff()
+    standin.create()
+    with pytest.raises(TypeError, match='unregistered'):
+        pickle.dumps(standin)
+    standin.close()
+    if sys.platform != 'win32':
+        unnamed = Semaphore(backend='posix').create()
+        with pytest.raises(TypeError, match='unnamed posix'):
+            pickle.dumps(unnamed)
+        unnamed.close()
+    with pytest.raises(ValueError):
+        Semaphore.from_handoff('not a token')
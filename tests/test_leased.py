@@ -0,0 +1,210 @@
+"""Tests for leasing permits in batches."""
+
+import pytest
+import threading
+import time
+import uuid
+
+from semaphore_win_ctypes import AcquireSemaphore, CreateSemaphore, \
+    LeasedSemaphore, OpenSemaphore, SemaphoreWaitTimeoutException
+
+
+@pytest.fixture
+def unique_name():
+    return str(uuid.uuid4())
+
+
+def test_permits_are_reused(backend):
+    with CreateSemaphore(maximum_count=4, backend=backend) as created:
+        with LeasedSemaphore(created, batch_size=3, idle_s=60) as leased:
+            leased.acquire(0)
+            # One permit taken, two more leased for later
+            assert leased.leased == 3
+            assert created.getvalue() == 1
+            assert leased.getvalue() == 3
+            leased.release()
+            for _ in range(100):
+                with AcquireSemaphore(leased, timeout_ms=0):
+                    pass
+            assert leased.kernel_waits == 3
+            assert leased.kernel_releases == 0
+        # close() gave everything back
+        assert created.getvalue() == 4
+
+
+def test_respects_maximum_count(backend, unique_name):
+    with CreateSemaphore(unique_name, maximum_count=2,
+                         backend=backend) as created, \
+            OpenSemaphore(unique_name, backend=backend) as opened, \
+            LeasedSemaphore(created, idle_s=60) as leased:
+        leased.acquire(0)
+        leased.acquire(0)
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            leased.acquire(20)
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            opened.sem.acquire(0)
+        leased.release(2)
+        # The pool keeps them, nobody else gets them right away
+        assert leased.leased == 2
+        with pytest.raises(ValueError):
+            leased.release()
+
+
+def test_idle_permits_go_back(backend):
+    with CreateSemaphore(maximum_count=4, backend=backend) as created, \
+            LeasedSemaphore(created, idle_s=0.01) as leased:
+        leased.acquire(0).release()
+        assert leased.leased == 4
+        deadline = time.monotonic() + 5
+        while leased.leased and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert leased.leased == 0
+        assert created.getvalue() == 4
+
+
+def test_other_process_gets_permits(backend, unique_name):
+    with CreateSemaphore(unique_name, maximum_count=2,
+                         backend=backend) as created, \
+            OpenSemaphore(unique_name, backend=backend) as opened, \
+            LeasedSemaphore(created, idle_s=0.01) as leased:
+        stop = threading.Event()
+
+        def busy():
+            # Keeps the pool in use, so only an exhausted semaphore makes
+            # it give permits back
+            while not stop.is_set():
+                with AcquireSemaphore(leased, timeout_ms=5000):
+                    time.sleep(0.001)
+
+        thread = threading.Thread(target=busy)
+        thread.start()
+        try:
+            # Another handle stands in for another process
+            opened.sem.acquire(5000)
+            opened.sem.release()
+        finally:
+            stop.set()
+            thread.join()
+
+
+def test_release_wakes_the_leasing_thread(backend):
+    with CreateSemaphore(maximum_count=1, backend=backend) as created, \
+            LeasedSemaphore(created, idle_s=60) as leased:
+        leased.acquire(0)
+        acquired = []
+        waiters = [threading.Thread(
+            target=lambda: acquired.append(leased.acquire(5000)))
+            for _ in range(2)]
+        for waiter in waiters:
+            waiter.start()
+        time.sleep(0.05)
+        leased.release()
+        waiters[0].join(5)
+        waiters[1].join(0.05)
+        assert len(acquired) == 1
+        leased.release()
+        for waiter in waiters:
+            waiter.join(5)
+        assert len(acquired) == 2
+        leased.release()
+
+
+def test_close_while_leasing(backend):
+    with CreateSemaphore(maximum_count=3, backend=backend) as created:
+        created.sem.acquire(0, count=3)
+        leased = LeasedSemaphore(created, idle_s=60)
+        results = []
+
+        def acquire():
+            try:
+                results.append(leased.acquire(5000))
+            except ValueError as e:
+                results.append(e)
+
+        waiters = [threading.Thread(target=acquire) for _ in range(2)]
+        for waiter in waiters:
+            waiter.start()
+            time.sleep(0.05)
+        leased.close()
+        # The thread waiting for the leaser gives up, the leaser gets its
+        # permit and gives the rest of its batch straight back
+        waiters[1].join(5)
+        assert isinstance(results[0], ValueError)
+        created.sem.release(3)
+        waiters[0].join(5)
+        assert results[1] is leased
+        assert leased.leased == 1 and created.getvalue() == 2
+        leased.release()
+        assert created.getvalue() == 3
+
+
+def test_close_while_starting_the_returner(backend, monkeypatch):
+    with CreateSemaphore(maximum_count=2, backend=backend) as created:
+        leased = LeasedSemaphore(created, idle_s=60)
+        errors = []
+
+        def close():
+            try:
+                leased.close()
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+
+        closer = threading.Thread(target=close)
+
+        class SlowToStart(threading.Thread):
+            def start(self):
+                # close() runs while the returner is being started
+                closer.start()
+                time.sleep(0.05)
+                super().start()
+
+        monkeypatch.setattr(threading, 'Thread', SlowToStart)
+        leased.acquire(0)
+        monkeypatch.undo()
+        closer.join(5)
+        assert errors == []
+        leased.release()
+        assert created.getvalue() == 2
+
+
+def test_contention(backend):
+    maximum_count = 3
+    in_use = [0]
+    errors = []
+    lock = threading.Lock()
+    with CreateSemaphore(maximum_count=maximum_count,
+                         backend=backend) as created:
+        leased = LeasedSemaphore(created, batch_size=2)
+
+        def worker():
+            try:
+                for _ in range(200):
+                    with AcquireSemaphore(leased, timeout_ms=10000):
+                        with lock:
+                            in_use[0] += 1
+                            assert in_use[0] <= maximum_count
+                        with lock:
+                            in_use[0] -= 1
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        leased.close()
+        assert errors == []
+        assert created.getvalue() == maximum_count
+
+
+def test_checks_arguments(backend):
+    with CreateSemaphore(backend=backend) as created:
+        with pytest.raises(ValueError):
+            LeasedSemaphore(created, batch_size=0)
+        leased = LeasedSemaphore(created)
+        with pytest.raises(ValueError):
+            leased.acquire(0, count=2)
+        leased.close()
+        with pytest.raises(ValueError):
+            leased.acquire(0)
@@ -0,0 +1,195 @@
+"""Tests for the lease ledger and reclaiming permits from dead processes."""
+
+import glob
+import multiprocessing
+import os
+import pytest
+import signal
+import sys
+import uuid
+
+from semaphore_win_ctypes import CreateSemaphore, LeasedSemaphore, \
+    LeaseLedger, LeaseReaper, OpenSemaphore, PrioritySemaphore, Semaphore, \
+    wait_all, wait_any
+from semaphore_win_ctypes.ledger import ledger_path
+from semaphore_win_ctypes.segment import segment_directory
+
+# Named semaphores other processes can open
+SHARED_BACKEND = 'win32' if sys.platform == 'win32' else 'posix'
+
+
+@pytest.fixture
+def unique_name():
+    name = str(uuid.uuid4())
+    yield name
+    for path in glob.glob(os.path.join(segment_directory(),
+                                       f'*-{name}.ledger')):
+        os.unlink(path)
+
+
+def dead_pid():
+    # The pid of a process that has exited and been waited for
+    process = multiprocessing.get_context('spawn').Process(target=int)
+    process.start()
+    process.join()
+    return process.pid
+
+
+def hold_permits(name, count, ready):
+    sem = Semaphore(name, SHARED_BACKEND, ledger=True).open()
+    sem.acquire(0, count)
+    ready.set()
+    # Killed by the test
+    signal.pause() if hasattr(signal, 'pause') else sys.stdin.read()
+
+
+def test_records_held_permits(backend, unique_name):
+    with CreateSemaphore(unique_name, maximum_count=3, backend=backend,
+                         ledger=True) as created:
+        ledger = created.sem.ledger
+        assert ledger.held == 0
+        created.sem.acquire(0, 2)
+        assert ledger.held == 2
+        assert ledger.holders() == {os.getpid(): 2}
+        with OpenSemaphore(unique_name, backend=backend,
+                           ledger=True) as opened:
+            opened.sem.acquire(0)
+            # Two slots for this process, one per Semaphore
+            assert opened.sem.ledger.holders() == {os.getpid(): 3}
+            opened.sem.release()
+        created.sem.release(2)
+        assert ledger.held == 0
+        assert ledger.holders() == {}
+        # Nobody died
+        assert ledger.reap(created) == 0
+    with pytest.raises(ValueError):
+        Semaphore(backend=backend, ledger=True)
+
+
+def test_records_permits_taken_without_acquire(backend, unique_name):
+    # Released through Semaphore.release(), so recorded when taken
+    with CreateSemaphore(unique_name, maximum_count=4, backend=backend,
+                         metrics=True, ledger=True) as created:
+        sem = created.sem
+        assert wait_any([created]) is created
+        assert wait_all([created]) == [created]
+        assert sem.ledger.held == 2
+        sem.release(2)
+        with PrioritySemaphore(created) as priority:
+            priority.acquire(0)
+            assert sem.ledger.held == 1
+            priority.release()
+        with LeasedSemaphore(created, batch_size=3, idle_s=60) as leased:
+            leased.acquire(0)
+            assert sem.ledger.held == 3
+            leased.release()
+        assert sem.ledger.held == 0
+        assert sem.metrics.acquired_permits == \
+            sem.metrics.released_permits == 6
+
+
+def test_reap_forged_dead_holder(backend, unique_name):
+    with CreateSemaphore(unique_name, maximum_count=3, backend=backend,
+                         ledger=True) as created:
+        created.sem.acquire(0, 2)
+        # As if another process had acquired them and died
+        ledger = created.sem.ledger
+        ledger._words[ledger._slot] = dead_pid()
+        ledger._slot = None
+        assert created.getvalue() == 1
+        assert ledger.reap(created) == 2
+        assert created.getvalue() == 3
+        assert ledger.holders() == {}
+        # The slot is free again
+        created.sem.acquire(0)
+        assert ledger.holders() == {os.getpid(): 1}
+        created.sem.release()
+
+
+def test_close_frees_the_slot(unique_name):
+    with LeaseLedger(unique_name, SHARED_BACKEND, slots=2) as first, \
+            LeaseLedger(unique_name, SHARED_BACKEND) as second:
+        assert second.slots == 2
+        first.record_acquire()
+        second.record_acquire()
+        third = LeaseLedger(unique_name, SHARED_BACKEND)
+        with pytest.raises(OSError):
+            third.record_acquire()
+        second.record_release()
+        second.close()
+        third.record_acquire()
+        assert third.holders() == {os.getpid(): 2}
+        third.record_release()
+        third.close()
+        first.record_release()
+    LeaseLedger(unique_name, SHARED_BACKEND).unlink()
+    assert not os.path.exists(ledger_path(unique_name, SHARED_BACKEND))
+
+
+def test_reaper_reclaims_from_killed_process(unique_name):
+    context = multiprocessing.get_context('spawn')
+    with CreateSemaphore(unique_name, maximum_count=3,
+                         backend=SHARED_BACKEND, ledger=True) as created, \
+            LeaseReaper(created, interval_s=3600) as reaper:
+        ready = context.Event()
+        process = context.Process(target=hold_permits,
+                                  args=(unique_name, 2, ready))
+        process.start()
+        try:
+            assert ready.wait(30)
+            assert created.getvalue() == 1
+            assert reaper.ledger.holders() == {process.pid: 2}
+            # Still running
+            assert reaper.reap() == 0
+        finally:
+            os.kill(process.pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+            process.join()
+        assert reaper.reap() == 2
+        assert reaper.reclaimed == 2
+        assert created.getvalue() == 3
+        assert reaper.ledger.holders() == {}
+
+
+def test_reaper_thread(unique_name):
+    with CreateSemaphore(unique_name, maximum_count=2,
+                         backend=SHARED_BACKEND) as created:
+        with LeaseLedger(unique_name, SHARED_BACKEND) as ledger:
+            created.sem.acquire(0)
+            ledger.record_acquire()
+            ledger._words[ledger._slot] = dead_pid()
+        with LeaseReaper(created, interval_s=0.01) as reaper:
+            deadline = 500
+            while created.getvalue() != 2 and deadline:
+                deadline -= 1
+                reaper._stop.wait(0.01)
+            assert created.getvalue() == 2
+            assert reaper.reclaimed == 1
+
+
+def test_reaper_thread_survives_errors(unique_name):
+    with CreateSemaphore(unique_name, maximum_count=2,
+                         backend=SHARED_BACKEND) as created, \
+            LeaseLedger(unique_name, SHARED_BACKEND) as ledger:
+        created.sem.acquire(0)
+        ledger.record_acquire()
+        ledger._words[ledger._slot] = dead_pid()
+        ledger._slot = None
+        reap = ledger.reap
+        calls = []
+
+        def failing_reap(semaphore):
+            calls.append(semaphore)
+            if len(calls) == 1:
+                raise OSError('Simulated failure')
+            return reap(semaphore)
+
+        ledger.reap = failing_reap
+        with LeaseReaper(created, interval_s=0.01, ledger=ledger) as reaper:
+            deadline = 500
+            while created.getvalue() != 2 and deadline:
+                deadline -= 1
+                reaper._stop.wait(0.01)
+            assert len(calls) > 1
+            assert created.getvalue() == 2
+            assert reaper.reclaimed == 1
+            assert str(reaper.reap_error) == 'Simulated failure'
@@ -0,0 +1,151 @@
+"""Tests for acquire and release metrics."""
+
+import asyncio
+import gc
+import pytest
+import threading
+import time
+import tracemalloc
+import uuid
+
+from semaphore_win_ctypes import AcquireSemaphore, AsyncAcquireSemaphore, \
+    CreateSemaphore, Histogram, OpenSemaphore, Semaphore, \
+    SemaphoreWaitTimeoutException, enable_metrics, get_metrics, \
+    reset_metrics
+from semaphore_win_ctypes import metrics as metrics_module
+
+
+@pytest.fixture
+def unique_name():
+    return str(uuid.uuid4())
+
+
+def test_metrics_are_off_by_default(backend):
+    with CreateSemaphore(backend=backend) as created:
+        assert created.sem.metrics is None
+
+
+def test_counts(backend):
+    with CreateSemaphore(maximum_count=3, backend=backend,
+                         metrics=True) as created:
+        metrics = created.sem.metrics
+        with AcquireSemaphore(created, timeout_ms=0, count=2):
+            time.sleep(0.002)
+            with pytest.raises(SemaphoreWaitTimeoutException):
+                created.sem.acquire(0, count=2)
+        with pytest.raises(OSError):
+            created.sem.release(5)
+        assert metrics.acquires == 1
+        assert metrics.acquired_permits == 2
+        assert metrics.timeouts == 1
+        assert metrics.failures == 1
+        assert metrics.releases == 1
+        assert metrics.released_permits == 2
+        assert metrics.wait_ns.count == 1
+        assert metrics.hold_ns.count == 1
+        assert metrics.hold_ns.max_ns >= 2000000
+        as_dict = metrics.as_dict()
+        assert as_dict['acquires'] == 1
+        assert len(as_dict['hold_ns']['buckets']) == 65
+
+
+def test_async_counts(backend):
+    async def main(created):
+        async with AsyncAcquireSemaphore(created, timeout_ms=1000):
+            pass
+
+    with CreateSemaphore(backend=backend, metrics=True) as created:
+        asyncio.run(main(created))
+        metrics = created.sem.metrics
+        assert (metrics.acquires, metrics.releases) == (1, 1)
+        assert metrics.hold_ns.count == 1
+
+
+def test_wait_time_under_contention(backend):
+    with CreateSemaphore(backend=backend, metrics=True) as created:
+        created.sem.acquire(0)
+        timer = threading.Timer(0.05, created.sem.release)
+        timer.start()
+        created.sem.acquire(5000)
+        timer.join()
+        created.sem.release()
+        wait_ns = created.sem.metrics.wait_ns
+        assert wait_ns.max_ns >= 40000000
+        assert wait_ns.percentile(1.0) == wait_ns.max_ns
+
+
+def test_aggregate_by_name(backend, unique_name):
+    reset_metrics()
+    with CreateSemaphore(unique_name, maximum_count=2, backend=backend,
+                         metrics=True) as created:
+        for _ in range(3):
+            with OpenSemaphore(unique_name, backend=backend,
+                               metrics=True) as opened:
+                with AcquireSemaphore(opened, timeout_ms=0):
+                    pass
+        created.sem.acquire(0)
+        created.sem.release()
+        total = get_metrics(unique_name)
+        assert total.acquires == 4
+        assert total.releases == 4
+        assert total.hold_ns.count == 3
+    assert get_metrics(unique_name).acquires == 4
+    reset_metrics()
+    assert get_metrics(unique_name).acquires == 0
+
+
+def test_collected_semaphores_are_retired(backend, unique_name):
+    sem = Semaphore(unique_name, backend, metrics=True).create()
+    sem.acquire(0)
+    sem.release()
+    # Dropped without close(), as unpickled semaphores often are
+    sem.backend.close(sem.hHandle)
+    del sem
+    gc.collect()
+    assert get_metrics(unique_name).acquires == 1
+    assert metrics_module._by_name[unique_name].live == {}
+    reset_metrics()
+    assert unique_name not in metrics_module._by_name
+
+
+def test_enable_metrics(backend):
+    enable_metrics()
+    try:
+        sem = Semaphore(backend=backend)
+        assert sem.metrics is not None
+        assert Semaphore(backend=backend, metrics=False).metrics is None
+    finally:
+        enable_metrics(False)
+    assert Semaphore(backend=backend).metrics is None
+
+
+def test_histogram():
+    histogram = Histogram()
+    assert histogram.percentile(0.5) == 0
+    for ns in (0, 1, 1000, 1000, 1000, 10 ** 9):
+        histogram.add(ns)
+    assert histogram.count == 6
+    assert histogram.buckets[0] == 1
+    assert histogram.buckets[(1000).bit_length()] == 3
+    # Within a factor of two
+    assert 1000 <= histogram.percentile(0.5) < 2000
+    assert histogram.percentile(1.0) == 10 ** 9
+    other = Histogram()
+    other.add(5)
+    histogram.merge(other)
+    assert histogram.count == 7
+
+
+def test_recording_does_not_allocate():
+    histogram = Histogram()
+    histogram.add(12345)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(1000):
+            histogram.add(12345)
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    # total_ns is a growing int, it may need a few more bytes
+    assert after - before < 100
@@ -1,6 +1,7 @@
 import datetime
 import pytest
 import subprocess
+import sys
 import time
 import uuid
 
@@ -14,6 +15,9 @@ TEST_SEMAPHORE_CREATE_TIME_MS = 5000
 TEST_SEMAPHORE_ACQUIRE_HOLD_TIME_S = 2
 LAST_WAS_CTYPES = False
 
+# The command line tool, run in another process
+CLI = [sys.executable, "-m", "semaphore_win_ctypes"]
+
 
 def unique_name():
     return str(uuid.uuid4())
@@ -30,22 +34,22 @@ def ctypes_semaphore() -> str:
 
 
 @pytest.fixture
-def cpp_semaphore() -> str:
+def cli_semaphore() -> str:
     """
-    Create a semaphore using compiled C++ helper
+    Create a semaphore in another process, using the command line tool
     """
     name = unique_name()
-    proc = subprocess.Popen([
-        "SemaphoreHelper.exe",
+    proc = subprocess.Popen(CLI + [
         "create",
         name,
         str(TEST_SEMAPHORE_CREATE_TIME_MS),
         str(TEST_SEMAPHORE_MAX_COUNT),
         str(TEST_SEMAPHORE_MAX_COUNT)
-    ])
-    # let it start
-    time.sleep(1)
+    ], stdout=subprocess.PIPE, universal_newlines=True)
+    # let it start: it prints once the semaphore exists
+    assert proc.stdout.readline().startswith("created")
     yield name
+    proc.stdout.close()
     proc.wait()
 
 
@@ -53,7 +57,7 @@ def mixed_acquire(params) -> int:
     name = params[0]
     index = params[1]
     if index % 2 == 0:
-        c = cpp_acquire(name)
+        c = cli_acquire(name)
     else:
         c = ctypes_acquire(name)
     return c
@@ -69,9 +73,8 @@ def ctypes_acquire(name: str) -> int:
         return 0
 
 
-def cpp_acquire(name: str) -> int:
-    p = subprocess.run([
-        "SemaphoreHelper.exe",
+def cli_acquire(name: str) -> int:
+    p = subprocess.run(CLI + [
         "open-and-acquire",
         name,
         str(TEST_SEMAPHORE_ACQUIRE_HOLD_TIME_S * 1000)
@@ -93,45 +96,45 @@ def test_multiprocess_ctypes(ctypes_semaphore: str):
     assert sum(results) == TEST_SEMAPHORE_MAX_COUNT
 
 
-def test_multiprocess_ctypes_with_cpp_semaphore(cpp_semaphore: str):
+def test_multiprocess_ctypes_with_cli_semaphore(cli_semaphore: str):
     # Create subprocesses, let each try to acquire the Semaphore
     with ThreadPool(TEST_THREADS) as p:
         results = p.map(
             ctypes_acquire,
-            [cpp_semaphore for _ in range(TEST_THREADS)]
+            [cli_semaphore for _ in range(TEST_THREADS)]
         )
     # Only some of them should succeed
     assert sum(results) == TEST_SEMAPHORE_MAX_COUNT
 
 
-def test_multiprocess_cpp_acquire_with_ctypes_semaphore(ctypes_semaphore: str):
+def test_multiprocess_cli_acquire_with_ctypes_semaphore(ctypes_semaphore: str):
     # Create subprocesses, let each try to acquire the Semaphore
     with ThreadPool(TEST_THREADS) as p:
         results = p.map(
-            cpp_acquire,
+            cli_acquire,
             [ctypes_semaphore for _ in range(TEST_THREADS)]
         )
     # Only some of them should succeed
     assert sum(results) == TEST_SEMAPHORE_MAX_COUNT
 
 
-def test_multiprocess_cpp_acquire_with_cpp_semaphore(cpp_semaphore: str):
+def test_multiprocess_cli_acquire_with_cli_semaphore(cli_semaphore: str):
     # Create subprocesses, let each try to acquire the Semaphore
     with ThreadPool(TEST_THREADS) as p:
         results = p.map(
-            cpp_acquire,
-            [cpp_semaphore for _ in range(TEST_THREADS)]
+            cli_acquire,
+            [cli_semaphore for _ in range(TEST_THREADS)]
         )
     # Only some of them should succeed
     assert sum(results) == TEST_SEMAPHORE_MAX_COUNT
 
 
-def test_multiprocess_mixed_with_cpp_semaphore(cpp_semaphore: str):
+def test_multiprocess_mixed_with_cli_semaphore(cli_semaphore: str):
     # Create subprocesses, let each try to acquire the Semaphore
     with ThreadPool(TEST_THREADS) as p:
         results = p.map(
             mixed_acquire,
-            [(cpp_semaphore, index) for index in range(TEST_THREADS)]
+            [(cli_semaphore, index) for index in range(TEST_THREADS)]
         )
     # Only some of them should succeed
     assert sum(results) == TEST_SEMAPHORE_MAX_COUNT
@@ -0,0 +1,181 @@
+"""Tests for the POSIX named semaphore backend."""
+
+import os
+import pytest
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+from semaphore_win_ctypes import Semaphore, SemaphoreWaitTimeoutException, \
+    SYNCHRONIZE, get_backend
+from semaphore_win_ctypes import posix
+from semaphore_win_ctypes.segment import segment_path
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32',
+                                reason="POSIX semaphores only")
+
+
+@pytest.fixture
+def unique_name():
+    return str(uuid.uuid4())
+
+
+def test_backend_by_name(unique_name):
+    sem = Semaphore(unique_name, backend='posix').create()
+    try:
+        assert sem.backend is get_backend('posix')
+        assert sem.getvalue() == 1
+    finally:
+        sem.close()
+
+
+def test_create_existing_opens_it(unique_name):
+    sem1 = Semaphore(unique_name).create(maximum_count=3, initial_count=1)
+    # Like CreateSemaphoreExW, the counts of an existing semaphore are kept
+    sem2 = Semaphore(unique_name).create(maximum_count=5)
+    try:
+        assert sem2.getvalue() == 1
+        assert sem2.release(2) == 1
+        with pytest.raises(OSError):
+            sem2.release()
+    finally:
+        sem2.close()
+        sem1.close()
+
+
+def test_opened_handle_knows_maximum(unique_name):
+    sem1 = Semaphore(unique_name).create(maximum_count=2, initial_count=0)
+    sem2 = Semaphore(unique_name).open()
+    try:
+        assert sem2.release(2) == 0
+        with pytest.raises(OSError):
+            sem2.release()
+        assert sem1.getvalue() == 2
+    finally:
+        sem2.close()
+        sem1.close()
+
+
+def test_opened_handle_outlives_creator(unique_name):
+    sem1 = Semaphore(unique_name).create()
+    sem2 = Semaphore(unique_name).open()
+    sem1.close()
+    try:
+        sem2.acquire(0)
+        assert sem2.release() == 0
+    finally:
+        sem2.close()
+
+
+def test_unnamed_semaphores_are_distinct():
+    sem1 = Semaphore().create()
+    sem2 = Semaphore().create()
+    try:
+        sem1.acquire(0)
+        sem2.acquire(0)
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            sem1.acquire(0)
+    finally:
+        sem1.close()
+        sem2.close()
+
+
+def test_release_requires_modify_state():
+    sem = Semaphore().create(initial_count=0, desired_access=SYNCHRONIZE)
+    try:
+        with pytest.raises(PermissionError):
+            sem.release()
+    finally:
+        sem.close()
+
+
+def test_create_while_another_process_creates(unique_name, monkeypatch):
+    backend = get_backend('posix')
+    # Another creator has created the lock file, and not the rest yet
+    lock_fd = os.open(segment_path(unique_name, backend, posix.LOCK_SUFFIX),
+                      os.O_RDWR | posix.O_CREAT | posix.O_EXCL)
+    created = []
+    try:
+        monkeypatch.setattr(posix, 'CREATE_RACE_TIMEOUT_S', 0.05)
+        with pytest.raises(FileNotFoundError):
+            Semaphore(unique_name, backend).create()
+        monkeypatch.setattr(posix, 'CREATE_RACE_TIMEOUT_S', 5)
+        thread = threading.Thread(target=lambda: created.append(
+            Semaphore(unique_name, backend).create()))
+        thread.start()
+        time.sleep(0.05)
+        maximum = backend._sem_open(
+            posix._sem_name(unique_name, posix.MAXIMUM_SUFFIX),
+            posix.O_CREAT | posix.O_EXCL, 3)
+        sem = backend._sem_open(posix._sem_name(unique_name),
+                                posix.O_CREAT | posix.O_EXCL, 2)
+        thread.join(5)
+        assert created[0].stats() == (2, 3)
+        created[0].close()
+        for opened in (sem, maximum):
+            backend.libc.sem_close(opened)
+    finally:
+        os.close(lock_fd)
+        backend._unlink_all(unique_name)
+
+
+def test_release_lock_is_dropped_with_its_holder(unique_name):
+    sem = Semaphore(unique_name, 'posix').create(2, 0)
+    lock_path = sem.hHandle.lock_path
+    try:
+        # Another process holds the lock, as if stopped inside release()
+        code = ("import fcntl, os, sys, time; "
+                "fd = os.open(sys.argv[1], os.O_RDWR); "
+                "fcntl.flock(fd, fcntl.LOCK_EX); print(flush=True); "
+                "time.sleep(60)")
+        holder = subprocess.Popen(
+            [sys.executable, '-c', code, lock_path],
+            stdout=subprocess.PIPE)
+        try:
+            holder.stdout.readline()
+            released = []
+            thread = threading.Thread(
+                target=lambda: released.append(sem.release()))
+            thread.start()
+            # A stalled holder is waited for, never taken over
+            thread.join(0.2)
+            assert released == []
+        finally:
+            holder.kill()
+            holder.wait()
+            holder.stdout.close()
+        thread.join(5)
+        assert released == [0]
+        assert sem.release() == 1
+    finally:
+        sem.close()
+    assert not os.path.exists(lock_path)
+
+
+def test_forked_child_has_its_own_release_lock():
+    if not hasattr(os, 'fork'):
+        pytest.skip('Needs fork()')
+    import fcntl
+    sem = Semaphore().create(2, 0)
+    try:
+        with sem.hHandle.lock:
+            fcntl.flock(sem.hHandle.lock_fd, fcntl.LOCK_EX)
+            pid = os.fork()
+            if pid == 0:  # pragma: no cover
+                status = 1
+                try:
+                    # Held by the parent, not shared with it
+                    fcntl.flock(sem.hHandle.lock_fd,
+                                fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    status = 0
+                finally:
+                    os._exit(status)
+            _, status = os.waitpid(pid, 0)
+            fcntl.flock(sem.hHandle.lock_fd, fcntl.LOCK_UN)
+        assert os.WEXITSTATUS(status) == 0
+        assert sem.release() == 0
+    finally:
+        sem.close()
@@ -0,0 +1,128 @@
+"""Tests for handing out permits by priority."""
+
+import pytest
+import threading
+import time
+
+from semaphore_win_ctypes import AcquireSemaphore, CreateSemaphore, \
+    PrioritySemaphore, SemaphoreWaitTimeoutException
+
+
+def wait_for(condition, timeout_s=5):
+    deadline = time.monotonic() + timeout_s
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def queue_waiters(prioritized, priorities, served, delay_s=0):
+    """
+    A thread per priority, each queued before the next one starts
+    """
+    threads = []
+    for priority in priorities:
+        def waiter(priority=priority):
+            with AcquireSemaphore(prioritized, priority=priority):
+                served.append(priority)
+
+        thread = threading.Thread(target=waiter)
+        queued = prioritized.waiting
+        thread.start()
+        wait_for(lambda: prioritized.waiting > queued)
+        time.sleep(delay_s)
+        threads.append(thread)
+    return threads
+
+
+def test_uncontended_acquire_skips_the_queue(backend):
+    with CreateSemaphore(maximum_count=2, backend=backend) as created, \
+            PrioritySemaphore(created) as prioritized:
+        prioritized.acquire(0)
+        with AcquireSemaphore(prioritized, timeout_ms=0, priority=5):
+            assert created.getvalue() == 0
+            with pytest.raises(SemaphoreWaitTimeoutException):
+                prioritized.acquire(0, priority=100)
+        assert prioritized.release() == 1
+        assert created.getvalue() == 2
+        # No waiter ever queued, so no proxy thread
+        assert prioritized.proxy_acquires == 0
+        assert prioritized._proxy is None
+
+
+def test_highest_priority_first(backend):
+    with CreateSemaphore(backend=backend) as created, \
+            PrioritySemaphore(created, aging_s=None) as prioritized:
+        prioritized.acquire(0)
+        served = []
+        threads = queue_waiters(prioritized, [0, 10, 5, 10], served)
+        prioritized.release()
+        for thread in threads:
+            thread.join(5)
+        # Equal priorities in the order they queued
+        assert served == [10, 10, 5, 0]
+        assert prioritized.handoffs == 4
+        wait_for(lambda: created.getvalue() == 1)
+
+
+def test_aging_prevents_starvation(backend):
+    with CreateSemaphore(backend=backend) as created, \
+            PrioritySemaphore(created, aging_s=0.02) as prioritized:
+        prioritized.acquire(0)
+        served = []
+        # 0.2 seconds of waiting is worth about 10 levels
+        threads = queue_waiters(prioritized, [0], served, delay_s=0.2)
+        threads += queue_waiters(prioritized, [3], served)
+        prioritized.release()
+        for thread in threads:
+            thread.join(5)
+        assert served == [0, 3]
+
+
+def test_proxy_takes_permits_from_the_semaphore(backend):
+    with CreateSemaphore(backend=backend) as created, \
+            PrioritySemaphore(created) as prioritized:
+        # Held outside the PrioritySemaphore, like another process would
+        created.sem.acquire(0)
+        served = []
+        threads = queue_waiters(prioritized, [1], served)
+        created.sem.release()
+        threads[0].join(5)
+        assert served == [1]
+        assert prioritized.proxy_acquires == 1
+        assert prioritized.handoffs == 0
+        wait_for(lambda: created.getvalue() == 1)
+
+
+def test_timeout_leaves_the_queue(backend):
+    with CreateSemaphore(backend=backend) as created, \
+            PrioritySemaphore(created) as prioritized:
+        prioritized.acquire(0)
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            prioritized.acquire(50, priority=1)
+        assert prioritized.waiting == 0
+        # Nobody is waiting, the permit goes back to the semaphore
+        assert prioritized.release() == 0
+        wait_for(lambda: created.getvalue() == 1)
+
+
+def test_close_wakes_waiters(backend):
+    with CreateSemaphore(backend=backend) as created:
+        prioritized = PrioritySemaphore(created)
+        prioritized.acquire(0)
+        errors = []
+
+        def waiter():
+            try:
+                prioritized.acquire()
+            except ValueError as exc:
+                errors.append(exc)
+
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        wait_for(lambda: prioritized.waiting == 1)
+        prioritized.close()
+        thread.join(5)
+        assert len(errors) == 1
+        with pytest.raises(ValueError):
+            prioritized.acquire(0)
+        created.sem.release()
@@ -0,0 +1,224 @@
+"""Tests for the token bucket rate limiter."""
+
+import asyncio
+import glob
+import multiprocessing
+import os
+import pytest
+import threading
+import time
+import uuid
+
+from semaphore_win_ctypes import RateLimiter, Semaphore, \
+    SemaphoreWaitTimeoutException
+from semaphore_win_ctypes.ratelimit import REFILLER_SUFFIX
+from semaphore_win_ctypes.segment import segment_directory
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def unique_name():
+    name = str(uuid.uuid4())
+    yield name
+    for path in glob.glob(os.path.join(segment_directory(),
+                                       f'*-{name}.refiller')):
+        os.unlink(path)
+
+
+def test_bucket_starts_full(backend):
+    with RateLimiter(rate=10, burst=3, backend=backend,
+                     interval_s=None) as limiter:
+        limiter.acquire(0).acquire(0, tokens=2)
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            limiter.acquire(0)
+        with pytest.raises(ValueError):
+            limiter.acquire(0, tokens=4)
+
+
+def test_refill_follows_the_clock(backend):
+    clock = SimulatedClock()
+    with RateLimiter(rate=100, burst=10, backend=backend, interval_s=None,
+                     clock=clock) as limiter:
+        # The first call elects the limiter
+        assert limiter.refill() == 0
+        assert limiter.elected
+        limiter.acquire(0, tokens=10)
+        clock.advance(0.055)
+        assert limiter.refill() == 5
+        assert limiter.getvalue() == 5
+        # The half token left over counts towards the next refill
+        clock.advance(0.005)
+        assert limiter.refill() == 1
+        # Clamped to burst, through the maximum count
+        clock.advance(60)
+        assert limiter.refill() == 4
+        assert limiter.getvalue() == 10
+        assert limiter.overflowed == 5996
+
+
+def test_rate_under_load(backend):
+    # Consumers drain the bucket as fast as the simulated clock fills it
+    clock = SimulatedClock()
+    rate, burst, seconds = 500, 20, 10
+    with RateLimiter(rate=rate, burst=burst, backend=backend,
+                     interval_s=None, clock=clock) as limiter:
+        limiter.refill()
+        taken = []
+        stop = threading.Event()
+
+        def consumer():
+            count = 0
+            while True:
+                try:
+                    limiter.acquire(10)
+                    count += 1
+                except SemaphoreWaitTimeoutException:
+                    if stop.is_set():
+                        break
+            taken.append(count)
+
+        threads = [threading.Thread(target=consumer) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        # 1 ms steps of simulated time
+        for _ in range(seconds * 1000):
+            clock.advance(0.001)
+            limiter.refill()
+            if limiter.getvalue() > burst // 2:
+                # Let the consumers catch up, so nothing overflows
+                time.sleep(0.001)
+        stop.set()
+        for thread in threads:
+            thread.join(10)
+        assert limiter.overflowed == 0
+        # The initial bucket plus rate * seconds, give or take the
+        # rounding of the floating point clock
+        assert abs(sum(taken) - (burst + rate * seconds)) <= 1
+
+
+def test_one_refiller_per_name(backend, unique_name):
+    clock = SimulatedClock()
+    first = RateLimiter(unique_name, rate=100, burst=10, backend=backend,
+                        interval_s=None, clock=clock)
+    second = RateLimiter(unique_name, rate=100, burst=10, backend=backend,
+                         interval_s=None, clock=clock)
+    try:
+        first.refill()
+        second.refill()
+        assert first.elected and not second.elected
+        first.acquire(0, tokens=10)
+        clock.advance(0.05)
+        assert second.refill() == 0
+        assert first.refill() == 5
+        assert second.getvalue() == 5
+        first.close()
+        # The election is handed over, from then on tokens accrue
+        assert second.refill() == 0
+        assert second.elected
+        clock.advance(0.02)
+        assert second.refill() == 2
+    finally:
+        second.close()
+
+
+def test_crashed_refiller_is_replaced(backend, unique_name):
+    clock = SimulatedClock()
+    crashed = RateLimiter(unique_name, rate=100, burst=10, backend=backend,
+                          interval_s=None, clock=clock)
+    survivor = RateLimiter(unique_name, rate=100, burst=10, backend=backend,
+                           interval_s=None, clock=clock)
+    try:
+        crashed.refill()
+        assert survivor.refill() == 0 and not survivor.elected
+        # As if the elected process had died: the election stays taken,
+        # with the pid of a process that's gone
+        process = multiprocessing.get_context('spawn').Process(target=int)
+        process.start()
+        process.join()
+        segment = crashed._segment
+        segment.words[segment.slot_indexes()[0]] = process.pid
+        crashed.elected = False
+        assert survivor.refill() == 0 and survivor.elected
+        survivor.acquire(0, tokens=10)
+        clock.advance(0.03)
+        assert survivor.refill() == 3
+        assert crashed.refill() == 0 and not crashed.elected
+    finally:
+        crashed.close()
+        survivor.close()
+
+
+def test_refiller_that_died_before_recording_itself(backend, unique_name):
+    clock = SimulatedClock()
+    with RateLimiter(unique_name, rate=100, burst=10, backend=backend,
+                     interval_s=None, clock=clock) as limiter:
+        # As if a process had died after winning the election and before
+        # recording its pid, or while handing the election over
+        election = Semaphore(unique_name + REFILLER_SUFFIX, backend).open()
+        try:
+            election.backend.wait(election.hHandle, 0)
+            assert limiter.refill() == 0 and limiter.elected
+            limiter.acquire(0, tokens=10)
+            clock.advance(0.03)
+            assert limiter.refill() == 3
+        finally:
+            election.close()
+
+
+def test_refiller_outlives_a_failed_refill(backend):
+    with RateLimiter(rate=1000, burst=5, backend=backend,
+                     interval_s=0.005) as limiter:
+        refill = limiter.refill
+        calls = []
+
+        def failing_refill():
+            calls.append(None)
+            if len(calls) == 1:
+                raise OSError('Simulated failure')
+            return refill()
+
+        limiter.refill = failing_refill
+        limiter.acquire(0, tokens=5)
+        limiter.acquire(5000)
+        assert len(calls) > 1
+        assert str(limiter.refill_error) == 'Simulated failure'
+
+
+def test_background_refill(backend):
+    with RateLimiter(rate=200, burst=2, backend=backend,
+                     interval_s=0.005) as limiter:
+        began = time.monotonic()
+        for _ in range(22):
+            limiter.acquire(5000)
+        elapsed = time.monotonic() - began
+        # 20 tokens after the first 2, at 200 per second
+        assert 0.05 < elapsed < 2
+
+
+def test_acquire_async(backend):
+    clock = SimulatedClock()
+
+    async def main(limiter):
+        await limiter.acquire_async(0)
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            await limiter.acquire_async(0)
+        waiter = asyncio.ensure_future(limiter.acquire_async(5000))
+        await asyncio.sleep(0.01)
+        clock.advance(1)
+        limiter.refill()
+        assert await waiter is limiter
+
+    with RateLimiter(rate=1, burst=1, backend=backend, interval_s=None,
+                     clock=clock) as limiter:
+        limiter.refill()
+        asyncio.run(main(limiter))
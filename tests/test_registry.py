@@ -0,0 +1,153 @@
+"""Tests for the named-handle registry."""
+
+import pytest
+import threading
+import uuid
+
+from semaphore_win_ctypes import AcquireSemaphore, CreateSemaphore, \
+    HandleRegistry, OpenSemaphore, SYNCHRONIZE, get_registry, set_registry
+
+
+@pytest.fixture
+def unique_name():
+    return str(uuid.uuid4())
+
+
+def test_handles_are_shared(backend, unique_name):
+    registry = HandleRegistry()
+    with CreateSemaphore(unique_name, maximum_count=2, backend=backend):
+        first = registry.open(unique_name, backend=backend)
+        second = registry.open(unique_name, backend=backend)
+        assert first is second
+        assert (registry.misses, registry.hits) == (1, 1)
+        registry.close(first)
+        registry.close(second)
+        # Idle, but still cached
+        assert registry.open(unique_name, backend=backend) is first
+        assert registry.hits == 2
+        registry.close(first)
+        registry.clear()
+        assert len(registry) == 0
+        assert first.hHandle is None
+
+
+def test_key_includes_access(backend, unique_name):
+    registry = HandleRegistry()
+    with CreateSemaphore(unique_name, backend=backend):
+        full = registry.open(unique_name, backend=backend)
+        limited = registry.open(unique_name, SYNCHRONIZE, backend=backend)
+        assert full is not limited
+        assert registry.misses == 2
+        registry.close(full)
+        registry.close(limited)
+        registry.clear()
+
+
+def test_lru_eviction(backend):
+    names = [str(uuid.uuid4()) for _ in range(3)]
+    registry = HandleRegistry(capacity=2)
+    created = [CreateSemaphore(name, backend=backend) for name in names]
+    try:
+        sems = [registry.open(name, backend=backend) for name in names]
+        # Handles in use are never evicted
+        assert len(registry) == 3
+        for sem in sems:
+            registry.close(sem)
+        # The least recently used one went first
+        assert len(registry) == 2
+        assert registry.evictions == 1
+        assert sems[0].hHandle is None
+        assert registry.open(names[2], backend=backend) is sems[2]
+        registry.close(sems[2])
+        registry.clear()
+    finally:
+        for semaphore in created:
+            semaphore.sem.close()
+
+
+def test_idle_timeout(backend, unique_name):
+    registry = HandleRegistry(idle_timeout_s=0)
+    with CreateSemaphore(unique_name, backend=backend):
+        sem = registry.open(unique_name, backend=backend)
+        assert registry.prune() == 0
+        registry.close(sem)
+        assert len(registry) == 0
+        assert sem.hHandle is None
+
+
+def test_close_checks_the_handle(backend, unique_name):
+    registry = HandleRegistry()
+    with CreateSemaphore(unique_name, backend=backend) as created:
+        with pytest.raises(ValueError):
+            registry.close(created.sem)
+        sem = registry.open(unique_name, backend=backend)
+        registry.close(sem)
+        with pytest.raises(ValueError):
+            registry.close(sem)
+        registry.clear()
+
+
+def test_open_semaphore_with_registry(backend, unique_name):
+    registry = HandleRegistry()
+    with CreateSemaphore(unique_name, maximum_count=2, backend=backend):
+        for _ in range(3):
+            with OpenSemaphore(unique_name, backend=backend,
+                               registry=registry) as opened:
+                with AcquireSemaphore(opened, timeout_ms=0):
+                    assert opened.getvalue() == 1
+        assert (registry.misses, registry.hits) == (1, 2)
+        registry.clear()
+
+
+def test_key_includes_metrics(backend, unique_name):
+    registry = HandleRegistry()
+    with CreateSemaphore(unique_name, backend=backend):
+        with OpenSemaphore(unique_name, backend=backend, registry=registry,
+                           metrics=True) as measured, \
+                OpenSemaphore(unique_name, backend=backend,
+                              registry=registry) as plain:
+            assert measured.sem is not plain.sem
+            assert measured.sem.metrics is not None
+            assert plain.sem.metrics is None
+            with OpenSemaphore(unique_name, backend=backend,
+                               registry=registry, metrics=False) as again:
+                assert again.sem is plain.sem
+        registry.clear()
+
+
+def test_process_wide_registry(backend, unique_name):
+    set_registry(HandleRegistry())
+    try:
+        with CreateSemaphore(unique_name, backend=backend):
+            with OpenSemaphore(unique_name, backend=backend, registry=True):
+                pass
+            with OpenSemaphore(unique_name, backend=backend, registry=True):
+                pass
+            assert get_registry().hits == 1
+            get_registry().clear()
+    finally:
+        set_registry(None)
+
+
+def test_concurrent_open(backend, unique_name):
+    registry = HandleRegistry()
+    errors = []
+    with CreateSemaphore(unique_name, maximum_count=8, backend=backend):
+        def worker():
+            try:
+                for _ in range(50):
+                    sem = registry.open(unique_name, backend=backend)
+                    sem.acquire(5000)
+                    sem.release()
+                    registry.close(sem)
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert len(registry) == 1
+        registry.clear()
@@ -0,0 +1,113 @@
+"""Tests for the semaphore with a limit that changes at runtime."""
+
+import pytest
+import threading
+import time
+import uuid
+
+from semaphore_win_ctypes import AcquireSemaphore, ResizableSemaphore, \
+    SemaphoreMetrics, SemaphoreWaitTimeoutException
+
+
+def test_grow_and_shrink(backend):
+    with ResizableSemaphore(limit=2, ceiling=8, backend=backend) as sem:
+        assert sem.ceiling == 8 and sem.limit == 2
+        sem.acquire(0).acquire(0)
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            sem.acquire(0)
+        assert sem.resize(4) == 2
+        assert sem.limit == 4
+        sem.acquire(0).acquire(0)
+        # Every permit is in use: all three are owed
+        assert sem.resize(1) == 0
+        assert sem.limit == 1
+        for _ in range(3):
+            assert sem.release() == 0
+        assert sem.getvalue() == 0
+        # The debt is paid, this one goes back to the semaphore
+        sem.release()
+        assert sem.getvalue() == 1
+        sem.acquire(0)
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            sem.acquire(0)
+        sem.release()
+
+
+def test_growing_forgives_debt(backend):
+    with ResizableSemaphore(limit=3, ceiling=8, backend=backend) as sem:
+        for _ in range(3):
+            sem.acquire(0)
+        assert sem.resize(1) == 0
+        # Two owed, growing by three forgives them and releases one
+        assert sem.resize(4) == 1
+        assert sem.limit == 4
+        assert sem.getvalue() == 1
+        sem.release(3)
+        assert sem.getvalue() == 4
+
+
+def test_paying_debt_counts_as_release(backend):
+    with ResizableSemaphore(limit=2, ceiling=4, backend=backend) as sem:
+        metrics = sem.semaphore.metrics = SemaphoreMetrics()
+        sem.acquire(0, 2)
+        # Moved by resize(), not released
+        sem.resize(1)
+        sem.resize(3)
+        assert metrics.releases == 0
+        sem.resize(1)
+        sem.release(2)
+        assert metrics.acquired_permits == metrics.released_permits == 2
+        assert sem.getvalue() == 1
+
+
+def test_resize_waits_for_another_resize(backend):
+    with ResizableSemaphore(limit=2, ceiling=4, backend=backend) as sem:
+        sem.resizing.acquire(0)
+        start = time.monotonic()
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            sem.resize(3, timeout_ms=50)
+        assert time.monotonic() - start >= 0.04
+        assert sem.limit == 2
+        sem.resizing.release()
+        assert sem.resize(3) == 1
+
+
+def test_shrink_waits_for_permits(backend):
+    with ResizableSemaphore(limit=2, ceiling=4, backend=backend) as sem:
+        sem.acquire(0).acquire(0)
+        releaser = threading.Timer(0.05, sem.release)
+        releaser.start()
+        assert sem.resize(1, timeout_ms=5000) == -1
+        releaser.join()
+        assert sem.limit == 1
+        assert sem.getvalue() == 0
+        sem.release()
+        assert sem.getvalue() == 1
+
+
+def test_shared_limit(backend):
+    name = str(uuid.uuid4())
+    with ResizableSemaphore(name, limit=2, ceiling=16,
+                            backend=backend) as first, \
+            ResizableSemaphore(name, limit=5, ceiling=32,
+                               backend=first.backend) as second:
+        # The second opened what the first created
+        assert second.limit == 2 and second.ceiling == 16
+        first.resize(6)
+        assert second.limit == 6
+        with AcquireSemaphore(second, timeout_ms=0):
+            assert first.getvalue() == 5
+
+
+def test_limits(backend):
+    with pytest.raises(ValueError):
+        ResizableSemaphore(limit=9, ceiling=8, backend=backend)
+    with ResizableSemaphore(limit=0, ceiling=8, backend=backend) as sem:
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            sem.acquire(0)
+        with pytest.raises(ValueError):
+            sem.resize(9)
+        began = time.monotonic()
+        sem.resize(8)
+        assert time.monotonic() - began < 1
+        assert sem.getvalue() == 8
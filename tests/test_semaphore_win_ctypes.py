@@ -4,7 +4,7 @@ import datetime
 import pytest
 import uuid
 
-from ctypes.wintypes import DWORD
+from semaphore_win_ctypes.kernel32 import DWORD
 from semaphore_win_ctypes import Semaphore, \
     SemaphoreWaitTimeoutException, CreateSemaphore, OpenSemaphore, \
     AcquireSemaphore
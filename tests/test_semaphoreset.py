@@ -0,0 +1,63 @@
+"""Tests for creating, opening and closing many semaphores at once."""
+
+import pytest
+import uuid
+from array import array
+
+from semaphore_win_ctypes import SemaphoreSet, \
+    SemaphoreWaitTimeoutException
+
+
+@pytest.fixture
+def names():
+    prefix = str(uuid.uuid4())
+    return [f'{prefix}-{index}' for index in range(20)]
+
+
+@pytest.mark.parametrize('workers', [None, 4])
+def test_create_open_and_snapshot(backend, names, workers):
+    with SemaphoreSet(names, backend).create(
+            3, workers=workers) as created:
+        assert len(created) == 20 and names[5] in created
+        assert list(created) == names
+        with SemaphoreSet(names, created.backend).open(
+                workers=workers) as opened:
+            opened.acquire(names[5], 0)
+            opened.acquire(names[7], 0).acquire(names[7], 0)
+            counts = created.snapshot()
+            assert counts.typecode == 'q'
+            assert list(counts) == [3] * 5 + [2, 3, 1] + [3] * 12
+            assert created.getvalue(names[7]) == 1
+            assert opened.release(names[7], 2) == 1
+            # Read into the same array again
+            assert created.snapshot(counts) is counts
+            assert created.as_dict()[names[5]] == 2
+        assert opened.closed
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            for _ in range(4):
+                created.acquire(names[0], 0)
+
+
+def test_handles_are_compact(backend, names):
+    with SemaphoreSet(names, backend).create() as created:
+        handles = created._handles
+        if isinstance(created.handle(names[0]), int):
+            assert isinstance(handles, array) and handles.typecode == 'Q'
+        assert len(handles) == len(names)
+        assert not hasattr(created, '__dict__')
+
+
+def test_open_is_all_or_nothing(backend, names):
+    with SemaphoreSet(names[:10], backend).create() as created:
+        # The last ten don't exist
+        with pytest.raises(OSError):
+            SemaphoreSet(names, created.backend).open(workers=4)
+        with pytest.raises(OSError):
+            SemaphoreSet(names, created.backend).open()
+        # Every opened handle was closed again, the counts are untouched
+        assert list(created.snapshot()) == [1] * 10
+
+
+def test_unique_names(backend):
+    with pytest.raises(ValueError):
+        SemaphoreSet(['a', 'a'], backend)
@@ -0,0 +1,123 @@
+"""Tests for the semaphore split across shards."""
+
+import pytest
+import threading
+import time
+import uuid
+
+from semaphore_win_ctypes import AcquireSemaphore, CancellationToken, \
+    SemaphoreMetrics, SemaphoreWaitCancelledException, \
+    SemaphoreWaitTimeoutException, ShardedSemaphore
+from semaphore_win_ctypes.sharded import shard_name
+
+
+def test_total_is_exact(backend):
+    with ShardedSemaphore(total=10, shards=4, backend=backend) as sem:
+        assert sem.total == 10
+        assert [shard.stats().maximum_count for shard in sem.shards] == [
+            3, 3, 2, 2]
+        # The home shard runs out, the others are stolen from
+        for _ in range(10):
+            sem.acquire(0)
+        assert sem.getvalue() == 0
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            sem.acquire(0)
+        sem.release(10)
+        assert [shard.getvalue() for shard in sem.shards] == [3, 3, 2, 2]
+
+
+def test_named_shards(backend):
+    name = str(uuid.uuid4())
+    with ShardedSemaphore(name, total=4, shards=2,
+                          backend=backend) as first:
+        assert first.shards[1].name == shard_name(name, 1) == f'{name}#1'
+        # The shards exist, their counts are kept
+        with ShardedSemaphore(name, total=100, shards=2,
+                              backend=first.backend) as second:
+            assert second.total == 4
+            with AcquireSemaphore(second):
+                assert first.getvalue() == 3
+        assert first.getvalue() == 4
+
+
+def test_waits_on_every_shard(backend):
+    with ShardedSemaphore(total=4, shards=4, backend=backend) as sem:
+        for _ in range(4):
+            sem.acquire(0)
+        acquired = []
+        thread = threading.Thread(
+            target=lambda: acquired.append(sem.acquire(5000)))
+        thread.start()
+        time.sleep(0.05)
+        assert not acquired
+        # Whichever shard it goes back to, the waiter gets it
+        sem.release()
+        thread.join(5)
+        assert acquired == [sem]
+        assert sem.getvalue() == 0
+        sem.release(3)
+
+
+def test_release_on_another_thread(backend):
+    with ShardedSemaphore(total=6, shards=3, backend=backend) as sem:
+        for _ in range(6):
+            sem.acquire(0)
+        # Nothing recorded where those permits came from on that thread,
+        # each goes to the first shard with room
+        thread = threading.Thread(target=sem.release, args=(6,))
+        thread.start()
+        thread.join(5)
+        assert [shard.getvalue() for shard in sem.shards] == [2, 2, 2]
+        with pytest.raises(OSError):
+            sem.release()
+
+
+def test_shards_count_their_traffic(backend):
+    with ShardedSemaphore(total=4, shards=2, backend=backend) as sem:
+        for shard in sem.shards:
+            shard.metrics = SemaphoreMetrics()
+        for _ in range(4):
+            sem.acquire(0)
+        thread = threading.Thread(target=sem.release, args=(2,))
+        thread.start()
+        thread.join(5)
+        sem.release(2)
+        assert [shard.metrics.acquires for shard in sem.shards] == [2, 2]
+        assert sum(shard.metrics.releases for shard in sem.shards) == 4
+
+
+def test_cancel(backend):
+    with ShardedSemaphore(total=2, shards=2, backend=backend) as sem, \
+            CancellationToken() as token:
+        sem.acquire(0).acquire(0)
+        timer = threading.Timer(0.05, token.cancel)
+        timer.start()
+        with pytest.raises(SemaphoreWaitCancelledException):
+            sem.acquire(5000, cancel=token)
+        timer.join()
+        sem.release(2)
+        assert sem.getvalue() == 2
+
+
+def test_invalid_shards(backend):
+    with pytest.raises(ValueError):
+        ShardedSemaphore(total=2, shards=3, backend=backend)
+    with pytest.raises(ValueError):
+        ShardedSemaphore(total=100, shards=0, backend=backend)
+
+
+def test_release_errors(backend, monkeypatch):
+    with ShardedSemaphore(total=4, shards=2, backend=backend) as sem:
+        with pytest.raises(ValueError):
+            sem.release(0)
+        sem.acquire(0)
+
+        def denied(handle, release_count):
+            raise PermissionError(13, 'Access is denied')
+
+        # Only a full shard sends the permit to another one
+        monkeypatch.setattr(sem.backend, 'release', denied)
+        with pytest.raises(PermissionError):
+            sem.release()
+        monkeypatch.undo()
+        assert sem.getvalue() == 3
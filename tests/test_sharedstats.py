@@ -0,0 +1,164 @@
+"""Tests for the statistics shared by the processes of a semaphore."""
+
+import glob
+import multiprocessing
+import os
+import pytest
+import sys
+import threading
+import time
+import uuid
+
+from semaphore_win_ctypes import CancellationToken, CreateSemaphore, \
+    OpenSemaphore, Semaphore, SemaphoreWaitCancelledException, \
+    SemaphoreWaitTimeoutException, SharedStats, SharedStatsSnapshot, \
+    read_shared_stats
+from semaphore_win_ctypes.segment import segment_directory
+
+# Named semaphores other processes can open
+SHARED_BACKEND = 'win32' if sys.platform == 'win32' else 'posix'
+
+
+@pytest.fixture
+def unique_name():
+    name = str(uuid.uuid4())
+    yield name
+    for path in glob.glob(os.path.join(segment_directory(),
+                                       f'*-{name}.stats')):
+        os.unlink(path)
+
+
+def acquire_and_release(name, times):
+    with OpenSemaphore(name, backend=SHARED_BACKEND,
+                       shared_stats=True) as opened:
+        for _ in range(times):
+            opened.sem.acquire(0)
+            opened.sem.release()
+
+
+def test_counts(backend, unique_name):
+    with CreateSemaphore(unique_name, maximum_count=2, backend=backend,
+                         shared_stats=True) as created, \
+            OpenSemaphore(unique_name, backend=backend,
+                          shared_stats=True) as opened:
+        created.sem.acquire(0, 2)
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            opened.sem.acquire(0)
+        with pytest.raises(SemaphoreWaitCancelledException):
+            token = CancellationToken()
+            token.cancel()
+            opened.sem.acquire(cancel=token)
+        opened.sem.release(2)
+        opened.sem.acquire(0)
+        created.sem.release()
+        # Both semaphores, through any of them or a reader
+        for snapshot in (created.sem.shared_stats.snapshot(),
+                         read_shared_stats(unique_name, created.sem.backend)):
+            assert snapshot.processes == 2
+            assert snapshot.waiting == 0
+            assert snapshot.longest_wait_ns == 0
+            assert snapshot.acquires == 2
+            assert snapshot.acquired_permits == 3
+            assert snapshot.timeouts == 1
+            assert snapshot.cancellations == 1
+            assert snapshot.failures == 0
+            assert snapshot.releases == 2
+            assert snapshot.released_permits == 3
+        with pytest.raises(OSError):
+            # Over the maximum count
+            created.sem.release(5)
+        assert created.sem.shared_stats.snapshot().failures == 1
+    # The counters outlive the semaphores
+    snapshot = read_shared_stats(unique_name, created.sem.backend)
+    assert snapshot.processes == 0
+    assert snapshot.acquires == 2
+
+
+def test_waiters(backend, unique_name):
+    with CreateSemaphore(unique_name, maximum_count=1, backend=backend,
+                         shared_stats=True) as created:
+        stats = created.sem.shared_stats
+        created.sem.acquire(0)
+        waiters = [threading.Thread(target=created.sem.acquire,
+                                    args=(5000,))
+                   for _ in range(2)]
+        for waiter in waiters:
+            waiter.start()
+            time.sleep(0.02)
+        deadline = time.monotonic() + 5
+        while stats.snapshot().waiting < 2 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        snapshot = stats.snapshot()
+        assert snapshot.waiting == 2
+        assert snapshot.longest_wait_ns >= 20_000_000
+        for remaining in (1, 0):
+            created.sem.release()
+            # Before releasing again, or it would overflow the count
+            while stats.snapshot().waiting > remaining:
+                time.sleep(0.001)
+        for waiter in waiters:
+            waiter.join()
+        snapshot = stats.snapshot()
+        assert snapshot.waiting == 0
+        assert snapshot.longest_wait_ns == 0
+        assert snapshot.acquires == 3
+
+
+def test_other_processes(unique_name):
+    context = multiprocessing.get_context('spawn')
+    with CreateSemaphore(unique_name, backend=SHARED_BACKEND,
+                         shared_stats=True) as created:
+        workers = [context.Process(target=acquire_and_release,
+                                   args=(unique_name, 50))
+                   for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            assert worker.exitcode == 0
+        before = created.sem.shared_stats.snapshot()
+        assert before.processes == 1
+        assert before.acquires == 150
+        assert before.releases == 150
+        created.sem.acquire(0)
+        created.sem.release()
+        after = read_shared_stats(unique_name, SHARED_BACKEND)
+        assert after.acquires == 151
+        assert after.rate(before) > 0
+
+
+def test_slots_are_reused(unique_name):
+    with SharedStats(unique_name, SHARED_BACKEND, slots=1) as first:
+        first.record_release()
+        with pytest.raises(OSError):
+            SharedStats(unique_name, SHARED_BACKEND)
+        first.close()
+        second = SharedStats(unique_name, SHARED_BACKEND)
+        # Carries on from the first's counters
+        second.record_release(2)
+        snapshot = second.snapshot()
+        assert snapshot.releases == 2
+        assert snapshot.released_permits == 3
+        second.close()
+
+
+def test_snapshot():
+    before = SharedStatsSnapshot('name', 1_000_000_000)
+    after = SharedStatsSnapshot('name', 3_000_000_000)
+    after.acquires = 100
+    after.timeouts = 4
+    assert after.rate(before) == 50
+    assert after.rate(before, 'timeouts') == 2
+    assert before.rate(before) == 0
+    assert after.as_dict()['acquires'] == 100
+
+
+def test_unavailable(backend, unique_name):
+    with pytest.raises(FileNotFoundError):
+        read_shared_stats(unique_name, SHARED_BACKEND)
+    with pytest.raises(ValueError):
+        Semaphore(backend=backend, shared_stats=True)
+    with CreateSemaphore(unique_name, backend=backend):
+        with pytest.raises(ValueError):
+            OpenSemaphore(unique_name, backend=backend, registry=True,
+                          shared_stats=True)
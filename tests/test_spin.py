@@ -0,0 +1,112 @@
+"""Tests for spin-then-block acquires."""
+
+import pytest
+import threading
+import time
+
+from semaphore_win_ctypes import AcquireSemaphore, AdaptiveSpin, \
+    CreateSemaphore, SemaphoreWaitTimeoutException
+from semaphore_win_ctypes.spin import MAX_SPIN_HOLD_NS, MIN_SPINS
+
+
+class FakeBackend:
+    """
+    Fails the first `failures` non-blocking waits, then succeeds
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.blocking_waits = []
+
+    def wait(self, handle, timeout_ms):
+        if timeout_ms != 0:
+            self.blocking_waits.append(timeout_ms)
+            return True
+        if self.failures:
+            self.failures -= 1
+            return False
+        return True
+
+
+def test_spin_acquire(backend):
+    with CreateSemaphore(maximum_count=2, backend=backend) as created:
+        created.sem.acquire(0, spin=True)
+        created.sem.acquire(1000, spin=True)
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            created.sem.acquire(50, spin=True)
+        assert created.getvalue() == 0
+        created.sem.release(2)
+        spinner = created.sem.get_spinner()
+        # acquire(0) never spins
+        assert spinner.spin_acquires == 1
+        assert spinner.blocked_acquires == 1
+
+
+def test_acquire_semaphore_records_hold_time(backend):
+    with CreateSemaphore(backend=backend) as created:
+        with AcquireSemaphore(created, timeout_ms=0, spin=True):
+            time.sleep(0.01)
+        assert created.sem.get_spinner().hold_ns >= 10000000 / 8
+        assert created.getvalue() == 1
+
+
+def test_budget_follows_successful_spins():
+    spin = AdaptiveSpin()
+    for _ in range(50):
+        assert spin.wait(FakeBackend(failures=11), None, None)
+    # Grown past the 12 attempts needed
+    assert spin.budget() >= 12
+    assert spin.spin_acquires > 45
+
+
+def test_budget_shrinks_when_spins_fail():
+    spin = AdaptiveSpin()
+    spin.spins = 20.0
+    backend = FakeBackend(failures=10 ** 6)
+    for _ in range(40):
+        assert spin.wait(backend, None, None)
+    assert spin.budget() == MIN_SPINS
+    assert len(backend.blocking_waits) == 40
+
+
+def test_long_holds_disable_spinning():
+    spin = AdaptiveSpin()
+    spin.spins = 20.0
+    for _ in range(40):
+        spin.record_hold(MAX_SPIN_HOLD_NS * 10)
+    assert spin.budget() == MIN_SPINS
+
+
+def test_spin_time_counts_towards_timeout():
+    spin = AdaptiveSpin()
+    backend = FakeBackend(failures=10 ** 6)
+    assert spin.wait(backend, None, 1000)
+    assert 0 <= backend.blocking_waits[0] <= 1000
+    assert spin.wait(backend, None, 0) is False
+
+
+def test_contention(backend):
+    in_use = [0]
+    errors = []
+    lock = threading.Lock()
+    with CreateSemaphore(maximum_count=2, backend=backend) as created:
+        def worker():
+            try:
+                for _ in range(100):
+                    with AcquireSemaphore(created, timeout_ms=10000,
+                                          spin=True):
+                        with lock:
+                            in_use[0] += 1
+                            assert in_use[0] <= 2
+                        with lock:
+                            in_use[0] -= 1
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert created.getvalue() == 2
@@ -0,0 +1,48 @@
+"""Tests for reading the count without acquiring the semaphore."""
+
+import pytest
+import uuid
+
+from semaphore_win_ctypes import CreateSemaphore, OpenSemaphore, \
+    SEMAPHORE_MODIFY_STATE, SYNCHRONIZE, SemaphoreStats
+
+
+def test_stats(backend):
+    with CreateSemaphore(maximum_count=5, initial_count=3,
+                         backend=backend) as created:
+        stats = created.sem.stats()
+        assert stats == SemaphoreStats(3, 5)
+        assert (stats.current_count, stats.maximum_count) == (3, 5)
+        current_count, maximum_count = stats
+        assert current_count == 3
+        assert repr(stats) == \
+            'SemaphoreStats(current_count=3, maximum_count=5)'
+        created.sem.acquire(0)
+        assert created.getvalue() == 2
+
+
+def test_getvalue_does_not_acquire(backend, monkeypatch):
+    with CreateSemaphore(maximum_count=2, backend=backend) as created:
+        def fail(*args):
+            raise AssertionError('getvalue() changed the count')
+
+        monkeypatch.setattr(created.sem.backend, 'wait', fail)
+        monkeypatch.setattr(created.sem.backend, 'release', fail)
+        assert created.getvalue() == 2
+
+
+def test_getvalue_from_another_handle(backend):
+    name = str(uuid.uuid4())
+    with CreateSemaphore(name, maximum_count=3, backend=backend) as created:
+        with OpenSemaphore(name, backend=backend) as opened:
+            created.sem.acquire(0)
+            assert opened.sem.stats() == (2, 3)
+
+
+def test_query_needs_query_state_access(backend):
+    name = str(uuid.uuid4())
+    with CreateSemaphore(name, backend=backend):
+        with OpenSemaphore(name, SYNCHRONIZE | SEMAPHORE_MODIFY_STATE,
+                           backend=backend) as opened:
+            with pytest.raises(PermissionError):
+                opened.getvalue()
@@ -0,0 +1,189 @@
+"""Tests for tracing waits and holds, and the Chrome trace export."""
+
+import io
+import json
+import multiprocessing
+import os
+import pytest
+import threading
+
+from semaphore_win_ctypes import AcquireSemaphore, CancellationToken, \
+    CreateSemaphore, Semaphore, SemaphoreTracer, \
+    SemaphoreWaitCancelledException, SemaphoreWaitTimeoutException, \
+    disable_tracing, enable_tracing, get_tracer, merge_traces
+from semaphore_win_ctypes import semaphore as semaphore_module
+
+
+@pytest.fixture(autouse=True)
+def no_process_tracer():
+    # Every test starts, and leaves, the process without a tracer
+    saved = semaphore_module._tracer
+    semaphore_module._tracer = None
+    yield
+    semaphore_module._tracer = saved
+
+
+def kinds(tracer):
+    return [(span[0], span[5], span[6]) for span in tracer.spans()]
+
+
+def dump_child_trace(path):
+    tracer = enable_tracing()
+    with CreateSemaphore() as created:
+        with AcquireSemaphore(created):
+            pass
+    tracer.dump(path)
+
+
+def test_off_unless_enabled(backend):
+    assert get_tracer() is None
+    sem = Semaphore(backend=backend)
+    assert sem.tracer is None
+    tracer = enable_tracing(capacity=8)
+    assert enable_tracing() is tracer and get_tracer() is tracer
+    assert tracer.capacity == 8
+    assert Semaphore(backend=backend).tracer is tracer
+    disable_tracing()
+    assert Semaphore(backend=backend).tracer is None
+    assert sem.tracer is None
+    with pytest.raises(ValueError):
+        SemaphoreTracer(0)
+
+
+def test_wait_and_hold_spans(backend):
+    with CreateSemaphore('traced', maximum_count=2,
+                         backend=backend) as created:
+        sem = created.sem
+        tracer = sem.tracer = SemaphoreTracer(16)
+        sem.acquire(0, count=2)
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            sem.acquire(0)
+        sem.release(2)
+        with pytest.raises(ValueError):
+            with AcquireSemaphore(created):
+                raise ValueError()
+        token = CancellationToken()
+        token.cancel()
+        with pytest.raises(SemaphoreWaitCancelledException):
+            sem.acquire(cancel=token)
+        assert kinds(tracer) == [
+            ('wait', 'acquired', 2),
+            ('hold', 'released', 2),
+            ('wait', 'timeout', 1),
+            ('wait', 'acquired', 1),
+            ('hold', 'ValueError', 1),
+            ('wait', 'cancelled', 1),
+        ]
+        tid = threading.get_native_id()
+        for kind, name, span_tid, start_ns, end_ns, _, _ in tracer.spans():
+            assert name == 'traced' and span_tid == tid
+            assert start_ns <= end_ns
+        wait, hold = tracer.spans()[:2]
+        # The hold starts when the wait ends
+        assert hold[3] == wait[4]
+
+
+def test_release_by_another_thread(backend):
+    sem = Semaphore(backend=backend).create()
+    tracer = sem.tracer = SemaphoreTracer()
+    sem.acquire()
+    thread = threading.Thread(target=sem.release)
+    thread.start()
+    thread.join()
+    sem.close()
+    assert kinds(tracer) == [('wait', 'acquired', 1),
+                             ('release', 'released', 1)]
+
+
+def test_ring_buffer_keeps_the_newest(backend):
+    sem = Semaphore(backend=backend).create()
+    tracer = sem.tracer = SemaphoreTracer(capacity=4)
+    for _ in range(10):
+        sem.acquire()
+        sem.release()
+    with pytest.raises(SemaphoreWaitTimeoutException):
+        sem.acquire(0).acquire(0)
+    sem.close()
+    assert tracer.recorded == 22 and tracer.dropped == 18
+    assert kinds(tracer) == [('wait', 'acquired', 1), ('hold', 'released', 1),
+                             ('wait', 'acquired', 1), ('wait', 'timeout', 1)]
+    tracer.clear()
+    assert tracer.spans() == [] and tracer.recorded == 0
+
+
+def test_acquire_future_belongs_to_caller(backend):
+    sem = Semaphore(backend=backend).create(1, 0)
+    tracer = sem.tracer = SemaphoreTracer()
+    future = sem.acquire_future(5000)
+    sem.release()
+    future.result(5)
+    sem.release()
+    sem.close()
+    # The first release may be recorded before or after the wait ends,
+    # the hold pairs with the second
+    assert sorted(kinds(tracer)) == [('hold', 'released', 1),
+                                     ('release', 'released', 1),
+                                     ('wait', 'acquired', 1)]
+    assert kinds(tracer)[-1] == ('hold', 'released', 1)
+    tid = threading.get_native_id()
+    assert {span[2] for span in tracer.spans()} == {tid}
+
+
+def test_chrome_trace_events():
+    with CreateSemaphore('exported') as created:
+        tracer = created.sem.tracer = SemaphoreTracer()
+        with AcquireSemaphore(created):
+            pass
+    output = io.StringIO()
+    tracer.dump(output)
+    trace = json.loads(output.getvalue())
+    assert trace['displayTimeUnit'] == 'ms'
+    metadata, wait, hold = trace['traceEvents']
+    assert metadata['ph'] == 'M' and metadata['pid'] == os.getpid()
+    assert wait['name'] == 'wait exported' and wait['ph'] == 'X'
+    assert wait['cat'] == 'semaphore.wait'
+    assert wait['args'] == {'semaphore': 'exported', 'outcome': 'acquired',
+                            'count': 1}
+    assert hold['name'] == 'hold exported' and hold['dur'] >= 0
+    assert hold['ts'] == pytest.approx(wait['ts'] + wait['dur'])
+    assert wait['tid'] == hold['tid'] == threading.get_native_id()
+
+
+def test_merge_across_processes(tmp_path):
+    enable_tracing()
+    sem = Semaphore().create()
+    sem.acquire()
+    sem.release()
+    sem.close()
+    get_tracer().dump(tmp_path / 'parent.json')
+    process = multiprocessing.get_context('spawn').Process(
+        target=dump_child_trace, args=(str(tmp_path / 'child.json'),))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+    merge_traces([tmp_path / 'parent.json', str(tmp_path / 'child.json')],
+                 tmp_path / 'merged.json')
+    events = json.loads((tmp_path / 'merged.json').read_text())[
+        'traceEvents']
+    assert {event['pid'] for event in events} == {os.getpid(), process.pid}
+    assert [event['cat'] for event in events if event['ph'] == 'X'] == \
+        ['semaphore.wait', 'semaphore.hold'] * 2
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork()')
+def test_forked_child_starts_afresh():
+    tracer = enable_tracing()
+    sem = Semaphore().create()
+    sem.acquire()
+    sem.release()
+    reader, writer = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(writer, f'{tracer.recorded} {tracer.pid}'.encode())
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.read(reader, 100).decode() == f'0 {pid}'
+    os.close(reader)
+    os.close(writer)
+    assert tracer.recorded == 2
+    sem.close()
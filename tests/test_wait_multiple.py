@@ -0,0 +1,82 @@
+"""Tests for wait_any and wait_all."""
+
+import pytest
+import threading
+import time
+
+from semaphore_win_ctypes import CreateSemaphore, Semaphore, \
+    SemaphoreWaitTimeoutException, StandInKernel32, wait_all, wait_any
+from semaphore_win_ctypes.win32 import Win32Backend
+
+
+def test_wait_any(backend):
+    with CreateSemaphore(initial_count=0, backend=backend) as first, \
+            CreateSemaphore(backend=backend) as second:
+        assert wait_any([first, second], timeout_ms=0) is second
+        assert second.getvalue() == 0
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            wait_any([first, second], timeout_ms=50)
+        first.sem.release()
+        assert wait_any([first.sem, second.sem], timeout_ms=0) is first.sem
+
+
+def test_wait_any_is_woken(backend):
+    with CreateSemaphore(initial_count=0, backend=backend) as first, \
+            CreateSemaphore(initial_count=0, backend=backend) as second:
+        timer = threading.Timer(0.05, second.sem.release)
+        timer.start()
+        assert wait_any([first, second], timeout_ms=5000) is second
+        timer.join()
+
+
+def test_wait_all(backend):
+    with CreateSemaphore(maximum_count=2, backend=backend) as first, \
+            CreateSemaphore(backend=backend) as second:
+        assert wait_all([first, second], timeout_ms=0) == [first, second]
+        assert first.getvalue() == 1
+        assert second.getvalue() == 0
+
+
+def test_wait_all_is_all_or_nothing(backend):
+    with CreateSemaphore(backend=backend) as first, \
+            CreateSemaphore(initial_count=0, backend=backend) as second, \
+            CreateSemaphore(backend=backend) as third:
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            wait_all([first, second, third], timeout_ms=50)
+        assert first.getvalue() == 1
+        assert second.getvalue() == 0
+        assert third.getvalue() == 1
+
+
+def test_wait_all_waits_for_the_last(backend):
+    with CreateSemaphore(backend=backend) as first, \
+            CreateSemaphore(initial_count=0, backend=backend) as second:
+        timer = threading.Timer(0.05, second.sem.release)
+        start = time.monotonic()
+        timer.start()
+        wait_all([first, second], timeout_ms=5000)
+        assert time.monotonic() - start >= 0.04
+        timer.join()
+        assert first.getvalue() == 0
+        assert second.getvalue() == 0
+
+
+def test_backends_must_match():
+    standin = Win32Backend(kernel32=StandInKernel32())
+    with CreateSemaphore(backend=standin) as first, \
+            CreateSemaphore(backend=Win32Backend(StandInKernel32())) as other:
+        with pytest.raises(ValueError):
+            wait_any([first, other])
+        with pytest.raises(ValueError):
+            wait_all([])
+
+
+def test_too_many_objects_on_windows():
+    backend = Win32Backend(kernel32=StandInKernel32())
+    sems = [Semaphore(backend=backend).create() for _ in range(65)]
+    try:
+        with pytest.raises(ValueError):
+            wait_all(sems, timeout_ms=0)
+    finally:
+        for sem in sems:
+            sem.close()
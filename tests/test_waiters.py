@@ -0,0 +1,124 @@
+"""Tests for acquire_future() and the waiter threads behind it."""
+
+import concurrent.futures
+import pytest
+import time
+import uuid
+
+from semaphore_win_ctypes import CreateSemaphore, Semaphore, \
+    SemaphoreWaitTimeoutException, WaiterPool
+from semaphore_win_ctypes.backend import get_backend
+from semaphore_win_ctypes.waiters import MULTI_WAIT_CAPACITY
+
+
+def wait_until(condition, timeout_s=5):
+    deadline = time.monotonic() + timeout_s
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_acquire_future(backend):
+    with CreateSemaphore(initial_count=0, backend=backend) as created:
+        future = created.sem.acquire_future()
+        assert not future.done()
+        created.sem.release()
+        assert future.result(5) is created.sem
+        assert created.getvalue() == 0
+        # Uncontended, it completes without a waiter thread
+        created.sem.release()
+        assert created.sem.acquire_future().done()
+
+
+def test_timeout(backend):
+    with CreateSemaphore(initial_count=0, backend=backend) as created:
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            created.sem.acquire_future(0).result(0)
+        start = time.monotonic()
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            created.sem.acquire_future(100).result(5)
+        assert 0.1 <= time.monotonic() - start <= 1
+        assert created.getvalue() == 0
+
+
+def test_many_waiters_few_threads(backend):
+    sems = [Semaphore(str(uuid.uuid4()), backend).create(3, 0)
+            for _ in range(MULTI_WAIT_CAPACITY * 2 + 10)]
+    try:
+        futures = [sem.acquire_future(10000) for sem in sems
+                   for _ in range(3)]
+        pool = sems[0].waiter_pool
+        assert pool.pending == len(futures)
+        assert len(pool.threads) <= 3
+        for sem in sems:
+            sem.release(3)
+        concurrent.futures.wait(futures, 5)
+        assert all(future.result(0) for future in futures)
+        assert sum(sem.getvalue() for sem in sems) == 0
+        assert pool.pending == 0
+    finally:
+        for sem in sems:
+            sem.close()
+
+
+def test_cancel_gives_the_permit_back(backend):
+    with CreateSemaphore(initial_count=0, backend=backend) as created:
+        cancelled = created.sem.acquire_future()
+        waiting = created.sem.acquire_future()
+        assert cancelled.cancel()
+        created.sem.release()
+        assert waiting.result(5) is created.sem
+        created.sem.release()
+        pool = created.sem.waiter_pool
+        wait_until(lambda: pool.pending == 0)
+        assert created.getvalue() == 1
+
+
+def test_close_cancels_pending_waits(backend):
+    sem = Semaphore(backend=backend).create(1, 0)
+    futures = [sem.acquire_future() for _ in range(3)]
+    sem.close()
+    assert all(future.cancelled() for future in futures)
+
+
+def test_metrics(backend):
+    with CreateSemaphore(initial_count=0, backend=backend,
+                         metrics=True) as created:
+        sem = created.sem
+        future = sem.acquire_future()
+        sem.release()
+        future.result(5)
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            sem.acquire_future(10).result(5)
+        sem.acquire_future().cancel()
+        wait_until(lambda: sem.metrics.cancellations == 1)
+        assert sem.metrics.acquires == 1
+        assert sem.metrics.timeouts == 1
+
+
+def test_threads_merge_and_exit(backend):
+    pool = WaiterPool(get_backend(backend), idle_timeout_s=0.05)
+    with CreateSemaphore(backend=backend) as created:
+        if pool.backend.fileno(created.sem.hHandle) is not None:
+            pytest.skip("one selector thread takes 1024 descriptors")
+    sems = [Semaphore(backend=backend).create(1, 0)
+            for _ in range(MULTI_WAIT_CAPACITY + 10)]
+    try:
+        futures = [pool.submit(sem.hHandle, None, sem) for sem in sems]
+        assert len(pool.threads) == 2
+        # A few waits left in the first thread, and 10 in the second: one
+        # thread takes the other's
+        for sem in sems[:MULTI_WAIT_CAPACITY - 3]:
+            sem.release()
+        wait_until(lambda: len(pool.threads) == 1 and pool.pending == 13)
+        assert pool.merges == 1
+        for sem in sems[MULTI_WAIT_CAPACITY - 3:]:
+            sem.release()
+        concurrent.futures.wait(futures, 5)
+        assert all(future.result(0) for future in futures)
+        # Idle, it exits
+        wait_until(lambda: not pool.threads)
+    finally:
+        for sem in sems:
+            pool.cancel(sem.hHandle)
+            sem.close()
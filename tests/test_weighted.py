@@ -0,0 +1,102 @@
+"""Tests for taking several permits at once."""
+
+import pytest
+import threading
+import time
+
+from semaphore_win_ctypes import AcquireSemaphore, CreateSemaphore, \
+    SemaphoreWaitTimeoutException
+
+
+def test_acquire_count(backend):
+    with CreateSemaphore(maximum_count=5, backend=backend) as created:
+        created.sem.acquire(0, count=3)
+        assert created.getvalue() == 2
+        assert created.sem.release(3) == 2
+
+
+def test_acquire_count_is_all_or_nothing(backend):
+    with CreateSemaphore(maximum_count=5, initial_count=3,
+                         backend=backend) as created:
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            created.sem.acquire(50, count=4)
+        assert created.getvalue() == 3
+        with pytest.raises(ValueError):
+            created.sem.acquire(0, count=0)
+
+
+def test_count_above_the_maximum(backend):
+    with CreateSemaphore(maximum_count=5, backend=backend) as created:
+        with pytest.raises(ValueError):
+            # Never satisfiable, so it doesn't wait at all
+            created.sem.acquire(None, count=6)
+        assert created.getvalue() == 5
+        created.sem.acquire(0, count=5)
+        created.sem.release(5)
+
+
+def test_acquire_semaphore_count(backend):
+    with CreateSemaphore(maximum_count=4, backend=backend) as created:
+        with AcquireSemaphore(created, timeout_ms=0, count=3) as acquired:
+            assert acquired.getvalue() == 1
+        assert created.getvalue() == 4
+
+
+def test_contention(backend):
+    maximum_count = 6
+    in_use = [0]
+    peak = [0]
+    lock = threading.Lock()
+    errors = []
+
+    with CreateSemaphore(maximum_count=maximum_count,
+                         backend=backend) as created:
+        def worker(count):
+            try:
+                for _ in range(20):
+                    with AcquireSemaphore(created, timeout_ms=10000,
+                                          count=count):
+                        with lock:
+                            in_use[0] += count
+                            peak[0] = max(peak[0], in_use[0])
+                        time.sleep(0.0005)
+                        with lock:
+                            in_use[0] -= count
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(count,))
+                   for count in (4, 4, 3, 1, 1, 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert peak[0] <= maximum_count
+        assert created.getvalue() == maximum_count
+
+
+def test_large_request_is_not_starved(backend):
+    maximum_count = 4
+    stop = threading.Event()
+
+    with CreateSemaphore(maximum_count=maximum_count,
+                         backend=backend) as created:
+        def small_worker():
+            while not stop.is_set():
+                with AcquireSemaphore(created, timeout_ms=10000):
+                    time.sleep(0.001)
+
+        threads = [threading.Thread(target=small_worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        try:
+            time.sleep(0.02)
+            with AcquireSemaphore(created, timeout_ms=10000,
+                                  count=maximum_count) as acquired:
+                assert acquired.getvalue() == 0
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        assert created.getvalue() == maximum_count
@@ -0,0 +1,192 @@
+"""Tests for the win32 backend and the kernel32 function table."""
+
+import pytest
+import subprocess
+import sys
+import threading
+import tracemalloc
+import uuid
+
+from semaphore_win_ctypes import Semaphore, SemaphoreWaitTimeoutException, \
+    Kernel32, StandInKernel32, get_kernel32, set_kernel32
+from semaphore_win_ctypes.win32 import Win32Backend
+
+
+@pytest.fixture
+def unique_name():
+    return str(uuid.uuid4())
+
+
+@pytest.fixture
+def backend():
+    return Win32Backend(kernel32=StandInKernel32())
+
+
+class FakeFunction:
+    argtypes = None
+    restype = None
+
+
+class FakeDll:
+    def __init__(self):
+        self.lookups = []
+
+    def __getattr__(self, name):
+        self.lookups.append(name)
+        return FakeFunction()
+
+
+def test_import_is_lazy():
+    # Importing the package must not load ctypes or bind any function
+    code = ("import sys, semaphore_win_ctypes; "
+            "print('ctypes' in sys.modules, 'typing' in sys.modules)")
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.split() == [b'False', b'False']
+
+
+def test_import_without_wintypes():
+    # ctypes.wintypes raises ValueError off Windows before Python 3.8
+    code = ("import sys; sys.modules['ctypes.wintypes'] = None; "
+            "from semaphore_win_ctypes import *; "
+            "from semaphore_win_ctypes.win32 import Win32Backend; "
+            "from semaphore_win_ctypes import Semaphore, StandInKernel32; "
+            "sem = Semaphore(backend=Win32Backend(StandInKernel32())); "
+            "sem.create(); sem.acquire(0); print(sem.release()); "
+            "sem.close()")
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.split() == [b'0']
+
+
+def test_kernel32_binds_on_first_use():
+    dll = FakeDll()
+    kernel32 = Kernel32(dll)
+    assert dll.lookups == []
+    function = kernel32.WaitForSingleObject
+    assert function.argtypes is not None
+    assert function.restype is not None
+    assert kernel32.WaitForSingleObject is function
+    assert dll.lookups == ['WaitForSingleObject']
+    with pytest.raises(AttributeError):
+        kernel32.NotAKernel32Function
+
+
+def test_ntdll_functions_bind_from_ntdll():
+    dll = FakeDll()
+    ntdll = FakeDll()
+    kernel32 = Kernel32(dll, ntdll)
+    kernel32.NtQuerySemaphore
+    kernel32.RtlNtStatusToDosError
+    kernel32.CloseHandle
+    assert ntdll.lookups == ['NtQuerySemaphore', 'RtlNtStatusToDosError']
+    assert dll.lookups == ['CloseHandle']
+
+
+def test_set_kernel32(unique_name):
+    previous = get_kernel32()
+    standin = StandInKernel32()
+    set_kernel32(standin)
+    try:
+        assert get_kernel32() is standin
+        sem = Semaphore(unique_name, backend=Win32Backend()).create()
+        assert standin.OpenSemaphoreW(0x1F0003, True, unique_name)
+        sem.close()
+    finally:
+        set_kernel32(previous)
+
+
+class CountingKernel32:
+    """
+    A function table whose semaphore is always available
+    """
+
+    def __init__(self):
+        self.lookups = 0
+
+    def __getattr__(self, name):
+        self.lookups += 1
+        return getattr(self, '_' + name)
+
+    def _WaitForSingleObject(self, handle, milliseconds):
+        return 0
+
+    def _ReleaseSemaphore(self, handle, release_count, previous_count):
+        previous_count._obj.value = 7
+        return 1
+
+
+def test_hot_path_binds_once():
+    kernel32 = CountingKernel32()
+    backend = Win32Backend(kernel32=kernel32)
+    for _ in range(10):
+        assert backend.wait(1, None)
+        assert backend.release(1, 1) == 7
+    assert kernel32.lookups == 2
+
+
+def test_hot_path_follows_set_kernel32(unique_name):
+    previous = get_kernel32()
+    backend = Win32Backend()
+    first, second = StandInKernel32(), StandInKernel32()
+    try:
+        set_kernel32(first)
+        handle = backend.create(unique_name, 0, 1, 0x1F0003)
+        assert backend.release(handle, 1) == 0
+        set_kernel32(second)
+        with pytest.raises(OSError):
+            # Not a handle of the new table
+            backend.release(handle, 1)
+    finally:
+        set_kernel32(previous)
+
+
+def test_hot_path_does_not_allocate():
+    backend = Win32Backend(kernel32=CountingKernel32())
+    backend.wait(1, None)
+    backend.release(1, 1)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(1000):
+            backend.wait(1, None)
+            backend.wait(1, 0)
+            backend.release(1, 1)
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    assert after - before < 100
+
+
+def test_previous_count_per_thread():
+    backend = Win32Backend(kernel32=CountingKernel32())
+    buffers = [backend._previous_count()]
+    thread = threading.Thread(
+        target=lambda: buffers.append(backend._previous_count()))
+    thread.start()
+    thread.join()
+    assert buffers[0][0] is not buffers[1][0]
+    assert backend._previous_count()[0] is buffers[0][0]
+
+
+def test_standin_semantics(backend, unique_name):
+    with pytest.raises(OSError):
+        Semaphore(unique_name, backend).open()
+    sem1 = Semaphore(unique_name, backend).create(maximum_count=2)
+    sem2 = Semaphore(unique_name, backend).open()
+    try:
+        sem1.acquire(0)
+        sem2.acquire(0)
+        with pytest.raises(SemaphoreWaitTimeoutException):
+            sem1.acquire(1)
+        assert sem2.release(2) == 0
+        with pytest.raises(OSError):
+            sem2.release()
+    finally:
+        sem1.close()
+    # Windows semantics: the object lives until its last handle closes
+    sem3 = Semaphore(unique_name, backend).open()
+    sem3.close()
+    sem2.close()
+    with pytest.raises(FileNotFoundError):
+        Semaphore(unique_name, backend).open()
+    with pytest.raises(OSError):
+        sem2.close()